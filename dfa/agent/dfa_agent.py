@@ -29,6 +29,7 @@ from dfa.agent.vdp import dfa_vdp_mgr as vdpm
 from dfa.common import dfa_logger as logging
 from dfa.common import config
 from dfa.common import constants
+from dfa.common import dfa_sys_lib
 from dfa.common import rpc
 from dfa.common import utils
 
@@ -126,9 +127,13 @@ class DfaAgent(object):
         config_dict['external_bridge'] = br_ext
         config_dict['host_id'] = self._my_host
         config_dict['root_helper'] = self._cfg.sys.root_helper
+        dfa_sys_lib.set_exec_opts(
+            timeout=self._cfg.sys.exec_timeout,
+            root_helper_daemon=self._cfg.sys.root_helper_daemon)
         config_dict['node_list'] = self._cfg.general.node
         config_dict['node_uplink_list'] = self._cfg.general.node_uplink
         config_dict['ucs_fi_evb_dmac'] = self._cfg.general.ucs_fi_evb_dmac
+        config_dict['state_dir'] = self._cfg.dfa_agent.state_dir
         self._vdpm = vdpm.VdpMgr(config_dict, self.clnt, self._host_name)
         self.pool = eventlet.GreenPool()
         self.setup_rpc()
@@ -224,6 +229,9 @@ def main():
     cfg = config.CiscoDFAConfig().cfg
     logging.setup_logger('agent', cfg)
 
+    # Reload the config files on SIGHUP.
+    config.install_sighup_handler()
+
     # Get pid of the process and save it.
     save_my_pid(cfg)
 
@@ -15,15 +15,20 @@
 #
 # @author: Padmanabhan Krishnan, Cisco Systems, Inc.
 
+import collections
 import json
+import os
 import Queue
+import threading
 import time
 
 from dfa.common import utils
 from dfa.agent.topo_disc import topo_disc
+from dfa.agent.vdp import lldpad
 from dfa.agent.vdp import ovs_vdp
 from dfa.common import constants
 from dfa.common import dfa_logger as logging
+from dfa.common import dfa_netlink
 from dfa.common import dfa_sys_lib as sys_utils
 from dfa.common import rpc
 from dfa.agent import detect_uplink as uplink_det
@@ -34,25 +39,131 @@ LOG = logging.getLogger(__name__)
 
 class VdpMsgPriQue(object):
 
-    '''VDP MEssage Queue'''
-
-    def __init__(self):
-        self._queue = Queue.PriorityQueue()
-
-    def enqueue(self, priority, msg):
-        msg_tupl = (priority, msg)
-        self._queue.put(msg_tupl)
+    """VDP Message Queue.
+
+    The messages are dequeued in the order of priority, lowest value first,
+    and in FIFO order within a priority. A message gains one priority
+    level for every aging_interval seconds it waits, up to aging_limit, so
+    that a low priority message is not starved. The messages are grouped by
+    group_fn, e.g. by uplink, and a message never ages past a queued higher
+    priority message of its group, so a VM message is still processed after
+    the queued messages of its uplink. A message enqueued with a key
+    supersedes the queued message of the same key, so that only the latest
+    state of a port is processed. It is queued behind the messages enqueued
+    before it, but ages from the time the superseded message was enqueued.
+    """
+
+    def __init__(self, aging_interval=constants.Q_AGING_INTERVAL,
+                 aging_limit=constants.Q_AGING_LIMIT, clock=time.time,
+                 group_fn=None):
+        self.aging_interval = aging_interval
+        self.aging_limit = aging_limit
+        self.clock = clock
+        self.group_fn = group_fn
+        # Priority to the FIFO of [key, msg, enqueue time, priority, group]
+        # entries. The superseded entries stay in the FIFO with msg set to
+        # None.
+        self._queues = {}
+        self._keys = {}
+        # Number of queued messages of each (priority, group).
+        self._group_cnt = collections.defaultdict(int)
+        self._size = 0
+        self._cond = threading.Condition(threading.Lock())
+        self.num_superseded = 0
+
+    def enqueue(self, priority, msg, key=None):
+        with self._cond:
+            enq_time = self.clock()
+            old_entry = self._keys.pop(key, None) if key is not None else None
+            if old_entry is not None:
+                old_entry[1] = None
+                enq_time = old_entry[2]
+                self._dec_group_cnt(old_entry)
+                self.num_superseded += 1
+                self._size -= 1
+            group = self.group_fn(msg) if self.group_fn else None
+            entry = [key, msg, enq_time, priority, group]
+            self._queues.setdefault(priority, collections.deque()).append(
+                entry)
+            if key is not None:
+                self._keys[key] = entry
+            self._group_cnt[(priority, group)] += 1
+            self._size += 1
+            self._cond.notify()
+
+    def _dec_group_cnt(self, entry):
+        grp_key = (entry[3], entry[4])
+        self._group_cnt[grp_key] -= 1
+        if not self._group_cnt[grp_key]:
+            del self._group_cnt[grp_key]
+
+    def _get_eff_prio(self, priority, entry, now):
+        if not self.aging_interval or priority <= self.aging_limit:
+            return priority
+        eff_prio = max(priority - int((now - entry[2]) /
+                                      self.aging_interval),
+                       self.aging_limit)
+        group = entry[4]
+        if group is None:
+            return eff_prio
+        # Not ahead of the queued higher priority messages of its group.
+        for grp_prio, grp in self._group_cnt:
+            if grp == group and eff_prio <= grp_prio < priority:
+                eff_prio = grp_prio + 1
+        return eff_prio
+
+    def _pop(self):
+        now = self.clock()
+        best = None
+        for priority, que in self._queues.items():
+            while que and que[0][1] is None:
+                que.popleft()
+            if not que:
+                continue
+            # Ties go to the older message.
+            sort_key = (self._get_eff_prio(priority, que[0], now), que[0][2],
+                        priority)
+            if best is None or sort_key < best[0]:
+                best = (sort_key, priority)
+        priority = best[1]
+        entry = self._queues[priority].popleft()
+        key, msg = entry[0], entry[1]
+        if key is not None:
+            del self._keys[key]
+        self._dec_group_cnt(entry)
+        self._size -= 1
+        return priority, msg
 
     def dequeue(self):
-        msg_tupl = self._queue.get()
-        return msg_tupl[0], msg_tupl[1]
+        with self._cond:
+            while not self._size:
+                self._cond.wait()
+            return self._pop()
 
     def dequeue_nonblock(self):
-        msg_tupl = self._queue.get_nowait()
-        return msg_tupl[0], msg_tupl[1]
+        with self._cond:
+            if not self._size:
+                raise Queue.Empty
+            return self._pop()
+
+    def qsize(self):
+        """Return the number of queued messages."""
+
+        return self._size
+
+    def get_depth(self):
+        """Return the number of queued messages of each priority."""
+
+        with self._cond:
+            depth = {}
+            for priority, que in self._queues.items():
+                num = sum(1 for entry in que if entry[1] is not None)
+                if num:
+                    depth[priority] = num
+            return depth
 
     def is_not_empty(self):
-        return not self._queue.empty()
+        return self._size != 0
 
 
 class VdpQueMsg(object):
@@ -130,6 +241,59 @@ class VdpQueMsg(object):
         self.msg_dict['phy_uplink'] = uplink
 
 
+class VdpPortRetry(object):
+
+    """Exponential backoff of the failed VM events, per port.
+
+    The event of a port is retried backoff seconds after its first failure,
+    and the backoff doubles on every further failure, up to max_backoff. A
+    port is forgotten once its event succeeds, fails permanently or is
+    replaced by a new event from the server.
+    """
+
+    def __init__(self, backoff=constants.VM_RETRY_BACKOFF,
+                 max_backoff=constants.VM_RETRY_BACKOFF_MAX, clock=time.time):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        # Port UUID to [msg, number of failures, retry time]. msg is None
+        # while the retried event is in the queue.
+        self.ports = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ports)
+
+    def failed(self, msg):
+        '''Schedule the retry of a failed event, return the backoff.'''
+        with self.lock:
+            entry = self.ports.setdefault(msg.get_port_uuid(), [None, 0, 0])
+            backoff = min(self.backoff * 2 ** entry[1], self.max_backoff)
+            entry[0] = msg
+            entry[1] += 1
+            entry[2] = self.clock() + backoff
+            return backoff
+
+    def remove(self, port_uuid):
+        with self.lock:
+            self.ports.pop(port_uuid, None)
+
+    def get_num_failures(self, port_uuid):
+        entry = self.ports.get(port_uuid)
+        return entry[1] if entry else 0
+
+    def get_due(self):
+        '''Return the events whose retry time has come.'''
+        now = self.clock()
+        due = []
+        with self.lock:
+            for entry in self.ports.values():
+                if entry[0] is not None and entry[2] <= now:
+                    due.append(entry[0])
+                    entry[0] = None
+        return due
+
+
 class VdpMgr(object):
 
     '''Responsible for Handling VM/Uplink requests'''
@@ -143,9 +307,14 @@ class VdpMgr(object):
         self.ucs_fi_evb_dmac = config_dict.get('ucs_fi_evb_dmac')
         self.node_list = config_dict['node_list']
         self.node_uplink_list = config_dict['node_uplink_list']
+        state_dir = config_dict.get('state_dir')
+        self.state_file = (os.path.join(state_dir,
+                                        constants.VDP_SNAPSHOT_FILE)
+                           if state_dir else None)
         # Check for error?? fixme(padkrish)
-        self.que = VdpMsgPriQue()
+        self.que = VdpMsgPriQue(group_fn=VdpQueMsg.get_uplink)
         self.err_que = VdpMsgPriQue()
+        self.vm_retry = VdpPortRetry()
         self.phy_uplink = None
         self.veth_intf = None
         self.veth_ovs_intf = None
@@ -165,6 +334,12 @@ class VdpMgr(object):
         self.bulk_vm_rcvd_flag = False
         self.bulk_vm_check_cnt = 0
         self.vdp_mgr_lock = utils.lock()
+        self.uplink_proc_lock = utils.lock()
+        self.link_evt_lock = utils.lock()
+        self.link_evt_pending = False
+        self.link_down_pending = False
+        self.link_evt_running = False
+        self.link_listener = None
         self.read_static_uplink()
         self.start()
         self.topo_disc = topo_disc.TopoDisc(self.topo_disc_cb,
@@ -228,6 +403,8 @@ class VdpMgr(object):
         if (not self.uplink_det_compl or
                 phy_uplink not in self.ovs_vdp_obj_dict):
             LOG.error("Uplink Port Event not received yet")
+            # The VMs are synced again once the uplink is up.
+            self.vm_retry.remove(msg.get_port_uuid())
             self.update_vm_result(msg.get_port_uuid(), res_fail)
             return
         ovs_vdp_obj = self.ovs_vdp_obj_dict[phy_uplink]
@@ -235,12 +412,19 @@ class VdpMgr(object):
             msg.get_port_uuid(), msg.get_mac(), msg.get_net_uuid(),
             msg.get_segmentation_id(), msg.get_status(), msg.get_oui())
         if not port_event_reply.get('result'):
-            LOG.error("Error in VDP port event, Err Queue enq")
-            self.update_vm_result(
-                msg.get_port_uuid(), res_fail,
-                fail_reason=port_event_reply.get('fail_reason'))
+            fail_reason = port_event_reply.get('fail_reason')
+            if self.is_vm_failure_retryable(fail_reason):
+                backoff = self.vm_retry.failed(msg)
+                LOG.error("Error in VDP port event, retry in %(backoff)s "
+                          "sec", {'backoff': backoff})
+            else:
+                self.vm_retry.remove(msg.get_port_uuid())
+                LOG.error("Error in VDP port event, not retried")
+            self.update_vm_result(msg.get_port_uuid(), res_fail,
+                                  fail_reason=fail_reason)
         else:
             LOG.error("Success in VDP port event")
+            self.vm_retry.remove(msg.get_port_uuid())
             lvid, vdp_vlan = ovs_vdp_obj.get_lvid_vdp_vlan(msg.get_net_uuid(),
                                                            msg.get_port_uuid())
             self.update_vm_result(
@@ -248,6 +432,15 @@ class VdpMgr(object):
                 lvid=lvid, vdp_vlan=vdp_vlan,
                 fail_reason=port_event_reply.get('fail_reason'))
 
+    def is_vm_failure_retryable(self, fail_reason):
+        '''Return False if a retry of the VM event fails the same way.'''
+        if fail_reason and (
+                fail_reason.startswith(
+                    constants.port_not_cached_reason.split('%')[0]) or
+                fail_reason == constants.lvm_not_avail_reason):
+            return False
+        return lldpad.is_retryable_failure(fail_reason)
+
     def process_bulk_vm_event(self, msg, phy_uplink):
         LOG.info("In processing Bulk VM Event status %s", msg)
         time.sleep(3)
@@ -261,7 +454,17 @@ class VdpMgr(object):
             self.update_vm_result(msg.get_port_uuid(), constants.CREATE_FAIL)
             return
         ovs_vdp_obj = self.ovs_vdp_obj_dict[phy_uplink]
+        # The VMs restored from the snapshot are processed only if they
+        # changed since, or are not in the list anymore.
+        restored = ovs_vdp_obj.pop_restored_ports()
+        num_skipped = 0
         for vm_dict in msg.msg_dict.get('vm_bulk_list'):
+            port_info = restored.pop(vm_dict['port_uuid'], None)
+            if vm_dict['status'] == 'up' and port_info == [
+                    vm_dict['net_uuid'], vm_dict['vm_mac'],
+                    vm_dict['segmentation_id'], vm_dict['oui']]:
+                num_skipped += 1
+                continue
             if vm_dict['status'] == 'down':
                 ovs_vdp_obj.pop_local_cache(vm_dict['port_uuid'],
                                             vm_dict['vm_mac'],
@@ -278,6 +481,17 @@ class VdpMgr(object):
                                oui=vm_dict['oui'],
                                phy_uplink=phy_uplink)
             self.process_vm_event(vm_msg, phy_uplink)
+        for port_uuid, port_info in restored.items():
+            net_uuid, vm_mac, segmentation_id, oui = port_info
+            LOG.info("Restored port %s removed while down", port_uuid)
+            vm_msg = VdpQueMsg(constants.VM_MSG_TYPE, port_uuid=port_uuid,
+                               vm_mac=vm_mac, net_uuid=net_uuid,
+                               segmentation_id=segmentation_id,
+                               status='down', oui=oui, phy_uplink=phy_uplink)
+            self.process_vm_event(vm_msg, phy_uplink)
+        LOG.info("Bulk VM Event processed, %d restored VMs unchanged",
+                 num_skipped)
+        ovs_vdp_obj.save_snapshot()
 
     def process_uplink_event(self, msg, phy_uplink):
         LOG.info("Received New uplink Msg %s for uplink %s" %
@@ -290,7 +504,8 @@ class VdpMgr(object):
                     phy_uplink, msg.get_integ_br(), msg.get_ext_br(),
                     msg.get_root_helper(), self.vdp_vlan_change_cb,
                     is_ucs_fi=self.is_ucs_fi,
-                    fi_evb_dmac=self.ucs_fi_evb_dmac)
+                    fi_evb_dmac=self.ucs_fi_evb_dmac,
+                    state_file=self.state_file)
             except Exception as exc:
                 ovs_exc_reason = str(exc)
                 LOG.error("OVS VDP Object creation failed %s" % ovs_exc_reason)
@@ -335,7 +550,8 @@ class VdpMgr(object):
             prio, msg = self.que.dequeue()
             msg_type = msg.msg_type
             phy_uplink = msg.get_uplink()
-            LOG.info("Msg dequeued type is %d" % msg_type)
+            LOG.info("Msg dequeued type is %(type)d, queue depth %(depth)s",
+                     {'type': msg_type, 'depth': self.que.get_depth()})
             try:
                 if msg_type == constants.VM_MSG_TYPE:
                     self.process_vm_event(msg, phy_uplink)
@@ -360,6 +576,12 @@ class VdpMgr(object):
                 LOG.info("Msg dequeued from err queue type is %d" % msg_type)
                 if msg_type == constants.UPLINK_MSG_TYPE:
                     self.que.enqueue(constants.Q_UPL_PRIO, msg)
+            for msg in self.vm_retry.get_due():
+                LOG.info("Retrying the VM event of port %s",
+                         msg.get_port_uuid())
+                msg.set_uplink(self.phy_uplink)
+                self.que.enqueue(constants.Q_VM_PRIO, msg,
+                                 key=msg.get_port_uuid())
         except Exception as e:
             LOG.exception("Exception caught in proc_err_que %s " % str(e))
 
@@ -375,6 +597,59 @@ class VdpMgr(object):
         task_uplink = utils.PeriodicTask(constants.UPLINK_DET_INTERVAL,
                                          self.vdp_uplink_proc_top)
         task_uplink.run()
+        # Netlink notifications trigger the uplink detection right away.
+        # The periodic task above remains as the fallback.
+        self.link_listener = dfa_netlink.LinkListener(self.link_event_cb)
+        if not self.link_listener.start():
+            self.link_listener = None
+
+    def _is_uplink_lost(self, event):
+        return (self.phy_uplink is not None and
+                event.name == self.phy_uplink and
+                (event.deleted or (event.running_changed and
+                                   not event.running)))
+
+    def _is_uplink_change(self, event):
+        if self.phy_uplink is None:
+            # A link that came up may be the uplink.
+            return event.running_changed and event.running
+        # The uplink was enslaved to a bond, or it came back up.
+        return event.name == self.phy_uplink and (
+            event.master_changed or event.running_changed)
+
+    def link_event_cb(self, event):
+        '''Callback for the link events from netlink. '''
+        link_down = self._is_uplink_lost(event)
+        if not link_down and not self._is_uplink_change(event):
+            return
+        LOG.info("Link event for %(name)s running %(run)s master %(mst)s",
+                 {'name': event.name, 'run': event.running,
+                  'mst': event.master})
+        with self.link_evt_lock:
+            self.link_evt_pending = True
+            # The last event of the uplink gives its state, the uplink may
+            # be up again by the time the coalesced events are processed.
+            self.link_down_pending = link_down
+            if self.link_evt_running:
+                return
+            self.link_evt_running = True
+        # Not done in the listener thread, since the uplink detection can
+        # take long. Events received meanwhile are coalesced.
+        thrd = threading.Thread(target=self.process_link_events,
+                                name='Link_Event')
+        thrd.daemon = True
+        thrd.start()
+
+    def process_link_events(self):
+        while True:
+            with self.link_evt_lock:
+                if not self.link_evt_pending:
+                    self.link_evt_running = False
+                    return
+                link_down = self.link_down_pending
+                self.link_evt_pending = False
+                self.link_down_pending = False
+            self.vdp_uplink_proc_top(link_down=link_down)
 
     def is_openstack_running(self):
         '''
@@ -390,9 +665,10 @@ class VdpMgr(object):
             LOG.error("Exception in is_openstack_running %s", str(e))
             return False
 
-    def vdp_uplink_proc_top(self):
+    def vdp_uplink_proc_top(self, link_down=False):
         try:
-            self.vdp_uplink_proc()
+            with self.uplink_proc_lock:
+                self.vdp_uplink_proc(link_down=link_down)
         except Exception as e:
             LOG.error("VDP uplink proc exception %s" % e)
 
@@ -474,7 +750,7 @@ class VdpMgr(object):
         else:
             return 'normal'
 
-    def vdp_uplink_proc(self):
+    def vdp_uplink_proc(self, link_down=False):
         '''
         -> restart_uplink_called: should be called by agent initially to set
            the stored uplink and veth from DB
@@ -484,6 +760,8 @@ class VdpMgr(object):
            detected and object created. Will be reset when uplink is down
         -> phy_uplink: Is the uplink interface
         -> veth_intf : Signifies the veth interface
+        -> link_down : Set when netlink reported that the uplink went down,
+           the uplink is brought down without waiting for the threshold
         '''
         LOG.info("In Periodic Uplink Task")
         if not self.is_os_run:
@@ -512,7 +790,9 @@ class VdpMgr(object):
                 if self.veth_intf is None:
                     LOG.error("Incorrect state, Bug")
                     return
-        if self.static_uplink:
+        if link_down:
+            ret = 'down'
+        elif self.static_uplink:
             ret = self.static_uplink_detect(self.veth_intf)
         else:
             ret = uplink_det.detect_uplink(self.veth_intf,
@@ -523,7 +803,7 @@ class VdpMgr(object):
                 return
             # Call API to set the uplink as "" DOWN event
             self.uplink_down_cnt = self.uplink_down_cnt + 1
-            if not self.static_uplink and (
+            if not self.static_uplink and not link_down and (
                self.uplink_down_cnt < constants.UPLINK_DOWN_THRES):
                 return
             self.process_uplink_ongoing = True
@@ -675,6 +955,12 @@ class VdpMgr(object):
                                status=vm_dict['status'],
                                oui=vm_dict['oui'],
                                phy_uplink=self.phy_uplink)
+            # A newer event of the port supersedes a queued one, and the
+            # retries of the older one.
+            self.vm_retry.remove(vm_msg.get_port_uuid())
+            self.que.enqueue(constants.Q_VM_PRIO, vm_msg,
+                             key=vm_msg.get_port_uuid())
+            return
         self.que.enqueue(constants.Q_VM_PRIO, vm_msg)
 
     def is_uplink_received(self):
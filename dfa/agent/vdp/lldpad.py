@@ -20,10 +20,16 @@ VDP is a part of LLDP Agent Daemon (lldpad). For more information on VDP,
 pls visit http://www.ieee802.org/1/pages/802.1bg.html
 """
 
+import collections
+import random
 import re
+import six
+import threading
+import time
 
 from dfa.common import config
 
+from dfa.agent.vdp import lldpad_clif
 from dfa.agent.vdp import lldpad_constants as vdp_const
 from dfa.common import constants
 from dfa.common import dfa_sys_lib as utils
@@ -41,6 +47,184 @@ LOG = logging.getLogger(__name__)
 #               help=_('Timeout in seconds for lldptool commands')),
 # ]
 
+# Raw (-R) reply: each key is followed by the 4 hex digit length of its value.
+RAW_FIELD_RE = re.compile(r'(hints|filter|uuid)([0-9a-fA-F]{4})?')
+# Reply of the VSI event (-W): one 'key = value' per line.
+TEXT_FIELD_RE = re.compile(r'\t*(\w+) = (\S*)')
+
+VdpReply = collections.namedtuple('VdpReply', ['mode', 'vsiid', 'mac',
+                                               'vlans', 'hints', 'num_hints',
+                                               'fail_reason', 'reply'])
+
+
+def is_retryable_failure(fail_reason):
+    '''Return False if a retry of the VDP request fails the same way.'''
+    if not fail_reason:
+        return True
+    for reason in vdp_const.VDP_PERMANENT_FAILURES:
+        if reason in fail_reason:
+            return False
+    return True
+
+
+def _parse_filter(filter_val, vlans):
+    '''Add the VLAN of a filter value to vlans, return the MAC.'''
+
+    fields = filter_val.split('-')
+    try:
+        vlans.append(int(fields[0]))
+    except ValueError:
+        vlans.append(None)
+    return fields[1] if len(fields) > 1 else None
+
+
+def parse_raw_reply(reply):
+    '''Parse a raw vdptool reply into a VdpReply.
+
+    The first uuid and filter are the ones of the reply. Every filter and
+    hints is counted, so that replies with several of them are detected.
+    A reply that is not a string, like the one of a failed vdptool run, is
+    parsed as an empty reply.
+    '''
+    if not isinstance(reply, six.string_types):
+        reply = ''
+    vsiid = mac = hints = None
+    num_hints = 0
+    vlans = []
+    for match in RAW_FIELD_RE.finditer(reply):
+        key, val_len = match.groups()
+        val = None
+        if val_len is not None:
+            val = reply[match.end():match.end() + int(val_len, 16)]
+        if key == 'hints':
+            num_hints += 1
+            try:
+                hints = int(val)
+            except (TypeError, ValueError):
+                hints = None
+        elif key == 'filter':
+            if val is None:
+                vlans.append(None)
+            elif vlans:
+                _parse_filter(val, vlans)
+            else:
+                mac = _parse_filter(val, vlans)
+        elif vsiid is None:
+            vsiid = val
+    return VdpReply(None, vsiid, mac, vlans, hints, num_hints, None, reply)
+
+
+def parse_event_reply(reply):
+    '''Parse the VSI event printed by vdptool into a VdpReply.
+
+    The failure reason is the line printed before the filter, which is
+    where vdptool prints the error returned by the bridge. A reply that is
+    not a string is parsed as an empty reply.
+    '''
+    if not isinstance(reply, six.string_types):
+        reply = ''
+    mode = vsiid = mac = fail_reason = None
+    vlans = []
+    prev_line = None
+    for line in reply.split('\n'):
+        match = TEXT_FIELD_RE.match(line)
+        if match is None:
+            prev_line = line.replace('\t', '')
+            continue
+        key, val = match.groups()
+        if key == 'mode' and mode is None:
+            mode = val
+        elif key == 'uuid' and vsiid is None:
+            vsiid = val
+        elif key == 'filter':
+            if not vlans:
+                mac = _parse_filter(val, vlans)
+                fail_reason = prev_line
+            else:
+                _parse_filter(val, vlans)
+        prev_line = line.replace('\t', '')
+    return VdpReply(mode, vsiid, mac, vlans, None, 0, fail_reason, reply)
+
+
+class VdpRefreshWheel(object):
+
+    """Timing wheel that spreads the VSI refreshes over the interval.
+
+    A VSI is placed in the least loaded slot of the wheel when it is added,
+    so that every slot holds about the same number of VSIs. The wheel moves
+    by one slot every tick and goes round once per interval. The slots are
+    filled from a random offset, so that the compute nodes do not refresh
+    their VSIs in step. A VSI whose refresh failed is also put in the
+    retry set of the next slot, which is cleared once it is due.
+    """
+
+    def __init__(self, interval, tick, clock=time.time, jitter=None):
+        self.num_slots = max(1, int(interval // tick))
+        self.tick = float(interval) / self.num_slots
+        self.clock = clock
+        if jitter is None:
+            jitter = random.random()
+        self.offset = int(jitter * self.num_slots)
+        self.start = clock()
+        self.slots = [set() for i in range(self.num_slots)]
+        self.retry_slots = [set() for i in range(self.num_slots)]
+        self.key_slot = {}
+        self.pos = self._get_pos(self.start) + 1
+        self.lock = threading.Lock()
+
+    def _get_pos(self, now):
+        return int((now - self.start) // self.tick)
+
+    def add(self, key):
+        '''Add a VSI to the least loaded slot.'''
+        with self.lock:
+            if key in self.key_slot:
+                return
+            slot = min(((self.offset + i) % self.num_slots
+                        for i in range(self.num_slots)),
+                       key=lambda slot: len(self.slots[slot]))
+            self.slots[slot].add(key)
+            self.key_slot[key] = slot
+
+    def remove(self, key):
+        with self.lock:
+            slot = self.key_slot.pop(key, None)
+            if slot is not None:
+                self.slots[slot].discard(key)
+            for retry_slot in self.retry_slots:
+                retry_slot.discard(key)
+
+    def retry(self, key):
+        '''Schedule a VSI once more in the slot of the next tick.'''
+        with self.lock:
+            if key in self.key_slot:
+                self.retry_slots[self.pos % self.num_slots].add(key)
+
+    def get_due(self, now=None):
+        '''Return the VSIs of the slots due since the last call.
+
+        A VSI is returned at most once, even if a whole interval has passed.
+        The VSIs to retry go first.
+        '''
+        if now is None:
+            now = self.clock()
+        retry = []
+        due = []
+        with self.lock:
+            pos = self._get_pos(now)
+            self.pos = max(self.pos, pos - self.num_slots + 1)
+            while self.pos <= pos:
+                slot = self.pos % self.num_slots
+                retry.extend(sorted(self.retry_slots[slot]))
+                self.retry_slots[slot].clear()
+                due.extend(sorted(self.slots[slot]))
+                self.pos += 1
+        retry_set = set(retry)
+        return retry + [key for key in due if key not in retry_set]
+
+    def __len__(self):
+        return len(self.key_slot)
+
 
 def enable_lldp(self, port_name, is_ncb=True, is_nb=False):
     '''Function to enable LLDP on the interface.'''
@@ -77,12 +261,17 @@ class LldpadDriver(object):
         self.root_helper = root_helper
         self.mutex_lock = sys_utils.lock()
         self.read_vdp_cfg()
+        self.clif = None
+        if self.vdp_opts['vdp_clif']:
+            self.clif = lldpad_clif.LldpadClif()
         self.vdp_vif_map = {}
         self.oui_vif_map = {}
         self.enable_lldp()
         sync_timeout_val = int(self.vdp_opts['vdp_sync_timeout'])
-        vdp_periodic_task = sys_utils.PeriodicTask(sync_timeout_val,
-                                                   self._vdp_refrsh_hndlr)
+        self.refresh_wheel = VdpRefreshWheel(sync_timeout_val,
+                                             vdp_const.VDP_REFRESH_TICK)
+        vdp_periodic_task = sys_utils.PeriodicTask(
+            self.refresh_wheel.tick, self._vdp_refrsh_hndlr)
         self.vdp_periodic_task = vdp_periodic_task
         vdp_periodic_task.run()
 
@@ -91,6 +280,8 @@ class LldpadDriver(object):
         self.phy_uplink = None
         self.port_name = None
         self.vdp_periodic_task.stop()
+        if self.clif:
+            self.clif.close()
         del self.vdp_vif_map
         del self.oui_vif_map
 
@@ -105,6 +296,7 @@ class LldpadDriver(object):
         self.vdp_opts['hints'] = self._cfg.vdp.hints
         self.vdp_opts['filter'] = self._cfg.vdp.filter
         self.vdp_opts['vdp_sync_timeout'] = self._cfg.vdp.vdp_sync_timeout
+        self.vdp_opts['vdp_clif'] = self._cfg.vdp.vdp_clif
 
     def enable_lldp(self):
         '''Function to enable LLDP on the interface.'''
@@ -139,77 +331,90 @@ class LldpadDriver(object):
             LOG.error("GPID cannot be set on NB")
             return False
 
+    def _is_vsi_failed(self, vdp_dict):
+        '''Return True if the last response for the VSI was a failure.'''
+        return (vdp_dict.get('fail_reason') is not None or
+                not utils.is_valid_vlan_tag(vdp_dict.get('vdp_vlan')))
+
     def _vdp_refrsh_hndlr(self):
         '''Periodic refresh of vNIC events to VDP
 
         VDP daemon itself has keepalives. This is needed on top of it
         to keep Orchestrator like Openstack, VDP daemon and the physical
         switch in sync.
+        This runs every tick of the refresh wheel and only refreshes the
+        VSIs of the slots that are due. A VSI whose refresh failed is
+        retried on the next tick, ahead of the VSIs of that slot.
         '''
         LOG.debug("Refresh handler")
         try:
             if not self.vdp_vif_map:
                 LOG.debug("vdp_vif_map not created, returning")
                 return
-            vdp_vif_map = dict.copy(self.vdp_vif_map)
-            oui_vif_map = dict.copy(self.oui_vif_map)
-            for key in vdp_vif_map.viewkeys():
-                lvdp_dict = vdp_vif_map.get(key)
-                loui_dict = oui_vif_map.get(key)
-                if not lvdp_dict:
-                    return
-                if not loui_dict:
-                    oui_id = ""
-                    oui_data = ""
-                else:
-                    oui_id = loui_dict.get('oui_id')
-                    oui_data = loui_dict.get('oui_data')
-                with self.mutex_lock:
-                    # VLAN of 0 should be used. This is because a query is
-                    # first done to lldpad. If it returns 0, it should be
-                    # queried from the switch. It you send a assoc to switch
-                    # specifying the VLAN, it may be stale which is wrong.
-                    # lldpad sending right VLAN in keepalives is ok.
-                    if key in self.vdp_vif_map:
-                        LOG.debug("Sending Refresh for VSI %s" % lvdp_dict)
-                        vdp_vlan, fail_reason = self.send_vdp_assoc(
-                            vsiid=lvdp_dict.get('vsiid'),
-                            mgrid=lvdp_dict.get('mgrid'),
-                            typeid=lvdp_dict.get('typeid'),
-                            typeid_ver=lvdp_dict.get('typeid_ver'),
-                            vsiid_frmt=lvdp_dict.get('vsiid_frmt'),
-                            filter_frmt=lvdp_dict.get('filter_frmt'),
-                            gid=lvdp_dict.get('gid'),
-                            mac=lvdp_dict.get('mac'),
-                            vlan=0, oui_id=oui_id, oui_data=oui_data,
-                            sw_resp=True)
-                # check validity.
-                if not utils.is_valid_vlan_tag(vdp_vlan):
-                    emsg = "Returned vlan %(vlan)s is invalid."
-                    LOG.error(emsg, {'vlan': vdp_vlan})
-                    # Need to invoke CB. So no return here.
-                    vdp_vlan = 0
-                exist_vdp_vlan = lvdp_dict.get('vdp_vlan')
-                exist_fail_reason = lvdp_dict.get('fail_reason')
-                callback_count = lvdp_dict.get('callback_count')
-                # Condition will be hit only during error cases when switch
-                # reloads or when compute reloads
-                if vdp_vlan != exist_vdp_vlan or (
-                   fail_reason != exist_fail_reason or
-                   callback_count > vdp_const.CALLBACK_THRESHOLD):
-                    # Invoke the CB Function
-                    cb_fn = lvdp_dict.get('vsw_cb_fn')
-                    cb_data = lvdp_dict.get('vsw_cb_data')
-                    if cb_fn:
-                        cb_fn(cb_data, vdp_vlan, fail_reason)
-                    lvdp_dict['vdp_vlan'] = vdp_vlan
-                    lvdp_dict['fail_reason'] = fail_reason
-                    lvdp_dict['callback_count'] = 0
-                else:
-                    lvdp_dict['callback_count'] += 1
+            for key in self.refresh_wheel.get_due():
+                lvdp_dict = self.vdp_vif_map.get(key)
+                if lvdp_dict is None:
+                    continue
+                self._vdp_refrsh_vsi(key, lvdp_dict,
+                                     self.oui_vif_map.get(key))
+                if self._is_vsi_failed(lvdp_dict):
+                    self.refresh_wheel.retry(key)
         except Exception as e:
             LOG.error("Exception in Refrsh %s" % str(e))
 
+    def _vdp_refrsh_vsi(self, key, lvdp_dict, loui_dict):
+        '''Refresh one VSI and invoke its callback if its state changed.'''
+        if not loui_dict:
+            oui_id = ""
+            oui_data = ""
+        else:
+            oui_id = loui_dict.get('oui_id')
+            oui_data = loui_dict.get('oui_data')
+        with self.mutex_lock:
+            # VLAN of 0 should be used. This is because a query is
+            # first done to lldpad. If it returns 0, it should be
+            # queried from the switch. It you send a assoc to switch
+            # specifying the VLAN, it may be stale which is wrong.
+            # lldpad sending right VLAN in keepalives is ok.
+            if key not in self.vdp_vif_map:
+                return
+            LOG.debug("Sending Refresh for VSI %s" % lvdp_dict)
+            vdp_vlan, fail_reason = self.send_vdp_assoc(
+                vsiid=lvdp_dict.get('vsiid'),
+                mgrid=lvdp_dict.get('mgrid'),
+                typeid=lvdp_dict.get('typeid'),
+                typeid_ver=lvdp_dict.get('typeid_ver'),
+                vsiid_frmt=lvdp_dict.get('vsiid_frmt'),
+                filter_frmt=lvdp_dict.get('filter_frmt'),
+                gid=lvdp_dict.get('gid'),
+                mac=lvdp_dict.get('mac'),
+                vlan=0, oui_id=oui_id, oui_data=oui_data,
+                sw_resp=True)
+        # check validity.
+        if not utils.is_valid_vlan_tag(vdp_vlan):
+            emsg = "Returned vlan %(vlan)s is invalid."
+            LOG.error(emsg, {'vlan': vdp_vlan})
+            # Need to invoke CB. So no return here.
+            vdp_vlan = 0
+        exist_vdp_vlan = lvdp_dict.get('vdp_vlan')
+        exist_fail_reason = lvdp_dict.get('fail_reason')
+        callback_count = lvdp_dict.get('callback_count')
+        # Condition will be hit only during error cases when switch
+        # reloads or when compute reloads
+        if vdp_vlan != exist_vdp_vlan or (
+           fail_reason != exist_fail_reason or
+           callback_count > vdp_const.CALLBACK_THRESHOLD):
+            # Invoke the CB Function
+            cb_fn = lvdp_dict.get('vsw_cb_fn')
+            cb_data = lvdp_dict.get('vsw_cb_data')
+            if cb_fn:
+                cb_fn(cb_data, vdp_vlan, fail_reason)
+            lvdp_dict['vdp_vlan'] = vdp_vlan
+            lvdp_dict['fail_reason'] = fail_reason
+            lvdp_dict['callback_count'] = 0
+        else:
+            lvdp_dict['callback_count'] += 1
+
     def run_lldptool(self, args):
         '''Function for invoking the lldptool utility'''
         full_args = ['lldptool'] + args
@@ -274,6 +479,7 @@ class LldpadDriver(object):
                     'fail_reason': reason,
                     'callback_count': 0}
         self.vdp_vif_map[port_uuid] = vdp_dict
+        self.refresh_wheel.add(port_uuid)
         LOG.debug("Storing VDP VSI MAC %s UUID %s VDP VLAN %s" %
                   (mac, vsiid, vdp_vlan))
         if oui_id:
@@ -302,6 +508,7 @@ class LldpadDriver(object):
             del self.vdp_vif_map[port_uuid]
         except Exception:
             LOG.error("VSI does not exist")
+        self.refresh_wheel.remove(port_uuid)
         self.clear_oui(port_uuid)
 
     def gen_cisco_vdp_oui(self, oui_id, oui_data):
@@ -501,153 +708,103 @@ class LldpadDriver(object):
                                      oui_args=oui_cmd_str)
         return reply
 
-    def crosscheck_reply1_vsiid_mac(self, reply, vsiid, mac):
-        """Cross Check the reply against the input vsiid, mac. """
-        vsiid_reply = reply.partition("uuid = ")[2].split()[0]
-        if vsiid != vsiid_reply:
-            fail_reason = vdp_const.vsi_mismatch_failure_reason % (
-                vsiid, vsiid_reply)
-            LOG.error(fail_reason)
-            return False, fail_reason
-        mac_reply = reply.partition("filter = ")[2].split('-')[1]
-        if mac != mac_reply:
-            fail_reason = vdp_const.mac_mismatch_failure_reason % (
-                mac, mac_reply)
-            LOG.error(fail_reason)
-            return False, fail_reason
-        return True, None
-
     def crosscheck_reply_vsiid_mac(self, reply, vsiid, mac):
-        """Cross Check the reply against the input vsiid, mac. """
-        vsiid_reply = reply.partition("uuid")[2].split()[0][4:]
-        if vsiid != vsiid_reply:
+        """Cross Check the parsed reply against the input vsiid, mac. """
+        if vsiid != reply.vsiid:
             fail_reason = vdp_const.vsi_mismatch_failure_reason % (
-                vsiid, vsiid_reply)
+                vsiid, reply.vsiid)
             LOG.error(fail_reason)
             return False, fail_reason
-        mac_reply = reply.partition("filter")[2].split('-')[1]
-        if mac != mac_reply:
+        if mac != reply.mac:
             fail_reason = vdp_const.mac_mismatch_failure_reason % (
-                mac, mac_reply)
+                mac, reply.mac)
             LOG.error(fail_reason)
             return False, fail_reason
         return True, None
 
     def get_vdp_failure_reason(self, reply):
-        """Parse the failure reason from VDP. """
-        try:
-            fail_reason = reply.partition(
-                "filter")[0].replace('\t', '').split('\n')[-2]
-        except Exception as exc:
-            fail_reason = vdp_const.retrieve_failure_reason % (reply)
-        return fail_reason
-
-    def check_filter_validity(self, reply, filter_str):
-        '''Check for the validify of the filter. '''
-        try:
-            f_ind = reply.index(filter_str)
-        except Exception:
-            fail_reason = vdp_const.filter_failure_reason % (reply)
-            LOG.error(fail_reason)
-            return False, fail_reason
-        try:
-            l_ind = reply.rindex(filter_str)
-        except Exception:
-            fail_reason = vdp_const.filter_failure_reason % (reply)
+        """Return the failure reason from VDP of a parsed reply. """
+        if reply.fail_reason is None:
+            return vdp_const.retrieve_failure_reason % (reply.reply)
+        return reply.fail_reason
+
+    def check_filter_validity(self, reply):
+        '''Check for the validify of the filter of a parsed reply. '''
+        if not reply.vlans:
+            fail_reason = vdp_const.filter_failure_reason % (reply.reply)
             LOG.error(fail_reason)
             return False, fail_reason
-        if f_ind != l_ind:
+        if len(reply.vlans) > 1:
             # Currently not supported if reply contains a filter keyword
-            fail_reason = vdp_const.multiple_filter_failure_reason % (reply)
+            fail_reason = vdp_const.multiple_filter_failure_reason % (
+                reply.reply)
             LOG.error(fail_reason)
             return False, fail_reason
         return True, None
 
     def get_vlan_from_reply1(self, reply, vsiid, mac):
         '''Parse the reply from VDP daemon to get the VLAN value'''
-        try:
-            verify_flag, fail_reason = self.crosscheck_reply1_vsiid_mac(
-                reply, vsiid, mac)
-            if not verify_flag:
-                return constants.INVALID_VLAN, fail_reason
-            mode_str = reply.partition("mode = ")[2].split()[0]
-            if mode_str != "assoc":
-                fail_reason = self.get_vdp_failure_reason(reply)
-                return constants.INVALID_VLAN, fail_reason
-        except Exception:
+        rec = parse_event_reply(reply)
+        if rec.vsiid is None or rec.mode is None or not rec.vlans:
             fail_reason = vdp_const.mode_failure_reason % (reply)
             LOG.error(fail_reason)
             return constants.INVALID_VLAN, fail_reason
-        check_filter, fail_reason = self.check_filter_validity(
-            reply, "filter = ")
+        verify_flag, fail_reason = self.crosscheck_reply_vsiid_mac(
+            rec, vsiid, mac)
+        if not verify_flag:
+            return constants.INVALID_VLAN, fail_reason
+        if rec.mode != "assoc":
+            fail_reason = self.get_vdp_failure_reason(rec)
+            return constants.INVALID_VLAN, fail_reason
+        check_filter, fail_reason = self.check_filter_validity(rec)
         if not check_filter:
             return constants.INVALID_VLAN, fail_reason
-        try:
-            vlan_val = reply.partition("filter = ")[2].split('-')[0]
-            vlan = int(vlan_val)
-        except ValueError:
+        if rec.vlans[0] is None:
             fail_reason = vdp_const.format_failure_reason % (reply)
             LOG.error(fail_reason)
             return constants.INVALID_VLAN, fail_reason
-        return vlan, None
+        return rec.vlans[0], None
 
     def check_hints(self, reply):
-        '''Parse the hints to check for errors'''
-        try:
-            f_ind = reply.index("hints")
-        except Exception:
-            fail_reason = vdp_const.hints_failure_reason % (reply)
+        '''Check the hints of a parsed reply for errors'''
+        if not reply.num_hints:
+            fail_reason = vdp_const.hints_failure_reason % (reply.reply)
             LOG.error(fail_reason)
             return False, fail_reason
-        try:
-            l_ind = reply.rindex("hints")
-        except Exception:
-            fail_reason = vdp_const.hints_failure_reason % (reply)
-            LOG.error(fail_reason)
-            return False, fail_reason
-        if f_ind != l_ind:
+        if reply.num_hints > 1:
             # Currently not supported if reply contains a filter keyword
-            fail_reason = vdp_const.multiple_hints_failure_reason % (reply)
+            fail_reason = vdp_const.multiple_hints_failure_reason % (
+                reply.reply)
             LOG.error(fail_reason)
             return False, fail_reason
-        try:
-            hints_compl = reply.partition("hints")[2]
-            hints_val = reply.partition("hints")[2][0:4]
-            len_hints = int(hints_val)
-            hints_val = hints_compl[4:4 + len_hints]
-            hints = int(hints_val)
-            if hints != 0:
-                fail_reason = vdp_const.nonzero_hints_failure % (hints)
-                return False, fail_reason
-        except ValueError:
-            fail_reason = vdp_const.format_failure_reason % (reply)
+        if reply.hints is None:
+            fail_reason = vdp_const.format_failure_reason % (reply.reply)
             LOG.error(fail_reason)
             return False, fail_reason
+        if reply.hints != 0:
+            fail_reason = vdp_const.nonzero_hints_failure % (reply.hints)
+            return False, fail_reason
         return True, None
 
     def get_vlan_from_reply(self, reply, vsiid, mac):
         '''Parse the reply from VDP daemon to get the VLAN value'''
-        hints_ret, fail_reason = self.check_hints(reply)
+        rec = parse_raw_reply(reply)
+        hints_ret, fail_reason = self.check_hints(rec)
         if not hints_ret:
             LOG.error("Incorrect hints found %s", reply)
             return constants.INVALID_VLAN, fail_reason
-        check_filter, fail_reason = self.check_filter_validity(reply, "filter")
+        check_filter, fail_reason = self.check_filter_validity(rec)
         if not check_filter:
             return constants.INVALID_VLAN, fail_reason
-        try:
-            verify_flag, fail_reason = self.crosscheck_reply_vsiid_mac(
-                reply, vsiid, mac)
-            if not verify_flag:
-                return constants.INVALID_VLAN, fail_reason
-            filter_val = reply.partition("filter")[2]
-            len_fil = len(filter_val)
-            vlan_val = filter_val[4:len_fil].split('-')[0]
-            vlan = int(vlan_val)
-        except ValueError:
+        verify_flag, fail_reason = self.crosscheck_reply_vsiid_mac(
+            rec, vsiid, mac)
+        if not verify_flag:
+            return constants.INVALID_VLAN, fail_reason
+        if rec.vlans[0] is None:
             fail_reason = vdp_const.format_failure_reason % (reply)
             LOG.error(fail_reason)
             return constants.INVALID_VLAN, fail_reason
-        return vlan, None
+        return rec.vlans[0], None
 
     def send_vdp_assoc(self, vsiid=None, mgrid=None, typeid=None,
                        typeid_ver=None, vsiid_frmt=vdp_const.VDP_VSIFRMT_UUID,
@@ -774,6 +931,30 @@ class LldpadDriver(object):
                            vsw_cb_data, fail_reason)
         return reply, fail_reason
 
+    def restore_vdp_vnic(self, port_uuid=None, vsiid=None, gid=0, mac="",
+                         vlan=0, oui={}, vsw_cb_fn=None, vsw_cb_data=None):
+        '''Interface function to apps, for a vNIC associated before a restart.
+
+        No associate is sent, the vNIC is only stored for the VDP Refresh,
+        which associates it again within the sync interval.
+        :param uuid: uuid of the vNIC
+        :param vsiid: VSI value, Only UUID supported for now
+        :param gid: Group ID the vNIC belongs to
+        :param mac: MAC Address of the vNIC
+        :param vlan: VLAN of the vNIC returned by the switch
+        :param oui: OUI of the vNIC
+        '''
+        oui_id = None
+        oui_data = None
+        if oui and 'oui_id' in oui:
+            oui_id = oui['oui_id']
+            oui_data = oui
+        self.store_vdp_vsi(port_uuid, None, None, None,
+                           vdp_const.VDP_VSIFRMT_UUID, vsiid,
+                           vdp_const.VDP_FILTER_GIDMACVID, gid, mac, vlan,
+                           False, vlan, oui_id, oui_data, vsw_cb_fn,
+                           vsw_cb_data, None)
+
     def send_vdp_vnic_down(self, port_uuid=None, vsiid=None, mgrid=None,
                            typeid=None, typeid_ver=None,
                            vsiid_frmt=vdp_const.VDP_VSIFRMT_UUID,
@@ -810,8 +991,81 @@ class LldpadDriver(object):
         except Exception as e:
             LOG.error("VNIC Down exception %s" % e)
 
+    def get_clif_cmd(self, args):
+        '''Translate the vdptool arguments into a clif VDP command.
+
+        :param args: vdptool arguments
+        :return cmd: dict of the vdp_request arguments, or None if the
+        :            arguments are not supported
+        '''
+        cmd = dict(cmd=None, ifname=self.port_name, tlvid=None, args=[],
+                   wait_event=False, vsiid=None)
+        args_iter = iter(args)
+        for arg in args_iter:
+            if arg == '-t':
+                cmd['cmd'] = vdp_const.CMD_GETTLV
+                cmd['ops'] = vdp_const.OP_CONFIG | vdp_const.OP_LOCAL | (
+                    vdp_const.OP_ARG)
+            elif arg == '-T':
+                cmd['cmd'] = vdp_const.CMD_SETTLV
+                cmd['ops'] = vdp_const.OP_CONFIG | vdp_const.OP_ARG | (
+                    vdp_const.OP_ARGVAL)
+            elif arg == '-i':
+                cmd['ifname'] = next(args_iter)
+            elif arg == '-V':
+                cmd['tlvid'] = vdp_const.VDP22_TLVID.get(next(args_iter))
+            elif arg == '-c':
+                cmd['args'].append(next(args_iter))
+                if cmd['args'][-1].startswith('uuid='):
+                    cmd['vsiid'] = cmd['args'][-1][len('uuid='):]
+            elif arg == '-W':
+                cmd['wait_event'] = True
+            elif arg != '-R':
+                return None
+        if cmd['cmd'] is None or cmd['tlvid'] is None:
+            return None
+        return cmd
+
+    def run_vdptool_clif(self, args):
+        '''Run the vdptool arguments over the lldpad socket.
+
+        The reply is returned as the text vdptool would have printed, or
+        None if the request needs to go through vdptool, which is also the
+        case when lldpad does not return success.
+        '''
+        cmd = self.get_clif_cmd(args)
+        if cmd is None:
+            return None
+        try:
+            reply, event = self.clif.vdp_request(**cmd)
+        except Exception as e:
+            LOG.error("Unable to send %(cmd)s to lldpad. "
+                      "Exception: %(exception)s",
+                      {'cmd': args, 'exception': e})
+            return None
+        if reply.status != vdp_const.CMD_SUCCESS:
+            LOG.info("lldpad returned status %(status)s for %(cmd)s, "
+                     "running vdptool", {'status': reply.status, 'cmd': args})
+            return None
+        if cmd['wait_event']:
+            if event is None or not event.vsis:
+                return vdp_const.VDP_NO_EVENT_REPLY
+            vsi = None
+            if cmd['vsiid'] is not None:
+                vsi = lldpad_clif.find_vsi(event.vsis, cmd['vsiid'])
+            return lldpad_clif.format_vsi(vsi or event.vsis[0])
+        # vdptool prints the raw request before the raw reply.
+        return "%s\n%s\n" % (lldpad_clif.render_vdp_cmd(
+            cmd['cmd'], cmd['ops'], cmd['ifname'], cmd['tlvid'],
+            cmd['args']), reply.raw)
+
     def run_vdptool(self, args, oui_args=[]):
         '''Function that runs the vdptool utility'''
+        # The OUI arguments are encoded by vdptool itself.
+        if self.clif and not oui_args:
+            reply = self.run_vdptool_clif(args)
+            if reply is not None:
+                return reply
         full_args = ['vdptool'] + args + oui_args
         try:
             return utils.execute(full_args, root_helper=self.root_helper)
@@ -0,0 +1,264 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+"""Client for the control interface (clif) of lldpad.
+
+lldptool and vdptool talk to lldpad over an abstract UNIX datagram socket.
+This module sends the same messages directly, so that a VDP request does not
+need a vdptool process. Only the VDP 2.2 module requests are supported.
+"""
+
+import collections
+import itertools
+import os
+import select
+import socket
+import threading
+import time
+
+from dfa.agent.vdp import lldpad_constants as vdp_const
+from dfa.common import dfa_logger as logging
+
+LOG = logging.getLogger(__name__)
+
+ClifReply = collections.namedtuple('ClifReply', ['status', 'cmd', 'ops',
+                                                 'ifname', 'tlvid', 'vsis',
+                                                 'raw'])
+
+_sock_cnt = itertools.count()
+
+
+class ClifError(Exception):
+
+    """Error in the messages exchanged with lldpad."""
+
+
+def encode_args(args):
+    '''Encode the key=value arguments the way vdptool does.'''
+
+    msg = []
+    for arg in args:
+        key, sep, val = arg.partition('=')
+        msg.append('%02x%s%04x%s' % (len(key), key, len(val), val))
+    return ''.join(msg)
+
+
+def render_vdp_cmd(cmd, ops, ifname, tlvid, args):
+    '''Return the clif message of a VDP 2.2 TLV command.'''
+
+    return ('%c%08x%c%1x%02x%08x%02x%s%02x%08x' % (
+        vdp_const.MOD_CMD, vdp_const.LLDP_MOD_VDP22, vdp_const.CMD_REQUEST,
+        vdp_const.CLIF_MSG_VERSION, cmd, ops, len(ifname), ifname,
+        vdp_const.NEAREST_CUSTOMER_BRIDGE, tlvid) + encode_args(args))
+
+
+def parse_vsi(data):
+    '''Parse the key/value list of one VSI into an ordered dict.'''
+
+    vsi = collections.OrderedDict()
+    off = 0
+    try:
+        while off < len(data):
+            key_len = int(data[off:off + 2], 16)
+            key = data[off + 2:off + 2 + key_len]
+            off += 2 + key_len
+            val_len = int(data[off:off + 4], 16)
+            vsi[key] = data[off + 4:off + 4 + val_len]
+            off += 4 + val_len
+    except ValueError:
+        raise ClifError("Malformed VSI %s" % data)
+    return vsi
+
+
+def parse_vsi_list(data):
+    '''Parse a list of VSIs, each one prefixed by its length.'''
+
+    vsis = []
+    off = 0
+    try:
+        while off + 4 <= len(data):
+            vsi_len = int(data[off:off + 4], 16)
+            off += 4
+            if off + vsi_len > len(data):
+                break
+            vsis.append(parse_vsi(data[off:off + vsi_len]))
+            off += vsi_len
+    except ValueError:
+        raise ClifError("Malformed VSI list %s" % data)
+    return vsis
+
+
+def parse_reply(buf):
+    '''Parse a command response or event of lldpad into a ClifReply.'''
+
+    try:
+        if buf[0] == vdp_const.MOD_CMD and buf[9] == vdp_const.EVENT_MSG:
+            return ClifReply(vdp_const.CMD_SUCCESS, None, None, None, None,
+                             parse_vsi_list(buf[12:]), buf)
+        if buf[0] != vdp_const.CMD_RESPONSE:
+            raise ClifError("Unknown message %s" % buf)
+        status = int(buf[1:3], 16)
+        if status != vdp_const.CMD_SUCCESS or (
+                buf[3] != vdp_const.CMD_REQUEST):
+            return ClifReply(status, None, None, None, None, [], buf)
+        cmd = int(buf[5:7], 16)
+        ops = int(buf[7:15], 16)
+        if_len = int(buf[15:17], 16)
+        ifname = buf[17:17 + if_len]
+        off = 17 + if_len
+        tlvid = None
+        vsis = []
+        if cmd in (vdp_const.CMD_GETTLV, vdp_const.CMD_SETTLV):
+            tlvid = int(buf[off:off + 8], 16)
+            vsis = parse_vsi_list(buf[off + 8:])
+    except (IndexError, ValueError):
+        raise ClifError("Malformed reply %s" % buf)
+    return ClifReply(status, cmd, ops, ifname, tlvid, vsis, buf)
+
+
+def find_vsi(vsis, vsiid):
+    '''Return the VSI of the given id in a list of VSIs, or None.'''
+
+    for vsi in vsis:
+        if vsi.get('uuid', '').lower() == vsiid.lower():
+            return vsi
+    return None
+
+
+def format_vsi(vsi):
+    '''Return the text vdptool prints for a VSI event.'''
+
+    lines = [vdp_const.VDP_REPLY_HDR + '\n']
+    for key, val in vsi.items():
+        if key != 'hints':
+            lines.append('\t%s = %s\n' % (key, val))
+            continue
+        try:
+            hints = int(val)
+        except ValueError:
+            continue
+        reason = vdp_const.VDP_BRIDGE_ERRORS.get(hints & 0xff)
+        if reason:
+            lines.append(vdp_const.bridge_error_fmt % reason)
+        for mask, reason in vdp_const.VDP_INTERNAL_ERRORS:
+            if (hints >> 8) & mask:
+                lines.append(vdp_const.internal_error_fmt % reason)
+    return ''.join(lines)
+
+
+class LldpadClif(object):
+
+    """Connection to the control socket of lldpad."""
+
+    def __init__(self, sock_name=vdp_const.LLDPAD_CLIF_SOCK,
+                 timeout=vdp_const.CLIF_TIMEOUT):
+        self.sock_name = sock_name
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        '''Bind a local abstract address and connect to lldpad.'''
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind('\0%s/%d-%d' % (self.sock_name, os.getpid(),
+                                      next(_sock_cnt)))
+            sock.connect('\0' + self.sock_name)
+        except socket.error:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _recv(self, timeout):
+        ready = select.select([self.sock], [], [], timeout)[0]
+        if not ready:
+            return None
+        return self.sock.recv(vdp_const.CLIF_MAX_MSG).decode('utf-8',
+                                                             'replace')
+
+    def _is_event(self, buf):
+        return buf[:1] == vdp_const.MOD_CMD and buf[9:10] == (
+            vdp_const.EVENT_MSG)
+
+    def request(self, msg):
+        '''Send a message and return the response to it.
+
+        Events that arrive before the response are dropped.
+        '''
+        self.sock.send(msg.encode('utf-8'))
+        while True:
+            buf = self._recv(self.timeout)
+            if buf is None:
+                raise ClifError("No reply from lldpad for %s" % msg)
+            if not self._is_event(buf):
+                return buf
+
+    def wait_event(self, timeout, vsiid=None):
+        '''Return the next parsed event, or None if there is none in time.
+
+        If vsiid is given, the events of the other VSIs are dropped.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            buf = self._recv(max(0, deadline - time.time()))
+            if buf is None:
+                return None
+            if not self._is_event(buf):
+                continue
+            event = parse_reply(buf)
+            if vsiid is None or find_vsi(event.vsis, vsiid) is not None:
+                return event
+
+    def _attach(self, attach):
+        cmd = vdp_const.ATTACH_CMD if attach else vdp_const.DETACH_CMD
+        reply = self.request('%s%x' % (cmd, vdp_const.LLDP_MOD_VDP22))
+        if reply[1:3] != '%02x' % vdp_const.CMD_SUCCESS:
+            raise ClifError("Attach failed %s" % reply)
+
+    def vdp_request(self, cmd, ops, ifname, tlvid, args, wait_event=False,
+                    vsiid=None):
+        '''Send a VDP 2.2 command and return the reply and event.
+
+        The event is the one lldpad sends once the switch responds, and is
+        only waited for if wait_event is set. If vsiid is given, it is the
+        first event for that VSI. It is None otherwise or if none arrives
+        within the timeout.
+        '''
+        with self.lock:
+            if self.sock is None:
+                self.open()
+            event = None
+            try:
+                if wait_event:
+                    self._attach(True)
+                reply = parse_reply(self.request(render_vdp_cmd(
+                    cmd, ops, ifname, tlvid, args)))
+                if wait_event:
+                    if reply.status == vdp_const.CMD_SUCCESS:
+                        event = self.wait_event(self.timeout, vsiid=vsiid)
+                    self._attach(False)
+            except (socket.error, ClifError):
+                # Start from a new socket, stale replies may be pending.
+                self.close()
+                raise
+        return reply, event
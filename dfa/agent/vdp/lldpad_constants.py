@@ -27,6 +27,9 @@ VDP_FILTER_MACVID = 2
 VDP_FILTER_GIDVID = 3
 VDP_FILTER_GIDMACVID = 4
 VDP_SYNC_TIMEOUT = 15
+# The VSI refreshes are spread over VDP_SYNC_TIMEOUT in slots of this many
+# seconds.
+VDP_REFRESH_TICK = 1
 CALLBACK_THRESHOLD = 5
 
 verify_failure_reason = "vsi_id mismatch, queried %s, returned %s"
@@ -43,3 +46,50 @@ nonzero_hints_failure = "Non-zero hints, value %d"
 vsi_mismatch_failure_reason = "VSIID Reply mis-match req vsi %s reply vsi %s"
 mac_mismatch_failure_reason = \
     "VSIID MAC Reply mis-match req mac %s reply mac %s"
+
+# lldpad control interface (clif), as used by lldptool and vdptool.
+VDP_CLIF = False
+LLDPAD_CLIF_SOCK = "/com/intel/lldpad"
+CLIF_TIMEOUT = 5
+CLIF_MAX_MSG = 8192
+CLIF_MSG_VERSION = 3
+MOD_CMD = 'M'
+CMD_REQUEST = 'C'
+CMD_RESPONSE = 'R'
+EVENT_MSG = 'E'
+ATTACH_CMD = 'A'
+DETACH_CMD = 'D'
+LLDP_MOD_VDP22 = 0x80c4
+NEAREST_CUSTOMER_BRIDGE = 2
+CMD_SUCCESS = 0
+CMD_GETTLV = 1
+CMD_SETTLV = 2
+OP_LOCAL = 0x01
+OP_ARG = 0x04
+OP_ARGVAL = 0x08
+OP_CONFIG = 0x10
+VDP22_TLVID = {'preassoc': 1, 'preassoc-rr': 2, 'assoc': 3, 'deassoc': 4}
+VDP_REPLY_HDR = "Response from VDP"
+VDP_NO_EVENT_REPLY = "\nReturn from vsievt -11"
+# Reasons vdptool prints for the hints value of a VSI event.
+bridge_error_fmt = "\tError returned by Bridge: %s\n"
+internal_error_fmt = "\tInternal Error : %s\n"
+VDP_BRIDGE_ERRORS = {
+    1: "VDP TLV Format is Invalid",
+    2: "Insufficient resources at bridge",
+    3: "Unable to contact VSI Mgr",
+    4: "Other Failures",
+    5: "Invalid VID, GroupID or MAC address field",
+    0xfc: "Deassoc received from switch",
+    0xfd: "Timeout Error",
+    0xfe: ("Command rejected by bridge and state prior to requested command "
+           "is kept")}
+VDP_INTERNAL_ERRORS = ((0x1, "Keepalive Timeout"),
+                       (0x2, "Ack not received from bridge"),
+                       (0x4, "Transmission Error"))
+# Failures a retry of the same request runs into again, the configuration of
+# the switch or of the VM has to change first. Any other failure is retried.
+VDP_PERMANENT_FAILURES = (
+    VDP_BRIDGE_ERRORS[1], VDP_BRIDGE_ERRORS[5], VDP_BRIDGE_ERRORS[0xfe],
+    multiple_filter_failure_reason.split('%')[0],
+    multiple_hints_failure_reason.split('%')[0])
@@ -20,6 +20,9 @@ VDP is a part of LLDP Agent Daemon (lldpad). For more information on VDP,
 pls visit http://www.ieee802.org/1/pages/802.1bg.html
 """
 
+import json
+import re
+
 from dfa.common import dfa_sys_lib as ovs_lib
 from dfa.agent.vdp import lldpad
 from dfa.common import constants as cconstants
@@ -30,6 +33,11 @@ from dfa.common import utils as sys_utils
 
 LOG = logging.getLogger(__name__)
 
+VM_FLOW_RE = re.compile(r'cookie=0x([0-9a-fA-F]+).*[ ,]in_port=([^, ]+)'
+                        r'.*[ ,]dl_vlan=(\d+).*mod_vlan_vid:(\d+)')
+INTEG_BR = 'int'
+EXT_BR = 'ext'
+
 
 def is_uplink_already_added(root_helper, br_ex, port_name):
     br, port_exist = ovs_lib.port_exists_glob(root_helper, port_name)
@@ -56,11 +64,69 @@ def delete_uplink_and_flows(root_helper, br_ex, port_name, ucs_fi):
 
 def glob_delete_vdp_flows(br_ex, root_helper, ucs_fi):
     br = ovs_lib.OVSBridge(br_ex, root_helper=root_helper)
-    if ucs_fi:
-        br.delete_flows(dl_dst=constants.NB_DMAC, dl_type=constants.LLDP_ETYPE)
-    br.delete_flows(dl_dst=constants.NCB_DMAC, dl_type=constants.LLDP_ETYPE)
-    br.delete_flows(dl_dst=constants.NCB_DMAC,
-                    dl_type=constants.VDP22_ETYPE)
+    with br.deferred():
+        if ucs_fi:
+            br.delete_flows(dl_dst=constants.NB_DMAC,
+                            dl_type=constants.LLDP_ETYPE)
+        br.delete_flows(dl_dst=constants.NCB_DMAC,
+                        dl_type=constants.LLDP_ETYPE)
+        br.delete_flows(dl_dst=constants.NCB_DMAC,
+                        dl_type=constants.VDP22_ETYPE)
+
+
+def vm_flow_cookie(lvid):
+    """Cookie of the VM flows of a local VLAN."""
+    return constants.VDP_VM_FLOW_COOKIE | int(lvid)
+
+
+def gen_vm_flow_set(phy_port_num, int_port_num, lvid, vdp_vlan):
+    """Return the set of VM flows needed for a local VLAN.
+
+    A flow is represented by (bridge, in_port, match vlan, set vlan).
+    """
+    return frozenset([(EXT_BR, str(phy_port_num), int(lvid), int(vdp_vlan)),
+                      (INTEG_BR, str(int_port_num), int(vdp_vlan),
+                       int(lvid))])
+
+
+def parse_vm_flows(br_tag, flows, flow_dict):
+    """Parse the dump of VM flows and add them to flow_dict per local VLAN.
+
+    Flows that are not programmed by the enabler are skipped, based on the
+    cookie.
+    """
+    for flow in flows.splitlines():
+        match = VM_FLOW_RE.search(flow)
+        if not match:
+            continue
+        cookie = int(match.group(1), 16)
+        if (cookie & constants.VDP_VM_FLOW_COOKIE_MASK) != (
+                constants.VDP_VM_FLOW_COOKIE):
+            continue
+        lvid = cookie & ~constants.VDP_VM_FLOW_COOKIE_MASK
+        flow_dict.setdefault(lvid, set()).add(
+            (br_tag, match.group(2), int(match.group(3)),
+             int(match.group(4))))
+    return flow_dict
+
+
+def read_snapshot(state_file):
+    """Return the VDP snapshot saved in state_file, None if there's none."""
+    try:
+        with open(state_file) as snap_file:
+            snapshot = json.load(snap_file)
+    except (IOError, OSError):
+        LOG.info("No VDP snapshot in %s", state_file)
+        return None
+    except ValueError as exc:
+        LOG.error("Invalid VDP snapshot in %(file)s: %(exc)s",
+                  {'file': state_file, 'exc': exc})
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != (
+            constants.VDP_SNAPSHOT_VERSION):
+        LOG.error("Unsupported VDP snapshot in %s", state_file)
+        return None
+    return snapshot
 
 
 def is_bridge_present(br, root_helper):
@@ -84,6 +150,9 @@ class LocalVlan():
         # of all VLAN's floating around for different vNIC's of the same
         # network.
         self.port_vdp_vlan_dict = {}
+        # Hash of the expected VM flows and the parameters it's computed for.
+        self._flow_hash = None
+        self._flow_key = None
 
     def set_port_uuid(self, port_uuid, vdp_vlan, fail_reason):
         if port_uuid not in self.port_uuid_list:
@@ -152,6 +221,18 @@ class LocalVlan():
         else:
             return self.port_vdp_vlan_dict.keys()[0]
 
+    def expected_flow_hash(self, phy_port_num, int_port_num, vdp_vlan):
+        """Hash of the VM flows needed for this local VLAN.
+
+        It's recomputed only when the ports or VLAN's change.
+        """
+        key = (str(phy_port_num), str(int_port_num), self.lvid, vdp_vlan)
+        if key != self._flow_key:
+            self._flow_hash = hash(gen_vm_flow_set(
+                phy_port_num, int_port_num, self.lvid, vdp_vlan))
+            self._flow_key = key
+        return self._flow_hash
+
 
 class OVSNeutronVdp(object):
 
@@ -165,7 +246,7 @@ class OVSNeutronVdp(object):
     def __init__(self, uplink, integ_br, ext_br, root_helper,
                  vdp_vlan_cb, vdp_mode=constants.VDP_SEGMENT_MODE,
                  is_ucs_fi=False,
-                 fi_evb_dmac=None):
+                 fi_evb_dmac=None, state_file=None):
         # self.root_helper = 'sudo'
         self.root_helper = root_helper
         self.uplink = uplink
@@ -187,9 +268,18 @@ class OVSNeutronVdp(object):
         self.fi_evb_dmac = fi_evb_dmac
         self.ucs_fi = is_ucs_fi
         self.uplink_fail_reason = ""
+        self.state_file = state_file
+        self.snapshot_dirty = False
+        self.snapshot_save_failed = False
+        # Port UUID to [net UUID, MAC, segmentation ID, OUI] of the VM ports
+        # restored from the snapshot, until the VMs are synced with the
+        # server.
+        self.restored_ports = {}
         self.setup_lldpad = self.setup_lldpad_ports()
         if not self.setup_lldpad:
             return
+        if self.state_file:
+            self.restore_snapshot()
         flow_check_periodic_task = sys_utils.PeriodicTask(
             cconstants.FLOW_CHECK_INTERVAL, self._flow_check_handler)
         self.flow_check_periodic_task = flow_check_periodic_task
@@ -198,45 +288,59 @@ class OVSNeutronVdp(object):
     def is_lldpad_setup_done(self):
         return self.setup_lldpad
 
-    def _check_bridge_flow(self, flow, out_vlan, in_vlan):
-        out_vlan_flow_str = 'dl_vlan=' + str(out_vlan)
-        in_vlan_flow_str = 'actions=mod_vlan_vid:' + str(in_vlan)
-        flow_str = out_vlan_flow_str + ' ' + in_vlan_flow_str
-        flow_partition = flow.partition(flow_str)[1]
-        if not len(flow_partition):
+    def _dump_vm_flows(self, br, flow_dict, br_tag):
+        cookie = "0x%x/0x%x" % (constants.VDP_VM_FLOW_COOKIE,
+                                constants.VDP_VM_FLOW_COOKIE_MASK)
+        flows = br.dump_flows_for(table=constants.VDP_VM_FLOW_TABLE,
+                                  cookie=cookie)
+        if flows is None:
             return False
+        parse_vm_flows(br_tag, flows, flow_dict)
         return True
 
     def _flow_check_handler_internal(self):
         """Periodic handler to check if installed flows are present.
 
         This handler runs periodically to check if installed flows are present.
-        This function cannot detect and delete the stale flows, if present.
-        It requires more complexity to delete stale flows. Generally, stale
-        flows are not present. So, that logic is not put here.
+        Only the flows programmed by the enabler are dumped, identified by
+        their cookie. The flows of each local VLAN are compared against the
+        hash of the expected flows, and only the VLAN's that differ are
+        reprogrammed. Stale flows of unknown local VLAN's are not deleted.
         """
-        integ_flow = self.integ_br_obj.dump_flows_for(
-            in_port=self.int_peer_port_num)
-        ext_flow = self.ext_br_obj.dump_flows_for(
-            in_port=self.phy_peer_port_num)
+        installed = {}
+        if not self._dump_vm_flows(self.integ_br_obj, installed, INTEG_BR) or (
+                not self._dump_vm_flows(self.ext_br_obj, installed, EXT_BR)):
+            LOG.error("Unable to dump the VM flows")
+            return
+        stale = []
         for net_uuid, lvm in self.local_vlan_map.iteritems():
             vdp_vlan = lvm.any_consistent_vlan()
-            flow_required = False
-            if vdp_vlan and ovs_lib.is_valid_vlan_tag(vdp_vlan):
-                if not self._check_bridge_flow(integ_flow, vdp_vlan, lvm.lvid):
-                    LOG.error("Flow for VDP Vlan %(vdp_vlan)s, Local vlan "
-                              "%(lvid)s not present on Integ bridge",
-                              {'vdp_vlan': vdp_vlan, 'lvid': lvm.lvid})
-                    flow_required = True
-                if not self._check_bridge_flow(ext_flow, lvm.lvid, vdp_vlan):
-                    LOG.error("Flow for VDP Vlan %(vdp_vlan)s, Local vlan "
-                              "%(lvid)s not present on External bridge",
-                              {'vdp_vlan': vdp_vlan, 'lvid': lvm.lvid})
-                    flow_required = True
-                if flow_required:
-                    LOG.info("Programming flows for lvid %(lvid)s vdp vlan "
-                             "%(vdp)s", {'lvid': lvm.lvid, 'vdp': vdp_vlan})
-                    self.program_vm_ovs_flows(lvm.lvid, 0, vdp_vlan)
+            if not vdp_vlan or not ovs_lib.is_valid_vlan_tag(vdp_vlan):
+                continue
+            expected = lvm.expected_flow_hash(self.phy_peer_port_num,
+                                              self.int_peer_port_num,
+                                              vdp_vlan)
+            flows = frozenset(installed.get(int(lvm.lvid), ()))
+            if hash(flows) == expected:
+                continue
+            LOG.error("Flows for VDP Vlan %(vdp_vlan)s, Local vlan %(lvid)s "
+                      "differ, installed %(flows)s",
+                      {'vdp_vlan': vdp_vlan, 'lvid': lvm.lvid,
+                       'flows': list(flows)})
+            stale.append((lvm.lvid, vdp_vlan))
+        # The flows of all the stale VLAN's are replaced together.
+        with self.ext_br_obj.deferred(), self.integ_br_obj.deferred():
+            for lvid, vdp_vlan in stale:
+                self._reprogram_vm_ovs_flows(lvid, vdp_vlan)
+
+    def _reprogram_vm_ovs_flows(self, lvid, vdp_vlan):
+        """Replace all the VM flows of a local VLAN. """
+        LOG.info("Programming flows for lvid %(lvid)s vdp vlan %(vdp)s",
+                 {'lvid': lvid, 'vdp': vdp_vlan})
+        cookie = "0x%x/-1" % vm_flow_cookie(lvid)
+        self.ext_br_obj.delete_flows(cookie=cookie)
+        self.integ_br_obj.delete_flows(cookie=cookie)
+        self.program_vm_ovs_flows(lvid, 0, vdp_vlan)
 
     def _flow_check_handler(self):
         """Top level routine to check OVS flow consistency. """
@@ -246,6 +350,7 @@ class OVSNeutronVdp(object):
                 self._flow_check_handler_internal()
         except Exception as e:
             LOG.error("Exception in _flow_check_handler_internal %s", str(e))
+        self.save_snapshot()
 
     def program_vdp_flows(self, lldp_ovs_portnum, phy_port_num):
         br = self.ext_br_obj
@@ -256,53 +361,57 @@ class OVSNeutronVdp(object):
             LOG.error("fi_evb_dmac is not configured on a UCS FI/Blade setup."
                       " This will cause connectivity issues")
 
-        if self.ucs_fi:
-            br.add_flow(priority=high_prio, in_port=lldp_ovs_portnum,
-                        dl_dst=constants.NB_DMAC, dl_type=constants.LLDP_ETYPE,
-                        actions="output:%s" % phy_port_num)
-            br.add_flow(priority=high_prio, in_port=phy_port_num,
-                        dl_dst=constants.NB_DMAC, dl_type=constants.LLDP_ETYPE,
-                        actions="output:%s" % lldp_ovs_portnum)
-        else:
-            br.add_flow(priority=high_prio, in_port=lldp_ovs_portnum,
-                        dl_dst=constants.NCB_DMAC,
-                        dl_type=constants.LLDP_ETYPE,
-                        actions="output:%s" % phy_port_num)
-            br.add_flow(priority=high_prio, in_port=phy_port_num,
-                        dl_dst=constants.NCB_DMAC,
-                        dl_type=constants.LLDP_ETYPE,
-                        actions="output:%s" % lldp_ovs_portnum)
-
-        if self.fi_evb_dmac is not None:
-            br.add_flow(priority=high_prio, in_port=lldp_ovs_portnum,
-                        dl_dst=constants.NCB_DMAC,
-                        dl_type=constants.VDP22_ETYPE,
-                        actions="mod_dl_dst:%s,output:%s" %
-                        (self.fi_evb_dmac, phy_port_num))
-            br.add_flow(priority=high_prio, in_port=phy_port_num,
-                        dl_dst=constants.NCB_DMAC,
-                        dl_type=constants.VDP22_ETYPE,
-                        actions="mod_dl_dst:%s,output:%s" %
-                        (self.fi_evb_dmac, lldp_ovs_portnum))
-        else:
-            br.add_flow(priority=high_prio, in_port=lldp_ovs_portnum,
-                        dl_dst=constants.NCB_DMAC,
-                        dl_type=constants.VDP22_ETYPE,
-                        actions="output:%s" % phy_port_num)
-            br.add_flow(priority=high_prio, in_port=phy_port_num,
-                        dl_dst=constants.NCB_DMAC,
-                        dl_type=constants.VDP22_ETYPE,
-                        actions="output:%s" % lldp_ovs_portnum)
+        with br.deferred():
+            if self.ucs_fi:
+                br.add_flow(priority=high_prio, in_port=lldp_ovs_portnum,
+                            dl_dst=constants.NB_DMAC,
+                            dl_type=constants.LLDP_ETYPE,
+                            actions="output:%s" % phy_port_num)
+                br.add_flow(priority=high_prio, in_port=phy_port_num,
+                            dl_dst=constants.NB_DMAC,
+                            dl_type=constants.LLDP_ETYPE,
+                            actions="output:%s" % lldp_ovs_portnum)
+            else:
+                br.add_flow(priority=high_prio, in_port=lldp_ovs_portnum,
+                            dl_dst=constants.NCB_DMAC,
+                            dl_type=constants.LLDP_ETYPE,
+                            actions="output:%s" % phy_port_num)
+                br.add_flow(priority=high_prio, in_port=phy_port_num,
+                            dl_dst=constants.NCB_DMAC,
+                            dl_type=constants.LLDP_ETYPE,
+                            actions="output:%s" % lldp_ovs_portnum)
+
+            if self.fi_evb_dmac is not None:
+                br.add_flow(priority=high_prio, in_port=lldp_ovs_portnum,
+                            dl_dst=constants.NCB_DMAC,
+                            dl_type=constants.VDP22_ETYPE,
+                            actions="mod_dl_dst:%s,output:%s" %
+                            (self.fi_evb_dmac, phy_port_num))
+                br.add_flow(priority=high_prio, in_port=phy_port_num,
+                            dl_dst=constants.NCB_DMAC,
+                            dl_type=constants.VDP22_ETYPE,
+                            actions="mod_dl_dst:%s,output:%s" %
+                            (self.fi_evb_dmac, lldp_ovs_portnum))
+            else:
+                br.add_flow(priority=high_prio, in_port=lldp_ovs_portnum,
+                            dl_dst=constants.NCB_DMAC,
+                            dl_type=constants.VDP22_ETYPE,
+                            actions="output:%s" % phy_port_num)
+                br.add_flow(priority=high_prio, in_port=phy_port_num,
+                            dl_dst=constants.NCB_DMAC,
+                            dl_type=constants.VDP22_ETYPE,
+                            actions="output:%s" % lldp_ovs_portnum)
 
     def delete_vdp_flows(self):
         br = self.ext_br_obj
-        if self.ucs_fi:
-            br.delete_flows(dl_dst=constants.NB_DMAC,
+        with br.deferred():
+            if self.ucs_fi:
+                br.delete_flows(dl_dst=constants.NB_DMAC,
+                                dl_type=constants.LLDP_ETYPE)
+            br.delete_flows(dl_dst=constants.NCB_DMAC,
                             dl_type=constants.LLDP_ETYPE)
-        br.delete_flows(dl_dst=constants.NCB_DMAC,
-                        dl_type=constants.LLDP_ETYPE)
-        br.delete_flows(dl_dst=constants.NCB_DMAC,
-                        dl_type=constants.VDP22_ETYPE)
+            br.delete_flows(dl_dst=constants.NCB_DMAC,
+                            dl_type=constants.VDP22_ETYPE)
 
     def clear_obj_params(self):
         LOG.debug("Clearing Uplink Params")
@@ -314,6 +423,8 @@ class OVSNeutronVdp(object):
         br = self.ext_br_obj
         br.delete_port(lldp_ovs_veth_str)
         br.delete_port(self.uplink)
+        br.stop_port_monitor()
+        self.integ_br_obj.stop_port_monitor()
         self.lldpad_info.clear_uplink()
         del self.lldpad_info
         # It's ok if the veth remains even if the uplink changes, worst case
@@ -324,6 +435,15 @@ class OVSNeutronVdp(object):
         # ip_lib.IPDevice(lldp_ovs_veth_str, self.root_helper).link.delete()
 
     def program_vm_ovs_flows(self, lvid, old_vlan, new_vlan):
+        '''Replace the VM flows of a local VLAN.
+
+        The old flows are deleted with one call and the new ones added with
+        one call on each bridge.
+        '''
+        with self.ext_br_obj.deferred(), self.integ_br_obj.deferred():
+            self._program_vm_ovs_flows(lvid, old_vlan, new_vlan)
+
+    def _program_vm_ovs_flows(self, lvid, old_vlan, new_vlan):
         if old_vlan:
             # outbound
             self.ext_br_obj.delete_flows(in_port=self.phy_peer_port_num,
@@ -332,14 +452,17 @@ class OVSNeutronVdp(object):
             self.integ_br_obj.delete_flows(in_port=self.int_peer_port_num,
                                            dl_vlan=old_vlan)
         if new_vlan:
+            cookie = "0x%x" % vm_flow_cookie(lvid)
             # outbound
             self.ext_br_obj.add_flow(priority=4,
+                                     cookie=cookie,
                                      in_port=self.phy_peer_port_num,
                                      dl_vlan=lvid,
                                      actions="mod_vlan_vid:%s,normal" %
                                              new_vlan)
             # inbound
             self.integ_br_obj.add_flow(priority=3,
+                                       cookie=cookie,
                                        in_port=self.int_peer_port_num,
                                        dl_vlan=new_vlan,
                                        actions="mod_vlan_vid:%s,normal" % lvid)
@@ -372,6 +495,11 @@ class OVSNeutronVdp(object):
         self.ext_br_obj = br
         int_br = ovs_lib.OVSBridge(self.integ_br, root_helper=self.root_helper)
         self.integ_br_obj = int_br
+        # The port lookups are cached while the OVSDB changes are monitored.
+        for bridge in (br, int_br):
+            if not bridge.start_port_monitor():
+                LOG.error("Unable to monitor the ports of %s, lookups are "
+                          "not cached", bridge.br_name)
 
         self.phy_peer_port, self.int_peer_port = self.find_interconnect_ports()
         if self.phy_peer_port is None or self.int_peer_port is None:
@@ -488,7 +616,7 @@ class OVSNeutronVdp(object):
         lvm = self.local_vlan_map.get(net_uuid)
         if lvm:
             if port_uuid not in lvm.port_uuid_list:
-                fail_reason = "port_uuid %s not in cache for port_down" % (
+                fail_reason = cconstants.port_not_cached_reason % (
                     port_uuid)
                 LOG.error(fail_reason)
                 return {'result': False, 'fail_reason': fail_reason}
@@ -550,7 +678,7 @@ class OVSNeutronVdp(object):
         else:
             # There's no logical change of this condition being hit
             # So, not returning False here.
-            fail_reason = "Local VLAN Map not available in port_down"
+            fail_reason = cconstants.lvm_not_avail_reason
             LOG.error(fail_reason)
             return {'result': False, 'fail_reason': fail_reason}
 
@@ -653,6 +781,7 @@ class OVSNeutronVdp(object):
                                                         net_uuid,
                                                         segmentation_id,
                                                         status, oui)
+                self.snapshot_dirty = True
                 return ret
         except Exception as e:
             LOG.error("Exception in send_vdp_port_event %s" % str(e))
@@ -676,6 +805,122 @@ class OVSNeutronVdp(object):
         if vdp_vlan != cconstants.INVALID_VLAN:
             lvm.late_binding_vlan = vdp_vlan
             lvm.vdp_nego_req = False
+        self.snapshot_dirty = True
+
+    def get_snapshot(self):
+        '''Return the snapshot of the local VLAN's and VSI's.
+
+        A network is saved as [lvid, segmentation ID, VDP VLAN, ports] and
+        a port as [MAC, VDP VLAN, OUI], to keep the snapshot compact.
+        '''
+        lldpad_port = getattr(self, 'lldpad_info', None)
+        vif_map = getattr(lldpad_port, 'vdp_vif_map', {})
+        oui_map = getattr(lldpad_port, 'oui_vif_map', {})
+        nets = {}
+        for net_uuid, lvm in self.local_vlan_map.iteritems():
+            ports = {}
+            for port_uuid, port_vlan_set in lvm.port_uuid_list.iteritems():
+                vsi = vif_map.get(port_uuid)
+                if vsi is None:
+                    continue
+                oui = oui_map.get(port_uuid, {}).get('oui_data')
+                ports[port_uuid] = [vsi.get('mac'), port_vlan_set[1], oui]
+            nets[net_uuid] = [lvm.lvid, lvm.segmentation_id,
+                              lvm.late_binding_vlan, ports]
+        return {'version': constants.VDP_SNAPSHOT_VERSION,
+                'uplink': self.uplink, 'nets': nets}
+
+    def save_snapshot(self):
+        '''Write the snapshot to the state file, if it changed.'''
+        if not self.state_file or not self.snapshot_dirty:
+            return
+        with self.ovs_vdp_lock:
+            data = json.dumps(self.get_snapshot(), separators=(',', ':'))
+            self.snapshot_dirty = False
+        try:
+            sys_utils.write_file_atomic(self.state_file, data)
+        except (IOError, OSError) as exc:
+            self.snapshot_dirty = True
+            # It's tried again on every flow check, the error is only
+            # logged the first time.
+            log_fn = LOG.debug if self.snapshot_save_failed else LOG.error
+            self.snapshot_save_failed = True
+            log_fn("Unable to save the VDP snapshot in %(file)s: %(exc)s",
+                   {'file': self.state_file, 'exc': exc})
+            return
+        if self.snapshot_save_failed:
+            self.snapshot_save_failed = False
+            LOG.info("VDP snapshot saved in %s", self.state_file)
+
+    def _is_restored_port_valid(self, port_uuid, lvid):
+        port_name = self.ext_br_obj.get_ofport_name(port_uuid)
+        if port_name is None:
+            return False
+        return self.integ_br_obj.get_port_vlan_tag(port_name) == lvid
+
+    def restore_snapshot(self):
+        '''Restore the local VLAN's and VSI's of the saved snapshot.
+
+        A network is restored only if its VM flows are installed as
+        expected, and only its ports that are still tagged with its local
+        VLAN. The VSI's of the restored ports are associated again by the
+        VDP Refresh, without waiting for the switch.
+        '''
+        snapshot = read_snapshot(self.state_file)
+        if snapshot is None:
+            return
+        if snapshot.get('uplink') != self.uplink:
+            LOG.info("VDP snapshot of uplink %s not restored",
+                     snapshot.get('uplink'))
+            return
+        installed = {}
+        if not self._dump_vm_flows(self.integ_br_obj, installed, INTEG_BR) or (
+                not self._dump_vm_flows(self.ext_br_obj, installed, EXT_BR)):
+            LOG.error("Unable to dump the VM flows, snapshot not restored")
+            return
+        for net_uuid, net in snapshot.get('nets', {}).iteritems():
+            lvid, segmentation_id, vdp_vlan, ports = net
+            flows = frozenset(installed.get(lvid, ()))
+            if ovs_lib.is_valid_vlan_tag(vdp_vlan):
+                expected = gen_vm_flow_set(self.phy_peer_port_num,
+                                           self.int_peer_port_num, lvid,
+                                           vdp_vlan)
+            else:
+                expected = frozenset()
+            if flows != expected:
+                LOG.info("Flows of network %s changed, not restored",
+                         net_uuid)
+                continue
+            lvm = LocalVlan(lvid, segmentation_id)
+            lvm.lvid = lvid
+            for port_uuid, (mac, port_vlan, oui) in ports.iteritems():
+                if not self._is_restored_port_valid(port_uuid, lvid):
+                    LOG.info("Port %s changed, not restored", port_uuid)
+                    continue
+                ovs_cb_data = {'obj': self, 'mac': mac,
+                               'port_uuid': port_uuid, 'net_uuid': net_uuid}
+                self.lldpad_info.restore_vdp_vnic(
+                    port_uuid=port_uuid, vsiid=port_uuid,
+                    gid=segmentation_id, mac=mac, vlan=port_vlan, oui=oui,
+                    vsw_cb_fn=self.vdp_vlan_change, vsw_cb_data=ovs_cb_data)
+                lvm.set_port_uuid(port_uuid, port_vlan, None)
+                self.restored_ports[port_uuid] = [net_uuid, mac,
+                                                  segmentation_id, oui]
+            if not lvm.port_uuid_list:
+                continue
+            lvm.late_binding_vlan = vdp_vlan
+            lvm.vdp_nego_req = False
+            self.local_vlan_map[net_uuid] = lvm
+        LOG.info("Restored %(ports)d ports of %(nets)d networks from the "
+                 "VDP snapshot", {'ports': len(self.restored_ports),
+                                  'nets': len(self.local_vlan_map)})
+
+    def pop_restored_ports(self):
+        '''Return the ports restored from the snapshot, and forget them.'''
+        with self.ovs_vdp_lock:
+            restored = self.restored_ports
+            self.restored_ports = {}
+        return restored
 
     def get_lvid_vdp_vlan(self, net_uuid, port_uuid):
         ''' Retrieve the Local Vlan ID and VDP Vlan '''
@@ -779,6 +1024,7 @@ class OVSNeutronVdp(object):
             with self.ovs_vdp_lock:
                 self.vdp_vlan_change_internal(vsw_cb_data, vdp_vlan,
                                               fail_reason)
+                self.snapshot_dirty = True
         except Exception as e:
             LOG.error("Exception in vdp_vlan_change %s" % str(e))
 
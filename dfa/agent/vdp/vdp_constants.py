@@ -26,4 +26,14 @@ LLDP_ETYPE = 0x88cc
 VDP22_ETYPE = 0x8940
 VDP_FLOW_PRIO = 99
 
+# Cookie of the VM flows programmed by the enabler. The lower 32 bits carry
+# the local VLAN of the flow.
+VDP_VM_FLOW_COOKIE = 0x5dfa << 32
+VDP_VM_FLOW_COOKIE_MASK = 0xffffffff << 32
+VDP_VM_FLOW_TABLE = 0
+
+# Version of the layout of the VDP snapshot, a snapshot of another version is
+# ignored.
+VDP_SNAPSHOT_VERSION = 1
+
 VDP_SEGMENT_MODE = 10
@@ -20,7 +20,10 @@ try:
     from oslo_config import cfg
 except ImportError:
     from oslo.config import cfg
+import os
+import signal
 import sys
+import threading
 
 import dfa.common.constants as com_const
 from dfa.agent.vdp import lldpad_constants as vdp_const
@@ -40,6 +43,7 @@ default_dfa_agent_opts = {
     'dfa_agent': {
         'integration_bridge': 'br-int',
         'external_dfa_bridge': 'br-ethd',
+        'state_dir': '',
     },
 }
 
@@ -52,6 +56,7 @@ default_vdp_opts = {
         'hints': 'none',
         'filter': vdp_const.VDP_FILTER_GIDMACVID,
         'vdp_sync_timeout': vdp_const.VDP_SYNC_TIMEOUT,
+        'vdp_clif': vdp_const.VDP_CLIF,
     },
 }
 
@@ -70,6 +75,7 @@ default_firewall_opts = {
         'fw_service_out_ip_start': fw_const.OUT_IP_START,
         'fw_service_out_ip_end': fw_const.OUT_IP_END,
         'fw_service_dummy_ip_subnet': fw_const.DUMMY_IP_SUBNET,
+        'fw_service_pool_size': fw_const.SERVICE_POOL_SIZE,
     },
 }
 
@@ -96,6 +102,8 @@ default_log_opts = {
 default_sys_opts = {
     'sys': {
         'root_helper': 'sudo',
+        'root_helper_daemon': '',
+        'exec_timeout': com_const.EXEC_TIMEOUT,
     },
 }
 
@@ -149,54 +157,178 @@ default_opts_list = [
 ]
 
 
+# Parsed config files, keyed by the tuple of file names. Files are parsed
+# once per process and re-parsed only when one of their mtimes changes or
+# a reload is requested (e.g. SIGHUP).
+_parsed_cache = {}
+_cache_lock = threading.Lock()
+_listeners = []
+
+
+class _ParsedConfig(object):
+
+    """Immutable snapshot of the parsed content of a list of config files."""
+
+    def __init__(self, files, mtimes, sections):
+        self._files = tuple(files)
+        self._mtimes = mtimes
+        self._sections = sections
+
+    @property
+    def files(self):
+        return self._files
+
+    @property
+    def mtimes(self):
+        return self._mtimes
+
+    def sections(self):
+        """Return a copy of the parsed sections."""
+
+        return dict((sec, dict(val)) for sec, val in self._sections.items())
+
+
+def _get_mtimes(files):
+    mtimes = []
+    for fname in files:
+        try:
+            mtimes.append(os.path.getmtime(fname))
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def _inspect_val(val):
+
+    if isinstance(val, str):
+        return True if val.lower() == 'true' else False if (
+            val.lower() == 'false') else val
+    return val
+
+
+def _parse_config_files(cfgfile):
+    """Read and parse the config files."""
+
+    mtimes = _get_mtimes(cfgfile)
+    multi_parser = cfg.MultiConfigParser()
+    read_ok = multi_parser.read(cfgfile)
+
+    if len(read_ok) != len(cfgfile):
+        raise cfg.Error(("Failed to read config files read_ok = %s "
+                         "cfgfile = %s" % (read_ok, cfgfile)))
+
+    sections = {}
+    for parsed_file in multi_parser.parsed:
+        for parsed_item in parsed_file.keys():
+            if parsed_item not in sections:
+                sections[parsed_item] = {}
+            for key, value in parsed_file[parsed_item].items():
+                sections[parsed_item][key] = _inspect_val(value[0])
+    return _ParsedConfig(cfgfile, mtimes, sections)
+
+
+def _get_parsed_config(cfgfile, force=False):
+    """Return the cached snapshot for cfgfile, re-parsing if stale.
+
+    Listeners are notified if an existing snapshot is replaced.
+    """
+
+    key = tuple(cfgfile)
+    with _cache_lock:
+        entry = _parsed_cache.get(key)
+        if (entry is not None and not force and
+                entry.mtimes == _get_mtimes(cfgfile)):
+            return entry
+        new_entry = _parse_config_files(cfgfile)
+        _parsed_cache[key] = new_entry
+
+    if entry is not None:
+        new_cfg = utils.Dict2Obj(_build_cfg_dict(new_entry))
+        for callback in list(_listeners):
+            callback(new_cfg)
+    return new_entry
+
+
+def _build_cfg_dict(parsed):
+    dfa_cfg = {}
+    for opt in default_opts_list:
+        for sec, val in opt.items():
+            dfa_cfg[sec] = dict(val)
+    for sec, val in parsed.sections().items():
+        dfa_cfg.setdefault(sec, {}).update(val)
+    return dfa_cfg
+
+
+def register_listener(callback):
+    """Register a callback that is called with the new cfg on reload.
+
+    It can be used to retune e.g. the interval of a PeriodicTask.
+    """
+
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def unregister_listener(callback):
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def reload_config():
+    """Re-parse all the cached config files and notify the listeners."""
+
+    with _cache_lock:
+        keys = list(_parsed_cache.keys())
+    for key in keys:
+        _get_parsed_config(list(key), force=True)
+
+
+def clear_cache():
+    """Drop all the cached config snapshots."""
+
+    with _cache_lock:
+        _parsed_cache.clear()
+
+
+def _sighup_handler(signum, frame):
+    # Reload outside of the signal handler, as the interrupted thread may
+    # be holding the cache lock.
+    thrd = threading.Thread(name='Config_Reload', target=reload_config)
+    thrd.daemon = True
+    thrd.start()
+
+
+def install_sighup_handler():
+    """Reload the config files when SIGHUP is received.
+
+    It must be called from the main thread.
+    """
+
+    signal.signal(signal.SIGHUP, _sighup_handler)
+
+
 class CiscoDFAConfig(object):
 
     """Cisco DFA Mechanism Driver Configuration class."""
 
     def __init__(self, service_name=None):
-        self.dfa_cfg = {}
-        self._load_default_opts()
         args = sys.argv[1:]
         try:
             opts = [(args[i], args[i + 1]) for i in range(0, len(args), 2)]
         except IndexError:
             opts = []
 
-        cfgfile = cfg.find_config_files(service_name)
+        cfgfile = list(cfg.find_config_files(service_name))
         for k, v in opts:
             if k == '--config-file':
                 cfgfile.append(v)
-        multi_parser = cfg.MultiConfigParser()
-        read_ok = multi_parser.read(cfgfile)
-
-        if len(read_ok) != len(cfgfile):
-            raise cfg.Error(("Failed to read config files read_ok = %s "
-                             "cfgfile = %s" % (read_ok, cfgfile)))
 
-        for parsed_file in multi_parser.parsed:
-            for parsed_item in parsed_file.keys():
-                if parsed_item not in self.dfa_cfg:
-                    self.dfa_cfg[parsed_item] = {}
-                for key, value in parsed_file[parsed_item].items():
-                    self.dfa_cfg[parsed_item][key] = (
-                        self._inspect_val(value[0]))
+        self._parsed = _get_parsed_config(cfgfile)
+        self.dfa_cfg = _build_cfg_dict(self._parsed)
 
         # Convert it to object.
         self._cfg = utils.Dict2Obj(self.dfa_cfg)
 
-    def _inspect_val(self, val):
-
-        if isinstance(val, str):
-            return True if val.lower() == 'true' else False if (
-                val.lower() == 'false') else val
-        return val
-
-    def _load_default_opts(self):
-        """Load default options."""
-
-        for opt in default_opts_list:
-            self.dfa_cfg.update(opt)
-
     @property
     def cfg(self):
         return self._cfg
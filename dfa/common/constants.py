@@ -79,12 +79,23 @@ FAIL_REC_INTERVAL = 60
 # Heartbeat interval
 HB_INTERVAL = 30
 
+# Interval to write the agents heartbeat into DB
+HB_FLUSH_INTERVAL = 5
+
 # Segmentation ID reuse after 1 hour
 SEG_REUSE_TIMEOUT = 1
 
 # Default Orchestrator ID
 ORCHESTRATOR_ID = 'Openstack Controller'
 
+# Default timeout in seconds of the system commands, and the time a
+# command is given to exit after SIGTERM before it is killed.
+EXEC_TIMEOUT = 60
+EXEC_KILL_GRACE = 5
+
+# File of the VDP snapshot in the state directory of the agent.
+VDP_SNAPSHOT_FILE = 'vdp_snapshot.json'
+
 # Special return value for an invalid OVS ofport
 INVALID_OFPORT = -1
 INVALID_VLAN = -1
@@ -98,6 +109,10 @@ VM_BULK_SYNC_MSG_TYPE = 52
 
 UPLINK_DET_INTERVAL = 10
 ERR_PROC_INTERVAL = 20
+# A failed VM event is retried after VM_RETRY_BACKOFF seconds, doubled on
+# every further failure of the port up to VM_RETRY_BACKOFF_MAX.
+VM_RETRY_BACKOFF = 20
+VM_RETRY_BACKOFF_MAX = 640
 # IF 'down' is seen twice continuously
 UPLINK_DOWN_THRES = 3
 
@@ -106,6 +121,11 @@ FLOW_CHECK_INTERVAL = 60
 
 Q_UPL_PRIO = 1
 Q_VM_PRIO = 2
+# A queued message gains one priority level every interval (in seconds), up
+# to Q_AGING_LIMIT, so that it's not starved by higher priority messages. A
+# VM message still never goes ahead of a queued message of its uplink.
+Q_AGING_INTERVAL = 30
+Q_AGING_LIMIT = Q_UPL_PRIO
 
 RES_SEGMENT = "SEGMENT"
 RES_VLAN = "VLAN"
@@ -113,6 +133,8 @@ RES_IN_SUBNET = 'IN_SUB'
 RES_OUT_SUBNET = 'OUT_SUB'
 
 uplink_down_reason = "Uplink went down"
+port_not_cached_reason = "port_uuid %s not in cache for port_down"
+lvm_not_avail_reason = "Local VLAN Map not available in port_down"
 uplink_undiscovered_reason = "Uplink not yet discovered"
 port_transition_bond_down_reason = \
     "Physical port became port of bond interface, intermittent down"
@@ -0,0 +1,331 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+"""Listener for the rtnetlink link notifications of the kernel.
+
+Only the link messages (RTM_NEWLINK/RTM_DELLINK) are parsed, and only the
+attributes needed to follow the state of an interface and its bond master.
+The links and IPv4 addresses can also be dumped on request.
+"""
+
+import collections
+import errno
+import itertools
+import socket
+import struct
+import threading
+
+from dfa.common import dfa_logger as logging
+
+LOG = logging.getLogger(__name__)
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+NLMSG_NOOP = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+
+IFLA_IFNAME = 3
+IFLA_MASTER = 10
+IFLA_OPERSTATE = 16
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+
+IF_OPER_UP = 6
+
+NLMSGHDR_FMT = '=LHHLL'
+NLMSGHDR_LEN = struct.calcsize(NLMSGHDR_FMT)
+IFINFOMSG_FMT = '=BxHiII'
+IFINFOMSG_LEN = struct.calcsize(IFINFOMSG_FMT)
+RTATTR_FMT = '=HH'
+RTATTR_LEN = struct.calcsize(RTATTR_FMT)
+IFADDRMSG_FMT = '=BBBBI'
+IFADDRMSG_LEN = struct.calcsize(IFADDRMSG_FMT)
+RTGENMSG_FMT = '=Bxxx'
+
+RECV_BUF_SIZE = 65536
+
+LinkMsg = collections.namedtuple('LinkMsg', ['msg_type', 'index', 'name',
+                                             'flags', 'master', 'operstate'])
+
+AddrMsg = collections.namedtuple('AddrMsg', ['family', 'prefixlen', 'index',
+                                             'address', 'label'])
+
+LinkEvent = collections.namedtuple('LinkEvent', ['index', 'name', 'running',
+                                                 'master', 'deleted',
+                                                 'running_changed',
+                                                 'master_changed'])
+
+
+_dump_seq = itertools.count(1)
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _parse_attrs(data, offset, end):
+    attrs = {}
+    while offset + RTATTR_LEN <= end:
+        rta_len, rta_type = struct.unpack_from(RTATTR_FMT, data, offset)
+        if rta_len < RTATTR_LEN or offset + rta_len > end:
+            break
+        attrs[rta_type] = data[offset + RTATTR_LEN:offset + rta_len]
+        offset += _align(rta_len)
+    return attrs
+
+
+def parse_link_msgs(data):
+    """Return the list of LinkMsg in a buffer read from the socket."""
+
+    msgs = []
+    offset = 0
+    while offset + NLMSGHDR_LEN <= len(data):
+        msg_len, msg_type, flags, seq, pid = struct.unpack_from(
+            NLMSGHDR_FMT, data, offset)
+        if msg_len < NLMSGHDR_LEN or offset + msg_len > len(data):
+            LOG.error("Truncated netlink message of length %s", msg_len)
+            break
+        if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+            body = offset + NLMSGHDR_LEN
+            family, if_type, index, if_flags, change = struct.unpack_from(
+                IFINFOMSG_FMT, data, body)
+            attrs = _parse_attrs(data, body + IFINFOMSG_LEN,
+                                 offset + msg_len)
+            name = attrs.get(IFLA_IFNAME)
+            if name is not None:
+                name = name.split(b'\0', 1)[0].decode()
+            master = attrs.get(IFLA_MASTER)
+            if master is not None:
+                master = struct.unpack('=I', master[:4])[0]
+            operstate = attrs.get(IFLA_OPERSTATE)
+            if operstate is not None:
+                operstate = struct.unpack('=B', operstate[:1])[0]
+            msgs.append(LinkMsg(msg_type, index, name, if_flags, master,
+                                operstate))
+        elif msg_type == NLMSG_DONE:
+            break
+        offset += _align(msg_len)
+    return msgs
+
+
+def parse_addr_msgs(data):
+    """Return the list of AddrMsg of the new addresses in a buffer."""
+
+    msgs = []
+    offset = 0
+    while offset + NLMSGHDR_LEN <= len(data):
+        msg_len, msg_type, flags, seq, pid = struct.unpack_from(
+            NLMSGHDR_FMT, data, offset)
+        if msg_len < NLMSGHDR_LEN or offset + msg_len > len(data):
+            LOG.error("Truncated netlink message of length %s", msg_len)
+            break
+        if msg_type == RTM_NEWADDR:
+            body = offset + NLMSGHDR_LEN
+            family, prefixlen, ifa_flags, scope, index = struct.unpack_from(
+                IFADDRMSG_FMT, data, body)
+            attrs = _parse_attrs(data, body + IFADDRMSG_LEN,
+                                 offset + msg_len)
+            # IFA_LOCAL is the address of the interface, IFA_ADDRESS is
+            # the peer address on point to point links.
+            addr = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+            if addr is not None:
+                addr = socket.inet_ntop(family, addr)
+            label = attrs.get(IFA_LABEL)
+            if label is not None:
+                label = label.split(b'\0', 1)[0].decode()
+            msgs.append(AddrMsg(family, prefixlen, index, addr, label))
+        elif msg_type == NLMSG_DONE:
+            break
+        offset += _align(msg_len)
+    return msgs
+
+
+def _is_dump_done(data, seq):
+    """Return True if a buffer ends the dump of sequence seq."""
+
+    offset = 0
+    while offset + NLMSGHDR_LEN <= len(data):
+        msg_len, msg_type, flags, msg_seq, pid = struct.unpack_from(
+            NLMSGHDR_FMT, data, offset)
+        if msg_len < NLMSGHDR_LEN:
+            break
+        if msg_seq == seq:
+            if msg_type == NLMSG_DONE:
+                return True
+            if msg_type == NLMSG_ERROR:
+                err = struct.unpack_from('=i', data, offset + NLMSGHDR_LEN)[0]
+                raise socket.error(-err, "Netlink dump failed")
+        offset += _align(msg_len)
+    return False
+
+
+def _dump(msg_type, family, parse_fn, sock=None):
+    """Send a dump request and return the messages of the reply."""
+
+    own_sock = sock is None
+    if own_sock:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                             NETLINK_ROUTE)
+    try:
+        seq = next(_dump_seq)
+        req = struct.pack(NLMSGHDR_FMT, NLMSGHDR_LEN + 4, msg_type,
+                          NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + (
+            struct.pack(RTGENMSG_FMT, family))
+        sock.sendto(req, (0, 0))
+        msgs = []
+        while True:
+            data = sock.recv(RECV_BUF_SIZE)
+            if not data:
+                raise socket.error(errno.EIO, "Netlink dump truncated")
+            msgs.extend(parse_fn(data))
+            if _is_dump_done(data, seq):
+                return msgs
+    finally:
+        if own_sock:
+            sock.close()
+
+
+def dump_links(sock=None):
+    """Return the LinkMsg of all the links.
+
+    Raises socket.error if the dump fails.
+    """
+    return _dump(RTM_GETLINK, socket.AF_UNSPEC, parse_link_msgs, sock=sock)
+
+
+def dump_addrs(family=socket.AF_INET, sock=None):
+    """Return the AddrMsg of all the addresses of a family.
+
+    Raises socket.error if the dump fails.
+    """
+    return [msg for msg in _dump(RTM_GETADDR, family, parse_addr_msgs,
+                                 sock=sock) if msg.family == family]
+
+
+class LinkListener(object):
+
+    """Listen to the link notifications and report the state changes.
+
+    The callback is called with a LinkEvent only when a link is deleted,
+    when its running state changes or when its master changes. Links seen
+    for the first time are reported as well.
+    """
+
+    def __init__(self, callback, sock=None):
+        self._callback = callback
+        self._sock = sock
+        self._links = {}
+        self._stop = False
+        self._thrd = None
+
+    def open(self):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                       NETLINK_ROUTE)
+            self._sock.bind((0, RTMGRP_LINK))
+
+    def start(self):
+        """Open the socket and start listening in a daemon thread.
+
+        Returns False if the netlink socket could not be opened.
+        """
+        try:
+            self.open()
+        except (socket.error, AttributeError) as exc:
+            LOG.error("Unable to open rtnetlink socket %s", exc)
+            return False
+        self._thrd = threading.Thread(target=self.run,
+                                      name='Netlink_Listener')
+        self._thrd.daemon = True
+        self._thrd.start()
+        return True
+
+    def stop(self):
+        self._stop = True
+        try:
+            self._sock.close()
+        except Exception:
+            pass
+
+    def _get_event(self, msg):
+        prev = self._links.get(msg.index)
+        if msg.msg_type == RTM_DELLINK:
+            self._links.pop(msg.index, None)
+            name = msg.name or (prev and prev[0])
+            return LinkEvent(msg.index, name, False, None, True,
+                             prev is not None and prev[1], False)
+        running = bool(msg.flags & IFF_RUNNING)
+        name = msg.name or (prev and prev[0])
+        self._links[msg.index] = (name, running, msg.master)
+        if prev is None:
+            return LinkEvent(msg.index, name, running, msg.master, False,
+                             True, msg.master is not None)
+        running_changed = prev[1] != running
+        master_changed = prev[2] != msg.master
+        if not running_changed and not master_changed and prev[0] == name:
+            return None
+        return LinkEvent(msg.index, name, running, msg.master, False,
+                         running_changed, master_changed)
+
+    def process(self, data):
+        """Process the messages in a buffer read from the socket."""
+
+        for msg in parse_link_msgs(data):
+            event = self._get_event(msg)
+            if event is None:
+                continue
+            try:
+                self._callback(event)
+            except Exception as exc:
+                LOG.exception("Exception in link event callback %s", exc)
+
+    def run(self):
+        while not self._stop:
+            try:
+                data = self._sock.recv(RECV_BUF_SIZE)
+            except socket.error as exc:
+                if self._stop:
+                    break
+                if exc.errno == errno.ENOBUFS:
+                    # Messages were dropped, the periodic uplink detection
+                    # will catch up. Forget the links to report them again.
+                    LOG.error("Netlink socket overrun, events lost")
+                    self._links = {}
+                    continue
+                if exc.errno == errno.EINTR:
+                    continue
+                LOG.error("Netlink socket receive failed %s", exc)
+                break
+            if not data:
+                break
+            self.process(data)
+        LOG.info("Netlink listener exiting")
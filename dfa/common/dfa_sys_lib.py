@@ -17,12 +17,18 @@
 
 """Common Routines used by DFA enabler"""
 
+import json
 import os
 import shlex
+import threading
+import time
 from eventlet import greenthread
 import netifaces
 import signal
+import six
+import socket
 from dfa.common import constants as q_const
+from dfa.common import dfa_netlink
 from eventlet.green import subprocess
 from dfa.common import dfa_logger as logging
 
@@ -31,6 +37,26 @@ LOG = logging.getLogger(__name__)
 # Default timeout for ovs-vsctl command
 DEFAULT_OVS_VSCTL_TIMEOUT = 10
 
+SYSFS_NET_DIR = '/sys/class/net'
+PROC_BONDING_DIR = '/proc/net/bonding'
+
+# OVSDB columns whose changes invalidate the cached port lookups.
+PORT_MONITOR_COLUMNS = {'Interface': ['name', 'ofport', 'external_ids'],
+                        'Port': ['name', 'tag']}
+
+
+# Options of execute, set from the config with set_exec_opts.
+_exec_opts = {'timeout': q_const.EXEC_TIMEOUT,
+              'kill_grace': q_const.EXEC_KILL_GRACE,
+              'root_helper_daemon': None}
+_rootwrap_client = None
+_rootwrap_lock = threading.Lock()
+
+
+class ProcessTimeout(RuntimeError):
+
+    """A command did not complete within its timeout."""
+
 
 class InvalidInput():
     message = ("Invalid input for operation: %(error_message)s.")
@@ -143,11 +169,210 @@ class BaseOVS(object):
         return bool(self.get_bridge_name_for_port_name(port_name))
 
 
+class DeferredFlows(object):
+
+    """Context that batches the flow changes of a bridge.
+
+    The add_flow and delete_flows calls of the current thread are queued
+    and applied when the outermost context exits, with one ovs-ofctl call
+    per action. Deletions are applied first, so that a flow replaced in
+    the same context is not deleted after it is added. Nothing is applied
+    if the context exits with an exception.
+    """
+
+    ACTION_ORDER = ('del', 'mod', 'add')
+
+    def __init__(self, br):
+        self.br = br
+        self.outer = False
+
+    def __enter__(self):
+        defer = self.br._defer
+        if getattr(defer, 'flows', None) is None:
+            defer.flows = {}
+            self.outer = True
+        return self.br
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if not self.outer:
+            return
+        flows = self.br._defer.flows
+        self.br._defer.flows = None
+        if exc_type is not None:
+            LOG.error("Flows of %(br)s not applied: %(flows)s",
+                      {'br': self.br.br_name, 'flows': flows})
+            return
+        for action in self.ACTION_ORDER:
+            if flows.get(action):
+                self.br.do_action_flows(action, flows[action])
+
+
+class OvsdbMonitor(object):
+
+    """Report the row changes of an OVSDB table from ovsdb-client monitor.
+
+    The callback is called with the list of changed rows, each a dict of
+    the monitored columns plus 'row' and 'action'. The rows of the initial
+    dump are not reported. The callback is called with None if the monitor
+    exits, since the changes from then on are lost.
+    """
+
+    def __init__(self, table, columns, callback, root_helper=None):
+        self.table = table
+        self.columns = columns
+        self._callback = callback
+        self.root_helper = root_helper
+        self._proc = None
+        self._thrd = None
+        self._stop = False
+        self.ready = False
+
+    def start(self):
+        """Start ovsdb-client and read its output in a daemon thread.
+
+        Returns False if ovsdb-client could not be started.
+        """
+        cmd = ["ovsdb-client", "monitor", self.table, ",".join(self.columns),
+               "--format=json"]
+        try:
+            self._proc, cmd = create_process(cmd,
+                                             root_helper=self.root_helper)
+        except Exception as exc:
+            LOG.error("Unable to start %(cmd)s. Exception: %(exc)s",
+                      {'cmd': cmd, 'exc': exc})
+            return False
+        self._thrd = threading.Thread(target=self.run,
+                                      name='Ovsdb_Monitor_%s' % self.table)
+        self._thrd.daemon = True
+        self._thrd.start()
+        return True
+
+    def stop(self):
+        self._stop = True
+        self.ready = False
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+            except Exception:
+                pass
+
+    def is_running(self):
+        return self.ready and not self._stop
+
+    def process(self, line):
+        """Process one update printed by ovsdb-client."""
+
+        try:
+            update = json.loads(line)
+            headings = update['headings']
+            rows = [dict(zip(headings, data)) for data in update['data']]
+        except (ValueError, KeyError, TypeError):
+            LOG.error("Unknown output of ovsdb-client monitor %s", line)
+            return
+        if not self.ready:
+            # The first update is the dump of the existing rows.
+            self.ready = True
+            rows = [row for row in rows if row.get('action') != 'initial']
+        if rows:
+            self._callback(rows)
+
+    def run(self):
+        while not self._stop:
+            line = self._proc.stdout.readline()
+            if not line:
+                break
+            line = line.strip()
+            if line:
+                self.process(line)
+        self.ready = False
+        if not self._stop:
+            LOG.error("ovsdb-client monitor of %s exited", self.table)
+            self._callback(None)
+
+
 class OVSBridge(BaseOVS):
 
     def __init__(self, br_name, root_helper):
         super(OVSBridge, self).__init__(root_helper)
         self.br_name = br_name
+        self._defer = threading.local()
+        self._port_cache = {}
+        self._port_cache_lock = threading.Lock()
+        # Incremented on every invalidation, a lookup that raced with an
+        # invalidation is not cached.
+        self._port_cache_gen = 0
+        self._port_monitors = []
+
+    def start_port_monitor(self):
+        """Cache the port lookups, invalidated by monitoring OVSDB.
+
+        The ofport, VLAN tag and name of the ports are cached only while
+        the monitors run, since they are also changed by other agents.
+        Returns False if the monitors could not be started.
+        """
+        self.stop_port_monitor()
+        for table, columns in sorted(PORT_MONITOR_COLUMNS.items()):
+            monitor = OvsdbMonitor(table, columns, self.port_update,
+                                   root_helper=self.root_helper)
+            self._port_monitors.append(monitor)
+            if not monitor.start():
+                self.stop_port_monitor()
+                return False
+        return True
+
+    def stop_port_monitor(self):
+        for monitor in self._port_monitors:
+            monitor.stop()
+        self._port_monitors = []
+        self.invalidate_port_cache()
+
+    def _port_cache_active(self):
+        return bool(self._port_monitors) and all(
+            monitor.is_running() for monitor in self._port_monitors)
+
+    def _cached_lookup(self, key, lookup_fn, is_valid):
+        if not self._port_cache_active():
+            return lookup_fn()
+        with self._port_cache_lock:
+            if key in self._port_cache:
+                return self._port_cache[key]
+            gen = self._port_cache_gen
+        val = lookup_fn()
+        if is_valid(val):
+            with self._port_cache_lock:
+                if gen == self._port_cache_gen:
+                    self._port_cache[key] = val
+        return val
+
+    def invalidate_port_cache(self, port_name=None):
+        """Drop the cached lookups of a port, or all of them."""
+
+        with self._port_cache_lock:
+            self._port_cache_gen += 1
+            if port_name is None:
+                self._port_cache.clear()
+                return
+            self._port_cache.pop(('ports',), None)
+            for key, val in list(self._port_cache.items()):
+                if port_name in (key[-1], val):
+                    del self._port_cache[key]
+
+    def port_update(self, rows):
+        """Callback of the OVSDB monitors."""
+
+        if rows is None:
+            self.invalidate_port_cache()
+            return
+        for row in rows:
+            name = row.get('name')
+            if not name or not isinstance(name, six.string_types):
+                self.invalidate_port_cache()
+                return
+            self.invalidate_port_cache(name)
+
+    def deferred(self):
+        """Return a context in which the flow changes are batched."""
+        return DeferredFlows(self)
 
     def set_secure_mode(self):
         self.run_vsctl(['--', 'set-fail-mode', self.br_name, 'secure'],
@@ -162,19 +387,23 @@ class OVSBridge(BaseOVS):
     def add_port(self, port_name):
         self.run_vsctl(["--", "--may-exist", "add-port", self.br_name,
                         port_name])
+        self.invalidate_port_cache(port_name)
         return self.get_port_ofport(port_name)
 
     def delete_port(self, port_name):
         self.run_vsctl(["--", "--if-exists", "del-port", self.br_name,
                         port_name])
+        self.invalidate_port_cache(port_name)
 
     def set_db_attribute(self, table_name, record, column, value):
         args = ["set", table_name, record, "%s=%s" % (column, value)]
         self.run_vsctl(args)
+        self.invalidate_port_cache(record)
 
     def clear_db_attribute(self, table_name, record, column):
         args = ["clear", table_name, record, column]
         self.run_vsctl(args)
+        self.invalidate_port_cache(record)
 
     def run_ofctl(self, cmd, args, process_input=None):
         full_args = ["ovs-ofctl", cmd, self.br_name] + args
@@ -189,6 +418,12 @@ class OVSBridge(BaseOVS):
         self.run_ofctl("del-flows", [])
 
     def get_port_ofport(self, port_name):
+        return self._cached_lookup(
+            ('ofport', port_name),
+            lambda: self._get_port_ofport(port_name),
+            lambda val: val != q_const.INVALID_OFPORT)
+
+    def _get_port_ofport(self, port_name):
         ofport = self.db_get_val("Interface", port_name, "ofport")
         # This can return a non-integer string, like '[]' so ensure a
         # common failure case
@@ -199,6 +434,12 @@ class OVSBridge(BaseOVS):
             return q_const.INVALID_OFPORT
 
     def get_port_vlan_tag(self, port_name):
+        return self._cached_lookup(
+            ('tag', port_name),
+            lambda: self._get_port_vlan_tag(port_name),
+            lambda val: val != q_const.INVALID_VLAN)
+
+    def _get_port_vlan_tag(self, port_name):
         vlan_tag = self.db_get_val("port", port_name, "tag")
         # This can return a non-integer string, like '[]' so ensure a
         # common failure case
@@ -209,6 +450,12 @@ class OVSBridge(BaseOVS):
             return q_const.INVALID_VLAN
 
     def get_ofport_name(self, iface_uuid):
+        return self._cached_lookup(
+            ('iface', iface_uuid),
+            lambda: self._get_ofport_name(iface_uuid),
+            lambda val: val is not None)
+
+    def _get_ofport_name(self, iface_uuid):
         ext_str = "external_ids:iface-id=" + iface_uuid
         try:
             output = self.run_vsctl(["--columns=name", "find", "Interface",
@@ -220,6 +467,10 @@ class OVSBridge(BaseOVS):
             return None
 
     def do_action_flows(self, action, kwargs_list):
+        flows = getattr(self._defer, 'flows', None)
+        if flows is not None:
+            flows.setdefault(action, []).extend(kwargs_list)
+            return
         flow_strs = [_build_flow_expr_str(kw, action) for kw in kwargs_list]
         self.run_ofctl('%s-flows' % action, ['-'], '\n'.join(flow_strs))
 
@@ -235,6 +486,10 @@ class OVSBridge(BaseOVS):
             return output.rstrip("\n\r")
 
     def get_port_name_list(self):
+        return list(self._cached_lookup(('ports',), self._get_port_name_list,
+                                        lambda val: bool(val)))
+
+    def _get_port_name_list(self):
         res = self.run_vsctl(["list-ports", self.br_name], check_error=True)
         if res:
             return res.strip().split("\n")
@@ -400,11 +655,73 @@ def subprocess_popen(args, stdin=None, stdout=None, stderr=None, shell=False,
                             close_fds=True, env=env)
 
 
-def create_process(cmd, root_helper=None, addl_env=None, log_output=True):
+def set_exec_opts(timeout=None, root_helper_daemon=None):
+    """Set the default timeout and the rootwrap daemon of execute.
+
+    A timeout of 0 waits for the commands forever. The commands run with
+    a root_helper are sent to the rootwrap daemon started by the
+    root_helper_daemon command, if set.
+    """
+    global _rootwrap_client
+    if timeout is not None:
+        _exec_opts['timeout'] = float(timeout) or None
+    with _rootwrap_lock:
+        if root_helper_daemon != _exec_opts['root_helper_daemon']:
+            _rootwrap_client = None
+        _exec_opts['root_helper_daemon'] = root_helper_daemon or None
+
+
+class ProcessKiller(object):
+
+    """Terminate a process that runs longer than its timeout.
+
+    The process is sent SIGTERM first, so that a root_helper like sudo
+    passes it on to the command, and SIGKILL if it has not exited after
+    the grace period.
+    """
+
+    def __init__(self, obj, cmd, timeout, grace=None):
+        self.obj = obj
+        self.cmd = cmd
+        self.grace = _exec_opts['kill_grace'] if grace is None else grace
+        self.fired = False
+        self._timer = threading.Timer(timeout, self._kill)
+        self._timer.daemon = True
+
+    def start(self):
+        self._timer.start()
+
+    def cancel(self):
+        self._timer.cancel()
+
+    def _kill(self):
+        if self.obj.poll() is not None:
+            return
+        self.fired = True
+        LOG.error("Command %s timed out, terminating it", self.cmd)
+        try:
+            self.obj.terminate()
+            end = time.time() + self.grace
+            while self.obj.poll() is None and time.time() < end:
+                time.sleep(0.1)
+            if self.obj.poll() is None:
+                LOG.error("Command %s did not terminate, killing it",
+                          self.cmd)
+                self.obj.kill()
+        except OSError:
+            # The process exited meanwhile.
+            pass
+
+
+def create_process(cmd, root_helper=None, addl_env=None, log_output=True,
+                   timeout=None):
     """Create a process object for the given command.
 
     The return value will be a tuple of the process object and the
-    list of command arguments used to create it.
+    list of command arguments used to create it. If a timeout is given,
+    the process is killed once it runs longer, and the started
+    ProcessKiller is set as its killer attribute for the caller to
+    cancel.
     """
     if root_helper:
         cmd = shlex.split(root_helper) + cmd
@@ -418,29 +735,112 @@ def create_process(cmd, root_helper=None, addl_env=None, log_output=True):
     obj = subprocess_popen(cmd, shell=False, stdin=subprocess.PIPE,
                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                            env=env)
+    obj.killer = None
+    if timeout:
+        obj.killer = ProcessKiller(obj, cmd, timeout)
+        obj.killer.start()
     return obj, cmd
 
 
+def _get_rootwrap_client():
+    """Return the client of the rootwrap daemon, None if not configured."""
+
+    global _rootwrap_client
+    with _rootwrap_lock:
+        daemon_cmd = _exec_opts['root_helper_daemon']
+        if not daemon_cmd or _rootwrap_client is not None:
+            return _rootwrap_client
+        try:
+            from oslo_rootwrap import client as rootwrap_client
+        except ImportError:
+            LOG.error("oslo.rootwrap is not installed, the rootwrap daemon "
+                      "is not used")
+            _exec_opts['root_helper_daemon'] = None
+            return None
+        _rootwrap_client = rootwrap_client.Client(shlex.split(daemon_cmd))
+        return _rootwrap_client
+
+
+def _execute_daemon(client, cmd, process_input, timeout):
+    """Run a command in the rootwrap daemon.
+
+    Returns the tuple of exit code, stdout and stderr. The daemon can not
+    kill a command, so one that times out is left running, but the caller
+    does not wait for it.
+    """
+    result = []
+
+    def run():
+        try:
+            result.append(client.execute(cmd, process_input))
+        except Exception as exc:
+            result.append(exc)
+
+    if not timeout:
+        run()
+    else:
+        thrd = threading.Thread(target=run, name='Rootwrap_Execute')
+        thrd.daemon = True
+        thrd.start()
+        thrd.join(timeout)
+        if not result:
+            raise ProcessTimeout("Command %s timed out in the rootwrap "
+                                 "daemon after %s sec" % (cmd, timeout))
+    if isinstance(result[0], Exception):
+        raise result[0]
+    return result[0]
+
+
 def execute(cmd, root_helper=None, process_input=None, addl_env=None,
             check_exit_code=True, return_stderr=False, log_fail_as_error=True,
-            log_output=True):
+            log_output=True, timeout=None):
+    """Run a command and return its output.
+
+    The command is killed and ProcessTimeout raised if it runs longer than
+    timeout seconds, by default the exec_timeout of the config. A timeout
+    of 0 waits forever.
+    """
+    if timeout is None:
+        timeout = _exec_opts['timeout']
+    client = None
+    if root_helper and not addl_env:
+        client = _get_rootwrap_client()
     try:
-        obj, cmd = create_process(cmd, root_helper=root_helper,
-                                  addl_env=addl_env, log_output=log_output)
-        _stdout, _stderr = (process_input and
-                            obj.communicate(process_input) or
-                            obj.communicate())
-        obj.stdin.close()
+        if client is not None:
+            cmd = map(str, cmd)
+            log_output and LOG.info("Running command (rootwrap daemon): %s",
+                                    cmd)
+            returncode, _stdout, _stderr = _execute_daemon(
+                client, cmd, process_input, timeout)
+        else:
+            obj, cmd = create_process(cmd, root_helper=root_helper,
+                                      addl_env=addl_env,
+                                      log_output=log_output, timeout=timeout)
+            try:
+                _stdout, _stderr = (process_input and
+                                    obj.communicate(process_input) or
+                                    obj.communicate())
+            finally:
+                if obj.killer is not None:
+                    obj.killer.cancel()
+            obj.stdin.close()
+            returncode = obj.returncode
+            if obj.killer is not None and obj.killer.fired:
+                raise ProcessTimeout(
+                    _("\nCommand: %(cmd)s\nTimed out after %(timeout)s sec"
+                      "\nStdout: %(stdout)r\nStderr: %(stderr)r") % {
+                        'cmd': cmd, 'timeout': timeout, 'stdout': _stdout,
+                        'stderr': _stderr})
         m = _("\nCommand: %(cmd)s\nExit code: %(code)s\nStdout: %(stdout)r\n"
-              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': obj.returncode,
+              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': returncode,
                                        'stdout': _stdout, 'stderr': _stderr}
 
-        if obj.returncode and log_fail_as_error:
+        if returncode and log_fail_as_error:
             LOG.error(m)
         else:
             log_output and LOG.info(m)
 
-        if obj.returncode and check_exit_code:
+        if returncode and check_exit_code:
             raise RuntimeError(m)
     finally:
         # NOTE(termie): this appears to be necessary to let the subprocess
@@ -485,30 +885,74 @@ def _build_flow_expr_str(flow_dict, cmd):
     return ','.join(flow_expr_arr)
 
 
+def _read_sysfs_net(intf, *path):
+    """Return the stripped content of a sysfs file of an interface.
+
+    Returns None if the file can not be read.
+    """
+    try:
+        with open(os.path.join(SYSFS_NET_DIR, intf, *path), 'r') as fd:
+            return fd.read().strip('\n')
+    except (IOError, OSError):
+        return None
+
+
+def _has_sysfs_net(intf):
+    return os.path.isdir(os.path.join(SYSFS_NET_DIR, intf))
+
+
+def _dump_links():
+    """Return the links keyed by name from rtnetlink, None on failure."""
+
+    try:
+        return dict((msg.name, msg) for msg in dfa_netlink.dump_links())
+    except (socket.error, AttributeError) as exc:
+        LOG.error("Unable to dump the links from rtnetlink %s", exc)
+        return None
+
+
 def get_all_run_phy_intf():
-    intf_list = []
-    base_dir = '/sys/class/net'
-    dir_exist = os.path.exists(base_dir)
-    if not dir_exist:
+    """Return the physical interfaces that are operationally up.
+
+    The physical interfaces are the ones with a device in sysfs. The state
+    of all of them is taken from one rtnetlink dump, or read from sysfs if
+    the dump fails.
+    """
+    try:
+        dir_cont = os.listdir(SYSFS_NET_DIR)
+    except OSError:
         LOG.error("Unable to get interface list :Base dir %s does not exist",
-                  base_dir)
-        return intf_list
-    dir_cont = os.listdir(base_dir)
-    for subdir in dir_cont:
-        dev_dir = base_dir + '/' + subdir + '/' + 'device'
-        dev_exist = os.path.exists(dev_dir)
-        if dev_exist:
-            oper_state = is_intf_up(subdir)
-            if oper_state is True:
-                    intf_list.append(subdir)
+                  SYSFS_NET_DIR)
+        return []
+    phy_intfs = [subdir for subdir in dir_cont if os.path.exists(
+        os.path.join(SYSFS_NET_DIR, subdir, 'device'))]
+    if not phy_intfs:
+        return []
+    links = _dump_links()
+    intf_list = []
+    for intf in phy_intfs:
+        if links is not None and intf in links:
+            oper_state = links[intf].operstate == dfa_netlink.IF_OPER_UP
         else:
-            LOG.info("Dev dir %s does not exist, not physical intf", dev_dir)
+            oper_state = is_intf_up(intf)
+        if oper_state:
+            intf_list.append(intf)
     return intf_list
 
 
 def get_intf_ipv4_addr(intf):
     """Retrieves the IPV4 address associated with an interface. """
 
+    ifindex = _read_sysfs_net(intf, 'ifindex')
+    if ifindex is not None:
+        try:
+            ifindex = int(ifindex)
+            for addr in dfa_netlink.dump_addrs(socket.AF_INET):
+                if addr.index == ifindex:
+                    return addr.address
+            return None
+        except (ValueError, socket.error, AttributeError) as exc:
+            LOG.error("Unable to dump the addresses from rtnetlink %s", exc)
     try:
         interface_addrs = netifaces.ifaddresses(intf)
         if netifaces.AF_INET in interface_addrs:
@@ -531,61 +975,69 @@ def is_intf_up(intf):
 
     """Function to check if a interface is up."""
 
-    intf_path = '/'.join(('/sys/class/net', intf))
-    intf_exist = os.path.exists(intf_path)
-    if not intf_exist:
-        LOG.error(
-            "Unable to get interface %s : Interface dir %s does not exist",
-            intf,
-            intf_path)
-        return False
-    try:
-        oper_file = '/'.join((intf_path, 'operstate'))
-        with open(oper_file, 'r') as fd:
-            oper_state = fd.read().strip('\n')
-            if oper_state == 'up':
-                return True
-    except Exception as e:
-        LOG.error("Exception in reading %s", str(e))
-
+    oper_state = _read_sysfs_net(intf, 'operstate')
+    if oper_state is not None:
+        return oper_state == 'up'
+    links = _dump_links()
+    if links is not None and intf in links:
+        return links[intf].operstate == dfa_netlink.IF_OPER_UP
+    LOG.error("Unable to get interface %s : Interface dir %s does not exist",
+              intf, os.path.join(SYSFS_NET_DIR, intf))
     return False
 
 
-def get_bond_intf(intf):
-    bond_dir = '/proc/net/bonding/'
-    dir_exist = os.path.exists(bond_dir)
-    if not dir_exist:
+def _get_bond_intf_proc(intf):
+    if not os.path.exists(PROC_BONDING_DIR):
         return
-    base_dir = '/sys/class/net'
-    for subdir in os.listdir(bond_dir):
-        file_name = '/'.join((base_dir, subdir, 'bonding', 'slaves'))
-        file_exist = os.path.exists(file_name)
-        if file_exist:
-            with open(file_name, 'r') as fd:
-                slave_val = fd.read().strip('\n')
-                if intf in slave_val:
-                    return subdir
+    for subdir in os.listdir(PROC_BONDING_DIR):
+        slave_val = _read_sysfs_net(subdir, 'bonding', 'slaves')
+        if slave_val is not None and intf in slave_val.split():
+            return subdir
+
+
+def get_bond_intf(intf):
+    """Return the bond interface intf is a member of, None if none."""
+
+    if _has_sysfs_net(intf):
+        try:
+            master = os.path.basename(os.readlink(
+                os.path.join(SYSFS_NET_DIR, intf, 'master')))
+        except OSError:
+            return None
+        return master if is_intf_bond(master) else None
+    links = _dump_links()
+    if links is None:
+        return _get_bond_intf_proc(intf)
+    link = links.get(intf)
+    if link is None or link.master is None:
+        return None
+    for name, master in links.items():
+        if master.index == link.master and is_intf_bond(name):
+            return name
 
 
 def is_intf_bond(intf):
-    bond_dir = '/proc/net/bonding/'
-    dir_exist = os.path.exists(bond_dir)
-    if not dir_exist or not intf:
+    if not intf:
         return False
-    bond_file = '/'.join((bond_dir, intf))
-    return os.path.exists(bond_file)
+    if _has_sysfs_net(intf):
+        return os.path.isdir(os.path.join(SYSFS_NET_DIR, intf, 'bonding'))
+    return os.path.exists(os.path.join(PROC_BONDING_DIR, intf))
 
 
 def get_member_ports(intf):
+    """Return the space separated member ports of a bond interface."""
+
     if not is_intf_bond(intf):
         return
-    base_dir = '/sys/class/net'
-    file_name = '/'.join((base_dir, intf, 'bonding', 'slaves'))
-    file_exist = os.path.exists(file_name)
-    if file_exist:
-        with open(file_name, 'r') as fd:
-            slave_val = fd.read().strip('\n')
-            return slave_val
+    slave_val = _read_sysfs_net(intf, 'bonding', 'slaves')
+    if slave_val is not None:
+        return slave_val
+    links = _dump_links()
+    if links is None or intf not in links:
+        return
+    index = links[intf].index
+    return ' '.join(sorted(name for name, link in links.items()
+                           if link.master == index))
 
 
 def get_dmi_info(id_type):
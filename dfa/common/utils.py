@@ -21,6 +21,7 @@ import six
 import socket
 import struct
 import sys
+import tempfile
 import threading
 from threading import Lock
 import time
@@ -60,6 +61,11 @@ class PeriodicTask(object):
                                                  'excp': str(e)})
                 self._excq.put(emsg, block=False)
 
+    def set_interval(self, interval):
+        """Change the interval, effective from the next run."""
+
+        self._interval = interval
+
     def stop(self):
         try:
             self.thrd.cancel()
@@ -134,6 +140,23 @@ def lock():
     return Lock()
 
 
+def write_file_atomic(path, data):
+    '''Write data to a file, readers see either the old or new content.'''
+    dir_name = os.path.dirname(path) or '.'
+    if not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
 def utc_time(ct):
     if ct:
         return datetime.datetime.strptime(ct, TIME_FORMAT)
@@ -18,8 +18,10 @@
 import json
 import netaddr
 import sqlalchemy as sa
+import socket
 import sqlalchemy.orm.exc as orm_exc
 from sqlalchemy.ext.declarative import declarative_base
+import struct
 import time
 
 try:
@@ -32,6 +34,7 @@ from six import moves
 from dfa.common import constants as const
 from dfa.common import dfa_logger as logging
 from dfa.common import utils
+from dfa.db import dfa_db_views as db_views
 import dfa_db_api as db
 
 LOG = logging.getLogger(__name__)
@@ -281,6 +284,30 @@ class DfaSegmentTypeDriver(object):
                 alloc = self.model(segmentation_id=seg_id)
                 session.add(alloc)
 
+    def update_segmentation_id(self, seg_id, net_id, source=None):
+        """Assign an allocated segment to a network."""
+
+        session = db.get_session()
+        with session.begin(subtransactions=True):
+            count = (session.query(self.model).filter_by(
+                segmentation_id=seg_id, allocated=True).update(
+                    {"network_id": net_id, "source": source}))
+        return count > 0
+
+    def release_segmentation_id_src(self, source):
+        """Release all the segments allocated by a source."""
+
+        session = db.get_session()
+        with session.begin(subtransactions=True):
+            count = (session.query(self.model).filter_by(
+                allocated=True, source=source).update(
+                    {"allocated": False, "network_id": None,
+                     "source": None}))
+        if count:
+            LOG.debug("Released %(count)s segments of %(src)s" % (
+                {'count': count, 'src': source}))
+        return count
+
     def get_segid_allocation(self, session, seg_id):
         return (session.query(self.model).filter_by(
             segmentation_id=seg_id).first())
@@ -314,6 +341,12 @@ class DfaNetwork(Base):
     """Represents DFA network."""
 
     __tablename__ = 'networks'
+    __table_args__ = (
+        sa.Index('ix_networks_tenant_id_result', 'tenant_id', 'result'),
+        sa.Index('ix_networks_name_tenant_id', 'name', 'tenant_id'),
+        sa.Index('ix_networks_segmentation_id_result', 'segmentation_id',
+                 'result'),
+    )
 
     network_id = sa.Column(sa.String(36), primary_key=True)
     name = sa.Column(sa.String(255))
@@ -342,6 +375,12 @@ class DfaVmInfo(Base):
     """Represents VM info."""
 
     __tablename__ = 'instances'
+    __table_args__ = (
+        sa.Index('ix_instances_host_result', 'host', 'result'),
+        sa.Index('ix_instances_network_id_host', 'network_id', 'host'),
+        sa.Index('ix_instances_segmentation_id_host', 'segmentation_id',
+                 'host'),
+    )
 
     port_id = sa.Column(sa.String(36), primary_key=True)
     name = sa.Column(sa.String(255))
@@ -399,13 +438,13 @@ class DfaFwInfo(Base):
     fw_id = sa.Column(sa.String(36), primary_key=True)
     name = sa.Column(sa.String(255))
     fw_type = sa.Column(sa.String(8))
-    tenant_id = sa.Column(sa.String(36))
-    in_network_id = sa.Column(sa.String(36))
+    tenant_id = sa.Column(sa.String(36), index=True)
+    in_network_id = sa.Column(sa.String(36), index=True)
     in_service_node_ip = sa.Column(sa.String(16))
-    out_network_id = sa.Column(sa.String(36))
+    out_network_id = sa.Column(sa.String(36), index=True)
     out_service_node_ip = sa.Column(sa.String(16))
-    router_id = sa.Column(sa.String(36))
-    router_net_id = sa.Column(sa.String(36))
+    router_id = sa.Column(sa.String(36), index=True)
+    router_net_id = sa.Column(sa.String(36), index=True)
     router_subnet_id = sa.Column(sa.String(36))
     fw_mgmt_ip = sa.Column(sa.String(16))
     openstack_provision_status = sa.Column(sa.String(34))
@@ -424,6 +463,21 @@ class DfaLbaaSMapping(Base):
     ip_address = sa.Column(sa.String(64))
 
 
+# Filter keys of get_network_by_filters and get_vms_by_filters, with the
+# column they match.
+NETWORK_FILTERS = (('name', DfaNetwork.name),
+                   ('id', DfaNetwork.network_id),
+                   ('tenant_id', DfaNetwork.tenant_id))
+VM_FILTERS = (('name', DfaVmInfo.name),
+              ('seg_id', DfaVmInfo.segmentation_id),
+              ('vdp_vlan', DfaVmInfo.vdp_vlan),
+              ('local_vlan', DfaVmInfo.local_vlan),
+              ('host', DfaVmInfo.host),
+              ('port', DfaVmInfo.port_id))
+VM_NETWORK_FILTERS = (('network_name', DfaNetwork.name),
+                      ('tenant_id', DfaNetwork.tenant_id))
+
+
 class DfaDBMixin(object):
 
     """Database API."""
@@ -433,11 +487,23 @@ class DfaDBMixin(object):
         super(DfaDBMixin, self).__init__(cfg)
         db.configure_db(cfg)
 
+    @property
+    def db_views(self):
+        """In-memory read views, used for CLI queries."""
+
+        views = db_views.get_views()
+        if not views.loaded:
+            views.load(self)
+        return views
+
     def add_project_db(self, pid, name, dci_id, result):
         proj = DfaTenants(id=pid, name=name, dci_id=dci_id, result=result)
         session = db.get_session()
         with session.begin(subtransactions=True):
             session.add(proj)
+            session.flush()
+            views = db_views.get_views()
+            views.set_row(views.projects, pid, db_views.row_to_dict(proj))
 
     def del_project_db(self, pid):
         session = db.get_session()
@@ -445,6 +511,9 @@ class DfaDBMixin(object):
             with session.begin(subtransactions=True):
                 ent = session.query(DfaTenants).filter_by(id=pid).one()
                 session.delete(ent)
+                session.flush()
+                views = db_views.get_views()
+                views.delete_row(views.projects, pid)
         except orm_exc.NoResultFound:
             LOG.info('Project %(id)s does not exist' % ({'id': pid}))
         except orm_exc.MultipleResultsFound:
@@ -498,6 +567,9 @@ class DfaDBMixin(object):
         with session.begin(subtransactions=True):
             session.query(DfaTenants).filter_by(id=pid).update(
                 {'result': result, 'dci_id': dci_id})
+            views = db_views.get_views()
+            views.update_row(views.projects, pid,
+                             {'result': result, 'dci_id': dci_id})
 
     def add_network_db(self, net_id, net_data, source, result):
         session = db.get_session()
@@ -513,6 +585,9 @@ class DfaDBMixin(object):
                              source=source,
                              result=result)
             session.add(net)
+            session.flush()
+            views = db_views.get_views()
+            views.set_row(views.networks, net_id, db_views.row_to_dict(net))
 
     def delete_network_db(self, net_id):
         session = db.get_session()
@@ -521,6 +596,9 @@ class DfaDBMixin(object):
                 network_id=net_id).first()
             if net is not None:
                 session.delete(net)
+                session.flush()
+            views = db_views.get_views()
+            views.delete_row(views.networks, net_id)
 
     def get_all_networks(self):
         session = db.get_session()
@@ -579,32 +657,39 @@ class DfaDBMixin(object):
 
         session = db.get_session()
         with session.begin(subtransactions=True):
-            net = session.query(DfaNetwork)
-            if filters.get('name'):
-                net = net.filter(DfaNetwork.name == filters.get('name'))
-            if filters.get('id'):
-                net = net.filter(DfaNetwork.network_id == filters.get('id'))
-            if filters.get('tenant_id'):
-                net = net.filter(DfaNetwork.tenant_id ==
-                                 filters.get('tenant_id'))
+            net = session.query(DfaNetwork).filter(
+                *self._filter_clauses(filters, NETWORK_FILTERS))
             if filters.get('tenant_name'):
-                net = net.join(
-                        DfaTenants,
-                        DfaTenants.name == filters.get('tenant_name')).filter(
-                        DfaNetwork.tenant_id == DfaTenants.id)
+                net = net.filter(DfaNetwork.tenant_id.in_(
+                    self._tenant_ids_query(session,
+                                           filters.get('tenant_name'))))
         return net.all()
 
+    @staticmethod
+    def _filter_clauses(filters, filter_map):
+        return [col == filters.get(fkey) for fkey, col in filter_map
+                if filters.get(fkey)]
+
+    @staticmethod
+    def _tenant_ids_query(session, tenant_name):
+        return session.query(DfaTenants.id).filter(
+            DfaTenants.name == tenant_name)
+
     def update_network_db(self, net_id, result):
         session = db.get_session()
         with session.begin(subtransactions=True):
             session.query(DfaNetwork).filter_by(
                 network_id=net_id).update({"result": result})
+            views = db_views.get_views()
+            views.update_row(views.networks, net_id, {'result': result})
 
     def update_network(self, net_id, **params):
         session = db.get_session()
         with session.begin(subtransactions=True):
             session.query(DfaNetwork).filter_by(
                 network_id=net_id).update(params.get('columns'))
+            views = db_views.get_views()
+            views.update_row(views.networks, net_id, params.get('columns'))
 
     def add_vms_db(self, vm_data, result):
         session = db.get_session()
@@ -623,6 +708,10 @@ class DfaDBMixin(object):
                                host=vm_data.get('host'),
                                result=result)
                 session.add(vm)
+                session.flush()
+                views = db_views.get_views()
+                views.set_row(views.instances, vm.port_id,
+                              db_views.row_to_dict(vm))
         except Exception as exc:
             LOG.warning("Exception %s occured, not added db" % exc.__class__)
 
@@ -632,12 +721,18 @@ class DfaDBMixin(object):
             vm = session.query(DfaVmInfo).filter_by(
                 port_id=port_id).first()
             session.delete(vm)
+            session.flush()
+            views = db_views.get_views()
+            views.delete_row(views.instances, port_id)
 
     def update_vm_db(self, vm_port_id, **params):
         session = db.get_session()
         with session.begin(subtransactions=True):
             session.query(DfaVmInfo).filter_by(
                 port_id=vm_port_id).update(params.get('columns'))
+            views = db_views.get_views()
+            views.update_row(views.instances, vm_port_id,
+                             params.get('columns'))
 
     def get_vm(self, port_id):
         session = db.get_session()
@@ -665,40 +760,24 @@ class DfaDBMixin(object):
         return vms
 
     def get_vms_by_filters(self, filters):
+        """Get the VMs matching the filters from the database.
+
+        The network and tenant filters are applied as sub-queries on the
+        network id, so that any combination of filters can be used.
+        """
+
         session = db.get_session()
         with session.begin(subtransactions=True):
-            vms = session.query(DfaVmInfo)
-            if filters.get('name'):
-                vms = vms.filter(DfaVmInfo.name == filters.get('name'))
-            if filters.get('seg_id'):
-                vms = vms.filter(DfaVmInfo.segmentation_id ==
-                                 filters.get('seg_id'))
-            if filters.get('vdp_vlan'):
-                vms = vms.filter(DfaVmInfo.vdp_vlan == filters.get('vdp_vlan'))
-            if filters.get('local_vlan'):
-                vms = vms.filter(DfaVmInfo.local_vlan == filters.get(
-                    'local_vlan'))
-            if filters.get('host'):
-                vms = vms.filter(DfaVmInfo.host == filters.get('host'))
-            if filters.get('port'):
-                vms = vms.filter(DfaVmInfo.port_id == filters.get('port'))
-            if filters.get('network_name'):
-                vms = vms.join(
-                        DfaNetwork,
-                        DfaNetwork.name == filters.get('network_name')).filter(
-                        DfaVmInfo.network_id == DfaNetwork.network_id)
-            if filters.get('tenant_id'):
-                vms = vms.join(
-                        DfaNetwork,
-                        DfaVmInfo.network_id == DfaNetwork.network_id).filter(
-                        DfaNetwork.tenant_id == filters.get('tenant_id'))
+            vms = session.query(DfaVmInfo).filter(
+                *self._filter_clauses(filters, VM_FILTERS))
+            for clause in self._filter_clauses(filters, VM_NETWORK_FILTERS):
+                vms = vms.filter(DfaVmInfo.network_id.in_(
+                    session.query(DfaNetwork.network_id).filter(clause)))
             if filters.get('tenant_name'):
-                vms = vms.join(
-                        DfaTenants,
-                        DfaTenants.name == filters.get('tenant_name')).join(
-                                DfaNetwork,
-                                DfaNetwork.tenant_id == DfaTenants.id).filter(
-                                DfaVmInfo.network_id == DfaNetwork.network_id)
+                net_ids = session.query(DfaNetwork.network_id).filter(
+                    DfaNetwork.tenant_id.in_(self._tenant_ids_query(
+                        session, filters.get('tenant_name'))))
+                vms = vms.filter(DfaVmInfo.network_id.in_(net_ids))
         return vms.all()
 
     def get_vms_per_tenant(self, tenant_id):
@@ -729,6 +808,9 @@ class DfaDBMixin(object):
                 # Entry exist, only update the heartbeat and configurations.
                 session.query(DfaAgentsDb).filter_by(host=host).update(
                     {'heartbeat': agent_info.get('timestamp')})
+                views = db_views.get_views()
+                views.update_row(views.agents, host,
+                                 {'heartbeat': agent_info.get('timestamp')})
             except orm_exc.NoResultFound:
                 LOG.info('Creating new entry for agent on %(host)s.' % (
                     {'host': host}))
@@ -737,10 +819,32 @@ class DfaDBMixin(object):
                                     heartbeat=agent_info.get('timestamp'),
                                     configurations=agent_info.get('config'))
                 session.add(agent)
+                session.flush()
+                views = db_views.get_views()
+                views.set_row(views.agents, host,
+                              db_views.row_to_dict(agent))
             except orm_exc.MultipleResultsFound:
                 LOG.error('More than one enty found for agent %(host)s.' % (
                     {'host': host}))
 
+    def update_agents_heartbeat(self, hb_dict):
+        """Update the heartbeat of several agents in one statement.
+
+        :param hb_dict: dictionary of host to heartbeat timestamp.
+        """
+        if not hb_dict:
+            return
+        session = db.get_session()
+        with session.begin(subtransactions=True):
+            session.query(DfaAgentsDb).filter(
+                DfaAgentsDb.host.in_(list(hb_dict.keys()))).update(
+                    {'heartbeat': sa.case(hb_dict, value=DfaAgentsDb.host)},
+                    synchronize_session=False)
+            views = db_views.get_views()
+            for host, timestamp in hb_dict.items():
+                views.update_row(views.agents, host,
+                                 {'heartbeat': timestamp})
+
     def get_agent_configurations(self, host):
         session = db.get_session()
         with session.begin(subtransactions=True):
@@ -768,8 +872,11 @@ class DfaDBMixin(object):
         session = db.get_session()
         with session.begin(subtransactions=True):
             # Update the configurations.
-            return session.query(DfaAgentsDb).filter_by(host=host).update(
+            res = session.query(DfaAgentsDb).filter_by(host=host).update(
                 {'configurations': configs})
+            views = db_views.get_views()
+            views.update_row(views.agents, host, {'configurations': configs})
+        return res
 
     def get_str_dict(self, fw_data):
         fw_dict = {}
@@ -929,10 +1036,10 @@ class DfaDBMixin(object):
         try:
             with session.begin(subtransactions=True):
                 net = session.query(DfaFwInfo).filter_by(
-                    (router_net_id == netid)).one()
+                    router_net_id=netid).one()
             return net
         except orm_exc.NoResultFound:
-            LOG.info('Network %(segid)s does not exist' % ({'netid': netid}))
+            LOG.info('Network %(netid)s does not exist' % ({'netid': netid}))
         except orm_exc.MultipleResultsFound:
             LOG.error('More than one enty found for netid-id %(id)s.' % (
                 {'id': netid}))
@@ -940,14 +1047,10 @@ class DfaDBMixin(object):
     # Tested
     def get_fw_by_rtrid(self, rtrid):
         session = db.get_session()
-        try:
-            with session.begin(subtransactions=True):
-                rtr = session.query(DfaFwInfo).filter_by(router_id=rtrid)
-        except orm_exc.NoResultFound:
+        with session.begin(subtransactions=True):
+            rtr = session.query(DfaFwInfo).filter_by(router_id=rtrid).first()
+        if rtr is None:
             LOG.info('rtr %(rtrid)s does not exist' % ({'rtrid': rtrid}))
-        except orm_exc.MultipleResultsFound:
-            LOG.error('More than one enty found for rtrid-id %(id)s.' % (
-                {'id': rtrid}))
         return rtr
 
     def delete_fw(self, fw_id):
@@ -1009,6 +1112,83 @@ class DfaOutSubnet(DfaResource):
         return cls.is_res_init_done(cls.dfa_out_subnet_init)
 
 
+class SubnetPoolIndex(object):
+
+    """In-memory index of a service subnet pool.
+
+    The subnets of the pool are tracked in an integer bitset, where bit N is
+    set when the subnet at offset N from the start of the pool is allocated.
+    The network of the allocated subnets is kept in two dictionaries.
+    Subnets allocated outside the pool are only kept in the dictionaries.
+    """
+
+    def __init__(self, subnet_min, subnet_max, step):
+        self.base = subnet_min
+        self.step = step
+        self.size = len(moves.xrange(subnet_min, subnet_max, step))
+        self.bits = 0
+        self.netid_to_subnet = {}
+        self.subnet_to_netid = {}
+        self.lock = utils.lock()
+
+    def offset(self, subnet):
+        """Return the offset of a subnet in the pool, None if outside."""
+
+        try:
+            subnet_int = struct.unpack('!I', socket.inet_aton(subnet))[0]
+        except (socket.error, TypeError):
+            return None
+        off, rem = divmod(subnet_int - self.base, self.step)
+        if rem or not 0 <= off < self.size:
+            return None
+        return off
+
+    def subnet(self, off):
+        return str(netaddr.IPAddress(self.base + off * self.step))
+
+    def is_allocated(self, subnet):
+        return subnet in self.subnet_to_netid
+
+    def find_free(self, excl_mask=0):
+        """Return the offset of the first free subnet, None if full."""
+
+        used = self.bits | excl_mask
+        off = (~used & (used + 1)).bit_length() - 1
+        if off >= self.size:
+            return None
+        return off
+
+    def excl_mask(self, subnet_lst):
+        mask = 0
+        for sub in set(subnet_lst):
+            off = self.offset(sub)
+            if off is not None:
+                mask |= 1 << off
+        return mask
+
+    def set_allocated(self, subnet, net_id):
+        off = self.offset(subnet)
+        if off is not None:
+            self.bits |= 1 << off
+        self.set_netid(subnet, net_id)
+
+    def set_netid(self, subnet, net_id):
+        old_netid = self.subnet_to_netid.get(subnet)
+        if old_netid and self.netid_to_subnet.get(old_netid) == subnet:
+            del self.netid_to_subnet[old_netid]
+        self.subnet_to_netid[subnet] = net_id
+        if net_id:
+            self.netid_to_subnet[net_id] = subnet
+
+    def set_free(self, subnet):
+        off = self.offset(subnet)
+        if off is not None:
+            self.bits &= ~(1 << off)
+        net_id = self.subnet_to_netid.pop(subnet, None)
+        if net_id and self.netid_to_subnet.get(net_id) == subnet:
+            del self.netid_to_subnet[net_id]
+
+
 class DfasubnetDriver(object):
 
     # Tested
@@ -1029,6 +1209,9 @@ class DfasubnetDriver(object):
         if not self.model_obj.is_init_done():
             self._subnet_id_allocations()
             self.model_obj.init_done()
+        self.pool = SubnetPoolIndex(self.subnet_min, self.subnet_max,
+                                    self.step)
+        self._load_pool()
 
     # Tested
     def _subnet_id_allocations(self):
@@ -1060,38 +1243,47 @@ class DfasubnetDriver(object):
                 alloc = self.model(subnet_address=subnet_add)
                 session.add(alloc)
 
+    def _load_pool(self):
+        """Load the allocated subnets of the pool from DB."""
+
+        session = db.get_session()
+        with session.begin(subtransactions=True):
+            allocs = session.query(self.model.subnet_address,
+                                   self.model.network_id).filter_by(
+                                       allocated=True).all()
+        with self.pool.lock:
+            for subnet, net_id in allocs:
+                self.pool.set_allocated(subnet, net_id)
+
     # Tested
     def allocate_subnet(self, subnet_lst, net_id=None):
         """Allocate subnet from pool.
 
-        Return allocated db object or None.
+        The subnets in subnet_lst are not allocated.
+        Return allocated subnet address or None.
         """
 
         session = db.get_session()
-        query_str = None
-        for sub in subnet_lst:
-            sub_que = (self.model.subnet_address != sub)
-            if query_str is not None:
-                query_str = query_str & sub_que
-            else:
-                query_str = sub_que
-        with session.begin(subtransactions=True):
-            select = (session.query(self.model).filter(
-                (self.model.allocated == 0) & query_str))
-
-            # Selected segment can be allocated before update by someone else,
-            # We retry until update success or DB_MAX_RETRIES retries
+        with self.pool.lock:
+            excl_mask = self.pool.excl_mask(subnet_lst)
+            # The subnet can be allocated in DB by someone else, in which
+            # case it is marked as allocated and the next one is tried.
             for attempt in range(1, DB_MAX_RETRIES + 1):
-                alloc = select.first()
-                if not alloc:
+                off = self.pool.find_free(excl_mask)
+                if off is None:
                     # No resource available
                     return
-                count = (session.query(self.model).
-                         filter_by(subnet_address=alloc.subnet_address,
-                         allocated=False).update({"allocated": True,
-                                                  "network_id": net_id}))
+                subnet = self.pool.subnet(off)
+                with session.begin(subtransactions=True):
+                    count = (session.query(self.model).
+                             filter_by(subnet_address=subnet,
+                                       allocated=False).update(
+                                           {"allocated": True,
+                                            "network_id": net_id}))
                 if count:
-                    return alloc.subnet_address
+                    self.pool.set_allocated(subnet, net_id)
+                    return subnet
+                self.pool.set_allocated(subnet, None)
 
         LOG.error('ERROR: Failed to allocate segment.')
         return None
@@ -1102,6 +1294,9 @@ class DfasubnetDriver(object):
             query = session.query(self.model).filter_by(
                 subnet_address=subnet).update({"network_id": net_id,
                                                "subnet_id": subnet_id})
+        with self.pool.lock:
+            if self.pool.is_allocated(subnet):
+                self.pool.set_netid(subnet, net_id)
 
     # Tested with a negative case
     def release_subnet(self, subnet_address):
@@ -1124,49 +1319,55 @@ class DfasubnetDriver(object):
                 if count:
                     LOG.debug("Releasing subnet %s outside pool" % (
                         subnet_address))
+        with self.pool.lock:
+            self.pool.set_free(subnet_address)
 
         if not count:
             LOG.debug("subnet %s not found" % subnet_address)
 
     def release_subnet_by_netid(self, netid):
 
-        session = db.get_session()
-        try:
-            with session.begin(subtransactions=True):
-                allocs = (session.query(self.model).filter_by(allocated=True,
-                          network_id=netid).update({"allocated": False}))
-        except orm_exc.NoResultFound:
+        with self.pool.lock:
+            subnet = self.pool.netid_to_subnet.get(netid)
+        if subnet is None:
             LOG.info('Network %(netid)s does not exist' % ({'netid': netid}))
+            return
+        session = db.get_session()
+        with session.begin(subtransactions=True):
+            session.query(self.model).filter_by(
+                allocated=True, network_id=netid).update({"allocated": False})
+        with self.pool.lock:
+            self.pool.set_free(subnet)
 
     def release_subnet_no_netid(self):
 
         net = ''
+        with self.pool.lock:
+            subnets = [sub for sub, netid in
+                       self.pool.subnet_to_netid.items() if netid == net]
+        if not subnets:
+            return
         session = db.get_session()
-        try:
-            with session.begin(subtransactions=True):
-                allocs = (session.query(self.model).filter_by(allocated=True,
-                                                              network_id=net).
-                          update({"allocated": False}))
-        except orm_exc.NoResultFound:
-            LOG.info('Query failed in release subnet no netid')
+        with session.begin(subtransactions=True):
+            session.query(self.model).filter_by(
+                allocated=True, network_id=net).update({"allocated": False})
+        with self.pool.lock:
+            for sub in subnets:
+                self.pool.set_free(sub)
 
     # Tested
     def get_subnet_by_netid(self, netid):
-        session = db.get_session()
-        try:
-            with session.begin(subtransactions=True):
-                net = session.query(self.model).filter_by(allocated=True,
-                                                          network_id=netid).\
-                    one()
-            return net.subnet_address
-        except orm_exc.NoResultFound:
+        with self.pool.lock:
+            subnet = self.pool.netid_to_subnet.get(netid)
+        if subnet is None:
             LOG.info('Network %(netid)s does not exist', ({'netid': netid}))
-        except orm_exc.MultipleResultsFound:
-            LOG.error('More than one enty found for netid-id %(id)s.', (
-                {'id': netid}))
-        return None
+        return subnet
 
     def get_subnet(self, sub):
+        with self.pool.lock:
+            if not self.pool.is_allocated(sub):
+                LOG.info('subnet %(sub)s does not exist', ({'sub': sub}))
+                return None
         session = db.get_session()
         try:
             with session.begin(subtransactions=True):
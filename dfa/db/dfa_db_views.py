@@ -0,0 +1,235 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+"""In-memory read views of the enabler database tables.
+
+The views are used to answer the CLI queries without going to the database.
+They are loaded from the database on first use and then kept up to date by
+the write methods of DfaDBMixin.
+"""
+
+import threading
+
+import six
+
+
+def row_to_dict(row):
+    """Convert a DB model object to a dictionary of its columns."""
+
+    return dict((col.name, getattr(row, col.name))
+                for col in row.__table__.columns)
+
+
+class ReadView(object):
+
+    """Versioned in-memory copy of one table, keyed by its primary key."""
+
+    def __init__(self, name):
+        self._name = name
+        self._rows = {}
+        self._version = 0
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def version(self):
+        return self._version
+
+    def load(self, rows):
+        self._rows = dict((key, dict(row)) for key, row in rows)
+        self._version += 1
+
+    def set(self, key, row):
+        self._rows[key] = dict(row)
+        self._version += 1
+
+    def update(self, key, columns):
+        row = self._rows.get(key)
+        if row is None:
+            return
+        row.update(columns)
+        self._version += 1
+
+    def delete(self, key):
+        if self._rows.pop(key, None) is not None:
+            self._version += 1
+
+    def get(self, key):
+        row = self._rows.get(key)
+        return dict(row) if row is not None else None
+
+    def values(self):
+        return [dict(row) for row in six.itervalues(self._rows)]
+
+
+class DBReadViews(object):
+
+    """Read views of the networks, instances, tenants and agents tables."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.networks = ReadView('networks')
+        self.instances = ReadView('instances')
+        self.projects = ReadView('tenants')
+        self.agents = ReadView('agents')
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def version(self):
+        """Combined version of all the views."""
+
+        return (self.networks.version + self.instances.version +
+                self.projects.version + self.agents.version)
+
+    def load(self, dbobj):
+        """Load all the views from the database, if not done already."""
+
+        with self._lock:
+            if self._loaded:
+                return
+            self.networks.load(
+                (net.network_id, row_to_dict(net))
+                for net in dbobj.get_all_networks())
+            self.instances.load(
+                (vm.port_id, row_to_dict(vm)) for vm in dbobj.get_vms())
+            self.projects.load(
+                (proj.id, row_to_dict(proj))
+                for proj in dbobj.get_all_projects())
+            self.agents.load(
+                (agent.host, row_to_dict(agent))
+                for agent in dbobj.get_agents_by_filters(None))
+            self._loaded = True
+
+    def reset(self):
+        with self._lock:
+            self._loaded = False
+
+    def set_row(self, view, key, row):
+        with self._lock:
+            if self._loaded:
+                view.set(key, row)
+
+    def update_row(self, view, key, columns):
+        with self._lock:
+            if self._loaded:
+                view.update(key, columns)
+
+    def delete_row(self, view, key):
+        with self._lock:
+            if self._loaded:
+                view.delete(key)
+
+    def _project_ids_by_name(self, name):
+        return set(p['id'] for p in self.projects.values()
+                   if p['name'] == name)
+
+    def _network_ids(self, **filters):
+        return set(n['network_id'] for n in self.networks.values()
+                   if all(n.get(k) == v for k, v in filters.items()))
+
+    def get_networks(self, filters):
+        """Same result as DfaDBMixin.get_network_by_filters."""
+
+        with self._lock:
+            nets = self.networks.values()
+            if filters.get('name'):
+                nets = [n for n in nets if n['name'] == filters.get('name')]
+            if filters.get('id'):
+                nets = [n for n in nets
+                        if n['network_id'] == filters.get('id')]
+            if filters.get('tenant_id'):
+                nets = [n for n in nets
+                        if n['tenant_id'] == filters.get('tenant_id')]
+            if filters.get('tenant_name'):
+                tids = self._project_ids_by_name(filters.get('tenant_name'))
+                nets = [n for n in nets if n['tenant_id'] in tids]
+            return self.networks.version, nets
+
+    def get_vms(self, filters):
+        """Same result as DfaDBMixin.get_vms_by_filters."""
+
+        with self._lock:
+            vms = self.instances.values()
+            for fkey, col in (('name', 'name'), ('seg_id', 'segmentation_id'),
+                              ('vdp_vlan', 'vdp_vlan'),
+                              ('local_vlan', 'local_vlan'),
+                              ('host', 'host'), ('port', 'port_id')):
+                if filters.get(fkey):
+                    vms = [v for v in vms if v[col] == filters.get(fkey)]
+            if filters.get('network_name'):
+                nids = self._network_ids(name=filters.get('network_name'))
+                vms = [v for v in vms if v['network_id'] in nids]
+            if filters.get('tenant_id'):
+                nids = self._network_ids(tenant_id=filters.get('tenant_id'))
+                vms = [v for v in vms if v['network_id'] in nids]
+            if filters.get('tenant_name'):
+                tids = self._project_ids_by_name(filters.get('tenant_name'))
+                nids = set(n['network_id'] for n in self.networks.values()
+                           if n['tenant_id'] in tids)
+                vms = [v for v in vms if v['network_id'] in nids]
+            return self.instances.version, vms
+
+    def get_projects(self, name, tenant_id):
+        """Same result as DfaDBMixin.get_project_by_filters."""
+
+        with self._lock:
+            projs = self.projects.values()
+            if name:
+                projs = [p for p in projs if p['name'] == name]
+            if tenant_id:
+                projs = [p for p in projs if p['id'] == tenant_id]
+            return self.projects.version, projs
+
+    def get_agents(self, host=None):
+        with self._lock:
+            agents = self.agents.values()
+            if host:
+                agents = [a for a in agents if a['host'] == host]
+            return self.agents.version, agents
+
+    def get_network(self, net_id):
+        with self._lock:
+            return self.networks.get(net_id)
+
+
+_views = DBReadViews()
+
+
+def get_views():
+    return _views
+
+
+def paginate(rows, filters, key):
+    """Return a page of rows if the filters have limit or offset.
+
+    Rows are sorted by key, so that pages are stable across calls.
+    """
+
+    limit = filters.get('limit')
+    offset = filters.get('offset') or 0
+    if not limit and not offset:
+        return rows
+    rows = sorted(rows, key=lambda r: r.get(key) or '')
+    if limit:
+        return rows[offset:offset + limit]
+    return rows[offset:]
@@ -0,0 +1,31 @@
+"""firewall lookup indexes
+
+Revision ID: 4a1c7e2d9b3f
+Revises: 388cbc17f111
+Create Date: 2017-02-14 10:12:31.517204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a1c7e2d9b3f'
+down_revision = '388cbc17f111'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+FW_INDEX_COLUMNS = ('tenant_id', 'in_network_id', 'out_network_id',
+                    'router_id', 'router_net_id')
+
+
+def upgrade():
+    for column in FW_INDEX_COLUMNS:
+        op.create_index(op.f('ix_firewall_%s' % column), 'firewall',
+                        [column], unique=False)
+
+
+def downgrade():
+    for column in FW_INDEX_COLUMNS:
+        op.drop_index(op.f('ix_firewall_%s' % column), table_name='firewall')
@@ -0,0 +1,39 @@
+"""vm and network filter indexes
+
+Revision ID: 5b2d8f3e0c4a
+Revises: 4a1c7e2d9b3f
+Create Date: 2017-02-21 15:40:07.281936
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b2d8f3e0c4a'
+down_revision = '4a1c7e2d9b3f'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+INDEXES = (('networks', ('tenant_id', 'result')),
+           ('networks', ('name', 'tenant_id')),
+           ('networks', ('segmentation_id', 'result')),
+           ('instances', ('host', 'result')),
+           ('instances', ('network_id', 'host')),
+           ('instances', ('segmentation_id', 'host')))
+
+
+def _index_name(table, columns):
+    return 'ix_%s_%s' % (table, '_'.join(columns))
+
+
+def upgrade():
+    for table, columns in INDEXES:
+        op.create_index(_index_name(table, columns), table, list(columns),
+                        unique=False)
+
+
+def downgrade():
+    for table, columns in INDEXES:
+        op.drop_index(_index_name(table, columns), table_name=table)
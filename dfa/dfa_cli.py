@@ -39,6 +39,54 @@ except ImportError:
 
 DFA_API_VERSION = '2.0'
 
+# Number of rows requested from the server per call.
+CLI_PAGE_SIZE = 500
+# Number of times a paginated query is restarted if the data changed on
+# the server between the pages.
+CLI_PAGE_RETRIES = 3
+
+
+def get_all_pages(clnt, method, filters, max_rows=None):
+    """Get the result of a CLI query from the server, page by page.
+
+    The query is restarted if the server view changed while reading the
+    pages, to avoid duplicate or missing rows. If it still changes after
+    CLI_PAGE_RETRIES restarts, all the rows are read in a single call.
+    """
+    context = {}
+    retries = 0
+    rows = []
+    version = None
+    while True:
+        page_size = CLI_PAGE_SIZE
+        if max_rows:
+            page_size = min(page_size, max_rows - len(rows))
+        args = dict(filters, offset=len(rows), limit=page_size)
+        msg = clnt.make_msg(method, context, msg=jsonutils.dumps(args))
+        resp = clnt.call(msg)
+        if not isinstance(resp, dict):
+            # Server does not support pagination.
+            return resp[:max_rows] if max_rows else resp
+
+        if version is not None and resp.get('version') != version:
+            if retries >= CLI_PAGE_RETRIES:
+                sys.stderr.write("Warning: Data changed on the Enabler "
+                                 "while reading %s, reading all rows at "
+                                 "once\n" % method)
+                msg = clnt.make_msg(method, context,
+                                    msg=jsonutils.dumps(filters))
+                resp = clnt.call(msg)
+                return resp[:max_rows] if max_rows else resp
+            retries += 1
+            rows = []
+            version = None
+            continue
+        version = resp.get('version')
+        page = resp.get('data') or []
+        rows.extend(page)
+        if len(page) < page_size or (max_rows and len(rows) >= max_rows):
+            return rows
+
 
 class ListNetwork(Lister):
     """List all the networks from Fabric Enabler. """
@@ -53,22 +101,20 @@ class ListNetwork(Lister):
                             help=_('Filter networks based on Tenant ID'))
         parser.add_argument('--tenant_name',
                             help=_('Filter networks based on Tenant Name'))
+        parser.add_argument('--limit', type=int,
+                            help=_('Maximum number of networks to list'))
         parser.add_argument('-D', '--show-details',
                             help=argparse.SUPPRESS,
                             action='store_true',
                             default=False, )
         return parser
 
-    def cli_get_networks(self, parsed_args):
+    def cli_get_networks(self, parsed_args, limit=None):
         '''Get all networks for a tenant from the Fabric Enabler. '''
 
-        context = {}
-        args = jsonutils.dumps(parsed_args)
-        msg = self.app.clnt.make_msg('cli_get_networks',
-                                     context, msg=args)
         try:
-            resp = self.app.clnt.call(msg)
-            return resp
+            return get_all_pages(self.app.clnt, 'cli_get_networks',
+                                 parsed_args, max_rows=limit)
         except (rpc.MessagingTimeout, rpc.RPCException, rpc.RemoteError) as e:
             print("RPC: Request to Enabler failed. Reason: %s" % e.message)
 
@@ -76,7 +122,8 @@ class ListNetwork(Lister):
         resp = self.cli_get_networks({'id': None,
                                       'name': parsed_args.name,
                                       'tenant_name': parsed_args.tenant_name,
-                                      'tenant_id': parsed_args.tenant_id})
+                                      'tenant_id': parsed_args.tenant_id},
+                                     limit=parsed_args.limit)
         if parsed_args.show_details:
             columns = ['Name', 'Segment ID', 'Vlan', 'Mobility-Domain',
                        'Config Profile', 'Tenant ID', 'Result',
@@ -158,22 +205,20 @@ class ListInstance(Lister):
                                    'Vlan'))
         parser.add_argument('--port_id',
                             help=argparse.SUPPRESS)
+        parser.add_argument('--limit', type=int,
+                            help=_('Maximum number of instances to list'))
         parser.add_argument('-D', '--show-details',
                             help=argparse.SUPPRESS,
                             action='store_true',
                             default=False, )
         return parser
 
-    def cli_get_instances(self, parsed_args):
+    def cli_get_instances(self, parsed_args, limit=None):
         '''Get all instances from the Fabric Enabler. '''
 
-        context = {}
-        args = jsonutils.dumps(parsed_args)
-        msg = self.app.clnt.make_msg('cli_get_instances',
-                                     context, msg=args)
         try:
-            resp = self.app.clnt.call(msg)
-            return resp
+            return get_all_pages(self.app.clnt, 'cli_get_instances',
+                                 parsed_args, max_rows=limit)
         except (rpc.MessagingTimeout, rpc.RPCException, rpc.RemoteError) as e:
             print("RPC: Request to Enabler failed. Reason: %s" % e.message)
 
@@ -188,7 +233,8 @@ class ListInstance(Lister):
                                        'local_vlan': parsed_args.local_vlan,
                                        'host': parsed_args.host,
                                        'port': parsed_args.port_id,
-                                       'detail': parsed_args.show_details})
+                                       'detail': parsed_args.show_details},
+                                      limit=parsed_args.limit)
 
         if parsed_args.show_details:
             columns = ['Name', 'Mac', 'IP', 'Host', 'Segmentation Id',
@@ -219,18 +265,16 @@ class ListProject(Lister):
                             help=_('Filter projects based on Tenant Name'))
         parser.add_argument('--tenant_id',
                             help=_('Filter projects based on Tenant ID'))
+        parser.add_argument('--limit', type=int,
+                            help=_('Maximum number of projects to list'))
         return parser
 
-    def cli_get_projects(self, parsed_args):
+    def cli_get_projects(self, parsed_args, limit=None):
         '''Get all projects from the Fabric Enabler. '''
 
-        context = {}
-        args = jsonutils.dumps(parsed_args)
-        msg = self.app.clnt.make_msg('cli_get_projects',
-                                     context, msg=args)
         try:
-            resp = self.app.clnt.call(msg)
-            return resp
+            return get_all_pages(self.app.clnt, 'cli_get_projects',
+                                 parsed_args, max_rows=limit)
         except (rpc.MessagingTimeout, rpc.RPCException, rpc.RemoteError) as e:
             print("RPC: Request to Enabler failed. Reason: %s" % e.message)
 
@@ -238,7 +282,8 @@ class ListProject(Lister):
         columns = ['Project ID', 'Name', 'DC ID', 'Result', 'Failure Reason']
 
         resp = self.cli_get_projects({'name': parsed_args.tenant_name,
-                                      'tenant_id': parsed_args.tenant_id})
+                                      'tenant_id': parsed_args.tenant_id},
+                                     limit=parsed_args.limit)
         return (columns, resp)
 
 
@@ -270,7 +315,7 @@ class ListAgent(Lister):
         columns = ['Host', 'Uplink Interface', 'Created', 'HeartBeat',
                    'Status']
 
-        resp = self.get_agents_details({'host': parsed_args.name})
+        resp = self.get_agents_details({'host': parsed_args.name}) or []
         data = [(r.get('host'), jsonutils.loads(r.get('config')).get('uplink'),
                  r.get('created').replace('T', ' ')[:-7],
                  r.get('heartbeat').replace('T', ' ')[:-7],
@@ -22,14 +22,18 @@ import json
 import requests
 import sys
 import re
+import time
 
 from dfa.common import dfa_exceptions as dexc
 from dfa.common import dfa_logger as logging
+from dfa.common import utils
 
 
 LOG = logging.getLogger(__name__)
 UNKNOWN_SRVN_NODE_IP = '0.0.0.0'
 UNKNOWN_DCI_ID = -1
+# Seconds a partition read from DCNM is reused.
+PART_CACHE_TTL = 10
 
 
 class DFARESTClient(object):
@@ -60,6 +64,10 @@ class DFARESTClient(object):
         self._exp_time = 100000
         self._resp_ok = (200, 201, 202)
 
+        # Partitions read from DCNM, keyed by (org, partition).
+        self._part_cache = {}
+        self._part_cache_lock = utils.lock()
+
         self.dcnm_http_or_https = self.get_dcnm_http_or_https()
         # urls
         self.fill_urls(self.dcnm_http_or_https)
@@ -313,7 +321,10 @@ class DFARESTClient(object):
 
             payload.update(extra_payload)
 
-        return self._send_request(operation, url, payload, 'partition')
+        try:
+            return self._send_request(operation, url, payload, 'partition')
+        finally:
+            self._invalidate_partition(org_name, part_name)
 
     def _get_partition(self, org_name, part_name=None):
         """send get partition request to the DCNM.
@@ -322,10 +333,31 @@ class DFARESTClient(object):
         """
         if part_name is None:
             part_name = self._part_name
+        key = (org_name, part_name)
+        with self._part_cache_lock:
+            entry = self._part_cache.get(key)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
         url = self._update_part_url % (org_name, part_name)
         res = self._send_request("GET", url, '', 'partition')
         if res and res.status_code in self._resp_ok:
-            return res.json()
+            part_info = res.json()
+            with self._part_cache_lock:
+                self._part_cache[key] = (time.time() + PART_CACHE_TTL,
+                                         part_info)
+            return part_info
+
+    def _invalidate_partition(self, org_name, part_name=None):
+        """Remove partitions from the cache.
+
+        :param org_name: name of organization
+        :param part_name: name of partition, all partitions of the
+                          organization if not given
+        """
+        with self._part_cache_lock:
+            for key in list(self._part_cache):
+                if key[0] == org_name and part_name in (None, key[1]):
+                    del self._part_cache[key]
 
     def update_partition_static_route(self, org_name, part_name,
                                       static_ip_list, vrf_prof=None,
@@ -364,7 +396,10 @@ class DFARESTClient(object):
             "vrfName": ':'.join((org_name, part_name)),
             "configArg": cfg_args}
 
-        res = self._send_request(operation, url, payload, 'partition')
+        try:
+            res = self._send_request(operation, url, payload, 'partition')
+        finally:
+            self._invalidate_partition(org_name, part_name)
         return (res is not None and res.status_code in self._resp_ok)
 
     def _delete_org(self, org_name):
@@ -373,7 +408,10 @@ class DFARESTClient(object):
         :param org_name: name of organization to be deleted
         """
         url = self._del_org_url % (org_name)
-        return self._send_request('DELETE', url, '', 'organization')
+        try:
+            return self._send_request('DELETE', url, '', 'organization')
+        finally:
+            self._invalidate_partition(org_name)
 
     def _delete_partition(self, org_name, partition_name):
         """Send partition delete request to DCNM.
@@ -382,7 +420,10 @@ class DFARESTClient(object):
         :param partition_name: name of partition
         """
         url = self._del_part % (org_name, partition_name)
-        return self._send_request('DELETE', url, '', 'partition')
+        try:
+            return self._send_request('DELETE', url, '', 'partition')
+        finally:
+            self._invalidate_partition(org_name, partition_name)
 
     def _delete_network(self, network_info):
         """Send network delete request to DCNM.
@@ -940,6 +981,11 @@ class DFARESTClient(object):
         except dexc.DfaClientRequestFailed:
             LOG.error("Failed to send request to DCNM.")
 
+    def get_default_partition_name(self):
+        """Return the name of the partition created by openstack."""
+
+        return self._part_name
+
     def get_network(self, org, segid):
         """Return given network from DCNM.
 
@@ -1041,3 +1087,57 @@ class DFARESTClient(object):
             '%s://%s/rest/settings/segmentid-ranges' % (protocol, self._ip))
         self._login_url = '%s://%s/rest/logon' % (protocol, self._ip)
         self._logout_url = '%s://%s/rest/logout' % (protocol, self._ip)
+
+
+class DcnmNetworkIndex(object):
+
+    """Answers network existence checks from one listing per partition.
+
+    The networks of a partition are read with list_networks the first time
+    the partition is checked, and indexed by segment id. An index lives for
+    one reconciliation pass, create a new one for the next pass.
+    """
+
+    def __init__(self, dcnm_client):
+        self._dcnm_client = dcnm_client
+        self._index = {}
+
+    def _get_index(self, org, part):
+        part = part or self._dcnm_client.get_default_partition_name()
+        key = (org, part)
+        if key not in self._index:
+            try:
+                nets = self._dcnm_client.list_networks(org, part)
+            except dexc.DfaClientRequestFailed:
+                LOG.error("Failed to list networks of %(org)s:%(part)s",
+                          {'org': org, 'part': part})
+                nets = None
+            if nets is None:
+                self._index[key] = None
+            else:
+                self._index[key] = dict(
+                    (str(net.get('segmentId')), net) for net in nets)
+        return self._index[key]
+
+    def get_network(self, org, segid, part=None):
+        """Return the network with the given segment id, if in DCNM.
+
+        :param org: name of organization.
+        :param segid: segmentation id of the network.
+        :param part: name of partition, default partition if not given.
+        """
+        index = self._get_index(org, part)
+        if index is not None:
+            return index.get(str(segid))
+
+    def network_exists(self, org, segid, part=None):
+        """Return whether the network is in DCNM, None if not known."""
+
+        index = self._get_index(org, part)
+        if index is None:
+            return None
+        return str(segid) in index
+
+    def invalidate(self, org, part=None):
+        part = part or self._dcnm_client.get_default_partition_name()
+        self._index.pop((org, part), None)
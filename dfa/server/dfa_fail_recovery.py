@@ -22,6 +22,7 @@ from dfa.common import constants
 from dfa.common import dfa_exceptions as dexc
 from dfa.common import dfa_logger as logging
 from dfa.common import utils
+from dfa.server import cisco_dfa_rest as cdr
 
 LOG = logging.getLogger(__name__)
 
@@ -174,6 +175,24 @@ class DfaFailureRecovery(object):
                 LOG.info('VM %(vm)s is in delete pending state.',
                          {'vm': vm.port_id})
 
+    def _get_net_config_profile(self, net):
+        """Fill the config profile of the network if it is not set."""
+
+        if not net.config_profile:
+            cfgp, fwd_mod = self.dcnm_client.get_config_profile_for_network(
+                net.name)
+            net.config_profile = cfgp
+            net.fwd_mod = fwd_mod
+
+    def _network_created(self, net):
+        """Update the database and the cache of a network created in DCNM."""
+
+        params = dict(columns=dict(config_profile=net.config_profile,
+                                   fwd_mod=net.fwd_mod,
+                                   result=constants.RESULT_SUCCESS))
+        self.update_network(net.network_id, **params)
+        self.network[net.network_id].update({'reason': 'SUCCESS'})
+
     def failure_recovery(self, fail_info):
         """Failure recovery task.
 
@@ -243,11 +262,29 @@ class DfaFailureRecovery(object):
                           'project %(name)s', {'name': proj.name})
 
         # 2. Try failure recovery for create network.
+        # The networks of a partition are read once from DCNM and used for
+        # all the create checks below.
+        dcnm_nets = cdr.DcnmNetworkIndex(self.dcnm_client)
         nets = self.get_all_networks()
         for net in nets:
             if (net.result == constants.CREATE_FAIL
                     and net.source.lower() == 'openstack'):
                 net_id = net.network_id
+                tenant_name = self.get_project_name(net.tenant_id)
+                if dcnm_nets.network_exists(tenant_name,
+                                            net.segmentation_id):
+                    # The request went through but the reply was lost.
+                    try:
+                        self._get_net_config_profile(net)
+                    except dexc.DfaClientRequestFailed as exc:
+                        LOG.error('Failed to get config profile of network '
+                                  '%(net)s.', {'net': net.name})
+                        self.network[net_id].update({'reason': exc.args[0]})
+                    else:
+                        self._network_created(net)
+                        LOG.debug("Network %(net)s already exists in DCNM",
+                                  {'net': net.name})
+                    continue
                 try:
                     subnets = self.neutron_event.nclient.list_subnets(
                         network_id=net_id).get('subnets')
@@ -259,13 +296,7 @@ class DfaFailureRecovery(object):
                     tenant_name = self.get_project_name(subnet['tenant_id'])
                     snet = utils.Dict2Obj(subnet)
                     try:
-                        # Check if config_profile is not NULL.
-                        if not net.config_profile:
-                            cfgp, fwd_mod = (
-                                self.dcnm_client.
-                                get_config_profile_for_network(net.name))
-                            net.config_profile = cfgp
-                            net.fwd_mod = fwd_mod
+                        self._get_net_config_profile(net)
                         if (self._lbMgr and
                                 self._lbMgr.lb_is_internal_nwk(net.name)):
                             net_in_dict = self.network.get(net_id)
@@ -284,12 +315,7 @@ class DfaFailureRecovery(object):
                         self.network[net_id].update({'reason': exc.args[0]})
                     else:
                         # Request is sent to DCNM, update the database
-                        params = dict(
-                            columns=dict(config_profile=net.config_profile,
-                                         fwd_mod=net.fwd_mod,
-                                         result=constants.RESULT_SUCCESS))
-                        self.update_network(net_id, **params)
-                        self.network[net_id].update({'reason': 'SUCCESS'})
+                        self._network_created(net)
                         LOG.debug("Success on failure recovery to create "
                                   "%(net)s", {'net': net.name})
 
@@ -318,6 +344,9 @@ class DfaFailureRecovery(object):
                 self._failure_vms(vm, vm_info)
 
         # 4. Try failure recovery for delete network.
+        # Networks were created in DCNM since the listing of step 2, read
+        # them again.
+        dcnm_nets = cdr.DcnmNetworkIndex(self.dcnm_client)
         for net in nets:
             if (net.result == constants.DELETE_FAIL
                     and net.source.lower() == 'openstack'):
@@ -325,7 +354,10 @@ class DfaFailureRecovery(object):
                 segid = net.segmentation_id
                 tenant_name = self.get_project_name(net.tenant_id)
                 try:
-                    self.dcnm_client.delete_network(tenant_name, net)
+                    # Nothing to delete if it is not in DCNM anymore.
+                    if dcnm_nets.network_exists(tenant_name,
+                                                segid) is not False:
+                        self.dcnm_client.delete_network(tenant_name, net)
                 except dexc.DfaClientRequestFailed as exc:
                     # Still is failure, only log the error.
                     LOG.error('Failed to delete network %(net)s.',
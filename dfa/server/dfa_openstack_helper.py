@@ -120,8 +120,7 @@ class DfaNeutronHelper(object):
     def is_subnet_present(self, subnet_addr):
         ''' Returns if a subnet is present '''
         try:
-            body = {}
-            subnet_list = self.neutronclient.list_subnets(body=body)
+            subnet_list = self.neutronclient.list_subnets(cidr=subnet_addr)
             subnet_dat = subnet_list.get('subnets')
             for sub in subnet_dat:
                 if sub.get('cidr') == subnet_addr:
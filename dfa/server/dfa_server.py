@@ -43,6 +43,7 @@ from dfa.common import dfa_logger as logging
 from dfa.common import rpc
 from dfa.common import utils
 from dfa.db import dfa_db_models as dfa_dbm
+from dfa.db import dfa_db_views as db_views
 from dfa.server import cisco_dfa_rest as cdr
 from dfa.server import dfa_events_handler as deh
 from dfa.server import dfa_fail_recovery as dfr
@@ -84,10 +85,9 @@ class RpcCallBacks(object):
 
         self.obj.update_agent_status(agent, when)
 
-        # Update the agents database.
-        agent_info = dict(timestamp=utils.utc_time(when), host=agent,
-                          config=json.dumps(configurations))
-        self.obj.update_agent_db(agent_info)
+        # Update the agents database. Only the first heartbeat is written
+        # right away, the rest are written periodically in bulk.
+        self.obj.update_agent_heartbeat(agent, when, configurations)
 
     def request_uplink_info(self, context, agent):
         """Process uplink message from an agent."""
@@ -249,48 +249,70 @@ class RpcCallBacks(object):
 
         return 0
 
+    def _cli_reply(self, version, data, payload):
+        """Make the reply for a CLI query.
+
+        Paginated requests, i.e. the ones with limit, get the view version
+        along with the data so that the client can detect changes between
+        pages.
+        """
+        if payload.get('limit') is None:
+            return data
+        return dict(version=version, data=data)
+
+    def _network_reason(self, net_id):
+        return self.obj.network.get(net_id, {}).get('reason')
+
     def cli_get_networks(self, context, msg):
         """Process request to get Network Details. """
 
         payload = json.loads(msg)
-        nets = self.obj.get_network_by_filters(payload)
+        version, nets = self.obj.db_views.get_networks(payload)
+        nets = db_views.paginate(nets, payload, 'network_id')
 
         data = []
         for net in nets:
-            tenant_name = self.obj.get_project_name(net.tenant_id)
-            data.append(dict(name=net.name, net_id=net.network_id,
-                             seg=net.segmentation_id, vlan=net.vlan,
-                             md=net.mob_domain, cfgp=net.config_profile,
-                             tenant_id=net.tenant_id, result=net.result,
-                             tenant_name=tenant_name, source=net.source,
-                             reason=(self.obj.network.get(
-                                 net.network_id)).get('reason')))
-        return data
+            tenant_name = self.obj.get_project_name(net['tenant_id'])
+            data.append(dict(name=net['name'], net_id=net['network_id'],
+                             seg=net['segmentation_id'], vlan=net['vlan'],
+                             md=net['mob_domain'],
+                             cfgp=net['config_profile'],
+                             tenant_id=net['tenant_id'],
+                             result=net['result'],
+                             tenant_name=tenant_name, source=net['source'],
+                             reason=self._network_reason(net['network_id'])))
+        return self._cli_reply(version, data, payload)
 
     def cli_get_instances(self, context, msg):
         """Process request to get Instance Details. """
 
         payload = json.loads(msg)
-        vms = self.obj.get_vms_by_filters(payload)
+        views = self.obj.db_views
+        version, vms = views.get_vms(payload)
+        # Instances without a network are dropped before paginating, so
+        # that only the last page is short.
+        nets = dict((v['network_id'], views.get_network(v['network_id']))
+                    for v in vms)
+        vms = [v for v in vms if nets[v['network_id']]]
+        vms = db_views.paginate(vms, payload, 'port_id')
 
         data = []
         for v in vms:
             reason = None
-            if v.port_id in self.obj.port_result:
+            if v['port_id'] in self.obj.port_result:
                 reason = self.obj.port_result[
-                    v.port_id].get('fail_reason')
-
-            net = self.obj.get_network(v.network_id)
-            if not net:
-                continue
-            tenant_name = self.obj.get_project_name(net.tenant_id)
-            data.append(dict(id=v.instance_id, ip=v.ip, name=v.name,
-                             mac=v.mac, net_id=v.network_id, host=v.host,
-                             local=v.local_vlan, seg=v.segmentation_id,
-                             vdp=v.vdp_vlan, port=v.port_id, result=v.result,
-                             net_name=net.name, tenant_name=tenant_name,
+                    v['port_id']].get('fail_reason')
+
+            net = nets[v['network_id']]
+            tenant_name = self.obj.get_project_name(net['tenant_id'])
+            data.append(dict(id=v['instance_id'], ip=v['ip'], name=v['name'],
+                             mac=v['mac'], net_id=v['network_id'],
+                             host=v['host'], local=v['local_vlan'],
+                             seg=v['segmentation_id'], vdp=v['vdp_vlan'],
+                             port=v['port_id'], result=v['result'],
+                             net_name=net['name'], tenant_name=tenant_name,
                              reason=reason))
-        return data
+        return self._cli_reply(version, data, payload)
 
     def cli_get_projects(self, context, msg):
         """Process request to get Project Details. """
@@ -299,11 +321,13 @@ class RpcCallBacks(object):
         name = payload.get('name')
         tenant_id = payload.get('tenant_id')
 
-        projs = self.obj.get_project_by_filters(name, tenant_id)
+        version, projs = self.obj.db_views.get_projects(name, tenant_id)
+        projs = db_views.paginate(projs, payload, 'id')
 
-        return [(p.id, p.name, p.dci_id, p.result,
-                 self.obj.project_info_cache[p.id].get('reason'))
+        data = [(p['id'], p['name'], p['dci_id'], p['result'],
+                 self.obj.project_info_cache.get(p['id'], {}).get('reason'))
                 for p in projs]
+        return self._cli_reply(version, data, payload)
 
     def get_fabric_summary(self, context, msg):
         """Process request to get DCNM and Fabric Details. """
@@ -407,20 +431,21 @@ class RpcCallBacks(object):
         if not tenant_name:
             return False
 
-        net = self.obj.get_network_by_filters(msg)
+        version, net = self.obj.db_views.get_networks(msg)
         netList = []
         for row in net:
-            gui_result = row.result
-            if row.result == 'CREATE:FAIL' or row.result == 'DELETE:FAIL':
-                gui_result = (row.result).replace(":", "_")
-            netList.append(dict(network_id=row.network_id,
-                                network_name=row.name,
-                                config_profile=row.config_profile,
-                                seg_id=row.segmentation_id,
-                                mob_domain=row.mob_domain, vlan_id=row.vlan,
+            gui_result = row['result']
+            if gui_result == 'CREATE:FAIL' or gui_result == 'DELETE:FAIL':
+                gui_result = gui_result.replace(":", "_")
+            netList.append(dict(network_id=row['network_id'],
+                                network_name=row['name'],
+                                config_profile=row['config_profile'],
+                                seg_id=row['segmentation_id'],
+                                mob_domain=row['mob_domain'],
+                                vlan_id=row['vlan'],
                                 result=gui_result,
-                                reason=(self.obj.network.get(
-                                    row.network_id)).get('reason')))
+                                reason=self._network_reason(
+                                    row['network_id'])))
         return netList
 
     def get_instance_by_tenant_id(self, context, msg):
@@ -432,25 +457,28 @@ class RpcCallBacks(object):
             return False
 
         vmlist = []
-        vms = self.obj.get_vms_per_tenant(project_id)
-        for row in vms:
-            gui_result = row[0].result
-            if (row[0].result == 'CREATE:FAIL' or
-                    row[0].result == 'DELETE:FAIL'):
-                gui_result = (row[0].result).replace(":", "_")
+        views = self.obj.db_views
+        version, vms = views.get_vms({'tenant_id': project_id})
+        for vm in vms:
+            net = views.get_network(vm['network_id'])
+            if not net:
+                continue
+            gui_result = vm['result']
+            if gui_result == 'CREATE:FAIL' or gui_result == 'DELETE:FAIL':
+                gui_result = gui_result.replace(":", "_")
 
             reason = None
-            if row[0].port_id in self.obj.port_result:
+            if vm['port_id'] in self.obj.port_result:
                 reason = self.obj.port_result[
-                    row[0].port_id].get('fail_reason')
-
-            vmlist.append(dict(port_id=row[0].port_id, name=row[0].name,
-                               network_name=row[1].name,
-                               instance_id=row[0].instance_id,
-                               mac=row[0].mac, ip=row[0].ip,
-                               seg_id=row[0].segmentation_id,
-                               host=row[0].host, vdp_vlan=row[0].vdp_vlan,
-                               local_vlan=row[0].local_vlan,
+                    vm['port_id']].get('fail_reason')
+
+            vmlist.append(dict(port_id=vm['port_id'], name=vm['name'],
+                               network_name=net['name'],
+                               instance_id=vm['instance_id'],
+                               mac=vm['mac'], ip=vm['ip'],
+                               seg_id=vm['segmentation_id'],
+                               host=vm['host'], vdp_vlan=vm['vdp_vlan'],
+                               local_vlan=vm['local_vlan'],
                                result=gui_result,
                                reason=reason))
         return vmlist
@@ -459,51 +487,59 @@ class RpcCallBacks(object):
         """Process request to get project details from Enabler and DCNM. """
 
         tenant_id = msg.get('tenant_id')
-        project = (self.obj.get_project_by_filters(None, tenant_id))[0]
-        if not project:
+        version, projs = self.obj.db_views.get_projects(None, tenant_id)
+        if not projs:
             return False
+        project = projs[0]
 
         part = self.obj.cfg.dcnm.default_partition_name
-        seg = self.obj.dcnm_client.get_partition_segmentId(project.name, part)
+        seg = self.obj.dcnm_client.get_partition_segmentId(project['name'],
+                                                           part)
         project_list = []
         project_list.append(dict(project_id=tenant_id,
-                                 project_name=project.name,
-                                 dci_id=project.dci_id, seg_id=seg,
-                                 result=project.result,
-                                 reason=self.obj.project_info_cache[
-                                     tenant_id].get('reason')))
+                                 project_name=project['name'],
+                                 dci_id=project['dci_id'], seg_id=seg,
+                                 result=project['result'],
+                                 reason=self.obj.project_info_cache.get(
+                                     tenant_id, {}).get('reason')))
         return project_list
 
     def get_agents_details(self, context, msg):
         """Process request to get all agents details from DB. """
 
-        agents = self.obj.get_agents_by_filters(None)
+        version, agents = self.obj.db_views.get_agents()
         if not agents:
             return False
         agent_list = []
         for agent in agents:
-            heartbeat = pytz.timezone('US/Pacific').localize(agent.heartbeat)
+            # The latest heartbeat may not be written into DB yet.
+            last_hb = (self.obj.get_agent_heartbeat(agent['host']) or
+                       agent['heartbeat'])
+            heartbeat = pytz.timezone('US/Pacific').localize(last_hb)
             tz_info = heartbeat.tzinfo
             time_diff = datetime.datetime.now(tz_info) - heartbeat
             timestamp = datetime.timedelta(seconds=constants.HB_INTERVAL)
             active = 'Active' if time_diff < timestamp else 'Not Active'
-            agent_list.append(dict(host=agent.host, created=agent.created,
-                                   heartbeat=agent.heartbeat,
+            agent_list.append(dict(host=agent['host'],
+                                   created=agent['created'],
+                                   heartbeat=last_hb,
                                    agent_status=active,
-                                   config=agent.configurations))
+                                   config=agent['configurations']))
         return agent_list
 
     def get_agent_details_per_host(self, context, msg):
         """Process request to get details for particular agent. """
 
         host = msg.get('host')
-        agent = self.obj.get_agents_by_filters(host)
-        if not agent:
+        version, agents = self.obj.db_views.get_agents(host)
+        if not agents:
             return False
+        agent = agents[0]
         agent_list = []
-        agent_list.append(dict(host=agent.host, created=agent.created,
-                               heartbeat=agent.heartbeat,
-                               config=agent.configurations))
+        agent_list.append(dict(host=agent['host'], created=agent['created'],
+                               heartbeat=(self.obj.get_agent_heartbeat(host) or
+                                          agent['heartbeat']),
+                               config=agent['configurations']))
         return agent_list
 
     def associate_profile_with_network(self, context, msg):
@@ -563,6 +599,11 @@ class DfaServer(dfr.DfaFailureRecovery, dfa_dbm.DfaDBMixin,
         self.port_result = {}
         self.dfa_threads = []
         self.agents_status_table = {}
+        # Latest heartbeat of the agents, and the ones not yet written in DB.
+        self.agent_heartbeats = {}
+        self._hb_pending = set()
+        self._agents_in_db = set()
+        self._hb_lock = utils.lock()
 
         # Create segmentation id pool.
         seg_id_min = int(cfg.dcnm.segmentation_id_min)
@@ -757,6 +798,48 @@ class DfaServer(dfr.DfaFailureRecovery, dfa_dbm.DfaDBMixin,
             self.agents_status_table[agent].update({'timestamp': ts,
                                                     'fail_count': 0})
 
+    def update_agent_heartbeat(self, agent, when, configurations):
+        """Save the heartbeat of an agent.
+
+        The first heartbeat from an agent is written into DB right away, so
+        that the entry for the agent exists. After that, only the latest
+        heartbeat is kept in memory and flush_agent_heartbeats writes it.
+        """
+        timestamp = utils.utc_time(when)
+        with self._hb_lock:
+            self.agent_heartbeats[agent] = timestamp
+            if agent in self._agents_in_db:
+                self._hb_pending.add(agent)
+                return
+
+        agent_info = dict(timestamp=timestamp, host=agent,
+                          config=json.dumps(configurations))
+        self.update_agent_db(agent_info)
+        with self._hb_lock:
+            self._agents_in_db.add(agent)
+
+    def flush_agent_heartbeats(self, **kwargs):
+        """Write the latest heartbeat of the agents into DB in bulk."""
+
+        with self._hb_lock:
+            if not self._hb_pending:
+                return
+            hb_dict = dict((agent, self.agent_heartbeats[agent])
+                           for agent in self._hb_pending)
+            self._hb_pending = set()
+        try:
+            self.update_agents_heartbeat(hb_dict)
+        except Exception as exc:
+            LOG.error("Failed to update heartbeat of %(num)s agents: "
+                      "%(exc)s", {'num': len(hb_dict), 'exc': exc})
+            with self._hb_lock:
+                self._hb_pending.update(hb_dict.keys())
+
+    def get_agent_heartbeat(self, agent):
+        """Return the latest heartbeat received from an agent."""
+
+        return self.agent_heartbeats.get(agent)
+
     def update_reason_in_port_result(self, port_id, reason):
         # Update Failure reason in port_result cache i.e RPC failed
         if port_id in self.port_result:
@@ -964,8 +1047,13 @@ class DfaServer(dfr.DfaFailureRecovery, dfa_dbm.DfaDBMixin,
                 for subnet in subnets:
                     self.create_subnet(subnet)
 
-    def create_subnet(self, snet):
-        """Create subnet."""
+    def create_subnet(self, snet, dcnm_nets=None):
+        """Create subnet.
+
+        :param snet: subnet dictionary
+        :param dcnm_nets: DcnmNetworkIndex of the networks in DCNM. The
+                          network is not created again if it is in there.
+        """
 
         snet_id = snet.get('id')
         # This checks if the source of the subnet creation is FW,
@@ -1013,8 +1101,14 @@ class DfaServer(dfr.DfaFailureRecovery, dfa_dbm.DfaDBMixin,
                                                snet)
             else:
                 part = net['partition']
-                self.dcnm_client.create_network(tenant_name, dcnm_net, subnet,
-                                                part, self.dcnm_dhcp)
+                if dcnm_nets and dcnm_nets.network_exists(
+                        tenant_name, dcnm_net.segmentation_id, part=part):
+                    LOG.info('create_subnet: network %(name)s exists in '
+                             'DCNM.', {'name': dcnm_net.name})
+                else:
+                    self.dcnm_client.create_network(tenant_name, dcnm_net,
+                                                    subnet, part,
+                                                    self.dcnm_dhcp)
             self.update_network_db(net.get('id'), constants.RESULT_SUCCESS)
             self.network[net.get('id')].update({'reason': 'SUCCESS'})
         except dexc.DfaClientRequestFailed as exc:
@@ -2401,10 +2495,13 @@ class DfaServer(dfr.DfaFailureRecovery, dfa_dbm.DfaDBMixin,
         for net in nets.get("networks"):
             LOG.info("Syncing network %s", net["id"])
             self.network_create_func(net)
+        # The networks of a partition are read once from DCNM and only the
+        # missing ones are created.
+        dcnm_nets = cdr.DcnmNetworkIndex(self.dcnm_client)
         subnets = self.neutronclient.list_subnets()
         for subnet in subnets.get("subnets"):
             LOG.info("Syncing subnet %s", subnet["id"])
-            self.create_subnet(subnet)
+            self.create_subnet(subnet, dcnm_nets=dcnm_nets)
 
     def create_threads(self):
         """Create threads on server."""
@@ -2448,12 +2545,19 @@ class DfaServer(dfr.DfaFailureRecovery, dfa_dbm.DfaDBMixin,
                                      priority=self.PRI_LOW_START + 10,
                                      excq=self._excpq)
 
+        # Create periodic task to write the agents heartbeat into DB.
+        hb_flush_thrd = utils.PeriodicTask(
+            interval=constants.HB_FLUSH_INTERVAL,
+            func=self.flush_agent_heartbeats,
+            excq=self._excpq)
+
         # Start all the threads.
         for t in self.dfa_threads:
             t.start()
 
         # Run the periodic tasks.
         fr_thrd.run()
+        hb_flush_thrd.run()
 
 
 def save_my_pid(cfg):
@@ -2477,9 +2581,11 @@ def save_my_pid(cfg):
 
 
 def dfa_server():
+    dfa = None
     try:
         cfg = config.CiscoDFAConfig().cfg
         logging.setup_logger('server', cfg)
+        config.install_sighup_handler()
         dfa = DfaServer(cfg)
         save_my_pid(cfg)
         dfa.create_threads()
@@ -2541,6 +2647,10 @@ def dfa_server():
     except KeyboardInterrupt:
         pass
 
+    finally:
+        if dfa is not None:
+            dfa.stop_fw_mgr()
+
 
 if __name__ == '__main__':
     sys.exit(dfa_server())
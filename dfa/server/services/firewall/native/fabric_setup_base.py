@@ -15,6 +15,9 @@
 #
 # @author: Padmanabhan Krishnan, Cisco Systems, Inc.
 
+import collections
+import threading
+
 import netaddr
 
 from dfa.common import config
@@ -249,10 +252,10 @@ class ServiceIpSegTenantMap(dfa_dbm.DfaDBMixin):
         result = self.get_local_final_result()
         if from_str == fw_const.FW_CR_OP:
             if result == fw_const.RESULT_FW_DELETE_INIT:
-                return state + 1
+                return min(state + 1, fw_const.FABRIC_PREPARE_DONE_STATE)
         if from_str == fw_const.FW_DEL_OP:
             if result == fw_const.RESULT_FW_CREATE_INIT:
-                return state - 1
+                return max(state - 1, fw_const.INIT_STATE)
         return state
 
     def get_state(self):
@@ -260,6 +263,88 @@ class ServiceIpSegTenantMap(dfa_dbm.DfaDBMixin):
         return self.state
 
 
+ServiceNwkRes = collections.namedtuple('ServiceNwkRes',
+                                       ['seg', 'vlan', 'subnet'])
+
+
+class ServiceNwkPool(object):
+
+    '''
+    Pool of the segment, VLAN and subnet of service networks, allocated
+    ahead for each direction so that a FW create does not wait for them.
+    The pool is refilled in the background after every resource taken.
+    '''
+
+    def __init__(self, size, alloc_fn, release_fn):
+        ''' Initialization '''
+        self.size = size
+        self.alloc_fn = alloc_fn
+        self.release_fn = release_fn
+        self.res = {'in': collections.deque(), 'out': collections.deque()}
+        self.lock = utils.lock()
+        self.refill_event = threading.Event()
+        self.stopped = False
+        self.thrd = None
+
+    def start(self):
+        ''' Starts the thread that fills the pool '''
+        self.thrd = threading.Thread(target=self.run,
+                                     name='Fw_Service_Pool')
+        self.thrd.daemon = True
+        self.refill_event.set()
+        self.thrd.start()
+
+    def stop(self):
+        ''' Stops the refill thread and releases the pooled resources '''
+        self.stopped = True
+        self.refill_event.set()
+        if self.thrd is not None:
+            self.thrd.join()
+        for direc in self.res:
+            while True:
+                with self.lock:
+                    if not self.res[direc]:
+                        break
+                    res = self.res[direc].popleft()
+                self.release_fn(direc, res)
+
+    def run(self):
+        ''' Refills the pool every time a resource is taken '''
+        while not self.stopped:
+            self.refill_event.wait()
+            self.refill_event.clear()
+            if not self.stopped:
+                self.fill()
+
+    def fill(self):
+        ''' Allocates resources until the pool is full '''
+        for direc in self.res:
+            while not self.stopped and self.get_depth(direc) < self.size:
+                try:
+                    res = self.alloc_fn(direc)
+                except Exception as exc:
+                    LOG.error("Exception %(exc)s filling the %(dir)s service"
+                              " pool", {'exc': str(exc), 'dir': direc})
+                    res = None
+                if res is None:
+                    # Exhausted, filled again on the next take.
+                    break
+                with self.lock:
+                    self.res[direc].append(res)
+
+    def get(self, direc):
+        ''' Takes a resource from the pool, None if the pool is empty '''
+        with self.lock:
+            res = self.res[direc].popleft() if self.res[direc] else None
+        self.refill_event.set()
+        return res
+
+    def get_depth(self, direc):
+        ''' Returns the number of resources in the pool '''
+        with self.lock:
+            return len(self.res[direc])
+
+
 class FabricApi(object):
 
     '''
@@ -491,6 +576,8 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
             self.service_out_ip_start, self.service_out_ip_end,
             const.RES_OUT_SUBNET)
         self.servicedummy_ip_subnet = cfg.firewall.fw_service_dummy_ip_subnet
+        self.service_pool_size = int(cfg.firewall.fw_service_pool_size)
+        self.service_pool = None
         self.service_attr = {}
         self.os_helper = OsHelper()
         self.fabric_fsm = dict()
@@ -566,38 +653,69 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
             fw_const.DCNM_OUT_PART_UPDDEL_SUCCESS:
                 fw_const.DCNM_OUT_NETWORK_STATE}
 
-        # This is a mapping of state to a dict of appropriate
-        # create and delete functions.
-        self.fabric_fsm = {
-            fw_const.INIT_STATE:
-                [self.init_state, self.init_state],
-            fw_const.OS_IN_NETWORK_STATE:
-                [self.create_os_in_nwk, self.delete_os_in_nwk],
-            fw_const.OS_OUT_NETWORK_STATE:
-                [self.create_os_out_nwk, self.delete_os_out_nwk],
-            fw_const.OS_DUMMY_RTR_STATE:
-                [self.create_os_dummy_rtr, self.delete_os_dummy_rtr],
-            fw_const.DCNM_IN_NETWORK_STATE:
-                [self.create_dcnm_in_nwk, self.delete_dcnm_in_nwk],
-            fw_const.DCNM_IN_PART_UPDATE_STATE:
-                [self.update_dcnm_in_part, self.clear_dcnm_in_part],
-            fw_const.DCNM_OUT_PART_STATE:
-                [self.create_dcnm_out_part, self.delete_dcnm_out_part],
-            fw_const.DCNM_OUT_NETWORK_STATE:
-                [self.create_dcnm_out_nwk, self.delete_dcnm_out_nwk],
-            fw_const.DCNM_OUT_PART_UPDATE_STATE:
-                [self.update_dcnm_out_part, self.clear_dcnm_out_part],
-            fw_const.FABRIC_PREPARE_DONE_STATE:
-                [self.prepare_fabric_done, self.prepare_fabric_done]}
+        self.store_fabric_steps(self.get_fabric_steps())
+        # The global lock only protects the shared allocators of segment,
+        # VLAN and subnet, the fabric of a tenant is prepared, deleted or
+        # retried with the lock of the tenant held.
         self.mutex_lock = utils.lock()
+        self.tenant_locks = {}
         self.correct_db_restart()
         self.populate_local_cache()
         self.store_db_obj(self.service_in_ip, self.service_out_ip)
+        if self.service_pool_size > 0:
+            self.service_pool = ServiceNwkPool(self.service_pool_size,
+                                               self.alloc_pool_res,
+                                               self.release_pool_res)
+            self.service_pool.start()
+
+    def get_fabric_steps(self):
+        '''
+        Returns the table of steps of the SM, in the order of creation.
+        Every step has a state and its create and delete functions. The
+        create SM runs the steps forward and the delete SM runs them
+        backward. The state of the next step to run is recorded in the FW DB
+        after every step that succeeds, so that a retry or a restart resumes
+        from the step that failed. The functions check what a previous run
+        already did, so that running a step again is harmless.
+        '''
+        return (
+            (fw_const.INIT_STATE, self.init_state, self.init_state),
+            (fw_const.OS_IN_NETWORK_STATE, self.create_os_in_nwk,
+             self.delete_os_in_nwk),
+            (fw_const.OS_OUT_NETWORK_STATE, self.create_os_out_nwk,
+             self.delete_os_out_nwk),
+            (fw_const.OS_DUMMY_RTR_STATE, self.create_os_dummy_rtr,
+             self.delete_os_dummy_rtr),
+            (fw_const.DCNM_IN_NETWORK_STATE, self.create_dcnm_in_nwk,
+             self.delete_dcnm_in_nwk),
+            (fw_const.DCNM_IN_PART_UPDATE_STATE, self.update_dcnm_in_part,
+             self.clear_dcnm_in_part),
+            (fw_const.DCNM_OUT_PART_STATE, self.create_dcnm_out_part,
+             self.delete_dcnm_out_part),
+            (fw_const.DCNM_OUT_NETWORK_STATE, self.create_dcnm_out_nwk,
+             self.delete_dcnm_out_nwk),
+            (fw_const.DCNM_OUT_PART_UPDATE_STATE, self.update_dcnm_out_part,
+             self.clear_dcnm_out_part),
+            (fw_const.FABRIC_PREPARE_DONE_STATE, self.prepare_fabric_done,
+             self.prepare_fabric_done))
+
+    def store_fabric_steps(self, steps):
+        ''' Stores the table of steps of the SM '''
+        # This is a mapping of state to a list of the appropriate
+        # create and delete functions.
+        self.fabric_fsm = dict((state, [create_fn, delete_fn])
+                               for state, create_fn, delete_fn in steps)
+        self.fabric_states = [step[0] for step in steps]
 
     def store_dcnm(self, dcnm_obj):
         '''Stores the DCNM object '''
         self.dcnm_obj = dcnm_obj
 
+    def get_tenant_lock(self, tenant_id):
+        ''' Returns the lock of a tenant, creating it if needed '''
+        with self.mutex_lock:
+            return self.tenant_locks.setdefault(tenant_id, utils.lock())
+
     def get_service_obj(self, tenant_id):
         ''' Retrieves the service object associated with a tenant. '''
         return self.service_attr[tenant_id]
@@ -703,7 +821,7 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         '''
         return str(netaddr.IPAddress(subnet) + (1 << (32 - self.mask)) - 2)
 
-    def check_allocate_ip(self, obj, direc):
+    def check_allocate_ip(self, obj, direc, net_id=None):
         '''
         This function allocates a subnet from the pool.
         It first checks to see if Openstack is already using the subnet.
@@ -711,15 +829,17 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         Openstack.
         '''
         subnet_lst = self.os_helper.get_all_subnets_cidr(no_mask=True)
-        ip_next = obj.allocate_subnet(subnet_lst)
+        with self.mutex_lock:
+            ip_next = obj.allocate_subnet(subnet_lst, net_id=net_id)
         if ip_next is None:
             LOG.error("Unable to allocate a subnet for direction %s", direc)
         return ip_next
 
-    def get_next_ip(self, tenant_id, direc):
+    def get_next_ip(self, tenant_id, direc, ip_next=None):
         '''
         Given a tenant, it returns the service subnet values assigned
-        to it based on direction.
+        to it based on direction. A subnet taken from the service pool is
+        passed in ip_next.
         This needs to be put in a common functionality for services
         '''
         if direc == 'in':
@@ -731,10 +851,10 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         if temp_store_ip != 0 and start != 0 and end != 0 and gateway != 0 \
            and sec_gateway != 0:
             return temp_store_ip, start, end, gateway, sec_gateway
-        if direc == 'in':
+        if ip_next is None and direc == 'in':
             # ip_next = self.service_in_ip.allocate_subnet()
             ip_next = self.check_allocate_ip(self.service_in_ip, "in")
-        else:
+        elif ip_next is None:
             # ip_next = self.service_out_ip.allocate_subnet()
             ip_next = self.check_allocate_ip(self.service_out_ip, "out")
         return ip_next, self.get_start_ip(ip_next), self.get_end_ip(ip_next),\
@@ -742,10 +862,9 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
 
     def release_subnet(self, cidr, direc):
         ''' Routine to release a subnet from the DB.'''
-        if direc == 'in':
-            self.service_in_ip.release_subnet(cidr)
-        else:
-            self.service_out_ip.release_subnet(cidr)
+        ip_obj = self.service_in_ip if direc == 'in' else self.service_out_ip
+        with self.mutex_lock:
+            ip_obj.release_subnet(cidr)
 
     def fill_dcnm_subnet_info(self, tenant_id, subnet, start, end, gateway,
                               sec_gateway, direc):
@@ -791,7 +910,7 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         subnet_dict = serv_obj.get_dcnm_subnet_dict(direc)
         return subnet_dict
 
-    def alloc_retrieve_subnet_info(self, tenant_id, direc):
+    def alloc_retrieve_subnet_info(self, tenant_id, direc, ip_next=None):
         '''
         This function initially checks if subnet is allocated for a tenant
         for the in/out direction. If not, it calls routine to allocate a subnet
@@ -801,8 +920,8 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         subnet_dict = self.retrieve_dcnm_subnet_info(tenant_id, direc)
         if len(subnet_dict) != 0:
             return subnet_dict
-        subnet, start, end, gateway, sec_gateway = self.get_next_ip(tenant_id,
-                                                                    direc)
+        subnet, start, end, gateway, sec_gateway = self.get_next_ip(
+            tenant_id, direc, ip_next=ip_next)
         subnet_dict = self.fill_dcnm_subnet_info(tenant_id, subnet, start,
                                                  end, gateway, sec_gateway,
                                                  direc)
@@ -881,17 +1000,93 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
     def alloc_seg(self, net_id):
         ''' Allocates the segmentation ID '''
         # Does allocation happen here or at ServiceIpSegTenantMap class? fixme
-        segmentation_id = self.service_segs.allocate_segmentation_id(
-            net_id, source=fw_const.FW_CONST)
+        with self.mutex_lock:
+            segmentation_id = self.service_segs.allocate_segmentation_id(
+                net_id, source=fw_const.FW_CONST)
         return segmentation_id
 
     def alloc_vlan(self, net_id):
         ''' Allocates the vlan ID '''
         # Does allocation happen here or at ServiceIpSegTenantMap class? fixme
-        vlan_id = self.service_vlans.allocate_segmentation_id(
-            net_id, source=fw_const.FW_CONST)
+        with self.mutex_lock:
+            vlan_id = self.service_vlans.allocate_segmentation_id(
+                net_id, source=fw_const.FW_CONST)
         return vlan_id
 
+    def alloc_pool_res(self, direc):
+        '''
+        Allocates the segment, VLAN and subnet of a service network for the
+        service pool. The segment and VLAN are not assigned to a network
+        yet, the subnet is allocated without a network like the subnet
+        allocated before the network is created, they are released on
+        restart.
+        '''
+        ip_obj = self.service_in_ip if direc == 'in' else self.service_out_ip
+        subnet = self.check_allocate_ip(ip_obj, direc, net_id='')
+        if subnet is None:
+            return None
+        with self.mutex_lock:
+            seg = self.service_segs.allocate_segmentation_id(
+                None, source=fw_const.FW_POOL_CONST)
+            vlan = self.service_vlans.allocate_segmentation_id(
+                None, source=fw_const.FW_POOL_CONST)
+        if seg is None or vlan is None:
+            LOG.error("Unable to allocate segment or VLAN for the service "
+                      "pool")
+            self.release_pool_res(direc, ServiceNwkRes(seg, vlan, subnet))
+            return None
+        return ServiceNwkRes(seg, vlan, subnet)
+
+    def release_pool_res(self, direc, res):
+        ''' Releases the resources allocated for the service pool '''
+        with self.mutex_lock:
+            if res.seg is not None:
+                self.service_segs.release_segmentation_id(res.seg)
+            if res.vlan is not None:
+                self.service_vlans.release_segmentation_id(res.vlan)
+        self.release_subnet(res.subnet, direc)
+
+    def get_pool_res(self, tenant_id, direc):
+        '''
+        Takes the resources of a service network from the pool. Returns None
+        if there's no pool, if it's empty, or if a subnet was already
+        allocated for the tenant by a previous try.
+        Openstack may have started using a pooled subnet after it was
+        allocated, such resources are released and the next ones are taken.
+        '''
+        if self.service_pool is None:
+            return None
+        if len(self.retrieve_dcnm_subnet_info(tenant_id, direc)) != 0:
+            return None
+        while True:
+            res = self.service_pool.get(direc)
+            if res is None:
+                return None
+            if not self.os_helper.is_subnet_present(
+                    '%s/%d' % (res.subnet, self.mask)):
+                return res
+            LOG.info("Pooled subnet %s is used by Openstack, releasing it",
+                     res.subnet)
+            self.release_pool_res(direc, res)
+
+    def stop(self):
+        ''' Stops the service pool and releases its resources '''
+        if self.service_pool is not None:
+            self.service_pool.stop()
+
+    def assign_pool_seg_vlan(self, res, net_id, is_fw_virt=False):
+        ''' Assigns the segment and VLAN taken from the pool to a network '''
+        with self.mutex_lock:
+            self.service_segs.update_segmentation_id(
+                res.seg, net_id, source=fw_const.FW_CONST)
+            # VLAN is only needed for physical case
+            if is_fw_virt:
+                self.service_vlans.release_segmentation_id(res.vlan)
+                return res.seg, 0
+            self.service_vlans.update_segmentation_id(
+                res.vlan, net_id, source=fw_const.FW_CONST)
+        return res.seg, res.vlan
+
     def update_subnet_db_info(self, tenant_id, direc, net_id, subnet_id):
         '''
         Update the subnet DB with the Net and Subnet ID, given the subnet
@@ -901,10 +1096,9 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
             LOG.error("Subnet dict not found")
             return
         subnet = subnet_dict['cidr'].split('/')[0]
-        if direc == 'in':
-            self.service_in_ip.update_subnet(subnet, net_id, subnet_id)
-        else:
-            self.service_out_ip.update_subnet(subnet, net_id, subnet_id)
+        ip_obj = self.service_in_ip if direc == 'in' else self.service_out_ip
+        with self.mutex_lock:
+            ip_obj.update_subnet(subnet, net_id, subnet_id)
 
     def update_net_info(self, tenant_id, direc, vlan_id, segmentation_id):
         ''' Update the DCNM netinfo with vlan and segmentation ID '''
@@ -1023,7 +1217,11 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         '''Function to create Openstack network'''
 
         # Step 1.a below (This fills IP DB after allocation)
-        subnet_dict = self.alloc_retrieve_subnet_info(tenant_id, direc)
+        # The subnet, segment and VLAN are taken from the service pool if
+        # there's one.
+        pool_res = self.get_pool_res(tenant_id, direc)
+        subnet_dict = self.alloc_retrieve_subnet_info(
+            tenant_id, direc, ip_next=pool_res and pool_res.subnet)
         # 1. Fill net parameters w/o vlan, seg allocated (becos we don't have
         # netid to store in DB)
         # 2. Create OS Network which gives NetID
@@ -1047,18 +1245,25 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
             net_id, subnet_id = self.os_helper.create_network(
                 net_dict['name'], tenant_id, subnet_dict['cidr'], gw=gw)
         except Exception as exc:
-            self.release_subnet(subnet_dict['cidr'], direc)
+            if pool_res is not None:
+                self.release_pool_res(direc, pool_res)
+            else:
+                self.release_subnet(subnet_dict['cidr'], direc)
             LOG.error("Create network for tenant %(tenant)s network %(name)s "
                       "direct %(dir)s failed exc %(exc)s ",
                       {'tenant': tenant_name, 'name': net_dict['name'],
                        'dir': direc, 'exc': str(exc)})
             return None, None
         # Step 3 (This fills the Seg/Vlan DB with net_id)
-        seg = self.alloc_seg(net_id)
-        vlan = 0
-        # VLAN allocation is only needed for physical case
-        if not is_fw_virt:
-            vlan = self.alloc_vlan(net_id)
+        if pool_res is not None:
+            seg, vlan = self.assign_pool_seg_vlan(pool_res, net_id,
+                                                  is_fw_virt=is_fw_virt)
+        else:
+            seg = self.alloc_seg(net_id)
+            vlan = 0
+            # VLAN allocation is only needed for physical case
+            if not is_fw_virt:
+                vlan = self.alloc_vlan(net_id)
         # Updating the local cache
         self.update_net_info(tenant_id, direc, vlan, seg)
         # Step 2.a (Updating IP DB with netid)
@@ -1104,11 +1309,24 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         self.delete_network_db(net_id)
         return ret
 
+    def _is_os_nwk_created(self, tenant_id, direc):
+        '''
+        Returns True if the Openstack network of the direction was created
+        and stored in DB by a previous run of the SM.
+        '''
+        serv_obj = self.get_service_obj(tenant_id)
+        net_id = serv_obj.get_fw_dict().get(direc + '_network_id')
+        return bool(net_id) and self.get_network(net_id) is not None
+
     def create_os_in_nwk(self, tenant_id, fw_dict, is_fw_virt=False):
         '''
         Create the Openstack IN network and stores the values in DB.
         '''
         tenant_name = fw_dict.get('tenant_name')
+        if self._is_os_nwk_created(tenant_id, "in"):
+            LOG.info("In Openstack network already created for tenant %s",
+                     tenant_id)
+            return True
         try:
             net, subnet = self._create_os_nwk(tenant_id, tenant_name, "in",
                                               is_fw_virt=is_fw_virt)
@@ -1141,6 +1359,10 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         Create the Openstack OUT network and stores the values in DB.
         '''
         tenant_name = fw_dict.get('tenant_name')
+        if self._is_os_nwk_created(tenant_id, "out"):
+            LOG.info("Out Openstack network already created for tenant %s",
+                     tenant_id)
+            return True
         try:
             net, subnet = self._create_os_nwk(tenant_id, tenant_name, "out",
                                               is_fw_virt=is_fw_virt)
@@ -1188,6 +1410,11 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
             net_id = fw_data.out_network_id
             seg, vlan = self.get_out_seg_vlan(tenant_id)
             sub, ip, ip_end, gw, sec_gw = self.get_out_ip_addr(tenant_id)
+        if not net_id or self.get_network(net_id) is None:
+            # Deleted by a previous run of the SM, or never created.
+            LOG.info("Openstack network %(dir)s for tenant %(tenant)s "
+                     "already deleted", {'dir': direc, 'tenant': tenant_id})
+            return True
         # Delete the Openstack Network
         try:
             ret = self.os_helper.delete_network_all_subnets(net_id)
@@ -1202,9 +1429,10 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
             return False
 
         # Release the segment, VLAN and subnet allocated
-        if not is_fw_virt:
-            self.service_vlans.release_segmentation_id(vlan)
-        self.service_segs.release_segmentation_id(seg)
+        with self.mutex_lock:
+            if not is_fw_virt:
+                self.service_vlans.release_segmentation_id(vlan)
+            self.service_segs.release_segmentation_id(seg)
         self.release_subnet(sub, direc)
         # Release the network DB entry
         self.delete_network_db(net_id)
@@ -1260,7 +1488,14 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
                 LOG.error("Invalid router id, attaching dummy interface"
                           " failed")
                 return False
-            if is_fw_virt:
+            net_id, subnet_id, dummy_rtr_id = self.get_dummy_router_net(
+                tenant_id)
+            attached = (net_id and subnet_id and
+                        self.get_network(net_id) is not None)
+            if not is_fw_virt and attached:
+                LOG.info("Dummy interface already attached for tenant %s",
+                         tenant_id)
+            elif is_fw_virt:
                 net_id = subnet_id = None
             else:
                 net_id, subnet_id = \
@@ -1276,6 +1511,8 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
                       ", Exception %(exc)s",
                       {'tenant': tenant_id, 'exc': str(exc)})
             res = fw_const.OS_DUMMY_RTR_CREATE_FAIL
+            self.update_fw_db_result(tenant_id, os_status=res)
+            return False
         self.store_fw_db_router(tenant_id, net_id, subnet_id, rtr_id, res)
         return True
 
@@ -1479,23 +1716,17 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
 
     def get_next_create_state(self, state, ret):
         ''' Return the next create state from previous state '''
-        if ret:
-            if state == fw_const.FABRIC_PREPARE_DONE_STATE:
-                return state
-            else:
-                return state + 1
-        else:
-            return state
+        idx = self.fabric_states.index(state)
+        if ret and idx < len(self.fabric_states) - 1:
+            return self.fabric_states[idx + 1]
+        return state
 
     def get_next_del_state(self, state, ret):
         ''' Return the next delete state from previous state '''
-        if ret:
-            if state == fw_const.INIT_STATE:
-                return state
-            else:
-                return state - 1
-        else:
-            return state
+        idx = self.fabric_states.index(state)
+        if ret and idx > 0:
+            return self.fabric_states[idx - 1]
+        return state
 
     def get_next_state(self, state, ret, oper):
         ''' Returns the next state for a create or delete operation '''
@@ -1504,37 +1735,55 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         else:
             return self.get_next_del_state(state, ret)
 
-    def run_create_sm(self, tenant_id, fw_dict, is_fw_virt):
+    def _run_sm(self, tenant_id, fw_dict, is_fw_virt, oper):
         '''
-        Runs the create SM. Goes through every state function until the end
-        or when one state returns failure.
+        Runs the steps of the create or delete SM from the recorded state.
+        Stops at the first step that fails, the state stays at that step.
         '''
-        ret = True
         serv_obj = self.get_service_obj(tenant_id)
+        if oper == fw_const.FW_CR_OP:
+            fn_idx = 0
+            init_result = fw_const.RESULT_FW_CREATE_INIT
+            final_state = fw_const.FABRIC_PREPARE_DONE_STATE
+            state_str = fw_const.fw_state_fn_dict
+        else:
+            fn_idx = 1
+            init_result = fw_const.RESULT_FW_DELETE_INIT
+            final_state = fw_const.INIT_STATE
+            state_str = fw_const.fw_state_fn_del_dict
         state = serv_obj.get_state()
         # Preserve the ordering of the next lines till while
-        new_state = serv_obj.fixup_state(fw_const.FW_CR_OP, state)
-        serv_obj.store_local_final_result(fw_const.RESULT_FW_CREATE_INIT)
-        if state != new_state:
-            state = new_state
-            serv_obj.store_state(state)
-        while ret:
+        state = serv_obj.fixup_state(oper, state)
+        serv_obj.store_local_final_result(init_result)
+        # Record the operation even if the first step fails, a restart
+        # resumes it from this state.
+        serv_obj.store_state(state)
+        while True:
             try:
-                ret = self.fabric_fsm[state][0](tenant_id, fw_dict,
-                                                is_fw_virt=is_fw_virt)
+                ret = self.fabric_fsm[state][fn_idx](tenant_id, fw_dict,
+                                                     is_fw_virt=is_fw_virt)
             except Exception as exc:
                 LOG.error("Exception %(exc)s for state %(state)s",
-                          {'exc': str(exc), 'state':
-                           fw_const.fw_state_fn_dict.get(state)})
+                          {'exc': str(exc), 'state': state_str.get(state)})
                 ret = False
-            if ret:
-                LOG.info("State %s return successfully",
-                         fw_const.fw_state_fn_dict.get(state))
-            state = self.get_next_state(state, ret, fw_const.FW_CR_OP)
+            if not ret:
+                LOG.error("State %s failed, will be resumed from it",
+                          state_str.get(state))
+                return False
+            LOG.info("State %s return successfully", state_str.get(state))
+            if state == final_state:
+                return True
+            state = self.get_next_state(state, ret, oper)
             serv_obj.store_state(state)
-            if state == fw_const.FABRIC_PREPARE_DONE_STATE:
-                break
+
+    def run_create_sm(self, tenant_id, fw_dict, is_fw_virt):
+        '''
+        Runs the create SM. Goes through every state function until the end
+        or when one state returns failure.
+        '''
+        ret = self._run_sm(tenant_id, fw_dict, is_fw_virt, fw_const.FW_CR_OP)
         if ret:
+            serv_obj = self.get_service_obj(tenant_id)
             serv_obj.store_local_final_result(fw_const.RESULT_FW_CREATE_DONE)
         return ret
 
@@ -1543,33 +1792,8 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         Runs the delete SM. Goes through every state function until the end
         or when one state returns failure.
         '''
-        # Read the current state from the DB
-        ret = True
-        serv_obj = self.get_service_obj(tenant_id)
-        state = serv_obj.get_state()
-        # Preserve the ordering of the next lines till while
-        new_state = serv_obj.fixup_state(fw_const.FW_DEL_OP, state)
-        serv_obj.store_local_final_result(fw_const.RESULT_FW_DELETE_INIT)
-        if state != new_state:
-            state = new_state
-            serv_obj.store_state(state)
-        while ret:
-            try:
-                ret = self.fabric_fsm[state][1](tenant_id, fw_dict,
-                                                is_fw_virt=is_fw_virt)
-            except Exception as exc:
-                LOG.error("Exception %(exc)s for state %(state)s",
-                          {'exc': str(exc), 'state':
-                           fw_const.fw_state_fn_del_dict.get(state)})
-                ret = False
-            if ret:
-                LOG.info("State %s return successfully",
-                         fw_const.fw_state_fn_del_dict.get(state))
-            if state == fw_const.INIT_STATE:
-                break
-            state = self.get_next_state(state, ret, fw_const.FW_DEL_OP)
-            serv_obj.store_state(state)
-        return ret
+        return self._run_sm(tenant_id, fw_dict, is_fw_virt,
+                            fw_const.FW_DEL_OP)
 
     def get_key_state(self, status, state_dict):
         ''' Returns the key associated with the dict '''
@@ -1721,6 +1945,10 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
         ''' Ensure DB is consistent after unexpected restarts. '''
 
         LOG.info("Checking consistency of DB")
+        # Release the segments and VLANs left in the service pool, the pool
+        # is filled again after start.
+        self.service_segs.release_segmentation_id_src(fw_const.FW_POOL_CONST)
+        self.service_vlans.release_segmentation_id_src(fw_const.FW_POOL_CONST)
         # Any Segments allocated that's not in Network or FW DB, release it
         seg_netid_dict = self.service_segs.get_seg_netid_src(fw_const.FW_CONST)
         vlan_netid_dict = self.service_vlans.get_seg_netid_src(
@@ -1855,7 +2083,7 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
     def prepare_fabric_fw(self, tenant_id, fw_dict, is_fw_virt, result):
         ''' Top level routine to prepare the fabric '''
         try:
-            with self.mutex_lock:
+            with self.get_tenant_lock(tenant_id):
                 ret = self.prepare_fabric_fw_int(tenant_id, fw_dict,
                                                  is_fw_virt, result)
         except Exception as exc:
@@ -1908,7 +2136,7 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
     def delete_fabric_fw(self, tenant_id, fw_dict, is_fw_virt, result):
         ''' Top level routine to unconfigure the fabric '''
         try:
-            with self.mutex_lock:
+            with self.get_tenant_lock(tenant_id):
                 ret = self.delete_fabric_fw_int(tenant_id, fw_dict,
                                                 is_fw_virt, result)
         except Exception as exc:
@@ -1949,7 +2177,7 @@ class FabricBase(dfa_dbm.DfaDBMixin, FabricApi):
                       result):
         ''' Top level retry failure routine '''
         try:
-            with self.mutex_lock:
+            with self.get_tenant_lock(tenant_id):
                 ret = self.retry_failure_int(tenant_id, tenant_name, fw_data,
                                              is_fw_virt, result)
         except Exception as exc:
@@ -35,6 +35,9 @@ IN_IP_END = '100.100.20.0/24'
 OUT_IP_START = '200.200.2.0/24'
 OUT_IP_END = '200.200.20.0/24'
 DUMMY_IP_SUBNET = '9.9.9.0/24'
+# Number of service network resources (segment, VLAN and subnet) allocated
+# ahead for each direction, 0 disables the pool.
+SERVICE_POOL_SIZE = 0
 
 IN_SERVICE_SUBNET = 'FwServiceInSub'
 IN_SERVICE_NWK = 'FwServiceInNwk'
@@ -101,6 +104,21 @@ DCNM_DELETE_SUCCESS = DCNM_IN_NETWORK_DEL_SUCCESS
 INIT = 0
 MAX_STATE = FABRIC_PREPARE_SUCCESS  # 17
 
+# Time in seconds during which rule changes of a tenant are merged into one
+# modify of the FW device.
+FW_MODIFY_DEBOUNCE_TIME = 2
+
+# Number of tenants whose failed FW operation is retried in parallel, and the
+# minimum and maximum time in seconds before a tenant that failed again is
+# retried.
+FW_RETRY_POOL_SIZE = 8
+FW_RETRY_BACKOFF_MIN = 60
+FW_RETRY_BACKOFF_MAX = 960
+
+# Source of the segments and VLANs held in the service network pool, they
+# are released on restart.
+FW_POOL_CONST = 'FirewallPool'
+
 INIT_STATE = 100
 OS_IN_NETWORK_STATE = INIT_STATE + 1
 OS_OUT_NETWORK_STATE = OS_IN_NETWORK_STATE + 1
@@ -15,6 +15,10 @@
 #
 # @author: Padmanabhan Krishnan, Cisco Systems, Inc.
 
+import Queue
+import threading
+import time
+
 from dfa.db import dfa_db_models as dfa_dbm
 from dfa.common import dfa_logger as logging
 from dfa.common import utils as sys_utils
@@ -94,7 +98,30 @@ class FwMapAttr(object):
         self.fw_type = None
         self.tenant_name = None
         self.fw_name = None
+        self.router_id = None
         self.mutex_lock = sys_utils.lock()
+        # Number of rules of a policy that are present, indexed by policy ID
+        # and the policies that a rule is a part of, indexed by rule ID.
+        self.pol_rule_present = {}
+        self.rule_pols = {}
+        # Incremented on every change, the FW dictionary is rebuilt only
+        # when its version is not the current one.
+        self.version = 0
+        self.fw_dict = None
+        self.fw_dict_version = -1
+
+    def _changed(self, fw_dict_changed=True):
+        ''' Bumps the version. The cached FW dictionary stays valid if the
+            change does not affect it.
+        '''
+        cache_valid = self.fw_dict_version == self.version
+        self.version += 1
+        if cache_valid and not fw_dict_changed:
+            self.fw_dict_version = self.version
+
+    def is_active_rule(self, rule_id):
+        ''' Returns if the rule is a part of the active policy '''
+        return self.active_pol_id in self.rule_pols.get(rule_id, ())
 
     def store_policy(self, pol_id, policy):
         ''' Store the policy. Policy is maintained as a dictionary of pol ID
@@ -102,6 +129,12 @@ class FwMapAttr(object):
         if pol_id not in self.policies:
             self.policies[pol_id] = policy
             self.policy_cnt += 1
+            rule_ids = set(policy['rule_dict'])
+            for rule_id in rule_ids:
+                self.rule_pols.setdefault(rule_id, set()).add(pol_id)
+            self.pol_rule_present[pol_id] = len(
+                [rule_id for rule_id in rule_ids if rule_id in self.rules])
+            self._changed(pol_id == self.active_pol_id)
 
     def store_rule(self, rule_id, rule):
         ''' Store the rules. Policy is maintained as a dictionary of Rule ID
@@ -109,6 +142,9 @@ class FwMapAttr(object):
         if rule_id not in self.rules:
             self.rules[rule_id] = rule
             self.rule_cnt += 1
+            for pol_id in self.rule_pols.get(rule_id, ()):
+                self.pol_rule_present[pol_id] += 1
+            self._changed(self.is_active_rule(rule_id))
 
     def delete_rule(self, rule_id):
         ''' Delete the specific Rule from the dictionary indexed by rule id '''
@@ -117,6 +153,9 @@ class FwMapAttr(object):
             return
         del self.rules[rule_id]
         self.rule_cnt -= 1
+        for pol_id in self.rule_pols.get(rule_id, ()):
+            self.pol_rule_present[pol_id] -= 1
+        self._changed(self.is_active_rule(rule_id))
         # No need to navigate through self.policies to delete rules since
         # if a rule is a part of a policy, Openstack would not allow to delete
         # that rule
@@ -135,7 +174,9 @@ class FwMapAttr(object):
         if rule_id not in self.rules:
             LOG.error("Rule ID not present %s", rule_id)
             return
+        # The FW dictionary refers to the same rule dictionary.
         self.rules[rule_id].update(rule)
+        self._changed(False)
 
     def is_policy_present(self, pol_id):
         ''' Returns a boolean based on if the policy index by ID is present
@@ -161,6 +202,7 @@ class FwMapAttr(object):
         self.active_pol_id = pol_id
         self.fw_type = fw_type
         self.router_id = rtr_id
+        self._changed()
 
     def delete_fw(self, fw_id):
         ''' Deletes the FW local attributes '''
@@ -168,14 +210,23 @@ class FwMapAttr(object):
         self.fw_name = None
         self.fw_created = False
         self.active_pol_id = None
+        self._changed()
 
     def delete_policy(self, pol_id):
         ''' Deletes the policy from the local dictionary '''
         if pol_id not in self.policies:
             LOG.error("Invalid policy %s", pol_id)
             return
+        for rule_id in set(self.policies[pol_id]['rule_dict']):
+            pols = self.rule_pols.get(rule_id)
+            if pols is not None:
+                pols.discard(pol_id)
+                if not pols:
+                    del self.rule_pols[rule_id]
         del self.policies[pol_id]
+        del self.pol_rule_present[pol_id]
         self.policy_cnt -= 1
+        self._changed(pol_id == self.active_pol_id)
 
     def is_fw_complete(self):
         ''' This API returns the complete status of FW.
@@ -230,11 +281,7 @@ class FwMapAttr(object):
 
     def one_rule_present(self, pol_id):
         ''' Returns if atleast one rule is present in the policy '''
-        pol_dict = self.policies[pol_id]
-        for rule in pol_dict['rule_dict']:
-            if self.is_rule_present(rule):
-                return True
-        return False
+        return self.pol_rule_present[pol_id] > 0
 
     def fw_drvr_created(self, status):
         ''' This stores the status of the driver init, this API assumes only
@@ -249,9 +296,16 @@ class FwMapAttr(object):
         return self.fw_drvr_status
 
     def get_fw_dict(self):
-        ''' This API creates a FW dictionary from the local attributes and
-            returns it.
+        ''' This API returns the FW dictionary created from the local
+            attributes. The dictionary is cached until the attributes change,
+            so it should not be modified by the caller.
         '''
+        if self.fw_dict_version != self.version:
+            self.fw_dict = self._build_fw_dict()
+            self.fw_dict_version = self.version
+        return self.fw_dict
+
+    def _build_fw_dict(self):
         fw_dict = {}
         if self.fw_id is None:
             return fw_dict
@@ -280,6 +334,7 @@ class FwMapAttr(object):
             self.router_id = rtr_id
         if fw_type != -1:
             self.fw_type = fw_type
+        self._changed()
 
 
 class FwMgr(dev_mgr.DeviceMgr):
@@ -311,11 +366,29 @@ class FwMgr(dev_mgr.DeviceMgr):
         self.fabric = fabric.FabricBase()
         self.temp_db = FwTempDb()
         self.os_helper = OsHelper.DfaNeutronHelper()
+        self.modify_debounce = fw_constants.FW_MODIFY_DEBOUNCE_TIME
+        self.modify_pending = {}
+        self.modify_lock = sys_utils.lock()
+        self.retry_pool_size = fw_constants.FW_RETRY_POOL_SIZE
+        self.retry_backoff = {}
+        self.retry_lock = sys_utils.lock()
         fw_dict = self.pop_local_cache()
         self.pop_local_sch_cache(fw_dict)
         self.dcnm_obj = None
         self.fw_init = True
 
+    def stop_fw_mgr(self):
+        ''' Stops the FW manager, when the server is shutting down '''
+        if not self.fw_init:
+            return
+        # The pending updates of the devices are done now, rather than
+        # dropped with their timers.
+        with self.modify_lock:
+            tenant_ids = list(self.modify_pending)
+        for tenant_id in tenant_ids:
+            self.flush_modify_fw(tenant_id)
+        self.fabric.stop()
+
     def populate_cfg_dcnm(self, cfg, dcnm_obj):
         ''' This routine is for storing the DCNM obj to make use of the
             utility functions.
@@ -401,6 +474,9 @@ class FwMgr(dev_mgr.DeviceMgr):
             configure the device
         '''
         if self.fwid_attr[tenant_id].is_fw_drvr_create_needed():
+            # The create programs the complete FW, so a pending modify is
+            # not needed.
+            self._cancel_modify_fw(tenant_id)
             fw_dict = self.fwid_attr[tenant_id].get_fw_dict()
             try:
                 with self.fwid_attr[tenant_id].mutex_lock:
@@ -447,6 +523,7 @@ class FwMgr(dev_mgr.DeviceMgr):
             calls the routine to remove the fabric cfg from DB and unconfigure
             the device
         '''
+        self._cancel_modify_fw(tenant_id)
         fw_dict = self.fwid_attr[tenant_id].get_fw_dict()
         ret = False
         try:
@@ -459,13 +536,54 @@ class FwMgr(dev_mgr.DeviceMgr):
         return ret
 
     def _check_update_fw(self, tenant_id, drvr_name):
-        ''' This function calls the device manager routine to update the device
-            with modified FW cfg.
+        ''' This function schedules the device manager routine to update the
+            device with modified FW cfg. Changes that come within the
+            debounce time are merged into one update of the device.
         '''
-        if self.fwid_attr[tenant_id].is_fw_complete():
-            fw_dict = self.fwid_attr[tenant_id].get_fw_dict()
+        if not self.fwid_attr[tenant_id].is_fw_complete():
+            return
+        if self.modify_debounce <= 0:
+            self._modify_fw(tenant_id)
+            return
+        with self.modify_lock:
+            if tenant_id in self.modify_pending:
+                return
+            timer = threading.Timer(self.modify_debounce,
+                                    self.flush_modify_fw, args=(tenant_id,))
+            timer.daemon = True
+            self.modify_pending[tenant_id] = timer
+            timer.start()
+
+    def _cancel_modify_fw(self, tenant_id):
+        ''' Cancels the pending update of the device for the tenant '''
+        with self.modify_lock:
+            timer = self.modify_pending.pop(tenant_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _modify_fw(self, tenant_id):
+        tenant_obj = self.fwid_attr.get(tenant_id)
+        if tenant_obj is None:
+            return
+        with tenant_obj.mutex_lock:
+            # The FW may have been deleted after the update was scheduled.
+            if not tenant_obj.is_fw_complete():
+                return
+            fw_dict = tenant_obj.get_fw_dict()
             self.modify_fw_device(tenant_id, fw_dict.get('fw_id'), fw_dict)
 
+    def flush_modify_fw(self, tenant_id):
+        ''' Updates the device with the FW cfg if an update is pending '''
+        with self.modify_lock:
+            timer = self.modify_pending.pop(tenant_id, None)
+        if timer is None:
+            return
+        timer.cancel()
+        try:
+            self._modify_fw(tenant_id)
+        except Exception as exc:
+            LOG.error("Exception in modify fw %s", str(exc))
+
     def _fw_create(self, drvr_name, data, cache):
         '''
             This function updates its local cache with FW parameters.
@@ -610,9 +728,14 @@ class FwMgr(dev_mgr.DeviceMgr):
         rule_id = fw_rule.get('id')
         if tenant_id not in self.fwid_attr:
             self.fwid_attr[tenant_id] = FwMapAttr(tenant_id)
-        self.fwid_attr[tenant_id].store_rule(rule_id, rule)
+        tenant_obj = self.fwid_attr[tenant_id]
+        fw_complete = not cache and tenant_obj.is_fw_complete()
+        tenant_obj.store_rule(rule_id, rule)
         if not cache:
             self._check_create_fw(tenant_id, drvr_name)
+        # A new rule of the active policy of a FW that is already configured.
+        if fw_complete and tenant_obj.is_active_rule(rule_id):
+            self._check_update_fw(tenant_id, drvr_name)
         self.temp_db.store_rule_tenant(rule_id, tenant_id)
         if fw_pol_id is not None and not (
                 self.fwid_attr[tenant_id].is_policy_present(fw_pol_id)):
@@ -811,6 +934,7 @@ class FwMgr(dev_mgr.DeviceMgr):
         This module calls routine in fabric to retry the failure cases.
         If device is not successfully cfg/uncfg, it calls the device manager
         routine to cfg/uncfg the device.
+        Returns False if the retry failed.
         '''
         result = fw_data.get('result').split('(')[0]
         is_fw_virt = self.is_device_virtual()
@@ -822,7 +946,7 @@ class FwMgr(dev_mgr.DeviceMgr):
             if not ret:
                 LOG.error("Retry failure returned fail for tenant %s",
                           tenant_id)
-                return
+                return False
             else:
                 result = fw_constants.RESULT_FW_CREATE_DONE
                 self.update_fw_db_final_result(fw_dict.get('fw_id'), result)
@@ -837,6 +961,8 @@ class FwMgr(dev_mgr.DeviceMgr):
                                                  'SUCCESS')
                     LOG.info("Retry failue return success for create"
                              " tenant %s", tenant_id)
+                return ret
+        return True
 
     def retry_failure_fab_dev_delete(self, tenant_id, fw_data, fw_dict):
         '''
@@ -844,10 +970,12 @@ class FwMgr(dev_mgr.DeviceMgr):
         delete.
         If device is not successfully cfg/uncfg, it calls the device manager
         routine to cfg/uncfg the device.
+        Returns False if the retry failed.
         '''
         result = fw_data.get('result').split('(')[0]
         name = dfa_dbm.DfaDBMixin.get_project_name(self, tenant_id)
-        fw_dict['tenant_name'] = name
+        # The FW dictionary of the tenant is cached, do not modify it.
+        fw_dict = dict(fw_dict, tenant_name=name)
         is_fw_virt = self.is_device_virtual()
         if result == fw_constants.RESULT_FW_DELETE_INIT:
             if self.fwid_attr[tenant_id].is_fw_drvr_created():
@@ -861,7 +989,7 @@ class FwMgr(dev_mgr.DeviceMgr):
                     LOG.info("Retry failue dev return success for delete"
                              " tenant %s", tenant_id)
                 else:
-                    return
+                    return False
                     # Fabric portion
             name = dfa_dbm.DfaDBMixin.get_project_name(self, tenant_id)
             ret = self.fabric.retry_failure(tenant_id, name, fw_dict,
@@ -869,7 +997,7 @@ class FwMgr(dev_mgr.DeviceMgr):
             if not ret:
                 LOG.error("Retry failure returned fail for tenant %s",
                           tenant_id)
-                return
+                return False
             else:
                 result = fw_constants.RESULT_FW_DELETE_DONE
                 self.update_fw_db_final_result(fw_dict.get('fw_id'),
@@ -877,24 +1005,86 @@ class FwMgr(dev_mgr.DeviceMgr):
                 self.delete_fw(fw_dict.get('fw_id'))
                 self.fwid_attr[tenant_id].delete_fw(fw_dict.get('fw_id'))
                 self.temp_db.del_fw_tenant(fw_dict.get('fw_id'))
+        return True
 
-    def fw_retry_failures_create(self):
-        '''This module is called for retrying the create cases'''
-        for tenant_id in self.fwid_attr:
+    def _is_retry_due(self, tenant_id, now):
+        with self.retry_lock:
+            backoff = self.retry_backoff.get(tenant_id)
+        return backoff is None or now >= backoff[1]
+
+    def _update_retry_backoff(self, tenant_id, success):
+        ''' Clears the backoff of a tenant on success, doubles it on failure
+        '''
+        with self.retry_lock:
+            if success:
+                self.retry_backoff.pop(tenant_id, None)
+                return
+            fail_cnt = self.retry_backoff.get(tenant_id, (0, 0))[0] + 1
+            delay = min(fw_constants.FW_RETRY_BACKOFF_MIN * (
+                2 ** (fail_cnt - 1)), fw_constants.FW_RETRY_BACKOFF_MAX)
+            self.retry_backoff[tenant_id] = (fail_cnt, time.time() + delay)
+        LOG.info("Retry of tenant %(tenant)s failed %(cnt)d times, next "
+                 "retry in %(delay)d seconds",
+                 {'tenant': tenant_id, 'cnt': fail_cnt, 'delay': delay})
+
+    def _retry_worker(self, tenant_que, retry_fn):
+        while True:
             try:
-                with self.fwid_attr[tenant_id].mutex_lock:
-                    if self.fwid_attr[tenant_id].is_fw_drvr_create_needed():
-                        fw_dict = self.fwid_attr[tenant_id].get_fw_dict()
-                        if len(fw_dict) > 0:
-                            fw_obj, fw_data = self.get_fw(fw_dict.get('fw_id'))
-                            self.retry_failure_fab_dev_create(tenant_id,
-                                                              fw_data,
-                                                              fw_dict)
-                        else:
-                            LOG.error("FW data not found for tenant %s",
-                                      tenant_id)
+                tenant_id = tenant_que.get_nowait()
+            except Queue.Empty:
+                return
+            tenant_obj = self.fwid_attr.get(tenant_id)
+            if tenant_obj is None:
+                continue
+            # Tenants busy with a FW event are retried in the next run.
+            if not tenant_obj.mutex_lock.acquire(False):
+                LOG.info("Tenant %s is busy, skipping retry", tenant_id)
+                continue
+            try:
+                ret = retry_fn(tenant_id)
             except Exception as exc:
-                LOG.error("Exception in retry failure create %s", str(exc))
+                LOG.error("Exception in retry failure %(fn)s %(exc)s",
+                          {'fn': retry_fn.__name__, 'exc': str(exc)})
+                ret = False
+            finally:
+                tenant_obj.mutex_lock.release()
+            if ret is not None:
+                self._update_retry_backoff(tenant_id, ret)
+
+    def _retry_tenants(self, retry_fn):
+        ''' Calls retry_fn for every tenant whose backoff has expired, in a
+            bounded pool of threads. retry_fn is called with the tenant lock
+            held and returns None if nothing had to be retried, else whether
+            the retry succeeded.
+        '''
+        now = time.time()
+        tenant_que = Queue.Queue()
+        for tenant_id in list(self.fwid_attr):
+            if self._is_retry_due(tenant_id, now):
+                tenant_que.put(tenant_id)
+        num_thrds = min(self.retry_pool_size, tenant_que.qsize())
+        thrds = [threading.Thread(target=self._retry_worker,
+                                  args=(tenant_que, retry_fn),
+                                  name='FW_Retry_%d' % cnt)
+                 for cnt in range(num_thrds)]
+        for thrd in thrds:
+            thrd.start()
+        for thrd in thrds:
+            thrd.join()
+
+    def _retry_failure_create(self, tenant_id):
+        if not self.fwid_attr[tenant_id].is_fw_drvr_create_needed():
+            return None
+        fw_dict = self.fwid_attr[tenant_id].get_fw_dict()
+        if len(fw_dict) <= 0:
+            LOG.error("FW data not found for tenant %s", tenant_id)
+            return None
+        fw_obj, fw_data = self.get_fw(fw_dict.get('fw_id'))
+        return self.retry_failure_fab_dev_create(tenant_id, fw_data, fw_dict)
+
+    def fw_retry_failures_create(self):
+        '''This module is called for retrying the create cases'''
+        self._retry_tenants(self._retry_failure_create)
 
     def fill_fw_dict_from_db(self, fw_data):
         ''' This routine is called to create a local fw_dict with data from DB.
@@ -911,28 +1101,26 @@ class FwMgr(dev_mgr.DeviceMgr):
             fw_dict['rules'][rule] = rule_dict.get(rule)
         return fw_dict
 
+    def _retry_failure_delete(self, tenant_id):
+        # For both create and delete case
+        fw_data = self.get_fw_by_tenant_id(tenant_id)
+        if fw_data is None:
+            LOG.info("No FW for tenant %s", tenant_id)
+            return None
+        result = fw_data.get('result').split('(')[0]
+        if result != fw_constants.RESULT_FW_DELETE_INIT:
+            return None
+        fw_dict = self.fwid_attr[tenant_id].get_fw_dict()
+        # This means a restart has happened before the FW is
+        # completely deleted
+        if len(fw_dict) <= 0:
+            # Need to fill fw_dict from fw_data
+            fw_dict = self.fill_fw_dict_from_db(fw_data)
+        return self.retry_failure_fab_dev_delete(tenant_id, fw_data, fw_dict)
+
     def fw_retry_failures_delete(self):
         '''This routine is called for retrying the delete cases'''
-        for tenant_id in self.fwid_attr:
-            try:
-                with self.fwid_attr[tenant_id].mutex_lock:
-                    # For both create and delete case
-                    fw_data = self.get_fw_by_tenant_id(tenant_id)
-                    if fw_data is None:
-                        LOG.info("No FW for tenant %s", tenant_id)
-                        continue
-                    result = fw_data.get('result').split('(')[0]
-                    if result == fw_constants.RESULT_FW_DELETE_INIT:
-                        fw_dict = self.fwid_attr[tenant_id].get_fw_dict()
-                        # This means a restart has happened before the FW is
-                        # completely deleted
-                        if len(fw_dict) <= 0:
-                            # Need to fill fw_dict from fw_data
-                            fw_dict = self.fill_fw_dict_from_db(fw_data)
-                        self.retry_failure_fab_dev_delete(tenant_id, fw_data,
-                                                          fw_dict)
-            except Exception as exc:
-                LOG.error("Exception in retry failure delete %s", str(exc))
+        self._retry_tenants(self._retry_failure_delete)
 
     def fw_retry_failures(self):
         ''' Top level retry routine called '''
@@ -15,12 +15,15 @@
 #  @author: Padmanabhan Krishnan, Cisco Systems, Inc.
 
 import collections
+import Queue
 
 import mock
 
 from dfa.agent.vdp import dfa_vdp_mgr
 from dfa.agent.vdp import ovs_vdp
 from dfa.common import constants
+from dfa.common import dfa_netlink
+from dfa.tests.common import test_dfa_netlink as nl_data
 from neutron.tests import base
 
 try:
@@ -55,7 +58,8 @@ class DfaVdpMgrTest(base.BaseTestCase):
     def _test_dfa_mgr_init(self):
         '''Test routine for init '''
         with mock.patch('dfa.common.utils.EventProcessingThread') as event_fn,\
-                mock.patch('dfa.common.utils.PeriodicTask') as period_fn:
+                mock.patch('dfa.common.utils.PeriodicTask') as period_fn,\
+                mock.patch.object(dfa_netlink.LinkListener, 'start'):
             event_obj = event_fn.return_value
             period_obj = period_fn.return_value
             parent = mock.MagicMock()
@@ -174,3 +178,392 @@ class DfaVdpMgrTest(base.BaseTestCase):
     def test_process_vm_event_fail(self):
         '''Top routine that calls process VM event fail case '''
         self._test_process_vm_event_fail()
+
+
+class VdpMgrLinkEventTest(base.BaseTestCase):
+    """Test cases for the uplink detection triggered by link events."""
+
+    def setUp(self):
+        super(VdpMgrLinkEventTest, self).setUp()
+        config_dict = {'integration_bridge': 'br-int',
+                       'external_bridge': 'br-ethd',
+                       'root_helper': 'sudo', 'host_id': 'host1',
+                       'ucs_fi_evb_dmac': None, 'node_list': None,
+                       'node_uplink_list': None}
+        with mock.patch('dfa.common.utils.EventProcessingThread'), \
+                mock.patch('dfa.common.utils.PeriodicTask'), \
+                mock.patch('dfa.common.dfa_sys_lib.is_cisco_ucs_b_series'), \
+                mock.patch('dfa.agent.topo_disc.topo_disc.TopoDisc'), \
+                mock.patch.object(dfa_netlink.LinkListener,
+                                  'start', return_value=True):
+            self.vdp_mgr = dfa_vdp_mgr.VdpMgr(config_dict, mock.Mock(),
+                                              'host1')
+        self.vdp_mgr.is_os_run = True
+        self.vdp_mgr.restart_uplink_called = True
+        self.vdp_mgr.uplink_det_compl = True
+        self.vdp_mgr.phy_uplink = 'eth2'
+        self.vdp_mgr.veth_intf = 'lldploc'
+        self.vdp_mgr.ovs_vdp_obj_dict = {'eth2': mock.Mock()}
+
+    def _feed(self, bufs):
+        listener = self.vdp_mgr.link_listener
+        with mock.patch('threading.Thread') as thrd_fn:
+            thrd_fn.return_value.start.side_effect = (
+                lambda: self.vdp_mgr.process_link_events())
+            for buf in bufs:
+                listener.process(buf)
+
+    def test_uplink_down_immediate(self):
+        """Test the uplink is brought down on the first netlink event."""
+
+        with mock.patch('dfa.agent.detect_uplink.detect_uplink',
+                        return_value='normal') as det_fn, \
+                mock.patch('dfa.common.dfa_sys_lib.get_bond_intf',
+                           return_value=None):
+            self._feed([nl_data.NL_ETH2_UP, nl_data.NL_ETH2_DOWN])
+        # Detection is not needed to bring the uplink down.
+        self.assertEqual(1, det_fn.call_count)
+        prio, msg = self.vdp_mgr.que.dequeue_nonblock()
+        self.assertEqual('down', msg.get_status())
+        self.assertEqual('eth2', msg.get_uplink())
+        self.assertIsNone(self.vdp_mgr.phy_uplink)
+
+    def test_uplink_down_up_coalesced(self):
+        """Test a down event followed by an up is not processed as down."""
+
+        # The events arrive while a detection is running.
+        self.vdp_mgr.link_evt_running = True
+        self._feed([nl_data.NL_ETH2_DOWN, nl_data.NL_ETH2_UP])
+        with mock.patch.object(self.vdp_mgr,
+                               'vdp_uplink_proc_top') as proc_fn:
+            self.vdp_mgr.process_link_events()
+        proc_fn.assert_called_once_with(link_down=False)
+        self.assertFalse(self.vdp_mgr.link_evt_running)
+
+        self.vdp_mgr.link_evt_running = True
+        self._feed([nl_data.NL_ETH2_UP, nl_data.NL_ETH2_DOWN])
+        with mock.patch.object(self.vdp_mgr,
+                               'vdp_uplink_proc_top') as proc_fn:
+            self.vdp_mgr.process_link_events()
+        proc_fn.assert_called_once_with(link_down=True)
+
+    def test_other_link_ignored(self):
+        """Test events of other links do not trigger the detection."""
+
+        with mock.patch('dfa.agent.detect_uplink.detect_uplink') as det_fn:
+            self._feed([nl_data.NL_ETH3_UP])
+        self.assertFalse(det_fn.called)
+        self.assertFalse(self.vdp_mgr.que.is_not_empty())
+
+    def test_uplink_enslaved_to_bond(self):
+        """Test the bond is brought up when the uplink is enslaved."""
+
+        with mock.patch('dfa.agent.detect_uplink.detect_uplink',
+                        return_value='normal'), \
+                mock.patch('dfa.common.dfa_sys_lib.get_bond_intf',
+                           return_value='bond0'), \
+                mock.patch('dfa.common.dfa_sys_lib.get_member_ports',
+                           return_value=[]):
+            self._feed([nl_data.NL_ETH2_SLAVE])
+        prio, msg = self.vdp_mgr.que.dequeue_nonblock()
+        self.assertEqual('down', msg.get_status())
+        prio, msg = self.vdp_mgr.que.dequeue_nonblock()
+        self.assertEqual('up', msg.get_status())
+        self.assertEqual('bond0', msg.get_uplink())
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class VdpMsgPriQueTest(base.BaseTestCase):
+    """Test the dedup and aging of the VDP message queue."""
+
+    def setUp(self):
+        super(VdpMsgPriQueTest, self).setUp()
+        self.clock = FakeClock()
+        self.que = dfa_vdp_mgr.VdpMsgPriQue(aging_interval=30,
+                                            clock=self.clock)
+        self.mgr = mock.Mock(que=self.que, phy_uplink='eth2')
+
+    def _vm_event(self, port_uuid, status):
+        vm_dict = {'port_uuid': port_uuid, 'vm_mac': '00:00:fa:11:22:33',
+                   'net_uuid': 'net-1', 'segmentation_id': 10001,
+                   'status': status, 'oui': None}
+        dfa_vdp_mgr.VdpMgr.vdp_vm_event.__func__(self.mgr, vm_dict)
+
+    def _uplink_msg(self, status):
+        return dfa_vdp_mgr.VdpQueMsg(constants.UPLINK_MSG_TYPE,
+                                     status=status, phy_uplink='eth2')
+
+    def _drain(self):
+        msgs = []
+        while self.que.is_not_empty():
+            msgs.append(self.que.dequeue_nonblock()[1])
+        return msgs
+
+    def test_flapping_port(self):
+        """Test only the latest state of a flapping port is processed."""
+
+        self._vm_event('port-a', 'up')
+        self._vm_event('port-b', 'up')
+        for i in range(50):
+            self._vm_event('port-a', 'down')
+            self._vm_event('port-a', 'up')
+            self.clock.now += 0.1
+        self._vm_event('port-c', 'up')
+        self._vm_event('port-a', 'down')
+        bulk = [{'port_uuid': 'port-a'}]
+        dfa_vdp_mgr.VdpMgr.vdp_vm_event.__func__(self.mgr, bulk)
+        self.que.enqueue(constants.Q_UPL_PRIO, self._uplink_msg('up'))
+        self.assertEqual(5, self.que.qsize())
+        self.assertEqual({constants.Q_UPL_PRIO: 1, constants.Q_VM_PRIO: 4},
+                         self.que.get_depth())
+        self.assertEqual(101, self.que.num_superseded)
+        msgs = self._drain()
+        self.assertEqual(constants.UPLINK_MSG_TYPE, msgs[0].msg_type)
+        # port-a is queued after the events received before its last one,
+        # but before the later bulk sync.
+        self.assertEqual([('port-b', 'up'), ('port-c', 'up'),
+                          ('port-a', 'down')],
+                         [(msg.get_port_uuid(), msg.get_status())
+                          for msg in msgs[1:4]])
+        self.assertEqual(bulk, msgs[4].msg_dict['vm_bulk_list'])
+        self.assertRaises(Queue.Empty, self.que.dequeue_nonblock)
+        self.assertEqual({}, self.que.get_depth())
+
+        # A port enqueued again once dequeued is a new message.
+        self._vm_event('port-a', 'up')
+        self.assertEqual(1, self.que.qsize())
+
+    def test_aging(self):
+        """Test a low priority message is not starved by the VM churn."""
+
+        low_prio = constants.Q_VM_PRIO + 1
+        self.que.enqueue(low_prio, 'low')
+        order = []
+        for i in range(8):
+            self.clock.now += 10
+            self._vm_event('port-%d' % i, 'up')
+            self._vm_event('port-%d' % i, 'down')
+            order.append(self.que.dequeue()[1])
+        # Aged by one level after 30 sec, it goes before the newer VM
+        # messages.
+        self.assertEqual(2, order.index('low'))
+
+    def _use_uplink_groups(self):
+        # Same queue as the one of VdpMgr, with the production constants.
+        self.que = dfa_vdp_mgr.VdpMsgPriQue(
+            clock=self.clock, group_fn=dfa_vdp_mgr.VdpQueMsg.get_uplink)
+        self.mgr.que = self.que
+
+    def test_aging_limit(self):
+        """Test an aged VM message goes ahead of other uplinks' messages."""
+
+        self._use_uplink_groups()
+        self._vm_event('port-a', 'up')
+        self.clock.now += constants.Q_AGING_INTERVAL
+        self.que.enqueue(constants.Q_UPL_PRIO,
+                         dfa_vdp_mgr.VdpQueMsg(constants.UPLINK_MSG_TYPE,
+                                               status='down',
+                                               phy_uplink='eth3'))
+        msgs = self._drain()
+        self.assertEqual('port-a', msgs[0].get_port_uuid())
+        self.assertEqual(constants.UPLINK_MSG_TYPE, msgs[1].msg_type)
+
+    def test_aging_same_uplink(self):
+        """Test a VM message never ages past a message of its uplink."""
+
+        self._use_uplink_groups()
+        self._vm_event('port-a', 'up')
+        self.clock.now += 10 * constants.Q_AGING_INTERVAL
+        self.que.enqueue(constants.Q_UPL_PRIO, self._uplink_msg('up'))
+        msgs = self._drain()
+        self.assertEqual(constants.UPLINK_MSG_TYPE, msgs[0].msg_type)
+        self.assertEqual('port-a', msgs[1].get_port_uuid())
+        self.assertEqual({}, self.que._group_cnt)
+
+    def test_superseded_keeps_age(self):
+        """Test a superseded message ages from the first enqueue."""
+
+        low_prio = constants.Q_VM_PRIO + 1
+        self.que.enqueue(low_prio, 'up', key='port-a')
+        self.clock.now += 25
+        self._vm_event('port-b', 'up')
+        self.que.enqueue(low_prio, 'down', key='port-a')
+        self.clock.now += 5
+        self.assertEqual((low_prio, 'down'), self.que.dequeue())
+
+
+class FakeOvsVdp(object):
+
+    """VDP driver returning scripted replies to the port events."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.events = []
+
+    def send_vdp_port_event(self, port_uuid, mac, net_uuid,
+                            segmentation_id, status, oui):
+        self.events.append(port_uuid)
+        fail_reason = self.replies.pop(0) if self.replies else None
+        return {'result': fail_reason is None, 'fail_reason': fail_reason}
+
+    def get_lvid_vdp_vlan(self, net_uuid, port_uuid):
+        return 1, 3003
+
+
+class VdpMgrTestCase(base.BaseTestCase):
+    """Base class of the tests on a VdpMgr whose threads are not started."""
+
+    config_dict = {'node_list': None, 'node_uplink_list': None}
+
+    def setUp(self):
+        super(VdpMgrTestCase, self).setUp()
+        with mock.patch.object(dfa_vdp_mgr.VdpMgr, 'start'), (
+                mock.patch('dfa.common.dfa_sys_lib.'
+                           'is_cisco_ucs_b_series')), (
+                mock.patch('dfa.agent.topo_disc.topo_disc.TopoDisc')):
+            self.mgr = dfa_vdp_mgr.VdpMgr(dict(self.config_dict),
+                                          mock.Mock(), 'host')
+        self.mgr.uplink_det_compl = True
+        sleep_patcher = mock.patch('time.sleep')
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+
+class VdpPortRetryTest(VdpMgrTestCase):
+    """Test the backoff of the failed VM events."""
+
+    def setUp(self):
+        super(VdpPortRetryTest, self).setUp()
+        self.clock = FakeClock()
+        self.mgr.vm_retry = dfa_vdp_mgr.VdpPortRetry(20, 100,
+                                                     clock=self.clock)
+        self.mgr.phy_uplink = 'eth2'
+        self.mgr.update_vm_result = mock.Mock()
+
+    def _vm_event(self, port_uuid):
+        self.mgr.vdp_vm_event({'port_uuid': port_uuid,
+                               'vm_mac': '00:00:fa:11:22:33',
+                               'net_uuid': 'net-1', 'segmentation_id': 10001,
+                               'status': 'up', 'oui': None})
+
+    def _run(self, seconds):
+        '''Process the queues for the given time, in steps of 10 sec.'''
+        for i in range(seconds // 10):
+            self.clock.now += 10
+            self.mgr.process_err_queue()
+            while self.mgr.que.is_not_empty():
+                prio, msg = self.mgr.que.dequeue_nonblock()
+                self.mgr.process_vm_event(msg, msg.get_uplink())
+
+    def test_backoff(self):
+        """Test the retries of a port back off up to the cap."""
+
+        timeout = "Error returned by Bridge: Timeout Error"
+        driver = FakeOvsVdp([timeout] * 6)
+        self.mgr.ovs_vdp_obj_dict['eth2'] = driver
+        self._vm_event('port-a')
+        times = []
+        for i in range(50):
+            num_events = len(driver.events)
+            self._run(10)
+            if len(driver.events) > num_events:
+                times.append(self.clock.now - 1000)
+        # Retried 20, 40, 80 and then 100 sec after each failure, and no
+        # more once the event succeeds.
+        self.assertEqual([10, 30, 70, 150, 250, 350, 450], times)
+        self.assertEqual(0, len(self.mgr.vm_retry))
+        self.assertEqual(('port-a', constants.RESULT_SUCCESS),
+                         self.mgr.update_vm_result.call_args[0])
+
+    def test_not_retryable(self):
+        """Test the permanent failures are not retried."""
+
+        driver = FakeOvsVdp([
+            "Error returned by Bridge: Invalid VID, GroupID or MAC address "
+            "field", constants.port_not_cached_reason % 'port-b',
+            "Error returned by Bridge: Insufficient resources at bridge"])
+        self.mgr.ovs_vdp_obj_dict['eth2'] = driver
+        for port_uuid in ('port-a', 'port-b', 'port-c'):
+            self._vm_event(port_uuid)
+        self._run(10)
+        self.assertEqual(['port-a', 'port-b', 'port-c'], driver.events)
+        self.assertEqual(['port-c'], list(self.mgr.vm_retry.ports))
+        self._run(300)
+        self.assertEqual(['port-a', 'port-b', 'port-c', 'port-c'],
+                         driver.events)
+
+    def test_new_event_resets(self):
+        """Test a new event of the port resets its backoff."""
+
+        driver = FakeOvsVdp(["Timeout Error"] * 3)
+        self.mgr.ovs_vdp_obj_dict['eth2'] = driver
+        self._vm_event('port-a')
+        self._run(40)
+        self.assertEqual(2, self.mgr.vm_retry.get_num_failures('port-a'))
+        self._vm_event('port-a')
+        self.assertEqual(0, self.mgr.vm_retry.get_num_failures('port-a'))
+        self._run(10)
+        self.assertEqual(1, self.mgr.vm_retry.get_num_failures('port-a'))
+        self._run(20)
+        self.assertEqual(4, len(driver.events))
+        self.assertEqual(0, len(self.mgr.vm_retry))
+
+
+class VdpRestartTest(VdpMgrTestCase):
+    """Test only the VMs changed since the snapshot are processed."""
+
+    config_dict = dict(VdpMgrTestCase.config_dict,
+                       state_dir='/var/lib/enabler')
+
+    def setUp(self):
+        super(VdpRestartTest, self).setUp()
+        self.driver = mock.Mock()
+        self.mgr.ovs_vdp_obj_dict['eth2'] = self.driver
+        self.mgr.process_vm_event = mock.Mock()
+
+    def _vm_dict(self, port_uuid, status, net_uuid='net-1'):
+        return {'port_uuid': port_uuid, 'vm_mac': 'mac-' + port_uuid,
+                'net_uuid': net_uuid, 'segmentation_id': 10001,
+                'status': status, 'oui': {'oui_id': 'cisco'},
+                'local_vlan': 10, 'vdp_vlan': 500}
+
+    def test_state_file(self):
+        """Test the snapshot is kept under the state dir."""
+
+        self.assertEqual('/var/lib/enabler/' + constants.VDP_SNAPSHOT_FILE,
+                         self.mgr.state_file)
+
+    def test_bulk_deltas(self):
+        """Test the restored VMs are processed only if they changed."""
+
+        self.driver.pop_restored_ports.return_value = dict(
+            (port_uuid, [net_uuid, 'mac-' + port_uuid, 10001,
+                         {'oui_id': 'cisco'}])
+            for port_uuid, net_uuid in (('port-1', 'net-1'),
+                                        ('port-2', 'net-1'),
+                                        ('port-3', 'net-1'),
+                                        ('port-4', 'net-1')))
+        bulk = [self._vm_dict('port-1', 'up'),
+                self._vm_dict('port-2', 'up', net_uuid='net-2'),
+                self._vm_dict('port-3', 'down'),
+                self._vm_dict('port-5', 'up')]
+        msg = dfa_vdp_mgr.VdpQueMsg(constants.VM_BULK_SYNC_MSG_TYPE,
+                                    vm_bulk_list=bulk, phy_uplink='eth2')
+        self.mgr.process_bulk_vm_event(msg, 'eth2')
+        processed = [(call[0][0].get_port_uuid(), call[0][0].get_status())
+                     for call in self.mgr.process_vm_event.call_args_list]
+        # port-1 is unchanged, port-4 was removed while the agent was down.
+        self.assertEqual([('port-2', 'up'), ('port-3', 'down'),
+                          ('port-5', 'up'), ('port-4', 'down')], processed)
+        self.assertEqual('mac-port-4', self.mgr.process_vm_event.call_args[
+            0][0].get_mac())
+        self.assertEqual(1, self.driver.pop_local_cache.call_count)
+        self.driver.save_snapshot.assert_called_once_with()
@@ -0,0 +1,259 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import socket
+import threading
+import uuid
+
+import mock
+
+from dfa.agent.vdp import lldpad
+from dfa.agent.vdp import lldpad_clif
+from dfa.agent.vdp import lldpad_constants as vdp_const
+from dfa.common import constants
+from dfa.common import dfa_sys_lib
+from dfa.common import utils
+from neutron.tests import base
+
+VSIID = "00000000-1111-2222-3333-444455556666"
+MAC = "00:11:22:33:44:55"
+
+# Messages recorded between vdptool and lldpad for the port loc_veth_eth2.
+QUERY_REQ = ("M000080c4C301000000150dloc_veth_eth2020000000304mode0005assoc"
+             "06mgrid20001006typeid0001009typeidver0001004uuid002400000000-"
+             "1111-2222-3333-444455556666")
+QUERY_REPLY = ("R00C301000000150dloc_veth_eth200000003009b04mode0005assoc"
+               "06mgrid20001006typeid0001009typeidver0001004uuid002400000000"
+               "-1111-2222-3333-44445555666605hints0001006filter001c3003-"
+               "00:11:22:33:44:55-20000")
+QUERY_FAIL_REPLY = "R01C301000000150dloc_veth_eth200000003"
+ASSOC_REQ = ("M000080c4C3020000001c0dloc_veth_eth2020000000304mode0005assoc"
+             "06mgrid20001006typeid0001009typeidver0001004uuid002400000000-"
+             "1111-2222-3333-44445555666605hints0004none06filter00190-"
+             "00:11:22:33:44:55-20000")
+ASSOC_REPLY = "R00C3020000001c0dloc_veth_eth200000003"
+ASSOC_EVENT = ("M000080c4E00009b04mode0005assoc06mgrid20001006typeid0001009"
+               "typeidver0001004uuid002400000000-1111-2222-3333-4444555566"
+               "6605hints0001006filter001c3003-00:11:22:33:44:55-20000")
+DEASSOC_EVENT = ("M000080c4E00009a04mode0007deassoc06mgrid20001006typeid00010"
+                 "09typeidver0001004uuid002400000000-1111-2222-3333-444455556"
+                 "66605hints0001206filter00190-00:11:22:33:44:55-20000")
+ATTACH_REQ = "A80c4"
+ATTACH_REPLY = "R00A"
+OTHER_ASSOC_EVENT = ASSOC_EVENT.replace("6666", "7777")
+QUERY_FAIL_OUT = QUERY_REQ + '\n' + QUERY_FAIL_REPLY + '\n'
+DETACH_REQ = "D80c4"
+DETACH_REPLY = "R00D"
+
+
+class FakeLldpad(threading.Thread):
+
+    """Replays recorded replies of lldpad on an abstract socket.
+
+    replies is a list of (request prefix, list of reply messages). The first
+    entry whose prefix matches a request is used and removed.
+    """
+
+    def __init__(self, sock_name, replies):
+        super(FakeLldpad, self).__init__()
+        self.daemon = True
+        self.replies = list(replies)
+        self.msgs = []
+        self.stop_event = threading.Event()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind('\0' + sock_name)
+        self.sock.settimeout(0.05)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                data, addr = self.sock.recvfrom(vdp_const.CLIF_MAX_MSG)
+            except socket.timeout:
+                continue
+            msg = data.decode('utf-8')
+            self.msgs.append(msg)
+            for entry in self.replies:
+                if msg.startswith(entry[0]):
+                    self.replies.remove(entry)
+                    for reply in entry[1]:
+                        self.sock.sendto(reply.encode('utf-8'), addr)
+                    break
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.sock.close()
+
+
+class LldpadClifTest(base.BaseTestCase):
+    """Test the VDP requests sent over the lldpad control socket."""
+
+    def setUp(self):
+        super(LldpadClifTest, self).setUp()
+        self.sock_name = '/test/lldpad/%s' % uuid.uuid4().hex
+        exec_patcher = mock.patch.object(dfa_sys_lib, 'execute')
+        self.execute = exec_patcher.start()
+        self.addCleanup(exec_patcher.stop)
+        vdp_cfg = utils.Dict2Obj({'vdp': {
+            'mgrid2': 0, 'typeid': 0, 'typeidver': 0,
+            'vsiidfrmt': vdp_const.VDP_VSIFRMT_UUID, 'hints': 'none',
+            'filter': vdp_const.VDP_FILTER_GIDMACVID,
+            'vdp_sync_timeout': vdp_const.VDP_SYNC_TIMEOUT,
+            'vdp_clif': True}})
+        with mock.patch('dfa.common.config.CiscoDFAConfig') as cfg_fn, (
+                mock.patch('dfa.common.utils.PeriodicTask')):
+            cfg_fn.return_value.cfg = vdp_cfg
+            self.lldpad = lldpad.LldpadDriver('loc_veth_eth2', 'eth2', 'sudo')
+        self.lldpad.clif.sock_name = self.sock_name
+        self.lldpad.clif.timeout = 1
+        self.addCleanup(self.lldpad.clif.close)
+        self.execute.reset_mock()
+
+    def _start_lldpad(self, replies):
+        server = FakeLldpad(self.sock_name, replies)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def _send_assoc(self):
+        return self.lldpad.send_vdp_assoc(vsiid=VSIID, mgrid=0, typeid=0,
+                                          typeid_ver=0, gid=20000, mac=MAC,
+                                          sw_resp=True)
+
+    def test_render_parse(self):
+        """Test the messages match the ones of vdptool."""
+
+        self.assertEqual(QUERY_REQ, lldpad_clif.render_vdp_cmd(
+            vdp_const.CMD_GETTLV, 0x15, 'loc_veth_eth2', 3,
+            ['mode=assoc', 'mgrid2=0', 'typeid=0', 'typeidver=0',
+             'uuid=' + VSIID]))
+        reply = lldpad_clif.parse_reply(QUERY_REPLY)
+        self.assertEqual((vdp_const.CMD_SUCCESS, vdp_const.CMD_GETTLV, 0x15,
+                          'loc_veth_eth2', 3),
+                         (reply.status, reply.cmd, reply.ops, reply.ifname,
+                          reply.tlvid))
+        self.assertEqual(1, len(reply.vsis))
+        self.assertEqual(['mode', 'mgrid2', 'typeid', 'typeidver', 'uuid',
+                          'hints', 'filter'], list(reply.vsis[0]))
+        self.assertEqual(VSIID, reply.vsis[0]['uuid'])
+        self.assertEqual('3003-00:11:22:33:44:55-20000',
+                         reply.vsis[0]['filter'])
+        event = lldpad_clif.parse_reply(DEASSOC_EVENT)
+        self.assertEqual('deassoc', event.vsis[0]['mode'])
+        self.assertEqual(1, lldpad_clif.parse_reply(QUERY_FAIL_REPLY).status)
+        self.assertRaises(lldpad_clif.ClifError, lldpad_clif.parse_reply,
+                          'R00C3010000001')
+
+    def test_query_vlan(self):
+        """Test the VLAN is returned by a query without vdptool."""
+
+        server = self._start_lldpad([
+            (QUERY_REQ, [ASSOC_EVENT, QUERY_REPLY])])
+        self.assertEqual((3003, None), self._send_assoc())
+        self.assertEqual([QUERY_REQ], server.msgs)
+        self.assertFalse(self.execute.called)
+
+    def test_assoc_event(self):
+        """Test the VLAN is returned from the event of the switch."""
+
+        # The failed query is run again with vdptool.
+        self.execute.return_value = QUERY_FAIL_OUT
+        server = self._start_lldpad([
+            (QUERY_REQ, [QUERY_FAIL_REPLY]),
+            (ATTACH_REQ, [ATTACH_REPLY]),
+            (ASSOC_REQ, [ASSOC_REPLY, OTHER_ASSOC_EVENT, ASSOC_EVENT]),
+            (DETACH_REQ, [DETACH_REPLY])])
+        self.assertEqual((3003, None), self._send_assoc())
+        self.assertEqual([QUERY_REQ, ATTACH_REQ, ASSOC_REQ, DETACH_REQ],
+                         server.msgs)
+        self.assertEqual(1, self.execute.call_count)
+        self.assertEqual(['vdptool', '-t'], self.execute.call_args[0][0][:2])
+
+    def test_assoc_event_other_vsi(self):
+        """Test the events of other VSIs are not taken as the response."""
+
+        self.lldpad.clif.timeout = 0.2
+        self.execute.return_value = QUERY_FAIL_OUT
+        self._start_lldpad([
+            (QUERY_REQ, [QUERY_FAIL_REPLY]),
+            (ATTACH_REQ, [ATTACH_REPLY]),
+            (ASSOC_REQ, [ASSOC_REPLY, OTHER_ASSOC_EVENT]),
+            (DETACH_REQ, [DETACH_REPLY])])
+        vlan, reason = self._send_assoc()
+        self.assertEqual(constants.INVALID_VLAN, vlan)
+        self.assertEqual(1, self.execute.call_count)
+
+    def test_assoc_failed_status(self):
+        """Test vdptool is run when lldpad fails the associate."""
+
+        self.execute.side_effect = [QUERY_FAIL_OUT,
+                                    lldpad_clif.format_vsi(
+                                        lldpad_clif.parse_reply(
+                                            ASSOC_EVENT).vsis[0])]
+        server = self._start_lldpad([
+            (QUERY_REQ, [QUERY_FAIL_REPLY]),
+            (ATTACH_REQ, [ATTACH_REPLY]),
+            (ASSOC_REQ, [QUERY_FAIL_REPLY.replace('C301', 'C302')]),
+            (DETACH_REQ, [DETACH_REPLY])])
+        self.assertEqual((3003, None), self._send_assoc())
+        self.assertEqual([QUERY_REQ, ATTACH_REQ, ASSOC_REQ, DETACH_REQ],
+                         server.msgs)
+        self.assertEqual(2, self.execute.call_count)
+        self.assertEqual(['vdptool', '-T'], self.execute.call_args[0][0][:2])
+
+    def test_assoc_rejected(self):
+        """Test the failure reason of a rejected associate."""
+
+        self.execute.return_value = QUERY_FAIL_OUT
+        self._start_lldpad([
+            (QUERY_REQ, [QUERY_FAIL_REPLY]),
+            (ATTACH_REQ, [ATTACH_REPLY]),
+            (ASSOC_REQ, [ASSOC_REPLY, DEASSOC_EVENT]),
+            (DETACH_REQ, [DETACH_REPLY])])
+        self.assertEqual((constants.INVALID_VLAN,
+                          "Error returned by Bridge: Insufficient resources "
+                          "at bridge"), self._send_assoc())
+
+    def test_assoc_no_event(self):
+        """Test an associate the switch does not respond to."""
+
+        self.lldpad.clif.timeout = 0.2
+        self.execute.return_value = QUERY_FAIL_OUT
+        self._start_lldpad([
+            (QUERY_REQ, [QUERY_FAIL_REPLY]),
+            (ATTACH_REQ, [ATTACH_REPLY]),
+            (ASSOC_REQ, [ASSOC_REPLY]),
+            (DETACH_REQ, [DETACH_REPLY])])
+        vlan, reason = self._send_assoc()
+        self.assertEqual(constants.INVALID_VLAN, vlan)
+        self.assertEqual(1, self.execute.call_count)
+
+    def test_cli_fallback(self):
+        """Test vdptool is run when lldpad can not be reached."""
+
+        self.execute.return_value = QUERY_REQ + '\n' + QUERY_REPLY + '\n'
+        self.assertEqual((3003, None), self._send_assoc())
+        self.assertEqual(1, self.execute.call_count)
+        self.assertEqual('vdptool', self.execute.call_args[0][0][0])
+        self.assertIsNone(self.lldpad.clif.sock)
+
+        # Requests with OUI arguments are always sent through vdptool.
+        self._start_lldpad([])
+        self.execute.reset_mock()
+        self.lldpad.run_vdptool(['-T', '-i', 'loc_veth_eth2', '-V', 'assoc',
+                                 '-c', 'mode=assoc'],
+                                oui_args=['-c', 'oui=cisco,vm_name=vm1'])
+        self.assertEqual(1, self.execute.call_count)
@@ -0,0 +1,193 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import collections
+
+import mock
+
+from dfa.agent.vdp import lldpad
+from dfa.agent.vdp import lldpad_constants as vdp_const
+from dfa.common import utils
+from neutron.tests import base
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, delta):
+        self.now += delta
+
+
+class VdpRefreshWheelTest(base.BaseTestCase):
+    """Test the spreading of the VSI refreshes with a fake clock."""
+
+    def setUp(self):
+        super(VdpRefreshWheelTest, self).setUp()
+        self.clock = FakeClock()
+
+    def _run_interval(self, wheel, interval):
+        '''Return the keys due at each tick of one interval.'''
+        ticks = []
+        for i in range(interval):
+            self.clock.advance(1)
+            ticks.append(wheel.get_due())
+        return ticks
+
+    def test_spread(self):
+        """Test every VSI is refreshed once per interval, evenly spread."""
+
+        wheel = lldpad.VdpRefreshWheel(30, 1, clock=self.clock, jitter=0)
+        self.assertEqual(30, wheel.num_slots)
+        for i in range(90):
+            wheel.add('vsi-%d' % i)
+        wheel.add('vsi-0')
+        self.assertEqual(90, len(wheel))
+        for cnt in range(2):
+            ticks = self._run_interval(wheel, 30)
+            self.assertEqual([3] * 30, [len(tick) for tick in ticks])
+            counts = collections.Counter(key for tick in ticks
+                                         for key in tick)
+            self.assertEqual(set(['vsi-%d' % i for i in range(90)]),
+                             set(counts))
+            self.assertEqual(set([1]), set(counts.values()))
+
+    def test_jitter(self):
+        """Test the jitter shifts the refresh time of the hosts."""
+
+        wheels = [lldpad.VdpRefreshWheel(20, 1, clock=self.clock,
+                                         jitter=jitter)
+                  for jitter in (0, 0.5)]
+        for wheel in wheels:
+            wheel.add('vsi')
+        due_at = [[], []]
+        for tick in range(40):
+            self.clock.advance(1)
+            for i, wheel in enumerate(wheels):
+                if wheel.get_due():
+                    due_at[i].append(tick)
+        self.assertEqual(2, len(due_at[0]))
+        self.assertEqual(20, due_at[0][1] - due_at[0][0])
+        self.assertEqual(10, abs(due_at[0][0] - due_at[1][0]))
+
+    def test_retry(self):
+        """Test a retried VSI is due on the next tick only."""
+
+        wheel = lldpad.VdpRefreshWheel(10, 1, clock=self.clock, jitter=0)
+        for i in range(20):
+            wheel.add('vsi-%02d' % i)
+        wheel.retry('vsi-15')
+        wheel.retry('vsi-99')
+        ticks = self._run_interval(wheel, 10)
+        self.assertEqual('vsi-15', ticks[0][0])
+        self.assertNotIn('vsi-99', ticks[0])
+        counts = collections.Counter(key for tick in ticks for key in tick)
+        self.assertEqual(2, counts['vsi-15'])
+        self.assertEqual(set([1]), set(count for key, count in
+                                       counts.items() if key != 'vsi-15'))
+        wheel.retry('vsi-15')
+        wheel.remove('vsi-15')
+        ticks = self._run_interval(wheel, 10)
+        self.assertNotIn('vsi-15', [key for tick in ticks for key in tick])
+
+    def test_late_and_removed(self):
+        """Test a late tick returns a VSI once and removal stops it."""
+
+        wheel = lldpad.VdpRefreshWheel(10, 1, clock=self.clock, jitter=0)
+        wheel.add('vsi-1')
+        wheel.add('vsi-2')
+        self.clock.advance(35)
+        self.assertEqual(['vsi-1', 'vsi-2'], sorted(wheel.get_due()))
+        wheel.remove('vsi-1')
+        wheel.remove('vsi-3')
+        ticks = self._run_interval(wheel, 10)
+        self.assertEqual(['vsi-2'], [key for tick in ticks for key in tick])
+
+
+class LldpadRefreshTest(base.BaseTestCase):
+    """Test the refresh handler of the LLDPad driver."""
+
+    def setUp(self):
+        super(LldpadRefreshTest, self).setUp()
+        vdp_cfg = utils.Dict2Obj({'vdp': {
+            'mgrid2': 0, 'typeid': 0, 'typeidver': 0,
+            'vsiidfrmt': vdp_const.VDP_VSIFRMT_UUID, 'hints': 'none',
+            'filter': vdp_const.VDP_FILTER_GIDMACVID,
+            'vdp_sync_timeout': 10, 'vdp_clif': False}})
+        with mock.patch('dfa.common.config.CiscoDFAConfig') as cfg_fn, (
+                mock.patch('dfa.common.utils.PeriodicTask')) as task_fn, (
+                mock.patch('dfa.common.dfa_sys_lib.execute')):
+            cfg_fn.return_value.cfg = vdp_cfg
+            self.lldpad = lldpad.LldpadDriver('loc_veth_eth2', 'eth2', 'sudo')
+        task_fn.assert_called_once_with(1.0, self.lldpad._vdp_refrsh_hndlr)
+        self.clock = FakeClock()
+        self.lldpad.refresh_wheel = lldpad.VdpRefreshWheel(
+            10, 1, clock=self.clock, jitter=0)
+        self.cb_fn = mock.Mock()
+
+    def _store_vsi(self, port_uuid, vlan, reason):
+        self.lldpad.store_vdp_vsi(port_uuid, 0, 0, 0,
+                                  vdp_const.VDP_VSIFRMT_UUID, port_uuid,
+                                  vdp_const.VDP_FILTER_GIDMACVID, 20000,
+                                  '00:11:22:33:44:55', vlan, False, None,
+                                  None, None, self.cb_fn, port_uuid, reason)
+
+    def test_refresh_failed_retried(self):
+        """Test a VSI whose refresh failed is retried on the next tick."""
+
+        for i in range(30):
+            self._store_vsi('vsi-%02d' % i, 100, None)
+        self._store_vsi('vsi-30', 0, 'Timeout Error')
+        self._store_vsi('vsi-31', 100, 'Other Failures')
+        sent = []
+        fails = {'vsi-30': 2}
+
+        def send_vdp_assoc(**kwargs):
+            vsiid = kwargs['vsiid']
+            sent.append(vsiid)
+            if fails.get(vsiid):
+                fails[vsiid] -= 1
+                return 0, 'Timeout Error'
+            return 100, None
+
+        self.lldpad.send_vdp_assoc = send_vdp_assoc
+        per_tick = []
+        for tick in range(12):
+            self.clock.advance(1)
+            cnt = len(sent)
+            self.lldpad._vdp_refrsh_hndlr()
+            per_tick.append(sent[cnt:])
+        self.assertEqual(32, sum(len(vsis) for vsis in per_tick[:10]))
+        self.assertLessEqual(max(len(vsis) for vsis in per_tick), 5)
+        # vsi-30 fails twice, and goes first on each of the next two ticks.
+        ticks = [i for i, vsis in enumerate(per_tick) if 'vsi-30' in vsis]
+        self.assertEqual(3, len(ticks))
+        self.assertEqual([ticks[0] + 1, ticks[0] + 2], ticks[1:])
+        for i in ticks[1:]:
+            self.assertEqual('vsi-30', per_tick[i][0])
+        # vsi-31 succeeds on its first refresh and is not retried.
+        self.assertEqual([1] + [0] * 9, [vsis.count('vsi-31')
+                                         for vsis in per_tick[:10]])
+        self.assertEqual([('vsi-30', 100, None), ('vsi-31', 100, None)],
+                         sorted(args for args, kwargs in
+                                self.cb_fn.call_args_list))
+
+        self.lldpad.clear_vdp_vsi('vsi-00')
+        self.assertEqual(31, len(self.lldpad.refresh_wheel))
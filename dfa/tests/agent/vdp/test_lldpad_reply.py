@@ -0,0 +1,158 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import time
+
+import mock
+
+from dfa.agent.vdp import lldpad
+from dfa.agent.vdp import lldpad_constants as vdp_const
+from dfa.common import constants
+from dfa.common import utils
+from neutron.tests import base
+
+VSIID = "00000000-1111-2222-3333-444455556666"
+MAC = "00:11:22:33:44:55"
+
+# Replies recorded from vdptool -t -R, the request is printed first.
+RAW_QUERY = ("M000080c4C301000000150dloc_veth_eth2020000000304mode0005assoc"
+             "06mgrid20001006typeid0001009typeidver0001004uuid002400000000-"
+             "1111-2222-3333-444455556666\n")
+RAW_OK = RAW_QUERY + (
+    "R00C301000000150dloc_veth_eth200000003009b04mode0005assoc06mgrid2"
+    "0001006typeid0001009typeidver0001004uuid002400000000-1111-2222-3333-"
+    "44445555666605hints0001006filter001c3003-00:11:22:33:44:55-20000\n")
+RAW_OUI = RAW_QUERY + (
+    "R00C3010000001509LLDPLeth5000000030105" "04mode0005assoc06mgrid2"
+    "0001006typeid0001009typeidver0001004uuid002400000000-1111-2222-3333-"
+    "44445555666605hints0001006filter001c3003-00:11:22:33:44:55-2000003"
+    "oui006105cisco07vm_name000bFW_SRVC_RTR07vm_uuid002467f338a6-0925-42aa-"
+    "b2df-e8114e9fd0da09ipv4_addr00020l\n")
+RAW_HINTS = RAW_OK.replace("hints00010", "hints00015")
+RAW_NO_HINTS = RAW_QUERY + "R01C301000000150dloc_veth_eth200000003\n"
+RAW_TWO_FILTERS = RAW_OK[:-1] + "06filter00190-00:11:22:33:44:55-1\n"
+RAW_OTHER_MAC = RAW_OK.replace("00:11:22:33:44:55", "00:12:22:33:44:55")
+# Replies recorded from vdptool -T -W.
+EVENT_OK = ("Response from VDP\n\tmode = assoc\n\tmgrid2 = 0\n\ttypeid = 0\n\t"
+            "typeidver = 0\n\tuuid = 00000000-1111-2222-3333-444455556666\n\t"
+            "filter = 3003-00:11:22:33:44:55-20000\n")
+EVENT_REJECTED = ("Response from VDP\n\tmode = deassoc\n\tmgrid2 = 0\n\t"
+                  "typeid = 0\n\ttypeidver = 0\n\tuuid = 00000000-1111-2222-"
+                  "3333-444455556666\n\tError returned by Bridge: "
+                  "Insufficient resources at bridge\n\t"
+                  "filter = 0-00:11:22:33:44:55-20000\n")
+EVENT_BAD_VLAN = EVENT_OK.replace("3003-", "x-")
+EVENT_NONE = "\nReturn from vsievt -11"
+
+RAW_CORPUS = [
+    (RAW_OK, 3003, None),
+    (RAW_OUI, 3003, None),
+    (RAW_HINTS, constants.INVALID_VLAN, vdp_const.nonzero_hints_failure % 5),
+    (RAW_NO_HINTS, constants.INVALID_VLAN,
+     vdp_const.hints_failure_reason % RAW_NO_HINTS),
+    (RAW_TWO_FILTERS, constants.INVALID_VLAN,
+     vdp_const.multiple_filter_failure_reason % RAW_TWO_FILTERS),
+    (RAW_OTHER_MAC, constants.INVALID_VLAN,
+     vdp_const.mac_mismatch_failure_reason % (MAC, "00:12:22:33:44:55")),
+]
+EVENT_CORPUS = [
+    (EVENT_OK, 3003, None),
+    (EVENT_REJECTED, constants.INVALID_VLAN,
+     "Error returned by Bridge: Insufficient resources at bridge"),
+    (EVENT_BAD_VLAN, constants.INVALID_VLAN,
+     vdp_const.format_failure_reason % EVENT_BAD_VLAN),
+    (EVENT_NONE, constants.INVALID_VLAN,
+     vdp_const.mode_failure_reason % EVENT_NONE),
+]
+
+
+class LldpadReplyTest(base.BaseTestCase):
+    """Test the parsing of the vdptool replies."""
+
+    def setUp(self):
+        super(LldpadReplyTest, self).setUp()
+        vdp_cfg = utils.Dict2Obj({'vdp': {
+            'mgrid2': 0, 'typeid': 0, 'typeidver': 0,
+            'vsiidfrmt': vdp_const.VDP_VSIFRMT_UUID, 'hints': 'none',
+            'filter': vdp_const.VDP_FILTER_GIDMACVID,
+            'vdp_sync_timeout': vdp_const.VDP_SYNC_TIMEOUT,
+            'vdp_clif': False}})
+        with mock.patch('dfa.common.config.CiscoDFAConfig') as cfg_fn, (
+                mock.patch('dfa.common.utils.PeriodicTask')), (
+                mock.patch('dfa.common.dfa_sys_lib.execute')):
+            cfg_fn.return_value.cfg = vdp_cfg
+            self.lldpad = lldpad.LldpadDriver('loc_veth_eth2', 'eth2', 'sudo')
+
+    def test_parse_raw_reply(self):
+        """Test the fields of a raw reply."""
+
+        rec = lldpad.parse_raw_reply(RAW_OUI)
+        self.assertEqual(VSIID, rec.vsiid)
+        self.assertEqual(MAC, rec.mac)
+        self.assertEqual([3003], rec.vlans)
+        self.assertEqual((0, 1), (rec.hints, rec.num_hints))
+        rec = lldpad.parse_raw_reply(RAW_TWO_FILTERS)
+        self.assertEqual([3003, 0], rec.vlans)
+        self.assertEqual(MAC, rec.mac)
+        # A failed vdptool run returns no string.
+        for reply in (None, 500, mock.Mock()):
+            rec = lldpad.parse_raw_reply(reply)
+            self.assertEqual((None, None, [], 0, ''),
+                             (rec.vsiid, rec.mac, rec.vlans, rec.num_hints,
+                              rec.reply))
+
+    def test_parse_event_reply(self):
+        """Test the fields of a VSI event reply."""
+
+        rec = lldpad.parse_event_reply(EVENT_REJECTED)
+        self.assertEqual(('deassoc', VSIID, MAC, [0]),
+                         (rec.mode, rec.vsiid, rec.mac, rec.vlans))
+        self.assertEqual("Error returned by Bridge: Insufficient resources "
+                         "at bridge", rec.fail_reason)
+        rec = lldpad.parse_event_reply(EVENT_BAD_VLAN)
+        self.assertEqual([None], rec.vlans)
+        for reply in (None, 500, mock.Mock()):
+            rec = lldpad.parse_event_reply(reply)
+            self.assertEqual((None, None, [], None, ''),
+                             (rec.mode, rec.vsiid, rec.vlans, rec.fail_reason,
+                              rec.reply))
+
+    def test_vlan_from_replies(self):
+        """Test the VLAN and failure reason of the recorded replies."""
+
+        for reply, vlan, reason in RAW_CORPUS:
+            self.assertEqual((vlan, reason), self.lldpad.get_vlan_from_reply(
+                reply, VSIID, MAC))
+        for reply, vlan, reason in EVENT_CORPUS:
+            self.assertEqual((vlan, reason),
+                             self.lldpad.get_vlan_from_reply1(reply, VSIID,
+                                                              MAC))
+
+    def test_parse_benchmark(self):
+        """Benchmark the parsing of the recorded replies."""
+
+        num_iter = 5000
+        with mock.patch.object(lldpad, 'LOG'):
+            start = time.time()
+            for i in range(num_iter):
+                for reply, vlan, reason in RAW_CORPUS:
+                    self.lldpad.get_vlan_from_reply(reply, VSIID, MAC)
+                for reply, vlan, reason in EVENT_CORPUS:
+                    self.lldpad.get_vlan_from_reply1(reply, VSIID, MAC)
+            elapsed = time.time() - start
+        num_replies = num_iter * (len(RAW_CORPUS) + len(EVENT_CORPUS))
+        # Each reply is parsed once, well under 100us per reply.
+        self.assertLess(elapsed / num_replies, 1e-4)
@@ -15,11 +15,19 @@
 #  @author: Padmanabhan Krishnan, Cisco Systems, Inc.
 
 import collections
+import json
+import os
+import shutil
+import tempfile
 
 import mock
 
+from dfa.agent.vdp import lldpad
+from dfa.agent.vdp import lldpad_constants as vdp_const
 from dfa.agent.vdp import ovs_vdp
 from dfa.agent.vdp import vdp_constants as vconstants
+from dfa.common import dfa_sys_lib
+from dfa.common import utils
 from neutron.tests import base
 
 try:
@@ -57,6 +65,8 @@ class OvsVdpTest(base.BaseTestCase):
                        return_value=str(lldp_ovs_portnum)), \
             mock.patch('dfa.common.dfa_sys_lib.OVSBridge.get_port_ofport',
                        return_value=str(phy_port_num)), \
+            mock.patch('dfa.common.dfa_sys_lib.OVSBridge.start_port_monitor',
+                       return_value=True), \
                 mock.patch('dfa.agent.vdp.lldpad.LldpadDriver') as lldpad:
             lldp_inst = lldpad.return_value
 
@@ -129,11 +139,14 @@ class OvsVdpTest(base.BaseTestCase):
             self.ovs_vdp.int_peer_port_num = int_peer_port_num
             self.ovs_vdp.send_vdp_port_event(port_uuid, mac, net_uuid,
                                              segmentation_id, status, oui)
+        cookie = "0x%x" % ovs_vdp.vm_flow_cookie(10)
         expected_calls = [
-            mock.call.add_flow(priority=4, in_port=phy_port_num,
+            mock.call.add_flow(priority=4, cookie=cookie,
+                               in_port=phy_port_num,
                                dl_vlan=10,
                                actions="mod_vlan_vid:%s,normal" % 500),
-            mock.call.add_flow(priority=3, in_port=int_peer_port_num,
+            mock.call.add_flow(priority=3, cookie=cookie,
+                               in_port=int_peer_port_num,
                                dl_vlan=500,
                                actions="mod_vlan_vid:%s,normal" % 10)]
         parent.assert_has_calls(expected_calls, any_order=False)
@@ -214,3 +227,425 @@ class OvsVdpTest(base.BaseTestCase):
     def test_vdp_port_event_down(self):
         '''Routine the calls the port down test '''
         self._test_vdp_port_event_down()
+
+
+class OvsVdpFlowTest(base.BaseTestCase):
+    """Test the programming and the periodic check of the VM flows."""
+
+    def setUp(self):
+        super(OvsVdpFlowTest, self).setUp()
+        with mock.patch.object(ovs_vdp.OVSNeutronVdp, 'setup_lldpad_ports',
+                               return_value=False):
+            self.ovs_vdp = ovs_vdp.OVSNeutronVdp('eth2', 'br-int', 'br-ethd',
+                                                 'sudo', mock.Mock())
+        self.ovs_vdp.ext_br_obj = dfa_sys_lib.OVSBridge('br-ethd', 'sudo')
+        self.ovs_vdp.integ_br_obj = dfa_sys_lib.OVSBridge('br-int', 'sudo')
+        self.ovs_vdp.phy_peer_port_num = 5
+        self.ovs_vdp.int_peer_port_num = 6
+        self.ovs_vdp.lldpad_info = mock.Mock()
+
+    def test_vdp_port_event_new(self):
+        """Test the VM flows of a new network carry the local VLAN cookie.
+        """
+        port_uuid = '0000-1111-2222-3333'
+        mac = '00:00:fa:11:22:33'
+        net_uuid = '0000-aaaa-bbbb-cccc'
+        self.ovs_vdp.lldpad_info.send_vdp_vnic_up.return_value = (500, None)
+        with mock.patch.object(self.ovs_vdp.ext_br_obj, 'get_ofport_name',
+                               return_value='test_port'), \
+            mock.patch.object(self.ovs_vdp.integ_br_obj, 'get_port_vlan_tag',
+                              return_value=10), \
+            mock.patch.object(self.ovs_vdp.ext_br_obj, 'add_flow') as (
+                ext_add), \
+            mock.patch.object(self.ovs_vdp.integ_br_obj, 'add_flow') as (
+                integ_add), \
+                mock.patch.object(dfa_sys_lib, 'execute'):
+            ret = self.ovs_vdp.send_vdp_port_event(port_uuid, mac, net_uuid,
+                                                   10001, 'up', None)
+        self.assertTrue(ret.get('result'))
+        cookie = "0x%x" % ovs_vdp.vm_flow_cookie(10)
+        ext_add.assert_called_once_with(
+            priority=4, cookie=cookie, in_port=5, dl_vlan=10,
+            actions="mod_vlan_vid:%s,normal" % 500)
+        integ_add.assert_called_once_with(
+            priority=3, cookie=cookie, in_port=6, dl_vlan=500,
+            actions="mod_vlan_vid:%s,normal" % 10)
+        lvm = self.ovs_vdp.local_vlan_map[net_uuid]
+        self.assertEqual(500, lvm.late_binding_vlan)
+
+    def _gen_flow_dump(self, lvm_list, phy_port_num, int_peer_port_num):
+        """Generate the dumps of the VM flows on both bridges."""
+        ext_flows = []
+        integ_flows = []
+        line = (" cookie=0x%(cookie)x, duration=10.5s, table=0, "
+                "n_packets=0, n_bytes=0, idle_age=10, priority=%(prio)s,"
+                "in_port=%(port)s,dl_vlan=%(match)s "
+                "actions=mod_vlan_vid:%(action)s,NORMAL")
+        for lvid, vdp_vlan in lvm_list:
+            cookie = ovs_vdp.vm_flow_cookie(lvid)
+            ext_flows.append(line % {'cookie': cookie, 'prio': 4,
+                                     'port': phy_port_num, 'match': lvid,
+                                     'action': vdp_vlan})
+            integ_flows.append(line % {'cookie': cookie, 'prio': 3,
+                                       'port': int_peer_port_num,
+                                       'match': vdp_vlan, 'action': lvid})
+        return '\n'.join(ext_flows), '\n'.join(integ_flows)
+
+    def _setup_lvm_map(self, lvm_list):
+        self.ovs_vdp.local_vlan_map = {}
+        for lvid, vdp_vlan in lvm_list:
+            lvm = ovs_vdp.LocalVlan(lvid, 10000 + lvid)
+            lvm.lvid = lvid
+            lvm.set_port_uuid('port-%d' % lvid, vdp_vlan, None)
+            lvm.late_binding_vlan = vdp_vlan
+            self.ovs_vdp.local_vlan_map['net-%d' % lvid] = lvm
+
+    def _run_flow_check(self, ext_dump, integ_dump):
+        with mock.patch.object(self.ovs_vdp.ext_br_obj, 'dump_flows_for',
+                               return_value=ext_dump), \
+            mock.patch.object(self.ovs_vdp.integ_br_obj, 'dump_flows_for',
+                              return_value=integ_dump), \
+            mock.patch.object(self.ovs_vdp,
+                              '_reprogram_vm_ovs_flows') as reprog:
+            self.ovs_vdp._flow_check_handler_internal()
+        return reprog
+
+    def test_flow_check_targeted(self):
+        """Test that only the VLAN's with differing flows are reprogrammed.
+        """
+        phy_port_num = self.ovs_vdp.phy_peer_port_num
+        int_peer_port_num = self.ovs_vdp.int_peer_port_num
+        lvm_list = [(10, 500), (11, 501), (12, 502)]
+        self._setup_lvm_map(lvm_list)
+        ext_dump, integ_dump = self._gen_flow_dump(
+            [(10, 500), (11, 601), (12, 502)], phy_port_num,
+            int_peer_port_num)
+        # Flow of lvid 12 missing on integration bridge.
+        integ_dump = '\n'.join(integ_dump.splitlines()[:2])
+        reprog = self._run_flow_check(ext_dump, integ_dump)
+        reprog.assert_has_calls([mock.call(11, 501), mock.call(12, 502)],
+                                any_order=True)
+        self.assertEqual(2, reprog.call_count)
+
+    def test_flow_check_benchmark(self):
+        """Test a flow check of 4k flows, none of them differ.
+
+        The expected flows are generated on the first run only, the next
+        runs use the hash cached in LocalVlan.
+        """
+        phy_port_num = self.ovs_vdp.phy_peer_port_num
+        int_peer_port_num = self.ovs_vdp.int_peer_port_num
+        lvm_list = [(lvid, lvid + 2000) for lvid in range(1, 2001)]
+        self._setup_lvm_map(lvm_list)
+        ext_dump, integ_dump = self._gen_flow_dump(lvm_list, phy_port_num,
+                                                   int_peer_port_num)
+        with mock.patch.object(ovs_vdp, 'gen_vm_flow_set',
+                               wraps=ovs_vdp.gen_vm_flow_set) as gen:
+            reprog = self._run_flow_check(ext_dump, integ_dump)
+            self.assertEqual(len(lvm_list), gen.call_count)
+            self.assertFalse(reprog.called)
+            gen.reset_mock()
+            reprog = self._run_flow_check(ext_dump, integ_dump)
+            self.assertFalse(gen.called)
+            self.assertFalse(reprog.called)
+
+
+class OvsVdpBatchTest(base.BaseTestCase):
+    """Test the number of ovs-ofctl calls made to program the flows."""
+
+    def setUp(self):
+        super(OvsVdpBatchTest, self).setUp()
+        with mock.patch.object(ovs_vdp.OVSNeutronVdp, 'setup_lldpad_ports',
+                               return_value=False):
+            self.ovs_vdp = ovs_vdp.OVSNeutronVdp('eth2', 'br-int', 'br-ethd',
+                                                 'sudo', mock.Mock())
+        self.ovs_vdp.ext_br_obj = dfa_sys_lib.OVSBridge('br-ethd', 'sudo')
+        self.ovs_vdp.integ_br_obj = dfa_sys_lib.OVSBridge('br-int', 'sudo')
+        self.ovs_vdp.phy_peer_port_num = 5
+        self.ovs_vdp.int_peer_port_num = 6
+        self.ofctl_calls = []
+        exec_patcher = mock.patch.object(dfa_sys_lib, 'execute',
+                                         side_effect=self._fake_execute)
+        exec_patcher.start()
+        self.addCleanup(exec_patcher.stop)
+
+    def _fake_execute(self, cmd, root_helper=None, process_input=None,
+                      **kwargs):
+        if cmd[0] == 'ovs-ofctl':
+            flows = process_input.splitlines() if process_input else []
+            self.ofctl_calls.append((cmd[2], cmd[1], flows))
+            if cmd[1] == 'dump-flows':
+                # None of the VM flows are installed.
+                return 'NXST_FLOW reply (xid=0x4):\n'
+        return ''
+
+    def _ofctl_count(self):
+        return collections.Counter((br, action) for br, action, flows in
+                                   self.ofctl_calls)
+
+    def test_program_vdp_flows(self):
+        """Test the VDP flows are added and deleted with one call each."""
+
+        self.ovs_vdp.program_vdp_flows(14, 15)
+        self.assertEqual(1, len(self.ofctl_calls))
+        self.assertEqual(('br-ethd', 'add-flows'), self.ofctl_calls[0][:2])
+        self.assertEqual(4, len(self.ofctl_calls[0][2]))
+        self.ovs_vdp.delete_vdp_flows()
+        self.assertEqual(2, len(self.ofctl_calls))
+        self.assertEqual(('br-ethd', 'del-flows'), self.ofctl_calls[1][:2])
+        self.assertEqual(2, len(self.ofctl_calls[1][2]))
+
+    def test_vlan_change(self):
+        """Test a VDP VLAN change forks one call per bridge and action."""
+
+        lvm = ovs_vdp.LocalVlan(10, 10010)
+        lvm.lvid = 10
+        lvm.set_port_uuid('port-10', 500, None)
+        lvm.late_binding_vlan = 500
+        self.ovs_vdp.local_vlan_map['net-10'] = lvm
+        self.ovs_vdp.lldpad_info = mock.Mock()
+        self.ovs_vdp.vdp_vlan_change_internal(
+            {'net_uuid': 'net-10', 'port_uuid': 'port-10'}, 600, None)
+        self.assertEqual({('br-ethd', 'del-flows'): 1,
+                          ('br-int', 'del-flows'): 1,
+                          ('br-ethd', 'add-flows'): 1,
+                          ('br-int', 'add-flows'): 1}, self._ofctl_count())
+        # The old flows are deleted before the new ones are added.
+        actions = [action for br, action, flows in self.ofctl_calls
+                   if br == 'br-int']
+        self.assertEqual(['del-flows', 'add-flows'], actions)
+        self.assertEqual(600, lvm.late_binding_vlan)
+
+    def test_flow_check_batched(self):
+        """Test the stale VLAN's of a flow check are reprogrammed together.
+        """
+        for lvid in range(10, 20):
+            lvm = ovs_vdp.LocalVlan(lvid, 10000 + lvid)
+            lvm.lvid = lvid
+            lvm.set_port_uuid('port-%d' % lvid, lvid + 500, None)
+            lvm.late_binding_vlan = lvid + 500
+            self.ovs_vdp.local_vlan_map['net-%d' % lvid] = lvm
+        self.ovs_vdp._flow_check_handler_internal()
+        count = self._ofctl_count()
+        self.assertEqual(2, count.pop(('br-ethd', 'dump-flows')) +
+                         count.pop(('br-int', 'dump-flows')))
+        self.assertEqual({('br-ethd', 'del-flows'): 1,
+                          ('br-int', 'del-flows'): 1,
+                          ('br-ethd', 'add-flows'): 1,
+                          ('br-int', 'add-flows'): 1}, count)
+        for br, action, flows in self.ofctl_calls:
+            if action == 'add-flows':
+                self.assertEqual(10, len(flows))
+
+    def test_deferred_error(self):
+        """Test no flows are applied when the batch fails."""
+
+        br = self.ovs_vdp.ext_br_obj
+        try:
+            with br.deferred():
+                br.add_flow(priority=4, in_port=5, actions='normal')
+                with br.deferred():
+                    br.delete_flows(in_port=5)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual([], self.ofctl_calls)
+        br.add_flow(priority=4, in_port=5, actions='normal')
+        self.assertEqual(1, len(self.ofctl_calls))
+
+
+class FakeOvs(object):
+
+    """OVS with VM flows and ports, answering ovs-ofctl and the lookups."""
+
+    def __init__(self):
+        # Bridge to list of (cookie, in_port, match vlan, set vlan).
+        self.flows = {'br-ethd': [], 'br-int': []}
+        # Port UUID to (port name, local VLAN tag).
+        self.ports = {}
+        self.ofctl_calls = []
+
+    def add_vm_flows(self, lvid, vdp_vlan, phy_port_num=5, int_port_num=6):
+        cookie = ovs_vdp.vm_flow_cookie(lvid)
+        self.flows['br-ethd'].append((cookie, phy_port_num, lvid, vdp_vlan))
+        self.flows['br-int'].append((cookie, int_port_num, vdp_vlan, lvid))
+
+    def execute(self, cmd, root_helper=None, process_input=None, **kwargs):
+        if cmd[0] != 'ovs-ofctl':
+            return ''
+        self.ofctl_calls.append((cmd[2], cmd[1]))
+        if cmd[1] != 'dump-flows':
+            return ''
+        lines = ['NXST_FLOW reply (xid=0x4):']
+        for cookie, in_port, match, action in self.flows[cmd[2]]:
+            lines.append(" cookie=0x%x, duration=10.5s, table=0, "
+                         "n_packets=0, n_bytes=0, priority=3,in_port=%s,"
+                         "dl_vlan=%s actions=mod_vlan_vid:%s,NORMAL" % (
+                             cookie, in_port, match, action))
+        return '\n'.join(lines) + '\n'
+
+    def get_ofport_name(self, port_uuid):
+        port = self.ports.get(port_uuid)
+        return port[0] if port else None
+
+    def get_port_vlan_tag(self, port_name):
+        for name, tag in self.ports.values():
+            if name == port_name:
+                return tag
+        return -1
+
+
+class OvsVdpSnapshotTest(base.BaseTestCase):
+    """Test the VDP snapshot is saved and restored against OVS."""
+
+    def setUp(self):
+        super(OvsVdpSnapshotTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.state_file = os.path.join(self.tmpdir, 'state',
+                                       'vdp_snapshot.json')
+        self.ovs = FakeOvs()
+        exec_patcher = mock.patch.object(dfa_sys_lib, 'execute',
+                                         side_effect=self.ovs.execute)
+        exec_patcher.start()
+        self.addCleanup(exec_patcher.stop)
+
+    def _create_ovs_vdp(self, uplink='eth2'):
+        with mock.patch.object(ovs_vdp.OVSNeutronVdp, 'setup_lldpad_ports',
+                               return_value=False):
+            obj = ovs_vdp.OVSNeutronVdp(uplink, 'br-int', 'br-ethd', 'sudo',
+                                        mock.Mock(),
+                                        state_file=self.state_file)
+        for br_name in ('br-ethd', 'br-int'):
+            br = dfa_sys_lib.OVSBridge(br_name, 'sudo')
+            br.get_ofport_name = self.ovs.get_ofport_name
+            br.get_port_vlan_tag = self.ovs.get_port_vlan_tag
+            if br_name == 'br-ethd':
+                obj.ext_br_obj = br
+            else:
+                obj.integ_br_obj = br
+        obj.phy_peer_port_num = 5
+        obj.int_peer_port_num = 6
+        vdp_cfg = utils.Dict2Obj({'vdp': {
+            'mgrid2': 0, 'typeid': 0, 'typeidver': 0,
+            'vsiidfrmt': vdp_const.VDP_VSIFRMT_UUID, 'hints': 'none',
+            'filter': vdp_const.VDP_FILTER_GIDMACVID,
+            'vdp_sync_timeout': 10, 'vdp_clif': False}})
+        with mock.patch('dfa.common.config.CiscoDFAConfig') as cfg_fn, (
+                mock.patch('dfa.common.utils.PeriodicTask')):
+            cfg_fn.return_value.cfg = vdp_cfg
+            obj.lldpad_info = lldpad.LldpadDriver('loc_veth_eth2', 'eth2',
+                                                  'sudo')
+        return obj
+
+    def _add_port(self, obj, net_uuid, lvid, port_uuid, vdp_vlan):
+        seg = 10000 + lvid
+        obj.pop_local_cache(port_uuid, 'mac-' + port_uuid, net_uuid, lvid,
+                            vdp_vlan, seg)
+        obj.lldpad_info.restore_vdp_vnic(
+            port_uuid=port_uuid, vsiid=port_uuid, gid=seg,
+            mac='mac-' + port_uuid, vlan=vdp_vlan,
+            oui={'oui_id': 'cisco', 'vm_name': port_uuid})
+        self.ovs.ports[port_uuid] = ('tap-' + port_uuid, lvid)
+
+    def _save(self):
+        obj = self._create_ovs_vdp()
+        self._add_port(obj, 'net-10', 10, 'port-1', 500)
+        self._add_port(obj, 'net-10', 10, 'port-2', 500)
+        self._add_port(obj, 'net-11', 11, 'port-3', 501)
+        self._add_port(obj, 'net-12', 12, 'port-4', 0)
+        obj.save_snapshot()
+        self.ovs.add_vm_flows(10, 500)
+        self.ovs.add_vm_flows(11, 501)
+        return obj
+
+    def test_save(self):
+        """Test the snapshot is written atomically and compact."""
+
+        obj = self._save()
+        self.assertEqual(['vdp_snapshot.json'],
+                         os.listdir(os.path.dirname(self.state_file)))
+        with open(self.state_file) as snap_file:
+            data = snap_file.read()
+        self.assertNotIn(' ', data)
+        snapshot = json.loads(data)
+        self.assertEqual(obj.get_snapshot(), snapshot)
+        self.assertEqual([10, 10010, 500, {
+            'port-1': ['mac-port-1', 500, {'oui_id': 'cisco',
+                                           'vm_name': 'port-1'}],
+            'port-2': ['mac-port-2', 500, {'oui_id': 'cisco',
+                                           'vm_name': 'port-2'}]}],
+            snapshot['nets']['net-10'])
+        self.assertFalse(obj.snapshot_dirty)
+        # Nothing is written if nothing changed.
+        os.remove(self.state_file)
+        obj.save_snapshot()
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_save_failed(self):
+        """Test a failed save is logged once and tried again."""
+
+        obj = self._create_ovs_vdp()
+        self._add_port(obj, 'net-10', 10, 'port-1', 500)
+        with mock.patch.object(ovs_vdp, 'LOG') as log, (
+                mock.patch.object(ovs_vdp.sys_utils, 'write_file_atomic',
+                                  side_effect=IOError('Permission denied'))):
+            for i in range(3):
+                obj.save_snapshot()
+        self.assertEqual(1, log.error.call_count)
+        self.assertTrue(obj.snapshot_dirty)
+        with mock.patch.object(ovs_vdp, 'LOG') as log:
+            obj.save_snapshot()
+        self.assertTrue(log.info.called)
+        self.assertFalse(obj.snapshot_dirty)
+        self.assertTrue(os.path.exists(self.state_file))
+
+    def test_restore(self):
+        """Test only the state matching OVS is restored."""
+
+        self._save()
+        # The flows of net-11 changed and port-2 was removed while down.
+        self.ovs.flows['br-int'][1] = (ovs_vdp.vm_flow_cookie(11), 6, 601,
+                                       11)
+        del self.ovs.ports['port-2']
+        self.ovs.ofctl_calls = []
+        obj = self._create_ovs_vdp()
+        obj.restore_snapshot()
+        self.assertEqual(['net-10', 'net-12'], sorted(obj.local_vlan_map))
+        lvm = obj.local_vlan_map['net-10']
+        self.assertEqual((10, 500), (lvm.lvid, lvm.late_binding_vlan))
+        self.assertEqual(['port-1'], list(lvm.port_uuid_list))
+        self.assertEqual({
+            'port-1': ['net-10', 'mac-port-1', 10010,
+                       {'oui_id': 'cisco', 'vm_name': 'port-1'}],
+            'port-4': ['net-12', 'mac-port-4', 10012,
+                       {'oui_id': 'cisco', 'vm_name': 'port-4'}]},
+            obj.restored_ports)
+        vsi = obj.lldpad_info.vdp_vif_map['port-1']
+        self.assertEqual(('mac-port-1', 10010, 500),
+                         (vsi['mac'], vsi['gid'], vsi['vdp_vlan']))
+        self.assertEqual({'obj': obj, 'mac': 'mac-port-1',
+                          'port_uuid': 'port-1', 'net_uuid': 'net-10'},
+                         vsi['vsw_cb_data'])
+        self.assertEqual(2, len(obj.lldpad_info.refresh_wheel))
+        # Only the flows are dumped, none are programmed.
+        self.assertEqual([('br-int', 'dump-flows'),
+                          ('br-ethd', 'dump-flows')], self.ovs.ofctl_calls)
+        self.assertEqual({'port-1': obj.restored_ports['port-1'],
+                          'port-4': obj.restored_ports['port-4']},
+                         obj.pop_restored_ports())
+        self.assertEqual({}, obj.restored_ports)
+
+    def test_restore_ignored(self):
+        """Test a snapshot of another uplink or a corrupt one is ignored."""
+
+        self._save()
+        obj = self._create_ovs_vdp(uplink='eth3')
+        obj.restore_snapshot()
+        self.assertEqual({}, obj.local_vlan_map)
+        with open(self.state_file, 'w') as snap_file:
+            snap_file.write('{"version": 1, "nets"')
+        obj = self._create_ovs_vdp()
+        obj.restore_snapshot()
+        self.assertEqual({}, obj.local_vlan_map)
+        self.assertEqual({}, obj.restored_ports)
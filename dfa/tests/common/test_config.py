@@ -0,0 +1,133 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import os
+import shutil
+import sys
+import tempfile
+
+import mock
+
+from neutron.tests import base
+
+from dfa.common import config
+from dfa.common import utils
+
+
+CFG_CONTENT = """
+[dcnm]
+dcnm_ip = %(ip)s
+dcnm_dhcp = false
+timeout_resp = %(timeout)d
+
+[general]
+node = host1
+"""
+
+
+class TestCiscoDFAConfig(base.BaseTestCase):
+    """Test cases for the cached config parsing."""
+
+    def setUp(self):
+        super(TestCiscoDFAConfig, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.cfg_file = os.path.join(self.tmp_dir, 'enabler_conf.ini')
+        self._write_cfg('1.1.1.1', 1000)
+
+        argv_patcher = mock.patch.object(
+            sys, 'argv', ['fabric-enabler-server', '--config-file',
+                          self.cfg_file])
+        argv_patcher.start()
+        self.addCleanup(argv_patcher.stop)
+        find_patcher = mock.patch.object(config.cfg, 'find_config_files',
+                                         side_effect=lambda *a, **kw: [])
+        find_patcher.start()
+        self.addCleanup(find_patcher.stop)
+
+        config.clear_cache()
+        self.addCleanup(config.clear_cache)
+
+    def _write_cfg(self, ip, mtime, timeout=20):
+        with open(self.cfg_file, 'w') as cfg_fd:
+            cfg_fd.write(CFG_CONTENT % {'ip': ip, 'timeout': timeout})
+        os.utime(self.cfg_file, (mtime, mtime))
+
+    def test_config_values(self):
+        """Test that file values override the default options."""
+
+        cfg = config.CiscoDFAConfig().cfg
+        self.assertEqual('1.1.1.1', cfg.dcnm.dcnm_ip)
+        self.assertFalse(cfg.dcnm.dcnm_dhcp)
+        self.assertEqual('host1', cfg.general.node)
+        self.assertEqual('br-int', cfg.dfa_agent.integration_bridge)
+
+    def test_config_parsed_once(self):
+        """Test that the config files are parsed once if not changed."""
+
+        with mock.patch.object(config, '_parse_config_files',
+                               wraps=config._parse_config_files) as parse:
+            cfg1 = config.CiscoDFAConfig().cfg
+            cfg2 = config.CiscoDFAConfig().cfg
+            self.assertEqual(1, parse.call_count)
+        self.assertEqual(cfg1.dcnm.dcnm_ip, cfg2.dcnm.dcnm_ip)
+
+    def test_config_reload_on_mtime_change(self):
+        """Test that a modified file is re-parsed and listeners notified."""
+
+        listener = mock.Mock()
+        config.register_listener(listener)
+        self.addCleanup(config.unregister_listener, listener)
+
+        with mock.patch.object(config, '_parse_config_files',
+                               wraps=config._parse_config_files) as parse:
+            config.CiscoDFAConfig()
+            self.assertFalse(listener.called)
+            self._write_cfg('2.2.2.2', 2000)
+            cfg = config.CiscoDFAConfig().cfg
+            self.assertEqual(2, parse.call_count)
+        self.assertEqual('2.2.2.2', cfg.dcnm.dcnm_ip)
+        self.assertEqual(1, listener.call_count)
+        self.assertEqual('2.2.2.2', listener.call_args[0][0].dcnm.dcnm_ip)
+
+    def test_config_reload_on_request(self):
+        """Test reload of the config files, as done on SIGHUP."""
+
+        task = utils.PeriodicTask(interval=20, func=mock.Mock())
+
+        def retune(cfg):
+            task.set_interval(int(cfg.dcnm.timeout_resp))
+
+        config.register_listener(retune)
+        self.addCleanup(config.unregister_listener, retune)
+        config.CiscoDFAConfig()
+
+        # Content changed, mtime did not.
+        self._write_cfg('3.3.3.3', 1000, timeout=40)
+        self.assertEqual('1.1.1.1', config.CiscoDFAConfig().cfg.dcnm.dcnm_ip)
+
+        config.reload_config()
+        self.assertEqual('3.3.3.3', config.CiscoDFAConfig().cfg.dcnm.dcnm_ip)
+        # The interval is retuned from the new config.
+        self.assertEqual(40, task._interval)
+
+    def test_config_snapshot_not_modified(self):
+        """Test that the cached snapshot is not modified by users."""
+
+        cfg_obj = config.CiscoDFAConfig()
+        cfg_obj.dfa_cfg['dcnm']['dcnm_ip'] = '9.9.9.9'
+        self.assertEqual('1.1.1.1', config.CiscoDFAConfig().cfg.dcnm.dcnm_ip)
@@ -0,0 +1,174 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import binascii
+import errno
+import socket
+import struct
+
+from dfa.common import dfa_netlink
+from neutron.tests import base
+
+# Recorded rtnetlink messages, trimmed to the IFLA_IFNAME, IFLA_MASTER and
+# IFLA_OPERSTATE attributes.
+# eth2 (ifindex 3) up and running.
+NL_ETH2_UP = binascii.unhexlify(
+    '34000000100000000000000000000000000001000300000043100100ffffffff'
+    '0900030065746832000000000500100006000000')
+# eth2 lost carrier.
+NL_ETH2_DOWN = binascii.unhexlify(
+    '34000000100000000000000000000000000001000300000003100000ffffffff'
+    '0900030065746832000000000500100002000000')
+# eth2 enslaved to bond0 (ifindex 5).
+NL_ETH2_SLAVE = binascii.unhexlify(
+    '3c000000100000000000000000000000000001000300000043180100ffffffff'
+    '09000300657468320000000008000a00050000000500100006000000')
+# eth2 deleted.
+NL_ETH2_DEL = binascii.unhexlify(
+    '2c000000110000000000000000000000000001000300000003100000ffffffff'
+    '090003006574683200000000')
+# eth3 (ifindex 4) up and running.
+NL_ETH3_UP = binascii.unhexlify(
+    '34000000100000000000000000000000000001000400000043100100ffffffff'
+    '0900030065746833000000000500100006000000')
+# RTM_NEWADDR, not a link message.
+NL_NEWADDR = binascii.unhexlify(
+    '200000001400000000000000000000000218000003000000080001000a000001')
+
+
+class FakeNetlinkSocket(object):
+
+    """Returns the recorded buffers, then fails like a closed socket."""
+
+    def __init__(self, bufs):
+        self.bufs = list(bufs)
+
+    def recv(self, size):
+        if not self.bufs:
+            raise socket.error(errno.EBADF, 'closed')
+        buf = self.bufs.pop(0)
+        if isinstance(buf, Exception):
+            raise buf
+        return buf
+
+    def close(self):
+        pass
+
+
+class FakeDumpSocket(FakeNetlinkSocket):
+
+    """Replies to a dump request with the recorded buffers.
+
+    The message ending the dump is added with the sequence of the request.
+    """
+
+    def __init__(self, bufs, error=0):
+        super(FakeDumpSocket, self).__init__(bufs)
+        self.error = error
+        self.reqs = []
+
+    def sendto(self, req, addr):
+        self.reqs.append(req)
+        seq = struct.unpack_from(dfa_netlink.NLMSGHDR_FMT, req)[3]
+        if self.error:
+            self.bufs.append(struct.pack(
+                dfa_netlink.NLMSGHDR_FMT + 'i', 20, dfa_netlink.NLMSG_ERROR,
+                0, seq, 0, -self.error))
+        else:
+            self.bufs.append(struct.pack(dfa_netlink.NLMSGHDR_FMT + 'i', 20,
+                                         dfa_netlink.NLMSG_DONE, 2, seq, 0,
+                                         0))
+
+
+class DfaNetlinkTest(base.BaseTestCase):
+    """Test cases for the rtnetlink link listener."""
+
+    def _run_listener(self, bufs):
+        events = []
+        listener = dfa_netlink.LinkListener(events.append,
+                                            sock=FakeNetlinkSocket(bufs))
+        listener.run()
+        return events
+
+    def test_parse_link_msgs(self):
+        """Test parsing of several messages in one buffer."""
+
+        msgs = dfa_netlink.parse_link_msgs(NL_ETH2_SLAVE + NL_NEWADDR +
+                                           NL_ETH2_DEL)
+        self.assertEqual(2, len(msgs))
+        self.assertEqual(dfa_netlink.RTM_NEWLINK, msgs[0].msg_type)
+        self.assertEqual(3, msgs[0].index)
+        self.assertEqual('eth2', msgs[0].name)
+        self.assertEqual(5, msgs[0].master)
+        self.assertEqual(6, msgs[0].operstate)
+        self.assertTrue(msgs[0].flags & dfa_netlink.IFF_RUNNING)
+        self.assertEqual(dfa_netlink.RTM_DELLINK, msgs[1].msg_type)
+        self.assertIsNone(msgs[1].master)
+
+    def test_parse_truncated_msg(self):
+        """Test a truncated message is dropped."""
+
+        msgs = dfa_netlink.parse_link_msgs(NL_ETH3_UP + NL_ETH2_UP[:30])
+        self.assertEqual(['eth3'], [msg.name for msg in msgs])
+
+    def test_link_state_changes(self):
+        """Test only the state changes are reported."""
+
+        events = self._run_listener([NL_ETH2_UP, NL_ETH2_UP + NL_NEWADDR,
+                                     NL_ETH2_DOWN, NL_ETH2_UP + NL_ETH2_SLAVE,
+                                     NL_ETH2_DEL])
+        self.assertEqual(5, len(events))
+        first, down, up, slave, deleted = events
+        self.assertTrue(first.running and first.running_changed)
+        self.assertFalse(down.running)
+        self.assertTrue(down.running_changed)
+        self.assertTrue(up.running and up.running_changed)
+        self.assertFalse(up.master_changed)
+        self.assertTrue(slave.master_changed)
+        self.assertFalse(slave.running_changed)
+        self.assertEqual(5, slave.master)
+        self.assertTrue(deleted.deleted)
+        self.assertEqual('eth2', deleted.name)
+
+    def test_overrun_resync(self):
+        """Test links are reported again after the socket overruns."""
+
+        events = self._run_listener([NL_ETH2_UP,
+                                     socket.error(errno.ENOBUFS, 'overrun'),
+                                     NL_ETH2_UP])
+        self.assertEqual(2, len(events))
+
+
+    def test_dump_links(self):
+        """Test the links are dumped until the end of the dump."""
+
+        sock = FakeDumpSocket([NL_ETH2_UP + NL_ETH2_SLAVE, NL_ETH3_UP])
+        msgs = dfa_netlink.dump_links(sock=sock)
+        self.assertEqual(['eth2', 'eth2', 'eth3'],
+                         [msg.name for msg in msgs])
+        req = struct.unpack_from(dfa_netlink.NLMSGHDR_FMT, sock.reqs[0])
+        self.assertEqual(dfa_netlink.RTM_GETLINK, req[1])
+        self.assertTrue(req[2] & dfa_netlink.NLM_F_DUMP)
+        sock = FakeDumpSocket([], error=errno.EPERM)
+        self.assertRaises(socket.error, dfa_netlink.dump_links, sock=sock)
+
+    def test_dump_addrs(self):
+        """Test the IPv4 addresses are dumped."""
+
+        sock = FakeDumpSocket([NL_NEWADDR + NL_ETH2_UP])
+        msgs = dfa_netlink.dump_addrs(sock=sock)
+        self.assertEqual([dfa_netlink.AddrMsg(socket.AF_INET, 24, 3,
+                                              '10.0.0.1', None)], msgs)
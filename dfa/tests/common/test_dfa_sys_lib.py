@@ -0,0 +1,407 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import mock
+
+from dfa.common import constants
+from dfa.common import dfa_netlink
+from dfa.common import dfa_sys_lib
+from neutron.tests import base
+
+TAP_UUID = '0000-1111-2222-3333'
+
+SCRIPTS = {
+    'sleep': 'exec sleep 30\n',
+    'stubborn': "trap '' TERM\nexec sleep 30\n",
+    'fail': 'echo out\necho err >&2\nexit 3\n',
+    'cat': 'exec cat\n',
+}
+
+
+def _update(action, *rows):
+    '''Return an update the way ovsdb-client monitor prints it.'''
+
+    return json.dumps({'headings': ['row', 'action', 'name', 'ofport'],
+                       'data': [['uuid-%s' % name, action, name, ofport]
+                                for name, ofport in rows]})
+
+
+# name: (ifindex, operstate, physical, bond master)
+SYSFS_LINKS = {
+    'lo': (1, 'unknown', False, None),
+    'eth0': (2, 'up', True, None),
+    'eth1': (3, 'down', True, None),
+    'eth2': (4, 'up', True, 'bond0'),
+    'eth3': (5, 'up', True, 'bond0'),
+    'bond0': (6, 'up', False, None),
+}
+
+
+def _link_msg(name, index, up, master=None):
+    return dfa_netlink.LinkMsg(dfa_netlink.RTM_NEWLINK, index, name, 0, master,
+                               dfa_netlink.IF_OPER_UP if up else 2)
+
+
+class FakeOvsdb(object):
+
+    """Answers the ovs-vsctl commands and counts them."""
+
+    def __init__(self):
+        self.ofports = {'eth2': 1, 'patch-int': 2, 'tap1': 3}
+        self.tags = {'tap1': 10}
+        self.calls = 0
+
+    def execute(self, cmd, root_helper=None, **kwargs):
+        self.calls += 1
+        if cmd[2] == 'list-ports':
+            return '\n'.join(sorted(self.ofports)) + '\n'
+        if 'find' in cmd:
+            return 'name                : "tap1"\n'
+        if cmd[2:5] == ['get', 'Interface', cmd[4]]:
+            return '%s\n' % self.ofports.get(cmd[4], '[]')
+        if cmd[2:5] == ['get', 'port', cmd[4]]:
+            return '%s\n' % self.tags.get(cmd[4], '[]')
+        return ''
+
+
+class OvsPortCacheTest(base.BaseTestCase):
+    """Test the caching of the port lookups of a bridge."""
+
+    def setUp(self):
+        super(OvsPortCacheTest, self).setUp()
+        self.ovsdb = FakeOvsdb()
+        exec_patcher = mock.patch.object(dfa_sys_lib, 'execute',
+                                         side_effect=self.ovsdb.execute)
+        exec_patcher.start()
+        self.addCleanup(exec_patcher.stop)
+        self.br = dfa_sys_lib.OVSBridge('br-ethd', 'sudo')
+
+    def _lookup_all(self):
+        return (self.br.get_port_ofport('eth2'),
+                self.br.get_port_vlan_tag('tap1'),
+                self.br.get_ofport_name(TAP_UUID),
+                self.br.get_port_name_list())
+
+    def _start_monitor(self):
+        with mock.patch.object(dfa_sys_lib.OvsdbMonitor, 'start',
+                               return_value=True):
+            self.assertTrue(self.br.start_port_monitor())
+        monitors = dict((monitor.table, monitor)
+                        for monitor in self.br._port_monitors)
+        for monitor in monitors.values():
+            monitor.process(_update('initial', ('eth2', 1)))
+        return monitors
+
+    def test_not_monitored(self):
+        """Test every lookup runs ovs-vsctl without a monitor."""
+
+        expected = ('1', '10', 'tap1', ['eth2', 'patch-int', 'tap1'])
+        self.assertEqual(expected, self._lookup_all())
+        self.assertEqual(expected, self._lookup_all())
+        self.assertEqual(8, self.ovsdb.calls)
+
+    def test_cached_lookups(self):
+        """Test the lookups are cached and invalidated by the monitor."""
+
+        monitors = self._start_monitor()
+        for i in range(10):
+            self.assertEqual(('1', '10', 'tap1',
+                              ['eth2', 'patch-int', 'tap1']),
+                             self._lookup_all())
+        self.assertEqual(4, self.ovsdb.calls)
+
+        # tap1 is retagged by another agent.
+        self.ovsdb.tags['tap1'] = 11
+        monitors['Port'].process(_update('new', ('tap1', 3)))
+        self.assertEqual('1', self.br.get_port_ofport('eth2'))
+        self.assertEqual('11', self.br.get_port_vlan_tag('tap1'))
+        self.assertEqual('tap1', self.br.get_ofport_name(TAP_UUID))
+        self.assertEqual(6, self.ovsdb.calls)
+
+        # Failed lookups are not cached.
+        self.br.get_port_ofport('tap2')
+        self.br.get_port_ofport('tap2')
+        self.assertEqual(8, self.ovsdb.calls)
+
+    def test_invalidate_during_lookup(self):
+        """Test a lookup racing with an invalidation is not cached."""
+
+        monitors = self._start_monitor()
+
+        def retag(cmd, **kwargs):
+            # tap1 is retagged while its old tag is being read.
+            ret = self.ovsdb.execute(cmd, **kwargs)
+            self.ovsdb.tags['tap1'] = 11
+            monitors['Port'].process(_update('new', ('tap1', 3)))
+            return ret
+
+        with mock.patch.object(dfa_sys_lib, 'execute', side_effect=retag):
+            self.assertEqual('10', self.br.get_port_vlan_tag('tap1'))
+        self.assertEqual('11', self.br.get_port_vlan_tag('tap1'))
+
+    def test_wrapper_invalidates(self):
+        """Test the ports added and deleted through the bridge."""
+
+        self._start_monitor()
+        self.assertEqual(['eth2', 'patch-int', 'tap1'],
+                         self.br.get_port_name_list())
+        self.ovsdb.ofports['tap2'] = 4
+        self.assertEqual('4', self.br.add_port('tap2'))
+        self.assertEqual(['eth2', 'patch-int', 'tap1', 'tap2'],
+                         self.br.get_port_name_list())
+        del self.ovsdb.ofports['tap2']
+        self.br.delete_port('tap2')
+        self.assertEqual(constants.INVALID_OFPORT,
+                         self.br.get_port_ofport('tap2'))
+        self.assertEqual(['eth2', 'patch-int', 'tap1'],
+                         self.br.get_port_name_list())
+
+    def test_monitor_exit(self):
+        """Test nothing is cached once a monitor exits."""
+
+        monitors = self._start_monitor()
+        monitors['Interface']._proc = mock.Mock(
+            stdout=io.StringIO(u'%s\n\n' % _update('delete', ('tap1', 3))))
+        self.br.get_port_ofport('eth2')
+        self.br.get_port_ofport('tap1')
+        with mock.patch.object(self.br, 'invalidate_port_cache') as inval:
+            monitors['Interface'].run()
+        inval.assert_has_calls([mock.call('tap1'), mock.call()])
+        self.assertFalse(monitors['Interface'].is_running())
+        calls = self.ovsdb.calls
+        self.br.get_port_ofport('eth2')
+        self.br.get_port_ofport('eth2')
+        self.assertEqual(calls + 2, self.ovsdb.calls)
+
+
+class FakeRootwrapClient(object):
+
+    """Runs the commands locally, the way the rootwrap daemon would."""
+
+    def __init__(self, daemon_cmd):
+        self.daemon_cmd = daemon_cmd
+        self.cmds = []
+        self.delay = 0
+
+    def execute(self, cmd, stdin=None):
+        self.cmds.append(cmd)
+        time.sleep(self.delay)
+        obj, cmd = dfa_sys_lib.create_process(cmd)
+        out, err = obj.communicate(stdin)
+        return obj.returncode, out, err
+
+
+class ExecuteTest(base.BaseTestCase):
+    """Test the timeouts of execute with fake scripts."""
+
+    def setUp(self):
+        super(ExecuteTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.scripts = {}
+        for name, body in SCRIPTS.items():
+            path = os.path.join(self.tmpdir, name)
+            with open(path, 'w') as script:
+                script.write('#!/bin/sh\n' + body)
+            os.chmod(path, 0o755)
+            self.scripts[name] = path
+        opts_patcher = mock.patch.dict(dfa_sys_lib._exec_opts,
+                                       {'kill_grace': 0.5})
+        opts_patcher.start()
+        self.addCleanup(opts_patcher.stop)
+        self.addCleanup(dfa_sys_lib.set_exec_opts, root_helper_daemon=None)
+
+    def _assert_timeout(self, script, timeout, max_time):
+        start = time.time()
+        self.assertRaises(dfa_sys_lib.ProcessTimeout, dfa_sys_lib.execute,
+                          [self.scripts[script]], timeout=timeout)
+        self.assertLess(time.time() - start, max_time)
+
+    def test_timeout(self):
+        """Test a command that sleeps is terminated."""
+
+        self._assert_timeout('sleep', 0.2, 2)
+        dfa_sys_lib.set_exec_opts(timeout=0.2)
+        self._assert_timeout('sleep', None, 2)
+
+    def test_timeout_kill(self):
+        """Test a command that ignores SIGTERM is killed."""
+
+        self._assert_timeout('stubborn', 0.2, 3)
+
+    def test_fail(self):
+        """Test the output and exit code of a failing command."""
+
+        exc = self.assertRaises(RuntimeError, dfa_sys_lib.execute,
+                                [self.scripts['fail']], timeout=5)
+        self.assertNotIsInstance(exc, dfa_sys_lib.ProcessTimeout)
+        self.assertIn('Exit code: 3', str(exc))
+        out, err = dfa_sys_lib.execute([self.scripts['fail']], timeout=5,
+                                       check_exit_code=False,
+                                       return_stderr=True)
+        self.assertEqual(('out\n', 'err\n'), (out, err))
+        self.assertEqual('abc', dfa_sys_lib.execute(
+            [self.scripts['cat']], process_input='abc', timeout=5))
+
+    def test_rootwrap_daemon(self):
+        """Test the commands with a root_helper go to the rootwrap daemon.
+        """
+        client_mod = mock.Mock()
+        client_mod.Client.side_effect = FakeRootwrapClient
+        rootwrap_mod = mock.Mock(client=client_mod)
+        with mock.patch.dict(sys.modules, {'oslo_rootwrap': rootwrap_mod,
+                                           'oslo_rootwrap.client':
+                                           client_mod}), \
+                mock.patch.object(dfa_sys_lib, 'subprocess_popen',
+                                  wraps=dfa_sys_lib.subprocess_popen) as popen:
+            dfa_sys_lib.set_exec_opts(
+                root_helper_daemon='sudo rootwrap-daemon rootwrap.conf')
+            self.assertEqual('abc', dfa_sys_lib.execute(
+                [self.scripts['cat']], root_helper='sudo',
+                process_input='abc'))
+            self.assertEqual('abc', dfa_sys_lib.execute(
+                [self.scripts['cat']], root_helper='sudo',
+                process_input='abc'))
+            client = dfa_sys_lib._rootwrap_client
+            self.assertEqual(['sudo', 'rootwrap-daemon', 'rootwrap.conf'],
+                             client.daemon_cmd)
+            self.assertEqual([[self.scripts['cat']]] * 2, client.cmds)
+            self.assertEqual(1, client_mod.Client.call_count)
+            # The rootwrap daemon does not add the root_helper.
+            self.assertEqual([self.scripts['cat']],
+                             list(popen.call_args[0][0]))
+
+            self.assertRaises(RuntimeError, dfa_sys_lib.execute,
+                              [self.scripts['fail']], root_helper='sudo')
+            client.delay = 1
+            start = time.time()
+            self.assertRaises(dfa_sys_lib.ProcessTimeout,
+                              dfa_sys_lib.execute, [self.scripts['cat']],
+                              root_helper='sudo', timeout=0.2)
+            self.assertLess(time.time() - start, 0.9)
+
+
+class SysfsNetTest(base.BaseTestCase):
+    """Test the interface helpers against a fake sysfs tree."""
+
+    def setUp(self):
+        super(SysfsNetTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        net_dir = os.path.join(self.tmpdir, 'net')
+        bond_dir = os.path.join(self.tmpdir, 'bonding')
+        os.makedirs(bond_dir)
+        for name, (index, state, phy, master) in SYSFS_LINKS.items():
+            intf_dir = os.path.join(net_dir, name)
+            os.makedirs(intf_dir)
+            self._write(intf_dir, 'ifindex', '%d\n' % index)
+            self._write(intf_dir, 'operstate', state + '\n')
+            if phy:
+                os.mkdir(os.path.join(intf_dir, 'device'))
+            if master:
+                os.symlink(os.path.join('..', master),
+                           os.path.join(intf_dir, 'master'))
+        os.mkdir(os.path.join(net_dir, 'bond0', 'bonding'))
+        self._write(net_dir, 'bond0/bonding/slaves', 'eth2 eth3\n')
+        self._write(bond_dir, 'bond0', '')
+        for attr, path in (('SYSFS_NET_DIR', net_dir),
+                           ('PROC_BONDING_DIR', bond_dir)):
+            patcher = mock.patch.object(dfa_sys_lib, attr, path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.dump_links = self._patch_netlink('dump_links')
+        self.dump_addrs = self._patch_netlink('dump_addrs')
+
+    def _write(self, path, name, content):
+        with open(os.path.join(path, name), 'w') as fd:
+            fd.write(content)
+
+    def _patch_netlink(self, name):
+        patcher = mock.patch.object(dfa_netlink, name,
+                                    side_effect=socket.error('no netlink'))
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_sysfs(self):
+        """Test the helpers read sysfs when rtnetlink fails."""
+
+        self.assertEqual(['eth0', 'eth2', 'eth3'],
+                         sorted(dfa_sys_lib.get_all_run_phy_intf()))
+        self.assertTrue(dfa_sys_lib.is_intf_up('eth0'))
+        self.assertFalse(dfa_sys_lib.is_intf_up('eth1'))
+        self.assertEqual('bond0', dfa_sys_lib.get_bond_intf('eth2'))
+        self.assertIsNone(dfa_sys_lib.get_bond_intf('eth0'))
+        self.assertIsNone(dfa_sys_lib.get_bond_intf('bond0'))
+        self.assertTrue(dfa_sys_lib.is_intf_bond('bond0'))
+        self.assertFalse(dfa_sys_lib.is_intf_bond('eth2'))
+        self.assertEqual('eth2 eth3', dfa_sys_lib.get_member_ports('bond0'))
+        self.assertIsNone(dfa_sys_lib.get_member_ports('eth2'))
+        # Only the failed dump of get_all_run_phy_intf.
+        self.assertEqual(1, self.dump_links.call_count)
+
+    def test_netlink_states(self):
+        """Test the state of the interfaces is taken from one dump."""
+
+        self.dump_links.side_effect = None
+        self.dump_links.return_value = [
+            _link_msg('eth0', 2, False), _link_msg('eth1', 3, True),
+            _link_msg('eth2', 4, True, 6), _link_msg('bond0', 6, True)]
+        # eth3 is missing from the dump, its state is read from sysfs.
+        self.assertEqual(['eth1', 'eth2', 'eth3'],
+                         sorted(dfa_sys_lib.get_all_run_phy_intf()))
+        self.assertEqual(1, self.dump_links.call_count)
+
+    def test_netlink_fallback(self):
+        """Test the interfaces missing from sysfs are found in rtnetlink."""
+
+        self.dump_links.side_effect = None
+        self.dump_links.return_value = [
+            _link_msg('eth8', 8, True, 7), _link_msg('eth9', 9, False, 7),
+            _link_msg('bond1', 7, True)]
+        self.assertTrue(dfa_sys_lib.is_intf_up('eth8'))
+        self.assertFalse(dfa_sys_lib.is_intf_up('eth9'))
+        self.assertFalse(dfa_sys_lib.is_intf_up('eth10'))
+        self._write(dfa_sys_lib.PROC_BONDING_DIR, 'bond1', '')
+        self.assertEqual('bond1', dfa_sys_lib.get_bond_intf('eth9'))
+        self.assertEqual('eth8 eth9', dfa_sys_lib.get_member_ports('bond1'))
+
+    def test_ipv4_addr(self):
+        """Test the IPv4 address from rtnetlink, then from netifaces."""
+
+        self.dump_addrs.side_effect = None
+        self.dump_addrs.return_value = [
+            dfa_netlink.AddrMsg(socket.AF_INET, 8, 1, '127.0.0.1', 'lo'),
+            dfa_netlink.AddrMsg(socket.AF_INET, 24, 2, '10.0.0.1', 'eth0')]
+        self.assertEqual('10.0.0.1', dfa_sys_lib.get_intf_ipv4_addr('eth0'))
+        self.assertTrue(dfa_sys_lib.is_phy_intf_ipv4_cfgd('eth0'))
+        self.assertFalse(dfa_sys_lib.is_phy_intf_ipv4_cfgd('eth1'))
+
+        self.dump_addrs.side_effect = socket.error('no netlink')
+        with mock.patch.object(dfa_sys_lib, 'netifaces') as netifaces:
+            netifaces.ifaddresses.return_value = {
+                netifaces.AF_INET: [{'addr': '10.0.0.2'}]}
+            self.assertEqual('10.0.0.2',
+                             dfa_sys_lib.get_intf_ipv4_addr('eth1'))
+        netifaces.ifaddresses.assert_called_once_with('eth1')
@@ -0,0 +1,66 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import mock
+import sqlalchemy as sa
+
+from neutron.tests import base
+
+from dfa.common import utils
+from dfa.db import dfa_db_api as db
+from dfa.db import dfa_db_models as dbm
+
+
+class FakeDfaDb(dbm.DfaDBMixin):
+    """DB mixin on an in-memory SQLite database."""
+
+    def __init__(self, cfg):
+        db.configure_db(cfg)
+        dbm.Base.metadata.create_all(db.get_session().bind)
+
+
+class DfaDbTestCase(base.BaseTestCase):
+    """Base class of the test cases run on an in-memory SQLite database."""
+
+    def setUp(self):
+        super(DfaDbTestCase, self).setUp()
+        session_patcher = mock.patch.object(db, 'DFA_db_session', None)
+        session_patcher.start()
+        self.addCleanup(session_patcher.stop)
+        self.cfg = utils.Dict2Obj({'dfa_mysql': {'connection': 'sqlite://'}})
+        self.dfa_db = FakeDfaDb(self.cfg)
+
+    def _query_plan(self, query):
+        session = db.get_session()
+        stmt = query.statement.compile(dialect=session.bind.dialect,
+                                       compile_kwargs={'literal_binds': True})
+        rows = session.execute('EXPLAIN QUERY PLAN %s' % stmt).fetchall()
+        return ' '.join(str(row[-1]) for row in rows)
+
+    def _count_queries(self):
+        """Return the list of statements run on the DB from now on."""
+
+        stmts = []
+
+        def before_execute(conn, cursor, statement, *args):
+            stmts.append(statement)
+
+        engine = db.get_session().bind
+        sa.event.listen(engine, 'before_cursor_execute', before_execute)
+        self.addCleanup(sa.event.remove, engine, 'before_cursor_execute',
+                        before_execute)
+        return stmts
@@ -0,0 +1,184 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import datetime
+
+from dfa.db import dfa_db_views as db_views
+from dfa.tests.db import db_base
+
+
+NUM_TENANTS = 3
+NETS_PER_TENANT = 4
+VMS_PER_NET = 5
+
+
+class TestDfaDBViews(db_base.DfaDbTestCase):
+    """Test that the read views give the same results as the DB queries."""
+
+    def setUp(self):
+        super(TestDfaDBViews, self).setUp()
+        self.views = db_views.get_views()
+        self.views.reset()
+        self.addCleanup(self.views.reset)
+
+    def _tenant_id(self, tnum):
+        return 'tenant-%d' % tnum
+
+    def _net_id(self, tnum, nnum):
+        return 'net-%d-%d' % (tnum, nnum)
+
+    def _port_id(self, tnum, nnum, vnum):
+        return 'port-%d-%d-%d' % (tnum, nnum, vnum)
+
+    def _populate(self, tenants):
+        for tnum in tenants:
+            tid = self._tenant_id(tnum)
+            self.dfa_db.add_project_db(tid, 'proj%d' % tnum, tnum, 'SUCCESS')
+            for nnum in range(NETS_PER_TENANT):
+                net_id = self._net_id(tnum, nnum)
+                net_data = dict(name='net%d' % nnum, tenant_id=tid,
+                                segmentation_id=tnum * 100 + nnum,
+                                config_profile='defaultNetworkL2Profile',
+                                vlan=nnum, fwd_mod='proxy-gateway',
+                                mob_domain_name='md0')
+                self.dfa_db.add_network_db(net_id, net_data, 'openstack',
+                                           'SUCCESS')
+                for vnum in range(VMS_PER_NET):
+                    vm_data = dict(status='up', net_uuid=net_id,
+                                   port_uuid=self._port_id(tnum, nnum, vnum),
+                                   vm_mac='fa:16:3e:00:%02x:%02x' % (
+                                       nnum, vnum),
+                                   segmentation_id=tnum * 100 + nnum,
+                                   host='host%d' % (vnum % 2),
+                                   oui=dict(vm_uuid='vm-%d' % vnum,
+                                            vm_name='vm%d' % vnum,
+                                            ip_addr='10.%d.%d.%d' % (
+                                                tnum, nnum, vnum),
+                                            fwd_mod='proxy-gateway',
+                                            gw_mac='20:20:00:00:00:aa'))
+                    self.dfa_db.add_vms_db(vm_data, 'SUCCESS')
+
+    def _modify(self):
+        self.dfa_db.update_network_db(self._net_id(0, 1), 'CREATE:FAIL')
+        self.dfa_db.update_network(self._net_id(1, 0),
+                                   columns={'vlan': 99, 'name': 'renamed'})
+        self.dfa_db.delete_network_db(self._net_id(2, 3))
+        self.dfa_db.update_vm_db(self._port_id(0, 0, 0),
+                                 columns={'host': 'host9', 'vdp_vlan': 3000,
+                                          'local_vlan': 7})
+        self.dfa_db.delete_vm_db(self._port_id(1, 1, 1))
+        self.dfa_db.update_project_entry(self._tenant_id(1), 12, 'UPDATE')
+        self.dfa_db.del_project_db(self._tenant_id(2))
+        hb = datetime.datetime(2015, 1, 1)
+        self.dfa_db.update_agent_db(dict(host='host0', timestamp=hb,
+                                         config='{}'))
+        self.dfa_db.update_agent_configurations('host0', '{"uplink": "e1"}')
+
+    def _sorted(self, rows, key):
+        return sorted(rows, key=lambda r: r[key])
+
+    def _compare(self):
+        net_filters = [{}, {'name': 'net1'}, {'id': self._net_id(1, 2)},
+                       {'tenant_id': self._tenant_id(1)},
+                       {'tenant_name': 'proj0'}, {'name': 'renamed'},
+                       {'name': 'net2', 'tenant_name': 'proj1'}]
+        for filters in net_filters:
+            db_rows = [db_views.row_to_dict(n)
+                       for n in self.dfa_db.get_network_by_filters(filters)]
+            version, view_rows = self.views.get_networks(filters)
+            self.assertEqual(self._sorted(db_rows, 'network_id'),
+                             self._sorted(view_rows, 'network_id'))
+
+        vm_filters = [{}, {'name': 'vm1'}, {'seg_id': 101},
+                      {'host': 'host1'}, {'host': 'host9'},
+                      {'vdp_vlan': 3000}, {'local_vlan': 7},
+                      {'port': self._port_id(0, 1, 2)},
+                      {'network_name': 'net3'},
+                      {'tenant_id': self._tenant_id(0)},
+                      {'tenant_name': 'proj1'},
+                      {'host': 'host0', 'tenant_name': 'proj0'}]
+        for filters in vm_filters:
+            db_rows = [db_views.row_to_dict(v)
+                       for v in self.dfa_db.get_vms_by_filters(filters)]
+            version, view_rows = self.views.get_vms(filters)
+            self.assertEqual(self._sorted(db_rows, 'port_id'),
+                             self._sorted(view_rows, 'port_id'))
+
+        for name, tenant_id in ((None, None), ('proj1', None),
+                                (None, self._tenant_id(0))):
+            db_rows = [db_views.row_to_dict(p) for p in
+                       self.dfa_db.get_project_by_filters(name, tenant_id)]
+            version, view_rows = self.views.get_projects(name, tenant_id)
+            self.assertEqual(self._sorted(db_rows, 'id'),
+                             self._sorted(view_rows, 'id'))
+
+        db_rows = [db_views.row_to_dict(a)
+                   for a in self.dfa_db.get_agents_by_filters(None)]
+        version, view_rows = self.views.get_agents()
+        self.assertEqual(self._sorted(db_rows, 'host'),
+                         self._sorted(view_rows, 'host'))
+
+    def test_views_load_from_db(self):
+        """Test views loaded from an already populated DB."""
+
+        self._populate(range(NUM_TENANTS))
+        self._modify()
+        self.assertFalse(self.views.loaded)
+        self.assertTrue(self.dfa_db.db_views.loaded)
+        self._compare()
+
+    def test_views_updated_by_db_writes(self):
+        """Test views that are updated by the DB write methods."""
+
+        self._populate([0])
+        self.views.load(self.dfa_db)
+        version = self.views.version
+        self._populate(range(1, NUM_TENANTS))
+        self._modify()
+        self.assertTrue(self.views.version > version)
+        self._compare()
+
+    def test_views_failed_write(self):
+        """Test a write that fails in DB is not applied to the views."""
+
+        self._populate([0])
+        self.views.load(self.dfa_db)
+        net_id = self._net_id(0, 0)
+        net_data = dict(name='dup', tenant_id=self._tenant_id(0),
+                        segmentation_id=999)
+        self.assertRaises(Exception, self.dfa_db.add_network_db, net_id,
+                          net_data, 'openstack', 'SUCCESS')
+        version, nets = self.views.get_networks({'id': net_id})
+        self.assertEqual(['net0'], [net['name'] for net in nets])
+        self._compare()
+
+    def test_views_pagination(self):
+        """Test that pages of a view cover all the rows once."""
+
+        self._populate(range(NUM_TENANTS))
+        version, vms = self.dfa_db.db_views.get_vms({})
+        pages = []
+        offset = 0
+        while True:
+            page = db_views.paginate(vms, dict(offset=offset, limit=7),
+                                     'port_id')
+            pages.extend(page)
+            offset += len(page)
+            if len(page) < 7:
+                break
+        self.assertEqual(sorted(v['port_id'] for v in vms),
+                         [v['port_id'] for v in pages])
@@ -0,0 +1,81 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+from dfa.db import dfa_db_api as db
+from dfa.db import dfa_db_models as dbm
+from dfa.tests.db import db_base
+
+
+NUM_FW = 10000
+
+
+class TestDfaFwDb(db_base.DfaDbTestCase):
+    """Test the firewall lookups on a table with many firewalls."""
+
+    def setUp(self):
+        super(TestDfaFwDb, self).setUp()
+        session = db.get_session()
+        with session.begin(subtransactions=True):
+            session.execute(dbm.DfaFwInfo.__table__.insert(), [
+                dict(fw_id='fw-%d' % i, name='fw%d' % i,
+                     tenant_id='tenant-%d' % i,
+                     in_network_id='in-net-%d' % i,
+                     out_network_id='out-net-%d' % i,
+                     router_id='rtr-%d' % i,
+                     router_net_id='rtr-net-%d' % i,
+                     rules='{"rules": {}}', result='CREATED')
+                for i in range(NUM_FW)])
+
+    def test_fw_indexes(self):
+        """Test the lookup columns are indexed."""
+
+        session = db.get_session()
+        for col in ('tenant_id', 'in_network_id', 'out_network_id',
+                    'router_id', 'router_net_id'):
+            query = session.query(dbm.DfaFwInfo).filter(
+                getattr(dbm.DfaFwInfo, col) == 'x')
+            plan = self._query_plan(query)
+            self.assertIn('ix_firewall_%s' % col, plan)
+            self.assertNotIn('SCAN', plan)
+
+        query = session.query(dbm.DfaFwInfo).filter(
+            (dbm.DfaFwInfo.in_network_id == 'x') |
+            (dbm.DfaFwInfo.out_network_id == 'x'))
+        plan = self._query_plan(query)
+        self.assertIn('ix_firewall_in_network_id', plan)
+        self.assertIn('ix_firewall_out_network_id', plan)
+
+    def test_fw_lookups(self):
+        """Test the lookups return the right firewall."""
+
+        for i in (0, NUM_FW // 2, NUM_FW - 1):
+            fw_id = 'fw-%d' % i
+            self.assertEqual(fw_id, self.dfa_db.get_fw_by_netid(
+                'in-net-%d' % i).fw_id)
+            self.assertEqual(fw_id, self.dfa_db.get_fw_by_netid(
+                'out-net-%d' % i).fw_id)
+            self.assertEqual(fw_id, self.dfa_db.get_fw_by_rtr_netid(
+                'rtr-net-%d' % i).fw_id)
+            self.assertEqual(fw_id, self.dfa_db.get_fw_by_rtrid(
+                'rtr-%d' % i).fw_id)
+            self.assertEqual(fw_id, self.dfa_db.get_fw_by_tenant_id(
+                'tenant-%d' % i).get('fw_id'))
+
+        self.assertIsNone(self.dfa_db.get_fw_by_netid('no-net'))
+        self.assertIsNone(self.dfa_db.get_fw_by_rtr_netid('no-net'))
+        self.assertIsNone(self.dfa_db.get_fw_by_rtrid('no-rtr'))
+        self.assertIsNone(self.dfa_db.get_fw_by_tenant_id('no-tenant'))
@@ -0,0 +1,53 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import mock
+
+from dfa.common import constants as const
+from dfa.db import dfa_db_models as dbm
+from dfa.tests.db import db_base
+
+
+class TestDfaSegmentTypeDriver(db_base.DfaDbTestCase):
+    """Test the segment allocations held for a source."""
+
+    def setUp(self):
+        super(TestDfaSegmentTypeDriver, self).setUp()
+        init_patcher = mock.patch.object(dbm.DfaSegment, 'dfa_segment_init',
+                                         0)
+        init_patcher.start()
+        self.addCleanup(init_patcher.stop)
+        self.drvr = dbm.DfaSegmentTypeDriver(1000, 1009, const.RES_SEGMENT,
+                                             self.cfg)
+
+    def test_update_release_source(self):
+        """Test pooled segments are assigned or released by source."""
+
+        segs = [self.drvr.allocate_segmentation_id(None, source='Pool')
+                for i in range(3)]
+        self.assertEqual([1000, 1001, 1002], segs)
+        self.assertTrue(self.drvr.update_segmentation_id(segs[0], 'net1',
+                                                         source='Firewall'))
+        self.assertFalse(self.drvr.update_segmentation_id(1005, 'net2'))
+        self.assertEqual({'net1': 1000},
+                         self.drvr.get_seg_netid_src('Firewall'))
+
+        self.assertEqual(2, self.drvr.release_segmentation_id_src('Pool'))
+        self.assertEqual(0, self.drvr.release_segmentation_id_src('Pool'))
+        self.assertEqual(1001, self.drvr.allocate_segmentation_id('net3'))
+        self.assertEqual({'net1': 1000},
+                         self.drvr.get_seg_netid_src('Firewall'))
@@ -0,0 +1,133 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import mock
+
+from dfa.common import constants as const
+from dfa.db import dfa_db_api as db
+from dfa.db import dfa_db_models as dbm
+from dfa.tests.db import db_base
+
+
+class TestDfasubnetDriver(db_base.DfaDbTestCase):
+    """Test the service subnet pool against the DB."""
+
+    def setUp(self):
+        super(TestDfasubnetDriver, self).setUp()
+        init_patcher = mock.patch.object(dbm.DfaInSubnet,
+                                         'dfa_in_subnet_init', 0)
+        init_patcher.start()
+        self.addCleanup(init_patcher.stop)
+
+    def _get_driver(self, start, end):
+        return dbm.DfasubnetDriver(start, end, const.RES_IN_SUBNET)
+
+    def _db_allocated(self):
+        session = db.get_session()
+        return dict((row.subnet_address, row.network_id) for row in
+                    session.query(dbm.DfaInServiceSubnet).filter_by(
+                        allocated=True))
+
+    def test_allocate_release(self):
+        """Test allocation and release are written through to DB."""
+
+        drvr = self._get_driver('100.100.0.0/24', '100.100.10.0/24')
+        excl = ['100.100.0.0', '100.100.2.0', '192.168.1.0']
+        sub1 = drvr.allocate_subnet(excl, net_id='net1')
+        sub2 = drvr.allocate_subnet(excl)
+        self.assertEqual('100.100.1.0', sub1)
+        self.assertEqual('100.100.3.0', sub2)
+        drvr.update_subnet(sub2, 'net2', 'subnet2')
+        self.assertEqual({sub1: 'net1', sub2: 'net2'}, self._db_allocated())
+        self.assertEqual(sub2, drvr.get_subnet_by_netid('net2'))
+        self.assertEqual(sub1, drvr.get_subnet(sub1).subnet_address)
+
+        drvr.release_subnet_by_netid('net1')
+        self.assertIsNone(drvr.get_subnet_by_netid('net1'))
+        self.assertIsNone(drvr.get_subnet(sub1))
+        self.assertEqual([sub2], list(self._db_allocated()))
+        drvr.release_subnet(sub2)
+        self.assertEqual({}, self._db_allocated())
+        self.assertEqual('100.100.0.0', drvr.allocate_subnet([]))
+
+        # A new driver loads the allocations from DB.
+        drvr2 = self._get_driver('100.100.0.0/24', '100.100.10.0/24')
+        self.assertEqual('100.100.1.0', drvr2.allocate_subnet([]))
+
+    def test_pool_exhausted(self):
+        """Test allocation fails when the pool is used up."""
+
+        drvr = self._get_driver('100.100.0.0/24', '100.100.4.0/24')
+        subs = [drvr.allocate_subnet(['100.100.3.0']) for i in range(3)]
+        self.assertEqual(['100.100.0.0', '100.100.1.0', '100.100.2.0'], subs)
+        self.assertIsNone(drvr.allocate_subnet(['100.100.3.0']))
+
+    def test_allocated_in_db_by_other(self):
+        """Test a subnet allocated in DB behind the pool is skipped."""
+
+        drvr = self._get_driver('100.100.0.0/24', '100.100.4.0/24')
+        session = db.get_session()
+        with session.begin(subtransactions=True):
+            session.query(dbm.DfaInServiceSubnet).filter_by(
+                subnet_address='100.100.0.0').update({'allocated': True})
+        self.assertEqual('100.100.1.0', drvr.allocate_subnet([]))
+
+    def test_allocate_benchmark(self):
+        """Benchmark allocation of /24 subnets from a /8 pool."""
+
+        drvr = self._get_driver('10.0.0.0/24', '11.0.0.0/24')
+        self.assertEqual(1 << 16, drvr.pool.size)
+        # The first half of the pool is allocated, the next subnets are in
+        # use by openstack.
+        used = ['10.%d.%d.0' % (i, j) for i in range(128) for j in range(256)]
+        excl = ['10.%d.%d.0' % (i, j) for i in range(128, 130)
+                for j in range(256)]
+        session = db.get_session()
+        with session.begin(subtransactions=True):
+            for cnt in range(0, len(used), 500):
+                session.query(dbm.DfaInServiceSubnet).filter(
+                    dbm.DfaInServiceSubnet.subnet_address.in_(
+                        used[cnt:cnt + 500])).update(
+                            {'allocated': True}, synchronize_session=False)
+        stmts = self._count_queries()
+        drvr = self._get_driver('10.0.0.0/24', '11.0.0.0/24')
+        # The pool is loaded with one query of the allocated subnets.
+        self.assertEqual(1, len(stmts))
+        self.assertTrue(stmts[0].startswith('SELECT'))
+
+        num_alloc = 2000
+        del stmts[:]
+        subs = [drvr.allocate_subnet(excl, net_id='net%d' % i)
+                for i in range(num_alloc)]
+        self.assertEqual(num_alloc, len(set(subs)))
+        self.assertFalse(set(subs) & set(excl))
+        self.assertEqual('10.130.0.0', subs[0])
+        # Allocation does one DB update by the subnet address index, with
+        # no scan of the pool.
+        self.assertEqual(num_alloc, len(stmts))
+        self.assertTrue(all(stmt.startswith('UPDATE') for stmt in stmts))
+        session = db.get_session()
+        plan = self._query_plan(session.query(
+            dbm.DfaInServiceSubnet).filter_by(subnet_address=subs[0],
+                                              allocated=False))
+        self.assertIn('(subnet_address=?)', plan)
+
+        # Lookups do not go to DB.
+        del stmts[:]
+        for i in range(num_alloc):
+            self.assertEqual(subs[i], drvr.get_subnet_by_netid('net%d' % i))
+        self.assertEqual([], stmts)
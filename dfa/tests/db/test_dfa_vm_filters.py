@@ -0,0 +1,136 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import time
+
+from dfa.db import dfa_db_api as db
+from dfa.db import dfa_db_models as dbm
+from dfa.tests.db import db_base
+
+
+NUM_TENANTS = 100
+NETS_PER_TENANT = 10
+VMS_PER_NET = 100
+NUM_HOSTS = 500
+
+
+class TestDfaVmFilters(db_base.DfaDbTestCase):
+    """Test the VM and network filters on a database with 100k VMs."""
+
+    def setUp(self):
+        super(TestDfaVmFilters, self).setUp()
+        tenants = []
+        nets = []
+        vms = []
+        for tnum in range(NUM_TENANTS):
+            tid = 'tenant-%d' % tnum
+            tenants.append(dict(id=tid, name='proj%d' % tnum, dci_id=0,
+                                result='SUCCESS'))
+            for nnum in range(NETS_PER_TENANT):
+                net_id = 'net-%d-%d' % (tnum, nnum)
+                seg_id = 10000 + tnum * NETS_PER_TENANT + nnum
+                nets.append(dict(network_id=net_id, name='net%d' % nnum,
+                                 tenant_id=tid, segmentation_id=seg_id,
+                                 result='SUCCESS'))
+                for vnum in range(VMS_PER_NET):
+                    vms.append(dict(port_id='port-%d-%d-%d' % (tnum, nnum,
+                                                               vnum),
+                                    name='vm%d' % vnum, network_id=net_id,
+                                    segmentation_id=seg_id,
+                                    host='host%d' % (len(vms) % NUM_HOSTS),
+                                    result='SUCCESS'))
+        session = db.get_session()
+        with session.begin(subtransactions=True):
+            session.execute(dbm.DfaTenants.__table__.insert(), tenants)
+            session.execute(dbm.DfaNetwork.__table__.insert(), nets)
+            session.execute(dbm.DfaVmInfo.__table__.insert(), vms)
+
+    def _port_ids(self, vms):
+        return sorted(vm.port_id for vm in vms)
+
+    def test_filter_results(self):
+        """Test the filters, alone and combined."""
+
+        vms = self.dfa_db.get_vms_by_filters({'host': 'host7'})
+        self.assertEqual(NUM_TENANTS * NETS_PER_TENANT * VMS_PER_NET //
+                         NUM_HOSTS, len(vms))
+        self.assertTrue(all(vm.host == 'host7' for vm in vms))
+
+        vms = self.dfa_db.get_vms_by_filters({'network_name': 'net3',
+                                              'tenant_id': 'tenant-5'})
+        self.assertEqual(['port-5-3-%d' % v for v in range(VMS_PER_NET)],
+                         sorted(self._port_ids(vms),
+                                key=lambda p: int(p.split('-')[-1])))
+
+        vms = self.dfa_db.get_vms_by_filters({'tenant_name': 'proj9',
+                                              'name': 'vm4'})
+        self.assertEqual(['port-9-%d-4' % n for n in range(NETS_PER_TENANT)],
+                         self._port_ids(vms))
+
+        vms = self.dfa_db.get_vms_by_filters({'seg_id': 10011,
+                                              'host': 'host1100'})
+        self.assertEqual([], vms)
+
+        nets = self.dfa_db.get_network_by_filters({'tenant_name': 'proj2',
+                                                   'name': 'net1'})
+        self.assertEqual(['net-2-1'], [n.network_id for n in nets])
+        nets = self.dfa_db.get_network_by_filters({'tenant_id': 'tenant-3'})
+        self.assertEqual(NETS_PER_TENANT, len(nets))
+
+    def test_filter_indexes(self):
+        """Test the filtered queries do not scan the tables."""
+
+        session = db.get_session()
+        for clause in (dbm.DfaVmInfo.host == 'host1',
+                       dbm.DfaVmInfo.segmentation_id == 10001,
+                       dbm.DfaVmInfo.network_id == 'net-1-1'):
+            plan = self._query_plan(session.query(dbm.DfaVmInfo).filter(
+                clause))
+            self.assertIn('USING INDEX ix_instances_', plan)
+            self.assertNotIn('SCAN', plan)
+        for clause in (dbm.DfaNetwork.tenant_id == 'tenant-1',
+                       dbm.DfaNetwork.name == 'net1',
+                       dbm.DfaNetwork.segmentation_id == 10001):
+            plan = self._query_plan(session.query(dbm.DfaNetwork).filter(
+                clause))
+            self.assertIn('USING INDEX ix_networks_', plan)
+            self.assertNotIn('SCAN', plan)
+
+    def test_filter_benchmark(self):
+        """Compare the filtered queries with filtering all rows in Python."""
+
+        session = db.get_session()
+        start = time.time()
+        all_vms = session.query(dbm.DfaVmInfo).all()
+        expected = [vm.port_id for vm in all_vms if vm.host == 'host3']
+        fetch_all = time.time() - start
+        # Do not keep the 100k objects in the session identity map.
+        session.expunge_all()
+
+        # Ten filtered queries take less time than one full fetch.
+        start = time.time()
+        for cnt in range(10):
+            vms = self.dfa_db.get_vms_by_filters({'host': 'host3'})
+        self.assertLess(time.time() - start, fetch_all)
+        self.assertEqual(sorted(expected), self._port_ids(vms))
+
+        start = time.time()
+        for cnt in range(10):
+            vms = self.dfa_db.get_vms_by_filters({'tenant_name': 'proj42',
+                                                  'host': 'host42'})
+        self.assertLess(time.time() - start, fetch_all)
+        self.assertTrue(all(vm.host == 'host42' for vm in vms))
@@ -0,0 +1,436 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import threading
+import time
+
+import mock
+
+from neutron.tests import base
+
+from dfa.server.services.firewall.native import fabric_setup_base
+from dfa.server.services.firewall.native import fw_constants
+
+
+FAKE_TENANT_ID = 'aee5da7e699444889c662cf7ec1c8de7'
+FAKE_TENANT_NAME = 'test_dfa_project'
+FAKE_FW_ID = '7a6c6f7e-4e83-4b2d-9a0c-2b2f1e9b3a11'
+
+STATES = list(range(fw_constants.INIT_STATE,
+                    fw_constants.FABRIC_PREPARE_DONE_STATE + 1))
+
+# Latency in seconds of the fake DB allocations and Openstack calls.
+ALLOC_DELAY = 0.005
+LIST_SUBNETS_DELAY = 0.02
+FIND_SUBNET_DELAY = 0.001
+CREATE_NWK_DELAY = 0.01
+
+
+class FakeSteps(object):
+
+    """Step functions that record their calls and fail when told to."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = set()
+
+    def _step(self, oper, state):
+        def step_fn(tenant_id, fw_dict, is_fw_virt=False):
+            self.calls.append((oper, state))
+            if (oper, state) in self.fail:
+                self.fail.discard((oper, state))
+                raise Exception("Injected failure")
+            return True
+        return step_fn
+
+    def get_steps(self):
+        return tuple((state, self._step('create', state),
+                      self._step('delete', state)) for state in STATES)
+
+
+class FakeSegDriver(object):
+
+    """Segment or VLAN allocations with DB latency."""
+
+    def __init__(self, start):
+        self.next_seg = start
+        self.allocs = {}
+
+    def allocate_segmentation_id(self, net_id, seg_id=None, source=None):
+        time.sleep(ALLOC_DELAY)
+        seg = self.next_seg
+        self.next_seg += 1
+        self.allocs[seg] = (net_id, source)
+        return seg
+
+    def update_segmentation_id(self, seg_id, net_id, source=None):
+        self.allocs[seg_id] = (net_id, source)
+        return True
+
+    def release_segmentation_id(self, seg_id):
+        del self.allocs[seg_id]
+
+
+class FakeSubnetDriver(object):
+
+    """Subnet allocations with DB latency."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.next_sub = 0
+        self.allocs = {}
+
+    def allocate_subnet(self, subnet_lst, net_id=None):
+        time.sleep(ALLOC_DELAY)
+        subnet = '%s.%d.0' % (self.prefix, self.next_sub)
+        self.next_sub += 1
+        self.allocs[subnet] = net_id
+        return subnet
+
+    def update_subnet(self, subnet, net_id, subnet_id):
+        self.allocs[subnet] = net_id
+
+    def release_subnet(self, subnet):
+        del self.allocs[subnet]
+
+
+class FakeOsHelper(object):
+
+    """Openstack calls with latency."""
+
+    def __init__(self):
+        self.num_nwk = 0
+        self.fail = False
+        self.subnets = []
+
+    def get_all_subnets_cidr(self, no_mask=False):
+        time.sleep(LIST_SUBNETS_DELAY)
+        return [sub.split('/')[0] if no_mask else sub
+                for sub in self.subnets]
+
+    def is_subnet_present(self, subnet_addr):
+        time.sleep(FIND_SUBNET_DELAY)
+        return subnet_addr in self.subnets
+
+    def create_network(self, name, tenant_id, subnet, gw=None):
+        time.sleep(CREATE_NWK_DELAY)
+        if self.fail:
+            raise Exception("Create failed")
+        self.num_nwk += 1
+        return 'net-%d' % self.num_nwk, 'subnet-%d' % self.num_nwk
+
+
+class FabricSmTest(base.BaseTestCase):
+    """Test the create and delete SM resume from the failed step."""
+
+    def setUp(self):
+        super(FabricSmTest, self).setUp()
+        self.db_result = {}
+        append_patcher = mock.patch.object(
+            fabric_setup_base.ServiceIpSegTenantMap,
+            'append_state_final_result', side_effect=self._append_result)
+        append_patcher.start()
+        self.addCleanup(append_patcher.stop)
+        self._reset_sm()
+
+    def _reset_sm(self):
+        self.db_result.clear()
+        self.steps = FakeSteps()
+        self.fabric = self._get_fabric()
+
+    def _append_result(self, fw_id, result, state):
+        self.db_result[fw_id] = '%s(%d)' % (result, state)
+
+    def _get_fabric(self):
+        fabric = fabric_setup_base.FabricBase.__new__(
+            fabric_setup_base.FabricBase)
+        fabric.service_attr = {}
+        fabric.store_fabric_steps(self.steps.get_steps())
+        fabric.create_serv_obj(FAKE_TENANT_ID)
+        serv_obj = fabric.get_service_obj(FAKE_TENANT_ID)
+        serv_obj.create_fw_db(FAKE_FW_ID, 'fw', FAKE_TENANT_ID)
+        return fabric
+
+    def _restart(self):
+        # Populate the state from DB, like populate_local_cache_tenant.
+        self.fabric = self._get_fabric()
+        serv_obj = self.fabric.get_service_obj(FAKE_TENANT_ID)
+        compl_res = self.db_result[FAKE_FW_ID]
+        serv_obj.store_local_final_result(compl_res.split('(')[0])
+        state = self.fabric.pop_fw_state(compl_res, None, None)
+        serv_obj.store_state(state, popl_db=False)
+
+    def _run(self, oper):
+        del self.steps.calls[:]
+        fw_dict = {'tenant_name': FAKE_TENANT_NAME}
+        if oper == 'create':
+            return self.fabric.run_create_sm(FAKE_TENANT_ID, fw_dict, False)
+        return self.fabric.run_delete_sm(FAKE_TENANT_ID, fw_dict, False)
+
+    def _state(self):
+        return self.fabric.get_service_obj(FAKE_TENANT_ID).get_state()
+
+    def test_steps_table(self):
+        """Test the table has every state once, in order."""
+
+        fabric = fabric_setup_base.FabricBase.__new__(
+            fabric_setup_base.FabricBase)
+        steps = fabric.get_fabric_steps()
+        self.assertEqual(STATES, [step[0] for step in steps])
+        fabric.store_fabric_steps(steps)
+        self.assertEqual(fw_constants.OS_IN_NETWORK_STATE,
+                         fabric.get_next_create_state(
+                             fw_constants.INIT_STATE, True))
+        self.assertEqual(fw_constants.FABRIC_PREPARE_DONE_STATE,
+                         fabric.get_next_create_state(
+                             fw_constants.FABRIC_PREPARE_DONE_STATE, True))
+        self.assertEqual(fw_constants.INIT_STATE,
+                         fabric.get_next_del_state(
+                             fw_constants.INIT_STATE, True))
+        self.assertEqual(fw_constants.OS_IN_NETWORK_STATE,
+                         fabric.get_next_del_state(
+                             fw_constants.OS_IN_NETWORK_STATE, False))
+
+    def test_create_sm(self):
+        """Test the create SM runs every step once."""
+
+        self.assertTrue(self._run('create'))
+        self.assertEqual([('create', state) for state in STATES],
+                         self.steps.calls)
+        self.assertEqual(fw_constants.FABRIC_PREPARE_DONE_STATE,
+                         self._state())
+        self.assertEqual(fw_constants.RESULT_FW_CREATE_DONE,
+                         self.fabric.get_service_obj(
+                             FAKE_TENANT_ID).get_local_final_result())
+
+    def test_create_failure_every_step(self):
+        """Test a failed create step is resumed, after a restart too."""
+
+        for fail_state in STATES:
+            for restart in (False, True):
+                self._reset_sm()
+                self.steps.fail.add(('create', fail_state))
+                self.assertFalse(self._run('create'))
+                self.assertEqual([('create', state) for state in STATES
+                                  if state <= fail_state], self.steps.calls)
+                self.assertEqual(fail_state, self._state())
+                self.assertEqual('%s(%d)' % (
+                    fw_constants.RESULT_FW_CREATE_INIT, fail_state),
+                    self.db_result[FAKE_FW_ID])
+                if restart:
+                    self._restart()
+                self.assertTrue(self._run('create'))
+                self.assertEqual([('create', state) for state in STATES
+                                  if state >= fail_state], self.steps.calls)
+
+    def test_delete_failure_every_step(self):
+        """Test a failed delete step is resumed, after a restart too."""
+
+        for fail_state in STATES:
+            for restart in (False, True):
+                self._reset_sm()
+                self.assertTrue(self._run('create'))
+                self.steps.fail.add(('delete', fail_state))
+                self.assertFalse(self._run('delete'))
+                self.assertEqual([('delete', state) for state in
+                                  reversed(STATES) if state >= fail_state],
+                                 self.steps.calls)
+                self.assertEqual(fail_state, self._state())
+                self.assertEqual('%s(%d)' % (
+                    fw_constants.RESULT_FW_DELETE_INIT, fail_state),
+                    self.db_result[FAKE_FW_ID])
+                if restart:
+                    self._restart()
+                self.assertTrue(self._run('delete'))
+                self.assertEqual([('delete', state) for state in
+                                  reversed(STATES) if state <= fail_state],
+                                 self.steps.calls)
+                self.assertEqual(fw_constants.INIT_STATE, self._state())
+
+    def test_delete_after_failed_create(self):
+        """Test delete after a failed create undoes the completed steps."""
+
+        fail_state = fw_constants.DCNM_OUT_PART_STATE
+        self.steps.fail.add(('create', fail_state))
+        self.assertFalse(self._run('create'))
+        self.assertTrue(self._run('delete'))
+        self.assertEqual([('delete', state) for state in reversed(STATES)
+                          if state < fail_state], self.steps.calls)
+
+    def test_os_nwk_create_idempotent(self):
+        """Test the Openstack network is not created again on a retry."""
+
+        self.fabric.os_helper = mock.Mock()
+        serv_obj = self.fabric.get_service_obj(FAKE_TENANT_ID)
+        serv_obj.update_fw_dict({'in_network_id': 'in-net'})
+        fw_dict = {'tenant_name': FAKE_TENANT_NAME}
+        with mock.patch.object(self.fabric, 'get_network') as get_net, \
+                mock.patch.object(self.fabric,
+                                  '_create_os_nwk') as create_nwk:
+            self.assertTrue(self.fabric.create_os_in_nwk(FAKE_TENANT_ID,
+                                                         fw_dict))
+            get_net.assert_called_once_with('in-net')
+            self.assertFalse(create_nwk.called)
+            # The recorded network is gone, it is created again.
+            get_net.return_value = None
+            create_nwk.return_value = (None, None)
+            self.assertFalse(self.fabric.create_os_in_nwk(FAKE_TENANT_ID,
+                                                          fw_dict))
+            self.assertTrue(create_nwk.called)
+
+
+class FabricServicePoolTest(base.BaseTestCase):
+    """Test the service network resources taken from the pool."""
+
+    def setUp(self):
+        super(FabricServicePoolTest, self).setUp()
+        self.fabric = fabric_setup_base.FabricBase.__new__(
+            fabric_setup_base.FabricBase)
+        self.fabric.service_attr = {}
+        self.fabric.mask = 24
+        self.fabric.serv_host_prof = fw_constants.HOST_PROF
+        self.fabric.serv_host_mode = fw_constants.HOST_FWD_MODE
+        self.fabric.serv_ext_prof = fw_constants.EXT_PROF
+        self.fabric.serv_ext_mode = fw_constants.EXT_FWD_MODE
+        self.fabric.os_helper = FakeOsHelper()
+        self.fabric.service_segs = FakeSegDriver(20000)
+        self.fabric.service_vlans = FakeSegDriver(100)
+        self.fabric.service_in_ip = FakeSubnetDriver('100.100')
+        self.fabric.service_out_ip = FakeSubnetDriver('200.200')
+        self.fabric.service_pool = None
+        self.fabric.mutex_lock = threading.Lock()
+        self.num_tenant = 0
+
+    def _start_pool(self, size):
+        pool = fabric_setup_base.ServiceNwkPool(size,
+                                                self.fabric.alloc_pool_res,
+                                                self.fabric.release_pool_res)
+        self.fabric.service_pool = pool
+        pool.start()
+        self.addCleanup(pool.stop)
+        self._wait_full(size)
+        return pool
+
+    def _wait_full(self, size):
+        pool = self.fabric.service_pool
+        for i in range(500):
+            if (pool.get_depth('in') == size and
+                    pool.get_depth('out') == size):
+                return
+            time.sleep(0.01)
+        self.fail("Service pool not filled")
+
+    def _create_nwks(self, num):
+        start = time.time()
+        for i in range(num):
+            self.num_tenant += 1
+            tenant_id = 'tenant-%d' % self.num_tenant
+            self.fabric.create_serv_obj(tenant_id)
+            self.fabric.get_service_obj(tenant_id).create_fw_db(
+                'fw-id-%d' % self.num_tenant, 'fw', tenant_id)
+            for direc in ('in', 'out'):
+                net_id, subnet_id = self.fabric._create_os_nwk(
+                    tenant_id, FAKE_TENANT_NAME, direc)
+                self.assertIsNotNone(net_id)
+        return (time.time() - start) / num
+
+    def test_pool_resources_assigned(self):
+        """Test the pooled resources are assigned to the new network."""
+
+        self._start_pool(2)
+        seg_pool = set(self.fabric.service_segs.allocs)
+        self.assertEqual(4, len(seg_pool))
+        self.assertEqual(set([(None, fw_constants.FW_POOL_CONST)]),
+                         set(self.fabric.service_segs.allocs.values()))
+        self.assertEqual(set(['']), set(
+            self.fabric.service_in_ip.allocs.values()))
+        self._create_nwks(1)
+        serv_obj = self.fabric.get_service_obj('tenant-1')
+        in_net = serv_obj.get_dcnm_net_dict('in')
+        self.assertIn(in_net['segmentation_id'], seg_pool)
+        self.assertEqual(('net-1', fw_constants.FW_CONST),
+                         self.fabric.service_segs.allocs[
+                             in_net['segmentation_id']])
+        self.assertEqual(('net-1', fw_constants.FW_CONST),
+                         self.fabric.service_vlans.allocs[in_net['vlan_id']])
+        in_sub = serv_obj.get_dcnm_subnet_dict('in')['cidr'].split('/')[0]
+        self.assertEqual('net-1', self.fabric.service_in_ip.allocs[in_sub])
+        # The pool is refilled in the background.
+        self._wait_full(2)
+        self.assertEqual(6, len(self.fabric.service_segs.allocs))
+
+    def test_create_failure_releases(self):
+        """Test resources taken from the pool are released on failure."""
+
+        self._start_pool(1)
+        self.fabric.os_helper.fail = True
+        self.fabric.create_serv_obj(FAKE_TENANT_ID)
+        self.fabric.get_service_obj(FAKE_TENANT_ID).create_fw_db(
+            FAKE_FW_ID, 'fw', FAKE_TENANT_ID)
+        self.assertEqual((None, None), self.fabric._create_os_nwk(
+            FAKE_TENANT_ID, FAKE_TENANT_NAME, 'in'))
+        self._wait_full(1)
+        self.assertEqual(2, len(self.fabric.service_segs.allocs))
+        self.assertEqual(1, len(self.fabric.service_in_ip.allocs))
+
+    def test_pool_stop_releases(self):
+        """Test the pooled resources are released when the fabric stops."""
+
+        self._start_pool(3)
+        self.fabric.stop()
+        self.assertEqual({}, self.fabric.service_segs.allocs)
+        self.assertEqual({}, self.fabric.service_vlans.allocs)
+        self.assertEqual({}, self.fabric.service_out_ip.allocs)
+
+    def test_pool_subnet_used_by_os(self):
+        """Test a pooled subnet used by Openstack meanwhile is not taken."""
+
+        self._start_pool(2)
+        self.fabric.os_helper.subnets = ['100.100.0.0/24']
+        self._create_nwks(1)
+        serv_obj = self.fabric.get_service_obj('tenant-1')
+        in_sub = serv_obj.get_dcnm_subnet_dict('in')['cidr']
+        self.assertEqual('100.100.1.0/24', in_sub)
+        self.assertNotIn('100.100.0.0', self.fabric.service_in_ip.allocs)
+        self._wait_full(2)
+        # The resources pooled with the subnet are released too.
+        self.assertEqual(6, len(self.fabric.service_segs.allocs))
+
+    def test_pool_exhausted(self):
+        """Test a create falls back to allocation when the pool is empty."""
+
+        pool = fabric_setup_base.ServiceNwkPool(2, mock.Mock(
+            return_value=None), mock.Mock())
+        pool.fill()
+        self.assertEqual(0, pool.get_depth('in'))
+        self.assertIsNone(pool.get('in'))
+        self.fabric.service_pool = pool
+        self._create_nwks(1)
+        self.assertEqual(2, self.fabric.os_helper.num_nwk)
+
+    def test_create_latency(self):
+        """Measure the network create latency with a cold and warm pool."""
+
+        num = 5
+        cold = self._create_nwks(num)
+        self._start_pool(num)
+        warm = self._create_nwks(num)
+        # A cold create lists the Openstack subnets and allocates the
+        # subnet, segment and VLAN, a warm create only creates the network.
+        self.assertGreater(cold, 2 * (LIST_SUBNETS_DELAY + 3 * ALLOC_DELAY +
+                                      CREATE_NWK_DELAY))
+        self.assertLess(warm, cold / 2)
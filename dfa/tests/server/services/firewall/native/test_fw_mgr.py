@@ -0,0 +1,416 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import threading
+import time
+
+import mock
+
+from neutron.tests import base
+
+from dfa.server.services.firewall.native import fabric_setup_base
+from dfa.server.services.firewall.native import fw_constants
+from dfa.server.services.firewall.native import fw_mgr
+
+
+FAKE_TENANT_ID = 'aee5da7e699444889c662cf7ec1c8de7'
+FAKE_TENANT_NAME = 'test_dfa_project'
+FAKE_FW_ID = '7a6c6f7e-4e83-4b2d-9a0c-2b2f1e9b3a11'
+FAKE_POLICY_ID = '5b3b9c52-8d27-4b6d-8f3c-2c1c1e5a6d22'
+FAKE_RTR_ID = '0c1d7b3a-2b9e-4a4c-a0f1-6f8b5d1c2e33'
+
+
+def _rule(num, action='allow'):
+    return {'protocol': 'tcp', 'source_ip_address': None,
+            'destination_ip_address': '10.1.%d.%d' % (num // 256, num % 256),
+            'source_port': None, 'destination_port': str(num),
+            'action': action, 'enabled': True, 'name': 'rule%d' % num}
+
+
+class FwMapAttrTest(base.BaseTestCase):
+    """Test the rule and policy storage of a tenant's firewall."""
+
+    def setUp(self):
+        super(FwMapAttrTest, self).setUp()
+        self.attr = fw_mgr.FwMapAttr(FAKE_TENANT_ID)
+
+    def _rule_ids(self, num):
+        return ['rule-%d' % i for i in range(num)]
+
+    def _create_fw(self, rule_ids):
+        self.attr.store_policy(FAKE_POLICY_ID, {'name': 'pol',
+                                                'rule_dict': rule_ids})
+        self.attr.create_fw(FAKE_TENANT_NAME, FAKE_POLICY_ID, FAKE_FW_ID,
+                            'fw', 'TE', FAKE_RTR_ID)
+
+    def test_rule_counters(self):
+        """Test the FW status follows the rules of the active policy."""
+
+        rule_ids = self._rule_ids(3)
+        self._create_fw(rule_ids)
+        self.assertFalse(self.attr.one_rule_present(FAKE_POLICY_ID))
+        self.assertFalse(self.attr.is_fw_drvr_create_needed())
+        # A rule that is not in the policy.
+        self.attr.store_rule('other', _rule(9))
+        self.assertFalse(self.attr.one_rule_present(FAKE_POLICY_ID))
+        self.attr.store_rule(rule_ids[2], _rule(2))
+        self.attr.store_rule(rule_ids[2], _rule(2))
+        self.assertTrue(self.attr.one_rule_present(FAKE_POLICY_ID))
+        self.assertTrue(self.attr.is_fw_drvr_create_needed())
+        self.attr.fw_drvr_created(True)
+        self.assertFalse(self.attr.is_fw_drvr_create_needed())
+        self.assertTrue(self.attr.is_fw_complete())
+        self.attr.delete_rule(rule_ids[2])
+        self.assertFalse(self.attr.is_fw_complete())
+
+        # A policy stored after its rules.
+        self.attr.store_policy('pol2', {'name': 'pol2',
+                                        'rule_dict': ['other', rule_ids[0]]})
+        self.assertTrue(self.attr.one_rule_present('pol2'))
+        self.attr.delete_policy('pol2')
+        self.assertNotIn('other', self.attr.rule_pols)
+        self.attr.delete_rule('other')
+        self.assertNotIn('other', self.attr.rules)
+
+    def test_fw_dict_cache(self):
+        """Test the FW dictionary is rebuilt only when it changes."""
+
+        rule_ids = self._rule_ids(2)
+        self._create_fw(rule_ids)
+        for num, rule_id in enumerate(rule_ids):
+            self.attr.store_rule(rule_id, _rule(num))
+        fw_dict = self.attr.get_fw_dict()
+        self.assertEqual(FAKE_FW_ID, fw_dict['fw_id'])
+        self.assertEqual(FAKE_RTR_ID, fw_dict['router_id'])
+        self.assertEqual(set(rule_ids), set(fw_dict['rules']))
+        self.assertIs(fw_dict, self.attr.get_fw_dict())
+
+        # Changes outside of the active policy keep the dictionary.
+        version = self.attr.version
+        self.attr.store_rule('other', _rule(9))
+        self.attr.store_policy('pol2', {'name': 'pol2',
+                                        'rule_dict': ['other']})
+        self.assertIs(fw_dict, self.attr.get_fw_dict())
+        self.attr.rule_update(rule_ids[0], {'action': 'deny'})
+        self.assertIs(fw_dict, self.attr.get_fw_dict())
+        self.assertEqual('deny', fw_dict['rules'][rule_ids[0]]['action'])
+        self.assertEqual(version + 3, self.attr.version)
+
+        self.attr.update_fw_params(fw_type='phy')
+        fw_dict = self.attr.get_fw_dict()
+        self.assertEqual('phy', fw_dict['fw_type'])
+        self.attr.delete_fw(FAKE_FW_ID)
+        self.assertEqual({}, self.attr.get_fw_dict())
+
+    def test_rule_events_benchmark(self):
+        """Benchmark 5k rule create and update events on one policy."""
+
+        num_rules = 5000
+        rule_ids = self._rule_ids(num_rules)
+        self._create_fw(rule_ids)
+        self.attr.fw_drvr_created(True)
+        start = time.time()
+        # Rules arrive in the reverse order of the policy.
+        for num in reversed(range(num_rules)):
+            self.attr.store_rule(rule_ids[num], _rule(num))
+            self.attr.is_fw_drvr_create_needed()
+        fw_dict = self.attr.get_fw_dict()
+        for num in range(num_rules):
+            self.attr.rule_update(rule_ids[num], _rule(num, action='deny'))
+            self.assertTrue(self.attr.is_fw_complete())
+            self.assertIs(fw_dict, self.attr.get_fw_dict())
+        elapsed = time.time() - start
+        self.assertEqual(num_rules, len(fw_dict['rules']))
+        self.assertTrue(all(rule['action'] == 'deny'
+                            for rule in fw_dict['rules'].values()))
+        self.assertLess(elapsed, 5)
+
+
+class FakeFwDriver(object):
+    """Records the calls made to the FW driver."""
+
+    def __init__(self):
+        self.calls = []
+        self.modified = threading.Event()
+
+    def modify_fw(self, tenant_id, data):
+        self.calls.append(('modify', tenant_id,
+                           dict((rule_id, dict(rule)) for rule_id, rule in
+                                data.get('rules').items())))
+        self.modified.set()
+        return True
+
+
+class FwMgrModifyTest(base.BaseTestCase):
+    """Test the rule updates of a tenant are merged into one modify."""
+
+    def setUp(self):
+        super(FwMgrModifyTest, self).setUp()
+        self.drvr = FakeFwDriver()
+        self.mgr = fw_mgr.FwMgr.__new__(fw_mgr.FwMgr)
+        self.mgr.fwid_attr = {}
+        self.mgr.temp_db = fw_mgr.FwTempDb()
+        self.mgr.modify_debounce = 60
+        self.mgr.modify_pending = {}
+        self.mgr.modify_lock = threading.Lock()
+        self.mgr.sched_obj = mock.Mock()
+        self.mgr.sched_obj.get_fw_dev_map.return_value = (
+            {'drvr_obj': self.drvr}, '1.1.1.1')
+        self.addCleanup(self._cancel_timers)
+        self.rule_ids = ['rule-%d' % i for i in range(200)]
+        attr = fw_mgr.FwMapAttr(FAKE_TENANT_ID)
+        attr.store_policy(FAKE_POLICY_ID, {'name': 'pol',
+                                           'rule_dict': self.rule_ids})
+        for num, rule_id in enumerate(self.rule_ids):
+            attr.store_rule(rule_id, _rule(num))
+        attr.create_fw(FAKE_TENANT_NAME, FAKE_POLICY_ID, FAKE_FW_ID, 'fw',
+                       'TE', FAKE_RTR_ID)
+        attr.fw_drvr_created(True)
+        self.mgr.fwid_attr[FAKE_TENANT_ID] = attr
+        self.mgr.temp_db.store_fw_tenant(FAKE_FW_ID, FAKE_TENANT_ID)
+
+    def _cancel_timers(self):
+        for timer in list(self.mgr.modify_pending.values()):
+            timer.cancel()
+
+    def _rule_event(self, num, action):
+        fw_rule = _rule(num, action=action)
+        fw_rule.update({'id': self.rule_ids[num], 'tenant_id': FAKE_TENANT_ID,
+                        'firewall_policy_id': FAKE_POLICY_ID})
+        return {'firewall_rule': fw_rule}
+
+    def test_rule_updates_merged(self):
+        """Test 200 rule events lead to one modify of the device."""
+
+        # The last rule is created after the other rules are updated.
+        self.mgr.fwid_attr[FAKE_TENANT_ID].delete_rule(self.rule_ids[-1])
+        for num in range(len(self.rule_ids) - 1):
+            self.mgr.fw_rule_update(self._rule_event(num, 'deny'))
+        self.mgr.fw_rule_create(self._rule_event(len(self.rule_ids) - 1,
+                                                 'deny'))
+        self.assertEqual([], self.drvr.calls)
+        self.assertEqual([FAKE_TENANT_ID], list(self.mgr.modify_pending))
+
+        self.mgr.flush_modify_fw(FAKE_TENANT_ID)
+        self.assertEqual(1, len(self.drvr.calls))
+        oper, tenant_id, rules = self.drvr.calls[0]
+        self.assertEqual(set(self.rule_ids), set(rules))
+        self.assertTrue(all(rule['action'] == 'deny'
+                            for rule in rules.values()))
+        self.assertEqual({}, self.mgr.modify_pending)
+        self.mgr.flush_modify_fw(FAKE_TENANT_ID)
+        self.assertEqual(1, len(self.drvr.calls))
+
+    def test_modify_after_debounce(self):
+        """Test the pending modify is done when the debounce time expires."""
+
+        self.mgr.modify_debounce = 0.05
+        for num in range(10):
+            self.mgr.fw_rule_update(self._rule_event(num, 'deny'))
+        self.assertTrue(self.drvr.modified.wait(5))
+        self.assertEqual(1, len(self.drvr.calls))
+
+    def test_delete_cancels_modify(self):
+        """Test a FW delete drops the pending modify of the device."""
+
+        self.mgr.fw_rule_update(self._rule_event(0, 'deny'))
+
+        def delete_fw(tenant_id, drvr_name, fw_dict):
+            self.drvr.calls.append(('delete', tenant_id, None))
+            self.mgr.fwid_attr[tenant_id].fw_drvr_created(False)
+            return True
+
+        with mock.patch.object(self.mgr, 'update_fw_db_final_result',
+                               create=True), \
+                mock.patch.object(self.mgr, '_delete_fw_fab_dev',
+                                  side_effect=delete_fw):
+            self.mgr.fw_delete({'firewall_id': FAKE_FW_ID})
+        self.assertEqual({}, self.mgr.modify_pending)
+        self.mgr.flush_modify_fw(FAKE_TENANT_ID)
+        self.mgr.fw_rule_update(self._rule_event(1, 'deny'))
+        self.assertEqual([('delete', FAKE_TENANT_ID, None)], self.drvr.calls)
+
+    def test_stop_fw_mgr(self):
+        """Test the pending modify and the fabric are done on shutdown."""
+
+        self.mgr.fw_init = True
+        self.mgr.fabric = mock.Mock()
+        for num in range(10):
+            self.mgr.fw_rule_update(self._rule_event(num, 'deny'))
+        self.assertEqual([], self.drvr.calls)
+        self.mgr.stop_fw_mgr()
+        self.assertEqual(1, len(self.drvr.calls))
+        self.assertEqual({}, self.mgr.modify_pending)
+        self.mgr.fabric.stop.assert_called_once_with()
+
+
+class FakeFabric(fabric_setup_base.FabricBase):
+    """Fabric whose retry takes the given time and result per tenant.
+
+    The retry goes through FabricBase.retry_failure, with the same locks as
+    the real fabric.
+    """
+
+    def __init__(self, latency, result):
+        self.latency = latency
+        self.result = result
+        self.mutex_lock = threading.Lock()
+        self.tenant_locks = {}
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.calls = []
+
+    def retry_failure_int(self, tenant_id, tenant_name, fw_data, is_fw_virt,
+                          result):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.latency.get(tenant_id, 0))
+        with self.lock:
+            self.running -= 1
+            self.calls.append(tenant_id)
+        return self.result.get(tenant_id, True)
+
+
+class FwMgrRetryTest(base.BaseTestCase):
+    """Test the retry of the failed FW operations of many tenants."""
+
+    num_tenants = 16
+
+    def setUp(self):
+        super(FwMgrRetryTest, self).setUp()
+        self.tenants = ['tenant-%d' % i for i in range(self.num_tenants)]
+        self.fabric = FakeFabric(dict((tenant_id, 0.1) for tenant_id in
+                                      self.tenants), {})
+        self.mgr = fw_mgr.FwMgr.__new__(fw_mgr.FwMgr)
+        self.mgr.fwid_attr = {}
+        self.mgr.temp_db = fw_mgr.FwTempDb()
+        self.mgr.fabric = self.fabric
+        self.mgr.retry_pool_size = 4
+        self.mgr.retry_backoff = {}
+        self.mgr.retry_lock = threading.Lock()
+        self.fw_data = {}
+        for tenant_id in self.tenants:
+            attr = fw_mgr.FwMapAttr(tenant_id)
+            attr.store_policy(FAKE_POLICY_ID, {'name': 'pol',
+                                               'rule_dict': ['rule-0']})
+            attr.store_rule('rule-0', _rule(0))
+            attr.create_fw(FAKE_TENANT_NAME, FAKE_POLICY_ID,
+                           'fw-' + tenant_id, 'fw', 'TE', FAKE_RTR_ID)
+            self.mgr.fwid_attr[tenant_id] = attr
+            self.mgr.temp_db.store_fw_tenant('fw-' + tenant_id, tenant_id)
+            self.fw_data['fw-' + tenant_id] = {
+                'result': fw_constants.RESULT_FW_CREATE_INIT,
+                'device_status': ''}
+        self.dev_created = []
+        for name, func in (
+                ('get_fw', lambda fw_id: (None, self.fw_data[fw_id])),
+                ('get_fw_by_tenant_id',
+                 lambda tenant_id: self.fw_data['fw-' + tenant_id]),
+                ('is_device_virtual', lambda: False),
+                ('create_fw_device', self._create_fw_device),
+                ('delete_fw_device', lambda tenant_id, fw_id, data: True),
+                ('update_fw_db_final_result', self._set_result),
+                ('update_fw_db_dev_status', lambda fw_id, status: None),
+                ('delete_fw', lambda fw_id: None)):
+            patcher = mock.patch.object(self.mgr, name, side_effect=func,
+                                        create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(fw_mgr.dfa_dbm.DfaDBMixin,
+                                    'get_project_name', create=True,
+                                    return_value=FAKE_TENANT_NAME)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_fw_device(self, tenant_id, fw_id, data):
+        self.dev_created.append(tenant_id)
+        return True
+
+    def _set_result(self, fw_id, result):
+        self.fw_data[fw_id]['result'] = result
+
+    def test_slow_tenant_parallel(self):
+        """Test a slow tenant does not delay the retry of the others."""
+
+        self.fabric.latency[self.tenants[0]] = 1
+        start = time.time()
+        self.mgr.fw_retry_failures_create()
+        elapsed = time.time() - start
+        # Serially, this takes 1 + 15 * 0.1 seconds.
+        self.assertLess(elapsed, 2)
+        self.assertEqual(sorted(self.tenants), sorted(self.fabric.calls))
+        self.assertEqual(sorted(self.tenants), sorted(self.dev_created))
+        self.assertLessEqual(self.fabric.max_running, 4)
+        self.assertGreater(self.fabric.max_running, 1)
+        self.assertEqual({}, self.mgr.retry_backoff)
+        self.assertFalse(any(attr.is_fw_drvr_create_needed()
+                             for attr in self.mgr.fwid_attr.values()))
+
+    def test_backoff(self):
+        """Test a failing tenant is retried after an increasing delay."""
+
+        failed = self.tenants[1]
+        self.fabric.result[failed] = False
+        self.mgr.fw_retry_failures_create()
+        self.assertEqual(1, self.mgr.retry_backoff[failed][0])
+        self.assertEqual([failed], list(self.mgr.retry_backoff))
+
+        self.fabric.calls = []
+        self.mgr.fw_retry_failures_create()
+        self.assertEqual([], self.fabric.calls)
+
+        cnt, next_time = self.mgr.retry_backoff[failed]
+        self.mgr.retry_backoff[failed] = (cnt, 0)
+        self.mgr.fw_retry_failures_create()
+        self.assertEqual([failed], self.fabric.calls)
+        cnt, next_time = self.mgr.retry_backoff[failed]
+        self.assertEqual(2, cnt)
+        self.assertGreater(next_time - time.time(),
+                           fw_constants.FW_RETRY_BACKOFF_MIN)
+
+        self.fabric.result[failed] = True
+        self.mgr.retry_backoff[failed] = (cnt, 0)
+        self.mgr.fw_retry_failures_create()
+        self.assertEqual({}, self.mgr.retry_backoff)
+
+    def test_busy_tenant_skipped(self):
+        """Test a tenant with its lock held is skipped, without backoff."""
+
+        busy = self.tenants[2]
+        with self.mgr.fwid_attr[busy].mutex_lock:
+            self.mgr.fw_retry_failures_create()
+        self.assertNotIn(busy, self.fabric.calls)
+        self.assertEqual(self.num_tenants - 1, len(self.fabric.calls))
+        self.assertEqual({}, self.mgr.retry_backoff)
+
+    def test_delete_retry(self):
+        """Test the delete retry of the tenants with a pending delete."""
+
+        for tenant_id in self.tenants[:8]:
+            self.fw_data['fw-' + tenant_id]['result'] = (
+                fw_constants.RESULT_FW_DELETE_INIT)
+            self.mgr.fwid_attr[tenant_id].fw_drvr_created(True)
+        self.fabric.result[self.tenants[0]] = False
+        self.mgr.fw_retry_failures_delete()
+        self.assertEqual(sorted(self.tenants[:8]), sorted(self.fabric.calls))
+        self.assertEqual([self.tenants[0]], list(self.mgr.retry_backoff))
+        for tenant_id in self.tenants[1:8]:
+            self.assertEqual(fw_constants.RESULT_FW_DELETE_DONE,
+                             self.fw_data['fw-' + tenant_id]['result'])
+            self.assertFalse(self.mgr.fwid_attr[tenant_id].fw_created)
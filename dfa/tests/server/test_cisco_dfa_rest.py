@@ -19,8 +19,9 @@ import mock
 
 from neutron.tests import base
 
-from networking_cisco.plugins.saf.common import config
-from networking_cisco.plugins.saf.server import cisco_dfa_rest as dc
+from dfa.common import config
+from dfa.server import cisco_dfa_rest as dc
+from dfa.server.services.firewall.native import fabric_setup_base
 
 """This file includes test cases for cisco_dfa_rest.py."""
 
@@ -151,3 +152,143 @@ class TestCiscoDFAClient(base.BaseTestCase):
                           mock.call('DELETE', del_org_url, '', 'organization')]
         self.assertEqual(expected_calls,
                          self.dcnm_client._send_request.call_args_list)
+
+
+class TestDFARESTClientCache(base.BaseTestCase):
+    """Test cases for the DCNM reads cached by DFARESTClient."""
+
+    def setUp(self):
+        super(TestDFARESTClientCache, self).setUp()
+
+        config.default_dcnm_opts['dcnm']['dcnm_ip'] = FAKE_DCNM_IP
+        config.default_dcnm_opts['dcnm']['dcnm_user'] = FAKE_DCNM_USERNAME
+        config.default_dcnm_opts['dcnm']['dcnm_password'] = FAKE_DCNM_PASSWD
+        config.default_dcnm_opts['dcnm']['timeout_resp'] = 0.01
+        self.cfg = config.CiscoDFAConfig().cfg
+
+        # DCNM answers, keyed by URL of the GET.
+        self.dcnm_get = {}
+        for name, kwargs in (('post', {}),
+                             ('request', {'side_effect': self._request})):
+            patcher = mock.patch.object(dc.requests, name, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name, ret in (('get_version', '7.1(0)'),
+                          ('_set_default_cfg_profile', None)):
+            patcher = mock.patch.object(dc.DFARESTClient, name,
+                                        return_value=ret)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.dcnm_client = dc.DFARESTClient(self.cfg)
+        self.part_url = self.dcnm_client._update_part_url % ('cisco',
+                                                             'CTX-ext')
+        for part_name in ('CTX-ext', self.dcnm_client._part_name):
+            url = self.dcnm_client._update_part_url % ('cisco', part_name)
+            self.dcnm_get[url] = {
+                'partitionName': part_name, 'vrfProfileName': 'vrfProf',
+                'dciId': 0, 'serviceNodeIpAddress': '10.1.1.2',
+                'partitionSegmentId': 50000}
+
+    def _request(self, operation, url, **kwargs):
+        res = mock.Mock()
+        res.status_code = 200
+        if operation == 'GET':
+            if url not in self.dcnm_get:
+                res.status_code = 404
+            res.json.return_value = self.dcnm_get.get(url)
+        return res
+
+    def _get_cnt(self, url=None):
+        return len([c for c in dc.requests.request.call_args_list
+                    if c[0][0] == 'GET' and url in (None, c[0][1])])
+
+    def test_partition_cache(self):
+        """Test partition attributes are read once from DCNM."""
+
+        org_name = 'cisco'
+        part_name = 'CTX-ext'
+        self.assertEqual('vrfProf', self.dcnm_client.get_partition_vrfProf(
+            org_name, part_name))
+        self.assertEqual(0, self.dcnm_client.get_partition_dciId(
+            org_name, part_name))
+        self.assertEqual('10.1.1.2',
+                         self.dcnm_client.get_partition_serviceNodeIp(
+                             org_name, part_name))
+        self.assertEqual(50000, self.dcnm_client.get_partition_segmentId(
+            org_name, part_name))
+        self.assertEqual(1, self._get_cnt(self.part_url))
+
+        # Expired entry is read again.
+        with mock.patch.object(dc.time, 'time',
+                               return_value=dc.time.time() +
+                               dc.PART_CACHE_TTL + 1):
+            self.dcnm_client.get_partition_segmentId(org_name, part_name)
+        self.assertEqual(2, self._get_cnt(self.part_url))
+
+        # Entry is removed when the partition is updated or deleted.
+        self.dcnm_client.get_partition_segmentId(org_name, part_name)
+        self.assertEqual(2, self._get_cnt(self.part_url))
+        self.dcnm_client.update_project(org_name, part_name, dci_id=10)
+        self.dcnm_client.get_partition_segmentId(org_name, part_name)
+        self.assertEqual(3, self._get_cnt(self.part_url))
+        self.dcnm_client.delete_partition(org_name, part_name)
+        self.dcnm_client.get_partition_segmentId(org_name, part_name)
+        self.assertEqual(4, self._get_cnt(self.part_url))
+
+    def test_partition_get_per_fw_create(self):
+        """Test number of partition GETs done to create a firewall."""
+
+        fabric = fabric_setup_base.FabricBase.__new__(
+            fabric_setup_base.FabricBase)
+        fabric.dcnm_obj = self.dcnm_client
+        fabric.serv_part_vrf_prof = 'vrfProf'
+        fw_dict = {'tenant_name': 'cisco'}
+        in_addr = ('20.1.1.0', '20.1.1.3', '20.1.1.254', '20.1.1.1', None)
+        num_fw = 10
+        with mock.patch.object(fabric, 'update_fw_db_result'), \
+            mock.patch.object(fabric, 'get_in_ip_addr',
+                              return_value=in_addr):
+            for cnt in range(num_fw):
+                # Partition steps of the firewall create and delete SM.
+                self.assertTrue(fabric.update_dcnm_in_part('tenant', fw_dict))
+                self.assertTrue(fabric.create_dcnm_out_part('tenant',
+                                                            fw_dict))
+                self.assertTrue(fabric.update_dcnm_out_part('tenant',
+                                                            fw_dict))
+                self.assertTrue(fabric.delete_dcnm_out_part('tenant',
+                                                            fw_dict))
+                self.assertTrue(fabric.clear_dcnm_in_part('tenant', fw_dict))
+
+        # The service partition update uses the partition read for its
+        # segment id, the default partition is read by each of its updates.
+        self.assertEqual(num_fw, self._get_cnt(self.part_url))
+        self.assertEqual(3 * num_fw, self._get_cnt())
+
+    def test_network_index(self):
+        """Test network checks are answered from one listing."""
+
+        num_nets = 5000
+        org_name = 'cisco'
+        part_name = self.dcnm_client.get_default_partition_name()
+        list_url = (self.dcnm_client._del_part + '/networks') % (org_name,
+                                                                  part_name)
+        self.dcnm_get[list_url] = [
+            {'segmentId': 30000 + i, 'networkName': 'net%d' % i,
+             'organizationName': org_name, 'partitionName': part_name}
+            for i in range(num_nets)]
+        index = dc.DcnmNetworkIndex(self.dcnm_client)
+        for i in range(num_nets):
+            self.assertTrue(index.network_exists(org_name, 30000 + i))
+        self.assertFalse(index.network_exists(org_name, 30000 + num_nets))
+        self.assertEqual('net10',
+                         index.get_network(org_name, '30010')['networkName'])
+        self.assertEqual(1, self._get_cnt())
+
+        # Unknown when the partition cannot be listed.
+        self.assertIsNone(index.network_exists('other', 30000))
+        self.assertIsNone(index.network_exists('other', 30001))
+        self.assertEqual(2, self._get_cnt())
+
+        index.invalidate(org_name)
+        self.assertTrue(index.network_exists(org_name, 30000))
+        self.assertEqual(2, self._get_cnt(list_url))
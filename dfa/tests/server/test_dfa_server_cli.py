@@ -0,0 +1,100 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import mock
+
+from neutron.tests import base
+
+from dfa import dfa_cli
+from dfa.db import dfa_db_views as db_views
+from dfa.server import dfa_server as ds
+
+NUM_VMS = 20
+PAGE_SIZE = 3
+
+
+class FakeClient(object):
+    """RPC client that calls the server callbacks directly."""
+
+    def __init__(self, rpc_cb, on_call=None):
+        self.rpc_cb = rpc_cb
+        self.on_call = on_call
+        self.msgs = []
+
+    def make_msg(self, method, context, msg):
+        return method, msg
+
+    def call(self, msg):
+        self.msgs.append(msg)
+        if self.on_call:
+            self.on_call()
+        method, payload = msg
+        return getattr(self.rpc_cb, method)(None, payload)
+
+
+class TestDFAServerCli(base.BaseTestCase):
+    """Test the paginated CLI queries of the DFA Server."""
+
+    def setUp(self):
+        super(TestDFAServerCli, self).setUp()
+        self.views = db_views.DBReadViews()
+        self.views.networks.load(
+            [('net-0', dict(network_id='net-0', name='net0',
+                            tenant_id='tenant-0'))])
+        # Every third instance has no network.
+        self.views.instances.load(
+            ('port-%02d' % i,
+             dict(port_id='port-%02d' % i, instance_id='vm-%d' % i,
+                  ip=None, name='vm%d' % i, mac=None, host='host-0',
+                  local_vlan=None, segmentation_id=None, vdp_vlan=None,
+                  result=None,
+                  network_id='net-0' if i % 3 else 'net-none'))
+            for i in range(NUM_VMS))
+        obj = mock.Mock(db_views=self.views, port_result={})
+        obj.get_project_name.return_value = 'tenant0'
+        self.rpc_cb = ds.RpcCallBacks(obj)
+        patcher = mock.patch.object(dfa_cli, 'CLI_PAGE_SIZE', PAGE_SIZE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _expected_ports(self):
+        return ['port-%02d' % i for i in range(NUM_VMS) if i % 3]
+
+    def test_instances_pages(self):
+        """Test instances without a network do not shorten the pages."""
+
+        clnt = FakeClient(self.rpc_cb)
+        rows = dfa_cli.get_all_pages(clnt, 'cli_get_instances', {})
+        self.assertEqual(self._expected_ports(),
+                         [row['port'] for row in rows])
+        num_rows = len(self._expected_ports())
+        self.assertEqual(num_rows // PAGE_SIZE + 1, len(clnt.msgs))
+
+    def test_instances_changed_retries_exhausted(self):
+        """Test the rows are read at once if the view keeps changing."""
+
+        def change_view():
+            self.views.instances.update('port-01', dict(name='vm1'))
+
+        clnt = FakeClient(self.rpc_cb, on_call=change_view)
+        with mock.patch.object(dfa_cli.sys, 'stderr') as stderr:
+            rows = dfa_cli.get_all_pages(clnt, 'cli_get_instances', {})
+        self.assertTrue(stderr.write.called)
+        self.assertEqual(self._expected_ports(),
+                         sorted(row['port'] for row in rows))
+        self.assertEqual(2 * (dfa_cli.CLI_PAGE_RETRIES + 1) + 1,
+                         len(clnt.msgs))
@@ -0,0 +1,154 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+import json
+import mock
+import time
+
+from neutron.tests import base
+
+from dfa.common import config
+from dfa.common import constants
+from dfa.db import dfa_db_models as dbm
+from dfa.server import cisco_dfa_rest as cdr
+from dfa.server import dfa_events_handler as deh
+from dfa.server import dfa_fail_recovery as dfr
+from dfa.server import dfa_instance_api as dia
+from dfa.server import dfa_listen_dcnm as dld
+from dfa.server import dfa_server as ds
+from dfa.server.services.firewall.native import fabric_setup_base as fsb
+from dfa.server.services.firewall.native import fw_mgr
+from dfa.server.services.firewall.native.drivers import dev_mgr
+
+FAKE_DCNM_USERNAME = 'cisco'
+FAKE_DCNM_PASSWD = 'password'
+FAKE_DCNM_IP = '1.1.2.2'
+
+
+class FakeClass(object):
+    """Fake class"""
+    @classmethod
+    def imitate(cls, *others):
+        for other in others:
+            for name in other.__dict__:
+                try:
+                    setattr(cls, name, mock.Mock())
+                except (TypeError, AttributeError):
+                    pass
+        return cls
+
+
+class TestDFAServerHeartbeat(base.BaseTestCase):
+    """Test cases for the agent heartbeats of the DFA Server."""
+
+    def setUp(self):
+        super(TestDFAServerHeartbeat, self).setUp()
+
+        # Mocking some modules
+        for target in (cdr.__name__ + '.DFARESTClient',
+                       deh.__name__ + '.EventsHandler',
+                       dia.__name__ + '.DFAInstanceAPI',
+                       dld.__name__ + '.DCNMListener',
+                       dbm.__name__ + '.DfaSegmentTypeDriver',
+                       dbm.__name__ + '.TopologyDiscoveryDb',
+                       fsb.__name__ + '.FabricApi'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        bases = ds.DfaServer.__bases__
+        ds.DfaServer.__bases__ = (FakeClass.imitate(
+            dfr.DfaFailureRecovery, dbm.DfaDBMixin, fw_mgr.FwMgr,
+            dev_mgr.DeviceMgr),)
+        self.addCleanup(setattr, ds.DfaServer, '__bases__', bases)
+
+        ds.DfaServer.get_all_projects.return_value = []
+        ds.DfaServer.get_all_networks.return_value = []
+        patcher = mock.patch.object(ds.DfaServer, '_setup_rpc')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Setting DCNM credentials.
+        patcher = mock.patch.dict(config.default_dcnm_opts['dcnm'], {
+            'dcnm_ip': FAKE_DCNM_IP, 'dcnm_user': FAKE_DCNM_USERNAME,
+            'dcnm_password': FAKE_DCNM_PASSWD, 'timeout_resp': 0.01,
+            'segmentation_id_min': 10000, 'segmentation_id_max': 20000})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cfg = config.CiscoDFAConfig().cfg
+        self.dfa_server = ds.DfaServer(self.cfg)
+
+    def test_create_threads(self):
+        """Test the heartbeat flush runs as a periodic task."""
+
+        with mock.patch.object(ds.utils, 'EventProcessingThread'), (
+                mock.patch.object(ds.utils, 'PeriodicTask')) as task_fn:
+            self.dfa_server.create_threads()
+        task_fn.assert_any_call(interval=constants.HB_FLUSH_INTERVAL,
+                                func=self.dfa_server.flush_agent_heartbeats,
+                                excq=self.dfa_server._excpq)
+        self.assertEqual(2, task_fn.return_value.run.call_count)
+
+    def test_agent_heartbeat_load(self):
+        """Test heartbeats of many agents are coalesced in DB."""
+
+        num_agents = 2000
+        num_rounds = 5
+        rpc_cb = ds.RpcCallBacks(self.dfa_server)
+        hosts = ['compute-%d' % i for i in range(num_agents)]
+        last_when = None
+        for rnd in range(num_rounds):
+            last_when = time.ctime(time.time() + rnd)
+            for host in hosts:
+                msg = json.dumps(dict(agent=host, when=last_when))
+                rpc_cb.heartbeat(None, msg)
+
+        # Only the first heartbeat of each agent is written right away.
+        self.assertEqual(num_agents,
+                         self.dfa_server.update_agent_db.call_count)
+        self.assertFalse(self.dfa_server.update_agents_heartbeat.called)
+
+        # The rest is written in one bulk update with the latest timestamp.
+        self.dfa_server.flush_agent_heartbeats()
+        self.assertEqual(1,
+                         self.dfa_server.update_agents_heartbeat.call_count)
+        hb_dict = self.dfa_server.update_agents_heartbeat.call_args[0][0]
+        self.assertEqual(set(hosts), set(hb_dict.keys()))
+        latest = ds.utils.utc_time(last_when)
+        self.assertTrue(all(ts == latest for ts in hb_dict.values()))
+        self.assertEqual(latest,
+                         self.dfa_server.get_agent_heartbeat(hosts[0]))
+
+        # Nothing left to write.
+        self.dfa_server.flush_agent_heartbeats()
+        self.assertEqual(1,
+                         self.dfa_server.update_agents_heartbeat.call_count)
+
+    def test_agent_heartbeat_flush_failed(self):
+        """Test the heartbeats are written again after a failed flush."""
+
+        rpc_cb = ds.RpcCallBacks(self.dfa_server)
+        for when in (time.ctime(), time.ctime(time.time() + 1)):
+            rpc_cb.heartbeat(None, json.dumps(dict(agent='compute-0',
+                                                   when=when)))
+        update_fn = self.dfa_server.update_agents_heartbeat
+        update_fn.side_effect = Exception('DB error')
+        self.dfa_server.flush_agent_heartbeats()
+        update_fn.side_effect = None
+        self.dfa_server.flush_agent_heartbeats()
+        self.assertEqual(2, update_fn.call_count)
+        self.assertEqual(update_fn.call_args_list[0],
+                         update_fn.call_args_list[1])